@@ -88,7 +88,7 @@ def setup_package():
     kwargs['entry_points'] = {}
     kwargs['entry_points'] = {'console_scripts': ['MTfit = MTfit.run:run', 'MTplot = MTfit.plot.core:run'],
                               'MTfit.parsers': ['.csv = MTfit.utilities.file_io:parse_csv', '.hyp = MTfit.utilities.file_io:parse_hyp'],
-                              'MTfit.location_pdf_parsers': ['.scatangle = MTfit.extensions.scatangle:location_pdf_parser'],
+                              'MTfit.location_pdf_parsers': ['.scatangle = MTfit.extensions.scatangle:location_pdf_parser', '.scatbin = MTfit.extensions.scatangle:location_pdf_parser'],
                               'MTfit.output_formats': ['matlab=MTfit.utilities.file_io:MATLAB_output', 'pickle=MTfit.utilities.file_io:pickle_output', 'hyp=MTfit.utilities.file_io:hyp_output'],
                               'MTfit.output_data_formats': ['full_pdf=MTfit.utilities.file_io:full_pdf_output_dicts', 'hyp=MTfit.utilities.file_io:hyp_output_dicts'],
                               'MTfit.cmd_defaults': ['scatangle=MTfit.extensions.scatangle:cmd_defaults'],
@@ -101,8 +101,18 @@ def setup_package():
     if 'win32' in sys.platform:
         extra_compile_args = []
         libraries = []
+    # Optional OpenMP build of the probability kernels (set MTFIT_OPENMP=1)
+    openmp_compile_args = []
+    openmp_link_args = []
+    if os.environ.get('MTFIT_OPENMP', '0').lower() not in ['', '0', 'false', 'no']:
+        if 'win32' in sys.platform:
+            openmp_compile_args = ['/openmp']
+        else:
+            openmp_compile_args = ['-fopenmp']
+            openmp_link_args = ['-fopenmp']
     if _CYTHON and 'build_ext' in sys.argv:
-        kwargs['ext_modules'] = [Extension('MTfit.probability.cprobability', sources=['src/MTfit/probability/cprobability.pyx'], libraries=libraries, extra_compile_args=extra_compile_args, optional=True),
+        kwargs['ext_modules'] = [Extension('MTfit.probability.cprobability', sources=['src/MTfit/probability/cprobability.pyx'], libraries=libraries, extra_compile_args=extra_compile_args+openmp_compile_args,
+                                           extra_link_args=openmp_link_args, optional=True),
                                  Extension('MTfit.convert.cmoment_tensor_conversion', sources=[
                                            'src/MTfit/convert/cmoment_tensor_conversion.pyx'], libraries=libraries, extra_compile_args=extra_compile_args, optional=True),
                                  Extension('MTfit.extensions.cscatangle', sources=[
@@ -110,7 +120,8 @@ def setup_package():
                                  Extension('MTfit.algorithms.cmarkov_chain_monte_carlo', sources=['src/MTfit/algorithms/cmarkov_chain_monte_carlo.pyx'], libraries=libraries, extra_compile_args=extra_compile_args, optional=True)]
         kwargs['cmdclass'] = {"build_ext": build_ext}
     else:
-        kwargs['ext_modules'] = [Extension('MTfit.probability.cprobability', sources=['src/MTfit/probability/cprobability.c'], libraries=libraries, extra_compile_args=extra_compile_args, optional=True),
+        kwargs['ext_modules'] = [Extension('MTfit.probability.cprobability', sources=['src/MTfit/probability/cprobability.c'], libraries=libraries, extra_compile_args=extra_compile_args+openmp_compile_args,
+                                           extra_link_args=openmp_link_args, optional=True),
                                  Extension('MTfit.convert.cmoment_tensor_conversion', sources=[
                                            'src/MTfit/convert/cmoment_tensor_conversion.c'], libraries=libraries, extra_compile_args=extra_compile_args, optional=True),
                                  Extension('MTfit.extensions.cscatangle', sources=['src/MTfit/extensions/cscatangle.c'], libraries=libraries, extra_compile_args=extra_compile_args, optional=True),
@@ -135,6 +146,11 @@ This will install the module to the user site-packages directory. Alternatively,
 
      $ python setup.py install --prefix=/path/to/top_level_directory
 
+To build the probability extension with OpenMP (so that the threads option splits the forward model across cores), set
+the MTFIT_OPENMP environment variable when building:
+
+    $ MTFIT_OPENMP=1 python setup.py install
+
 """)
 
 
@@ -18,10 +18,16 @@ import types
 import sys
 
 import numpy as np
+try:
+    from numpy.random import SeedSequence
+except ImportError:
+    # numpy < 1.17
+    SeedSequence = None
 
 from ..sampling import Sample, FileSample, _6sphere_prior
 from ..utilities.extensions import get_extensions
 from ..utilities import C_EXTENSION_FALLBACK_LOG_MSG
+from ..utilities.quasi_random import SobolSequence
 
 
 logger = logging.getLogger('MTfit.algorithms')
@@ -78,9 +84,21 @@ class BaseAlgorithm(object):
             sampling_prior:[6sphere_prior] string selector for the full moment
                 tensor sampling prior (MTfit.sampling_prior entry point)
             sampling:[6sphere] string selector for the full moment tensor
-                sampling model (MTfit.sampling entry point)
+                sampling model (MTfit.sampling entry point), sobol uses
+                scrambled Sobol quasi-random samples for both the full
+                moment tensor and double-couple samples.
             model:[False] selector for alternate models using the
                 MTfit.sample_distribution entry_point
+            worker_generate:[False] Boolean to select whether to generate the
+                random moment tensors in the forward task using independent
+                seeded random number streams (SeededRandomSample).
+            seed:[None] Seed for the worker_generate random number streams.
+            streaming_discard:[0] Discard cut-off for dropping negligible
+                samples as they are added (see Sample), 0 keeps all the samples.
+            max_retained_samples:[0] Maximum number of samples to retain,
+                keeping the highest probability samples, 0 keeps all the samples.
+            single_precision:[False] Boolean to select whether to generate and
+                store the moment tensor samples in single precision (float32).
         """
         self.number_samples = number_samples
         self.dc = dc
@@ -88,7 +106,15 @@ class BaseAlgorithm(object):
         self.basic_cdc = kwargs.get('basic_cdc', False)
         self.number_events = kwargs.get('number_events', 1)
         self.generate = generate
+        self.worker_generate = kwargs.get('worker_generate', False)
+        self._seed_sequence = None
+        if self.worker_generate and SeedSequence is None:
+            logger.warning('worker_generate requires numpy>=1.17, generating samples in the main process')
+            self.worker_generate = False
+        elif self.worker_generate:
+            self._seed_sequence = SeedSequence(kwargs.get('seed', None))
         self.quality_check = quality_check
+        self.dtype = np.float32 if kwargs.get('single_precision', False) else np.float64
         self._model = kwargs.get('sample_distribution', False)
         self.get_sampling_model(kwargs, file_sample, file_safe)
 
@@ -109,12 +135,13 @@ class BaseAlgorithm(object):
             except Exception:
                 logger.exception('Error setting prior: {}\n'.format(self._model))
                 self._model = False
-        sampling = {'6sphere': _6sphere_random_mt}
+        sampling = {'6sphere': _6sphere_random_mt, 'sobol': _sobol_random_mt}
 
         sampling_names, sampling = get_extensions('MTfit.sampling', sampling)
         # Check sampling distribution selection
         if not kwargs.get('sampling', '6sphere') in sampling_names:
             kwargs['sampling'] = '6sphere'
+        self.quasi_random = kwargs.get('sampling', '6sphere') == 'sobol'
         # Set prior sampling as random_mt - check if the method already exists in self
         # and use that, otherwise use types to add method
 
@@ -146,7 +173,10 @@ class BaseAlgorithm(object):
                                          number_events=self.number_events,
                                          file_safe=file_safe, prior=self._prior)
         else:
-            self.pdf_sample = Sample(number_events=self.number_events, prior=self._prior)
+            self.pdf_sample = Sample(number_events=self.number_events, prior=self._prior,
+                                     discard=kwargs.get('streaming_discard', 0),
+                                     max_retained=kwargs.get('max_retained_samples', 0),
+                                     dtype=self.dtype)
 
     def max_value(self):
         return 'BaseAlgorithm has no max_value'
@@ -160,16 +190,21 @@ class BaseAlgorithm(object):
         """
         if self.generate:
             return False
-
+        if self.worker_generate and not self.basic_cdc and not self._model and self.random_mt.__name__ in ['_6sphere_random_mt', '_sobol_random_mt']:
+            # Generate the samples in the forward task from a new random stream
+            return SeededRandomSample(self._seed_sequence.spawn(1)[0], self.number_samples, self.dc, self.dtype, self.quasi_random)
         # Return random samples
         if self.dc:
-            return self.random_dc()
+            mts = self.random_dc()
         elif self.basic_cdc:
-            return self.random_basic_cdc()
+            mts = self.random_basic_cdc()
         elif self._model:
-            return self.random_model(self.number_samples)
+            mts = self.random_model(self.number_samples)
         else:
-            return self.random_mt()
+            mts = self.random_mt()
+        if self.dtype != np.float64 and isinstance(mts, np.ndarray):
+            mts = mts.astype(self.dtype)
+        return mts
 
     def output(self, normalise=True, convert=False, discard=10000):
         """
@@ -232,6 +267,10 @@ class BaseAlgorithm(object):
             numpy matrix of random double-couple moment tensors, size 6,number_samples
 
         """
+        if self.quasi_random:
+            if getattr(self, '_quasi_random_dc_sampler', None) is None:
+                self._quasi_random_dc_sampler = QuasiRandomSampler(dc=True)
+            return self._quasi_random_dc_sampler(self.number_samples)
         # Check CYTHON code - use C code if possible
         if cprobability:
             return cprobability.random_dc(self.number_samples)
@@ -292,28 +331,7 @@ class BaseAlgorithm(object):
         """
         # Initialise seed
         np.random.seed()
-        # Get random vector - eigenvector 1
-        a = np.random.randn(3, self.number_samples)
-        # Normalise eigenvector 1
-        a = a/np.sqrt(np.sum(np.multiply(a, a), axis=0))
-        # Get another random vector
-        x = np.random.randn(3, self.number_samples)
-        # Cross x with the first eigenvector to get another orthogonal
-        # eigenvector 2
-        b = np.cross(a.transpose(), x.transpose()).transpose()
-        # Check if any of the x are parallel to a (unlikely but a possible edge
-        # case), and redraw.
-        while not np.sum(np.multiply(b, b), axis=0).all():
-            x = np.random.randn(3, self.number_samples)
-            b = np.cross(a.transpose(), x.transpose()).transpose()
-        # Normalise eigenvector 2
-        b = b/np.sqrt(np.sum(np.multiply(b, b), axis=0))
-        # Obtain third eigenvector as orthogonal to first two (a and b)
-        c = np.cross(a.transpose(), b.transpose()).transpose()
-        # Normalise eigenvector 3
-        c = c/np.sqrt(np.sum(np.multiply(c, c), axis=0))
-        # Return list of vectors
-        return [a, b, c]
+        return _random_orthogonal_eigenvectors(self.number_samples, np.random)
 
     def eigenvectors_mt_2_mt6(self, diag, a, b, c):
         """
@@ -331,19 +349,223 @@ class BaseAlgorithm(object):
             numpy matrix of moment tensor 6-vectors.
 
         """
-        # Converts moment tensor from eigenvalues and eigenvectors to six
-        # vector form.
+        return _eigenvectors_mt_2_mt6(diag, a, b, c)
+
+
+class SeededRandomSample(object):
+
+    """
+    Seeded random moment tensor samples
+
+    Generates the random samples for a forward task from an independent
+    random number stream, so that the samples can be generated in the worker
+    rather than pickled from the main process. The stream is seeded from a
+    numpy.random.SeedSequence child (spawned by the algorithm for each task),
+    so the samples are reproducible for a given seed. If quasi_random is set,
+    the samples are from a Sobol sequence scrambled using the seed (see
+    QuasiRandomSampler).
+
+    Initialisation
+        Args
+            seed: numpy.random.SeedSequence or integer seed.
+            number_samples: Number of samples to generate.
+            dc:[False] Boolean to select double-couple samples rather than full moment tensor samples.
+            dtype:[np.float64] Data type of the samples.
+            quasi_random:[False] Boolean to select scrambled Sobol quasi-random samples.
+
+    """
+
+    def __init__(self, seed, number_samples, dc=False, dtype=np.float64, quasi_random=False):
+        """
+        SeededRandomSample initialisation
+
+        Args
+            seed: numpy.random.SeedSequence or integer seed.
+            number_samples: Number of samples to generate.
+            dc:[False] Boolean to select double-couple samples rather than full moment tensor samples.
+            dtype:[np.float64] Data type of the samples.
+            quasi_random:[False] Boolean to select scrambled Sobol quasi-random samples.
+        """
+        self.seed = seed
+        self.number_samples = int(number_samples)
+        self.dc = dc
+        self.dtype = dtype
+        self.quasi_random = quasi_random
+
+    def __len__(self):
+        return self.number_samples
+
+    def __call__(self):
+        """
+        Generates the random samples
+
+        Returns
+            numpy matrix of random moment tensors, size 6,number_samples
+        """
+        if self.quasi_random:
+            return QuasiRandomSampler(self.dc, self.seed, self.dtype)(self.number_samples)
+        random_state = np.random.default_rng(self.seed)
+        if self.dc:
+            dc_diag = np.array([[1/np.sqrt(2)], [0], [-1/np.sqrt(2)]])
+            return _eigenvectors_mt_2_mt6(dc_diag, *_random_orthogonal_eigenvectors(self.number_samples, random_state)).astype(self.dtype, copy=False)
+        M = random_state.standard_normal((6, self.number_samples))
+        return np.matrix(M/np.sqrt(np.sum(np.multiply(M, M), axis=0)), dtype=self.dtype)
+
+
+class QuasiRandomSampler(object):
+
+    """
+    Scrambled Sobol quasi-random moment tensor samples
+
+    Maps successive points of a scrambled Sobol sequence (see
+    MTfit.utilities.quasi_random.SobolSequence) to moment tensors that are
+    uniformly distributed on the 6-sphere (using the inverse normal CDF for
+    each coordinate and normalising), or to double-couples with uniform strike,
+    cos(dip) and slip angle (as cprobability.random_dc). The samples cover the
+    source space more evenly than pseudo-random samples, so the Bayesian
+    evidence and posterior estimates converge with fewer samples.
+
+    The sampler is called with the number of samples, continuing the sequence
+    on each call, and can be passed to the Cython sample generation
+    (cprobability.combined_ln_pdf). The sequence is created on the first call,
+    so copies that are pickled before then (e.g. to the workers) each use an
+    independent scramble if the seed is None.
+
+    Initialisation
+        Keyword Args
+            dc:[False] Boolean to select double-couple samples rather than full moment tensor samples.
+            seed:[None] Seed for the scrambling (integer, numpy.random.SeedSequence or None to seed from the system).
+            dtype:[np.float64] Data type of the samples.
+
+    """
+
+    def __init__(self, dc=False, seed=None, dtype=np.float64):
+        """
+        QuasiRandomSampler initialisation
 
-        v1 = np.array([a[0, :], b[0, :], c[0, :]])
-        v2 = np.array([a[1, :], b[1, :], c[1, :]])
-        v3 = np.array([a[2, :], b[2, :], c[2, :]])
-        M = np.matrix([np.sum(v1*v1*diag, axis=0),  # M11
-                       np.sum(v2*v2*diag, axis=0),  # M22
-                       np.sum(v3*v3*diag, axis=0),  # M33
-                       np.sqrt(2)*np.sum(v1*v2*diag, axis=0),  # sqrt2*M12
-                       np.sqrt(2)*np.sum(v1*v3*diag, axis=0),  # sqrt2*M13
-                       np.sqrt(2)*np.sum(v2*v3*diag, axis=0)])  # sqrt2*M23
-        return np.matrix(M/np.sqrt(np.sum(np.multiply(M, M), axis=0)))
+        Keyword Args
+            dc:[False] Boolean to select double-couple samples rather than full moment tensor samples.
+            seed:[None] Seed for the scrambling (integer, numpy.random.SeedSequence or None to seed from the system).
+            dtype:[np.float64] Data type of the samples.
+        """
+        self.dc = dc
+        self.seed = seed
+        self.dtype = dtype
+        self.sequence = None
+
+    def __call__(self, number_samples):
+        """
+        Generates the next quasi-random samples
+
+        Args
+            number_samples: Number of samples to generate.
+
+        Returns
+            numpy matrix of moment tensors, size 6,number_samples
+        """
+        from scipy.special import ndtri
+        if self.sequence is None:
+            self.sequence = SobolSequence(3 if self.dc else 6, self.seed)
+        points = self.sequence.random(number_samples).T
+        if self.dc:
+            M = _dc_mt6(points[0, :], 2*np.pi*points[1, :], np.pi*(points[2, :]-0.5))
+        else:
+            M = ndtri(points)
+            M /= np.sqrt(np.sum(np.multiply(M, M), axis=0))
+        return np.matrix(M, dtype=self.dtype)
+
+
+def _dc_mt6(h, kappa, sigma):
+    """
+    Converts the double-couple orientation to normalised moment tensor 6-vectors (as cprobability.random_dc).
+
+    Args
+        h: numpy array of cos(dip) (between 0 and 1).
+        kappa: numpy array of strikes (between 0 and 2*pi).
+        sigma: numpy array of slip angles (between -pi/2 and pi/2).
+
+    Returns
+        numpy array of double-couple moment tensor 6-vectors.
+
+    """
+    ck = np.cos(kappa)
+    sk = np.sin(kappa)
+    s2k = np.sin(2*kappa)
+    cs = np.cos(sigma)
+    ss = np.sin(sigma)
+    sh = np.sqrt(1-h*h)
+    # The moment tensors have norm sqrt(2)
+    return np.array([-sh*cs*s2k-2*h*sh*ss*sk*sk,
+                     sh*cs*2*sk*ck-2*sh*h*ss*ck*ck,
+                     2*sh*h*ss,
+                     np.sqrt(2)*(sh*cs*(ck*ck-sk*sk)+h*sh*ss*s2k),
+                     np.sqrt(2)*(-h*cs*ck-(2*h*h-1)*ss*sk),
+                     np.sqrt(2)*(-h*cs*sk+(2*h*h-1)*ss*ck)])/np.sqrt(2)
+
+
+def _random_orthogonal_eigenvectors(number_samples, random_state):
+    """
+    Generates random orthogonal eigenvectors.
+
+    Args
+        number_samples: Number of samples to generate.
+        random_state: Random number generator with a standard_normal method (e.g. numpy.random).
+
+    Returns
+        list of numpy arrays of eigenvectors.
+
+    """
+    # Get random vector - eigenvector 1
+    a = random_state.standard_normal((3, number_samples))
+    # Normalise eigenvector 1
+    a = a/np.sqrt(np.sum(np.multiply(a, a), axis=0))
+    # Get another random vector
+    x = random_state.standard_normal((3, number_samples))
+    # Cross x with the first eigenvector to get another orthogonal
+    # eigenvector 2
+    b = np.cross(a.transpose(), x.transpose()).transpose()
+    # Check if any of the x are parallel to a (unlikely but a possible edge
+    # case), and redraw.
+    while not np.sum(np.multiply(b, b), axis=0).all():
+        x = random_state.standard_normal((3, number_samples))
+        b = np.cross(a.transpose(), x.transpose()).transpose()
+    # Normalise eigenvector 2
+    b = b/np.sqrt(np.sum(np.multiply(b, b), axis=0))
+    # Obtain third eigenvector as orthogonal to first two (a and b)
+    c = np.cross(a.transpose(), b.transpose()).transpose()
+    # Normalise eigenvector 3
+    c = c/np.sqrt(np.sum(np.multiply(c, c), axis=0))
+    # Return list of vectors
+    return [a, b, c]
+
+
+def _eigenvectors_mt_2_mt6(diag, a, b, c):
+    """
+    Converts eigenvectors and eigenvalues to moment tensor 6-vector.
+
+    Args
+        diag: numpy matrix of eigenvalues.
+        a: numpy array of eigenvectors corresponding to the first eigenvalue.
+        b: numpy array of eigenvectors corresponding to the second eigenvalue.
+        c: numpy array of eigenvectors corresponding to the third eigenvalue.
+
+    Returns
+        numpy matrix of moment tensor 6-vectors.
+
+    """
+    # Converts moment tensor from eigenvalues and eigenvectors to six
+    # vector form.
+
+    v1 = np.array([a[0, :], b[0, :], c[0, :]])
+    v2 = np.array([a[1, :], b[1, :], c[1, :]])
+    v3 = np.array([a[2, :], b[2, :], c[2, :]])
+    M = np.matrix([np.sum(v1*v1*diag, axis=0),  # M11
+                   np.sum(v2*v2*diag, axis=0),  # M22
+                   np.sum(v3*v3*diag, axis=0),  # M33
+                   np.sqrt(2)*np.sum(v1*v2*diag, axis=0),  # sqrt2*M12
+                   np.sqrt(2)*np.sum(v1*v3*diag, axis=0),  # sqrt2*M13
+                   np.sqrt(2)*np.sum(v2*v3*diag, axis=0)])  # sqrt2*M23
+    return np.matrix(M/np.sqrt(np.sum(np.multiply(M, M), axis=0)))
 
 
 def _6sphere_random_mt(self):
@@ -369,3 +591,21 @@ def _6sphere_random_mt(self):
     np.random.seed()
     M = np.random.randn(6, ns)
     return np.matrix(M/np.sqrt(np.sum(np.multiply(M, M), axis=0)))
+
+
+def _sobol_random_mt(self):
+    """
+    Generate scrambled Sobol quasi-random moment tensors (size 6,number_samples)
+
+    Generates moment tensors uniformly distributed on the surface of the unit 6-sphere from a scrambled Sobol sequence
+    (see QuasiRandomSampler), continuing the sequence on each call.
+
+    Returns
+        numpy matrix of quasi-random moment tensors, size 6,number_samples
+
+    """
+    if isinstance(self, int):
+        return QuasiRandomSampler()(self)
+    if getattr(self, '_quasi_random_sampler', None) is None:
+        self._quasi_random_sampler = QuasiRandomSampler()
+    return self._quasi_random_sampler(self.number_samples)
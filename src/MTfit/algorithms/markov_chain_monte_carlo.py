@@ -25,8 +25,10 @@ from .base import BaseAlgorithm
 from .monte_carlo import IterationSample
 from ..probability import gaussian_pdf, gaussian_cdf, beta_pdf, LnPDF
 from ..sampling import Sample
+from ..sampling import ChainSample
 from ..convert import Tape_MT33, basic_cdc_GD, MT33_MT6, MT6_Tape
 from ..utilities.extensions import get_extensions
+from ..utilities.memory import collect
 from ..utilities import C_EXTENSION_FALLBACK_LOG_MSG
 
 logger = logging.getLogger('MTfit.algorithms')
@@ -50,7 +52,10 @@ __all__ = ['McMCAlgorithmCreator',
            'IterativeMetropolisHastingsGaussianTape',
            'IterativeTransDMetropolisHastingsGaussianTape',
            'IterativeMultipleTryMetropolisHastingsGaussianTape',
-           'IterativeMultipleTryTransDMetropolisHastingsGaussianTape']
+           'IterativeMultipleTryTransDMetropolisHastingsGaussianTape',
+           'MultipleChainMetropolisHastingsGaussianTape',
+           'gelman_rubin',
+           'temperature_ladder']
 
 
 # Priors
@@ -132,6 +137,59 @@ def flat_prior(xi, dc=None, basic_cdc=False, poisson=None, max_poisson=0, min_po
     return p
 
 
+# Multiple chain functions
+def temperature_ladder(number_chains, max_temperature=1.):
+    """
+    Calculates a geometrically spaced temperature ladder for tempered chains
+
+    Args
+        number_chains: Number of chains.
+
+    Keyword Args
+        max_temperature:[1.] Temperature of the hottest chain, if <=1 all the chains have a temperature of 1.
+
+    Returns
+        list: list of chain temperatures (the first chain always has temperature 1).
+    """
+    if not max_temperature or max_temperature <= 1 or number_chains < 2:
+        return [1. for i in range(number_chains)]
+    return list(np.logspace(0, np.log10(max_temperature), number_chains))
+
+
+def gelman_rubin(chains):
+    """
+    Calculates the Gelman-Rubin potential scale reduction factor
+
+    Uses the split chain form (each chain is split in half) so that it can be calculated for a single chain.
+    The chains are truncated to the length of the shortest chain, discarding the start of each chain.
+    Values close to 1 suggest that the chains have converged.
+
+    Args
+        chains: list of sample arrays for each chain (number of parameters x number of samples).
+
+    Returns
+        np.array: potential scale reduction factor for each parameter (nan if the chains are too short).
+    """
+    chains = [np.asarray(chain) for chain in chains]
+    if not len(chains):
+        return np.array([])
+    n = min([chain.shape[1] for chain in chains])//2
+    if n < 2:
+        return np.nan*np.ones(chains[0].shape[0])
+    split_chains = []
+    for chain in chains:
+        chain = chain[:, -2*n:]
+        split_chains.extend([chain[:, :n], chain[:, n:]])
+    split_chains = np.array(split_chains)
+    # Within chain variance
+    within = split_chains.var(axis=2, ddof=1).mean(axis=0)
+    # Between chain variance
+    between = n*split_chains.mean(axis=2).var(axis=0, ddof=1)
+    variance = (n-1.)*within/n+between/n
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(variance/within)
+
+
 class DataError(ValueError):
     pass
 
@@ -170,6 +228,12 @@ class McMCAlgorithmCreator(object):
                 modifying the acceptance rate.
             initial_sample:['Grid'] Initialisation sampling mode to use options are 'Grid'.
 
+        Keyword Args
+            number_chains:[1] Number of chains to run together for a single event (see MultipleChainMetropolisHastingsGaussianTape).
+            max_temperature:[1] Temperature of the hottest chain when running multiple chains (1 means no tempering).
+            temperatures:[False] List of chain temperatures when running multiple chains (overrides max_temperature).
+            exchange_interval:[10] Number of steps between replica exchange proposals for tempered chains.
+
         Returns
             McMC sampling object.
         """
@@ -177,6 +241,19 @@ class McMCAlgorithmCreator(object):
         # McMC algorithms included in this file
         if mode.lower() in ['metropolis_hastings'] and parameterisation.lower() == 'tape' and transition.lower() == 'gaussian':
             number_samples = kwargs.pop('number_samples', 1000)
+            number_chains = kwargs.pop('number_chains', 1)
+            if number_chains and number_chains > 1:
+                if kwargs.get('number_events', 1) > 1:
+                    logger.warning('Multiple chains not implemented for multiple event inversions - running a single chain')
+                else:
+                    if trans_dimensional:
+                        kwargs['dimension_jump_prob'] = kwargs.get('dimension_jump_prob', 0.01)
+                    return MultipleChainMetropolisHastingsGaussianTape(number_chains=number_chains, trans_dimensional=trans_dimensional, alpha=alpha,
+                                                                       learning_length=learning_length, chain_length=chain_length,
+                                                                       min_acceptance_rate=min_acceptance_rate,
+                                                                       max_acceptance_rate=max_acceptance_rate,
+                                                                       initial_sample=initial_sample,
+                                                                       acceptance_rate_window=acceptance_rate_window, **kwargs)
             if not number_samples:  # or kwargs.get('multiple_events',False):
                 if trans_dimensional:
                     dimension_jump_prob = kwargs.pop('dimension_jump_prob', 0.01)
@@ -266,9 +343,12 @@ class MarginalisedMarkovChainMonteCarlo(BaseAlgorithm):
             diagnostic_output:[False] Set algorithm to output all information on iterations - for testing/plotting and debugging.
             min_number_initialisation_samples:[30000] Minimum number of samples for grid based iteration sampler.
             number_samples:[10000] Number of samples to use for each iteration of the grid sampler.
+            record_samples:[True] Store the chain samples for output (not needed for tempered chains).
         """
         super(MarginalisedMarkovChainMonteCarlo, self).__init__(*args, **kwargs)
         self.mcmc = True
+        # The chain samples are kept in double precision (single_precision only applies to the forward model)
+        self.dtype = np.float64
         self.number_samples = 1
         self._tried = 0
         self._accepted = -1
@@ -298,6 +378,13 @@ class MarginalisedMarkovChainMonteCarlo(BaseAlgorithm):
         self.max_acceptance_rate = kwargs.get('max_acceptance_rate', 0.5)
         self.acceptance_rate_window = kwargs.get('acceptance_rate_window', 100)
         self._debug = kwargs.get('diagnostic_output', False)
+        self.record_samples = kwargs.get('record_samples', True)
+        # Preallocated chain store, unless saving the samples to file (the samples are not stored if they are not recorded,
+        # so only a minimal store is allocated)
+        chain_length = kwargs.get('chain_length', 1000000) if self.record_samples else 0
+        if type(self.pdf_sample) is Sample:
+            self.pdf_sample = ChainSample(chain_length, number_events=self.number_events, prior=self._prior)
+        self._recorded_xi = None
         self._init_nonzero = False
         self._max_initialisation_probability = -np.inf
         self._init_max_mt = False
@@ -313,7 +400,10 @@ class MarginalisedMarkovChainMonteCarlo(BaseAlgorithm):
         self.scale_factor_i = False
         # Multiple events
         if self.number_events > 1:
-            self.pdf_sample = Sample(number_events=self.number_events)
+            if type(self.pdf_sample) is ChainSample:
+                self.pdf_sample = ChainSample(chain_length, number_events=self.number_events)
+            else:
+                self.pdf_sample = Sample(number_events=self.number_events)
             all_alpha = []
             dc = self.dc
             self.dc = []
@@ -452,6 +542,9 @@ class MarginalisedMarkovChainMonteCarlo(BaseAlgorithm):
                     newAlpha[key] = alpha[key]*ratio
                     if newAlpha[key] > self.max_alpha[key]:
                         newAlpha[key] = alpha[key]
+                else:
+                    # Dimension jump parameters are not modified
+                    newAlpha[key] = alpha[key]
         elif isinstance(alpha, list):
             newAlpha = []
             for i, alph in enumerate(alpha):
@@ -590,7 +683,11 @@ class MarginalisedMarkovChainMonteCarlo(BaseAlgorithm):
             self.dc = False
         self.scale_factor_i = scale_factori_1
         if not self.learning_check():
-            self.pdf_sample.append(self.convert_sample(xi_1), ln_pi_1, 1, scale_factori_1)
+            if self.record_samples:
+                # Repeats of the last recorded sample are run-length encoded in the chain store
+                if not (xi_1 is self._recorded_xi and isinstance(self.pdf_sample, ChainSample) and self.pdf_sample.repeat()):
+                    self.pdf_sample.append(self.convert_sample(xi_1), ln_pi_1, 1, scale_factori_1)
+                    self._recorded_xi = xi_1
             self._tried += 1
 
     def iterate(self, result):
@@ -754,7 +851,7 @@ class MarginalisedMarkovChainMonteCarlo(BaseAlgorithm):
                     self._add_new(self.xi, self.ln_likelihood_xi, self.scale_factor_i)
                 elif not self._tried % 100:
                     logger.info('{} samples tried: {} samples accepted'.format(self._tried, self._accepted))
-            gc.collect()
+            collect()
             return self.new_sample(), False
         # Error handling
         except MemoryError:
@@ -790,7 +887,7 @@ class MarginalisedMarkovChainMonteCarlo(BaseAlgorithm):
         self._tried = -1  # As this will always be accepted as initial sample
         self.ln_likelihood_xi = 0
         self.scale_factor_i = False
-        gc.collect()
+        collect()
         return self.convert_sample(self.xi_1), False
 
     def _convert_sample_single(self, x):
@@ -1080,7 +1177,6 @@ class MarginalisedMetropolisHastingsGaussianTape(MarginalisedMetropolisHastings)
                     s = -np.pi+s
             s = self.alpha['sigma']*np.random.randn(1)+self.xi['sigma']
         x['sigma'] = s
-        gc.collect()
         return x
 
     def new_sample(self, *args, **kwargs):
@@ -1401,8 +1497,10 @@ class IterativeTransDMetropolisHastingsGaussianTape(IterativeMetropolisHastingsG
         Returns
             float:acceptance
         """
-        if isinstance(self.ln_likelihood_xi, np.ndarray):
+        if isinstance(self.ln_likelihood_xi, (np.ndarray, LnPDF)):
             self.ln_likelihood_xi = float(self.ln_likelihood_xi)
+        if isinstance(ln_likelihoodx, (np.ndarray, LnPDF)):
+            ln_likelihoodx = float(ln_likelihoodx)
         # Handle jump parameters
         if self.jump and (self.ln_likelihood_xi > -np.inf):
             # No jump - may have been accidentally picked up
@@ -1732,3 +1830,229 @@ class IterativeMultipleTryTransDMetropolisHastingsGaussianTape(IterativeTransDMe
             New sample.
         """
         return IterativeMultipleTryMetropolisHastingsGaussianTape.new_sample(self, self.dimension_jump_prob, self.gaussian_jump_params)
+
+
+class MultipleChainMetropolisHastingsGaussianTape(object):
+
+    """
+    Multiple chain Metropolis-Hastings Markov chain Monte Carlo Algorithm using Gaussian Transition PDF and Tape parameterisation
+
+    Runs several Markov chains for a single event together. The proposals from all the chains are returned as a single
+    set of moment tensor samples, so that each step is evaluated with one forward model call (and hence one combined
+    probability calculation). The chains can be run at different temperatures (parallel tempering), with the likelihood
+    for each chain raised to the power 1/T, and replica exchange proposals between chains with adjacent temperatures.
+
+    The chains at temperature 1 are merged for the output, which is the same as for the single chain algorithms, with
+    the Gelman-Rubin potential scale reduction factor for the moment tensor components added.
+    The parameterisation is from Tape and Tape (A geometric setting for moment tensors, Tape and Tape, 2012, GJI 190 pp 476-490).
+
+    """
+
+    def __init__(self, number_chains=4, temperatures=False, max_temperature=1., exchange_interval=10, trans_dimensional=False, **kwargs):
+        """
+        Initialisation of multiple chain Metropolis-Hastings Markov chain Monte Carlo Algorithm
+
+        Keyword Args
+            number_chains:[4] Number of chains to run.
+            temperatures:[False] List of chain temperatures, if not set, a geometric ladder up to max_temperature is used.
+            max_temperature:[1.] Temperature of the hottest chain (1 means no tempering).
+            exchange_interval:[10] Number of steps between replica exchange proposals for tempered chains.
+            trans_dimensional:[False] Boolean flag to run with trans-dimensional sampling.
+            chain_length:[1000000] Length of the merged chain (split between the chains at temperature 1).
+
+        Other kwargs are passed to the individual chains (IterativeMetropolisHastingsGaussianTape or
+        IterativeTransDMetropolisHastingsGaussianTape)
+        """
+        if not temperatures:
+            temperatures = temperature_ladder(number_chains, max_temperature)
+        if len(temperatures) != number_chains:
+            raise ValueError('Number of temperatures ({}) does not match the number of chains ({})'.format(len(temperatures), number_chains))
+        if min(temperatures) < 1:
+            raise ValueError('Chain temperatures must be >= 1')
+        self.number_chains = number_chains
+        self.temperatures = [float(temperature) for temperature in temperatures]
+        self.exchange_interval = max(int(exchange_interval), 1)
+        self.mcmc = True
+        self._cold = [i for i, temperature in enumerate(self.temperatures) if temperature == 1]
+        if not len(self._cold):
+            raise ValueError('At least one chain must have a temperature of 1')
+        # Split the chain length between the cold chains
+        chain_length = int(np.ceil(kwargs.pop('chain_length', 1000000)/float(len(self._cold))))
+        # The chains are stored in memory and merged for the output
+        kwargs['file_sample'] = False
+        if trans_dimensional:
+            chain_class = IterativeTransDMetropolisHastingsGaussianTape
+        else:
+            kwargs.pop('dimension_jump_prob', None)
+            chain_class = IterativeMetropolisHastingsGaussianTape
+        self.chains = []
+        for temperature in self.temperatures:
+            self.chains.append(chain_class(chain_length=chain_length, record_samples=temperature == 1, **kwargs))
+        self._ended = [False for i in range(self.number_chains)]
+        self._slices = []
+        self._step = 0
+        self._exchange_tried = [0 for i in range(self.number_chains-1)]
+        self._exchange_accepted = [0 for i in range(self.number_chains-1)]
+        self.t0 = time.time()
+
+    @property
+    def total_number_samples(self):
+        return sum([self.chains[i]._tried for i in self._cold])
+
+    def _batch(self, mts):
+        """
+        Combines the moment tensor samples from each chain
+
+        Args
+            mts: list of moment tensor samples for each chain (None if the chain has ended).
+
+        Returns
+            np.matrix: moment tensor samples for all the chains.
+        """
+        self._slices = []
+        start = 0
+        batch = []
+        for mt in mts:
+            if mt is None or not np.prod(np.shape(mt)):
+                self._slices.append((start, start))
+                continue
+            self._slices.append((start, start+mt.shape[1]))
+            start += mt.shape[1]
+            batch.append(mt)
+        return np.matrix(np.hstack(batch))
+
+    def initialise(self):
+        """
+        Initialise the chains
+
+        Returns
+            new_sample,False
+        """
+        mts = []
+        for chain in self.chains:
+            mts.append(chain.initialise()[0])
+        self.t0 = time.time()
+        return self._batch(mts), False
+
+    def iterate(self, result):
+        """
+        Iterate from result
+
+        Splits the result between the chains, iterates each chain and carries out the replica exchange proposals.
+
+        Args
+            result: Result dictionary from forward task (e.g. MTfit.inversion.ForwardTask)
+
+        Returns
+            new_sample,End where End is a boolean flag to end the chains.
+        """
+        ln_pdf = result['ln_pdf']
+        if isinstance(ln_pdf, LnPDF):
+            ln_pdf = ln_pdf._ln_pdf
+        ln_pdf = np.array(ln_pdf, ndmin=2)
+        scale_factor = result.get('scale_factor', False)
+        mts = []
+        for i, chain in enumerate(self.chains):
+            start, end = self._slices[i]
+            if self._ended[i] or start == end:
+                mts.append(None)
+                continue
+            chain_ln_pdf = ln_pdf[:, start:end]
+            if self.temperatures[i] != 1:
+                chain_ln_pdf = chain_ln_pdf/self.temperatures[i]
+            chain_result = {'moment_tensors': result['moment_tensors'][:, start:end], 'ln_pdf': LnPDF(chain_ln_pdf), 'n': end-start}
+            if not isinstance(scale_factor, bool) and scale_factor is not None:
+                chain_result['scale_factor'] = scale_factor[start:end]
+            mt, self._ended[i] = chain.iterate(chain_result)
+            if self._ended[i]:
+                mt = None
+            mts.append(mt)
+        self._step += 1
+        if not self._step % self.exchange_interval:
+            for i in self._exchange():
+                if mts[i] is not None:
+                    # Proposal from the exchanged sample
+                    mts[i] = self.chains[i].new_sample()
+        if all([self._ended[i] for i in self._cold]):
+            self._t1 = time.time()
+            logger.info('\nChains complete\nChains elapsed time: {}\n'.format(self._t1-self.t0))
+            return [], True
+        return self._batch(mts), False
+
+    def _can_exchange(self, i):
+        """Check if chain i is in the main part of the chain with a non-zero probability sample"""
+        chain = self.chains[i]
+        return not self._ended[i] and not chain._initialising and not chain._initialiser and \
+            isinstance(chain.xi, dict) and len(chain.xi) and np.isfinite(float(chain.ln_likelihood_xi))
+
+    def _exchange(self):
+        """
+        Replica exchange proposals between chains with adjacent temperatures
+
+        Alternates between exchanging the even and odd pairs of chains.
+
+        Returns
+            list: indices of the chains with exchanged samples.
+        """
+        exchanged = []
+        offset = (self._step//self.exchange_interval) % 2
+        for i in range(offset, self.number_chains-1, 2):
+            j = i+1
+            if self.temperatures[i] == self.temperatures[j] or not self._can_exchange(i) or not self._can_exchange(j):
+                continue
+            self._exchange_tried[i] += 1
+            # Untempered ln_likelihoods
+            ln_likelihood_i = float(self.chains[i].ln_likelihood_xi)*self.temperatures[i]
+            ln_likelihood_j = float(self.chains[j].ln_likelihood_xi)*self.temperatures[j]
+            ln_acceptance = (1/self.temperatures[i]-1/self.temperatures[j])*(ln_likelihood_j-ln_likelihood_i)
+            if np.log(np.random.rand()) <= ln_acceptance:
+                xi_i, scale_factor_i = self.chains[i].xi, self.chains[i].scale_factor_i
+                self._set_state(self.chains[i], self.chains[j].xi, ln_likelihood_j/self.temperatures[i], self.chains[j].scale_factor_i)
+                self._set_state(self.chains[j], xi_i, ln_likelihood_i/self.temperatures[j], scale_factor_i)
+                self._exchange_accepted[i] += 1
+                exchanged.extend([i, j])
+        return exchanged
+
+    @staticmethod
+    def _set_state(chain, xi, ln_likelihood, scale_factor):
+        """Set the current sample for a chain"""
+        chain.xi = xi
+        chain.ln_likelihood_xi = ln_likelihood
+        chain.scale_factor_i = scale_factor
+        chain.dc = bool('gamma' in xi and xi['gamma'] == 0 and xi['delta'] == 0)
+
+    def exchange_acceptance_rate(self):
+        """
+        Gets the replica exchange acceptance rates.
+
+        Returns
+            np.array: acceptance rate for the exchanges between each pair of adjacent chains.
+        """
+        return np.array([float(accepted)/tried if tried else 0. for accepted, tried in zip(self._exchange_accepted, self._exchange_tried)])
+
+    def output(self, normalise=True, convert=False, discard=10000):
+        """
+        Returns output dictionary
+
+        Merges the chains with temperature 1 and adds the multiple chain diagnostics.
+
+        Returns
+            dict: Output dictionary
+        """
+        cold_chains = [self.chains[i] for i in self._cold]
+        samples = [chain.pdf_sample.expand()[0] for chain in cold_chains]
+        potential_scale_reduction = gelman_rubin(samples)
+        # Merge the cold chains into the first cold chain
+        merged = cold_chains[0]
+        for chain in cold_chains[1:]:
+            merged.pdf_sample.extend(chain.pdf_sample)
+            merged._tried += chain._tried
+            merged._accepted += chain._accepted
+            merged.p_dc += chain.p_dc
+        output, output_string = merged.output(normalise, convert, discard)
+        output.update({'number_chains': self.number_chains,
+                       'temperatures': np.array(self.temperatures),
+                       'gelman_rubin': potential_scale_reduction,
+                       'exchange_acceptance_rate': self.exchange_acceptance_rate()})
+        output_string += 'Gelman-Rubin potential scale reduction factor: {}\n\n'.format(potential_scale_reduction)
+        return output, output_string
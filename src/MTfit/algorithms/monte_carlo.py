@@ -12,11 +12,12 @@ Module containing algorithm classes for Monte Carlo random sampling.
 
 
 import time
-import gc
 import logging
 
 from .base import BaseAlgorithm
 from .base import PRINT_N_ITERATIONS
+from ..utilities.memory import collect
+from ..utilities.memory import array_nbytes
 
 logger = logging.getLogger('MTfit.algorithms')
 
@@ -75,6 +76,10 @@ class BaseMonteCarloRandomSample(BaseAlgorithm):
     def total_number_samples(self):
         return self.pdf_sample.n
 
+    def number_non_zero(self):
+        """Returns the number of non-zero samples, including those dropped by the streaming discard"""
+        return len(self.pdf_sample.ln_pdf.nonzero())+self.pdf_sample.number_dropped
+
     def check_finished(self, end):
         return end
 
@@ -99,7 +104,7 @@ class BaseMonteCarloRandomSample(BaseAlgorithm):
         except MemoryError:
             task, end = [], True
         if (isinstance(self.quality_check, (float, int)) and self.quality_check > 0) and self.pdf_sample.n > self._min_number_check_samples:
-            if (100*float(len(self.pdf_sample.ln_pdf.nonzero()))/float(self.pdf_sample.n)) > self.quality_check:
+            if (100*float(self.number_non_zero())/float(self.pdf_sample.n)) > self.quality_check:
                 logger.error("Data Error: Non-zero sample percentage above {}".format(self.quality_check))
                 return [], True
 
@@ -109,13 +114,14 @@ class BaseMonteCarloRandomSample(BaseAlgorithm):
         if not self.iteration % PRINT_N_ITERATIONS:
             if self.pdf_sample.n > 0:
                 message = 'Iteration: {} | Elapsed Time: {:.0f} seconds | Total Samples: {} | Non-zero samples: {} | Percentage Non-Zero: {:f} %'
-                message = message.format(self.iteration, time.time()-self.start_time, self.pdf_sample.n, len(self.pdf_sample.ln_pdf.nonzero()),
-                                         100*float(len(self.pdf_sample.ln_pdf.nonzero()))/float(self.pdf_sample.n))
+                number_non_zero = self.number_non_zero()
+                message = message.format(self.iteration, time.time()-self.start_time, self.pdf_sample.n, number_non_zero,
+                                         100*float(number_non_zero)/float(self.pdf_sample.n))
             else:
                 message = 'Iteration: {} | Elapsed Time: {:.0f} seconds | Total Samples: {} | Non-zero samples: {}'
-                message = message.format(self.iteration, time.time()-self.start_time, self.pdf_sample.n, len(self.pdf_sample.ln_pdf.nonzero()))
+                message = message.format(self.iteration, time.time()-self.start_time, self.pdf_sample.n, self.number_non_zero())
             logger.info(message)
-        gc.collect()
+        collect(array_nbytes(task))
         return task, end
 
     def initialise(self):
@@ -192,6 +198,8 @@ class IterationSample(BaseMonteCarloRandomSample):
         """
         super(IterationSample, self).__init__(*args, **kwargs)
         self.max_samples = int(max_samples)
+        # Use the final number of samples for the streaming discard cut-off
+        self.pdf_sample.n_samples = self.max_samples
 
     def max_value(self):
         return '{} samples'.format(self.max_samples)
@@ -18,7 +18,6 @@ The coordinate system is North (X), East (Y), Down (Z)
 import logging
 
 import numpy as np
-from scipy.optimize import fsolve
 
 from ..utilities import C_EXTENSION_FALLBACK_LOG_MSG
 
@@ -1022,6 +1021,8 @@ def MT6_biaxes(MT6, c=isotropic_c(lambda_=1, mu=1)):
         if is_isotropic_c(c):
             explosion = isotropic
         else:
+            from scipy.optimize import fsolve
+
             def isotropic_solve(iso):
 
                 iso6 = np.squeeze(iso)*np.array([[1], [1], [1], [0], [0], [0]])
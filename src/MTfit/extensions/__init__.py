@@ -29,7 +29,7 @@ extensions/scatangle.py is an example extension structure, although it would be
 
 entry_points = ['MTfit.cmd_opts', 'MTfit.cmd_defaults', 'MTfit.tests', 'MTfit.pre_inversion', 'MTfit.post_inversion',
                 'MTfit.extensions', 'MTfit.parsers', 'MTfit.location_pdf_parsers', 'MTfit.output_data_formats',
-                'MTfit.output_formats', 'MTfit.process_data_types', 'MTfit.data_types', 'MTfit.parallel_algorithms',
+                'MTfit.output_formats', 'MTfit.process_data_types', 'MTfit.data_types', 'MTfit.forward_model_backends', 'MTfit.parallel_algorithms',
                 'MTfit.directed_algorithms', 'MTfit.sampling', 'MTfit.sampling_prior', 'MTfit.sample_distribution',
                 'MTfit.plot', 'MTfit.plot_read', 'MTfit.documentation', 'MTfit.source_code']
 
@@ -47,6 +47,7 @@ entry_points_descriptions = {
     'MTfit.output_formats': 'Functions that output the results from the output_data_formats',
     'MTfit.process_data_types': 'Functions to convert input data into correct format for new data types in forward model',
     'MTfit.data_types': 'Functions to evaluate the forward model for new data types',
+    'MTfit.forward_model_backends': 'Backends that evaluate the combined forward model PDF for the moment tensor samples',
     'MTfit.parallel_algorithms': 'Search algorithms that can be run (in parallel) like monte carlo random sampling',
     'MTfit.directed_algorithms': 'Search algorithms that are dependent on the previous value (e.g. McMC)',
     'MTfit.documentation': 'Installs the documentation for the extension',
@@ -789,6 +790,47 @@ Where ext_data_* is the extension data for each event as a dictionary. This dict
 the scale and scale_uncertainty return variables correspond to estimates of the relative seismic moment between the two events, if it is generated by the extension function (if this is not estimated, 1. and 0. should be returned)
 """
 
+_forward_model_backends_rst_doc = """A backend to evaluate the combined polarity, polarity probability and amplitude ratio forward model PDF (e.g. tuned for particular hardware). This can be installed using :mod:`setuptools` by adding the ``MTfit.forward_model_backends`` entry point to the extension ``setup.py`` script::
+
+    setup(...
+          entry_points = {
+                'MTfit.forward_model_backends':
+                    ['my_backend = mymodule:MyBackend']
+                }
+          ...)
+
+The entry point should be a subclass (or instance) of :class:`MTfit.probability.backends.ForwardModelBackend`, overriding the ``available`` and ``combined_ln_pdf`` methods. The ``combined_ln_pdf`` method is called with the same arguments as :func:`MTfit.probability.cprobability.combined_ln_pdf`::
+
+    ln_pdf = backend.combined_ln_pdf(mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                                     percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_prob,
+                                     polarity_prob, incorrect_polarity_prob, generate_samples=0, dc=False, cutoff=100000000,
+                                     marginalised=1, location_samples_multipliers=ln_multipliers, number_threads=1,
+                                     single_precision=False, ratio_pdf_max_error=0, location_tolerance=0, sampler=None)
+
+and returns the ln PDF array for the moment tensor samples (marginalised over the location samples if ``marginalised`` is set). Backends that can generate the samples while evaluating the ln PDF should set the ``generates_samples`` attribute to ``True``, and return a tuple of the ln PDF, moment tensors and number of samples tried when ``generate_samples`` is non-zero.
+
+The backend is selected by name using the ``backend`` option, otherwise the fastest available backend in a short calibration benchmark is used.
+"""
+
+_forward_model_backends_doc = """A backend to evaluate the combined polarity, polarity probability and amplitude ratio forward model PDF (e.g. tuned for particular hardware). This can be installed using setuptools (https://pypi.python.org/pypi/setuptools) by adding the MTfit.forward_model_backends entry point to the extension setup.py script:
+
+    setup(...
+          entry_points = {'MTfit.forward_model_backends': ['my_backend = mymodule:MyBackend']}
+          ...)
+
+The entry point should be a subclass (or instance) of MTfit.probability.backends.ForwardModelBackend, overriding the available and combined_ln_pdf methods. The combined_ln_pdf method is called with the same arguments as MTfit.probability.cprobability.combined_ln_pdf:
+
+    ln_pdf = backend.combined_ln_pdf(mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                                     percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_prob,
+                                     polarity_prob, incorrect_polarity_prob, generate_samples=0, dc=False, cutoff=100000000,
+                                     marginalised=1, location_samples_multipliers=ln_multipliers, number_threads=1,
+                                     single_precision=False, ratio_pdf_max_error=0, location_tolerance=0, sampler=None)
+
+and returns the ln PDF array for the moment tensor samples (marginalised over the location samples if marginalised is set). Backends that can generate the samples while evaluating the ln PDF should set the generates_samples attribute to True, and return a tuple of the ln PDF, moment tensors and number of samples tried when generate_samples is non-zero.
+
+The backend is selected by name using the backend option, otherwise the fastest available backend in a short calibration benchmark is used.
+"""
+
 _parallel_algorithms_rst_doc = """This extension provides an entry point for customising the search algorithm. This can be installed using :mod:`setuptools` by adding the ``MTfit.parallel_algorithms`` entry point to the extension ``setup.py`` script::
 
     setup(...
@@ -1190,6 +1232,7 @@ entry_points_docs = {'MTfit.cmd_defaults': _cmd_defaults_doc,
                      'MTfit.output_formats': _output_formats_doc,
                      'MTfit.process_data_types': _process_data_types_doc,
                      'MTfit.data_types': _data_types_doc,
+                     'MTfit.forward_model_backends': _forward_model_backends_doc,
                      'MTfit.parallel_algorithms': _parallel_algorithms_doc,
                      'MTfit.directed_algorithms': _directed_algorithms_doc,
                      'MTfit.documentation': _documentation_doc,
@@ -1211,6 +1254,7 @@ entry_points_rst_docs = {'MTfit.cmd_defaults': _cmd_defaults_rst_doc,
                          'MTfit.output_formats': _output_formats_rst_doc,
                          'MTfit.process_data_types': _process_data_types_rst_doc,
                          'MTfit.data_types': _data_types_rst_doc,
+                         'MTfit.forward_model_backends': _forward_model_backends_rst_doc,
                          'MTfit.parallel_algorithms': _parallel_algorithms_rst_doc,
                          'MTfit.directed_algorithms': _directed_algorithms_rst_doc,
                          'MTfit.documentation': _documentation_rst_doc,
@@ -39,44 +39,52 @@ from libc.math cimport M_SQRT2 as sqrt2
 @cython.wraparound(False)
 @cython.nonecheck(False)
 @cython.cdivision(True)
-cdef DTYPE_t[::1] get_multipliers(DTYPE_t[:,:,::1] angles,DTYPE_t bin_size,DTYPE_t [::1] multipliers) nogil:
+cdef DTYPE_t[::1] get_multipliers(DTYPE_t[:,::1] angles,Py_ssize_t[::1] order,Py_ssize_t[:,::1] starts,Py_ssize_t[:,::1] ends,DTYPE_t bin_size,DTYPE_t [::1] multipliers) nogil:
+    # Only the samples in the neighbouring hash grid cells (starts to ends in order) can be within the bin
     cdef Py_ssize_t umax=angles.shape[0]
-    cdef Py_ssize_t nsta=angles.shape[2]
+    cdef Py_ssize_t nangles=angles.shape[1]
+    cdef Py_ssize_t ncells=starts.shape[1]
     cdef Py_ssize_t u
+    cdef Py_ssize_t v
     cdef Py_ssize_t w
+    cdef Py_ssize_t c
+    cdef Py_ssize_t p
     cdef int ok=1
     for u in range(umax):
         if multipliers[u]==-1:
             continue
-        for v in range(u+1,umax):  
-            if multipliers[v]>-1:
-                ok=1
-                for w in range(nsta):
-                    ok=ok*(fabs(angles[u,0,w]-angles[v,0,w])<bin_size/2.)*(fabs(angles[u,1,w]-angles[v,1,w])<bin_size/2.)
-                    if ok==0:
-                        break
-                if w==nsta-1 and ok>0:
-                    multipliers[u]+=multipliers[v]
-                    if v>u:
+        for c in range(ncells):
+            for p in range(starts[u,c],ends[u,c]):
+                v=order[p]
+                if v>u and multipliers[v]>-1:
+                    ok=1
+                    for w in range(nangles):
+                        if fabs(angles[u,w]-angles[v,w])>=bin_size/2.:
+                            ok=0
+                            break
+                    if ok>0:
+                        multipliers[u]+=multipliers[v]
                         multipliers[v]=-1
     return multipliers
 
 
+cpdef bin_angles(angles,multipliers,bin_size):
+    from .scatangle import grid_bin_cells
+    angles=np.ascontiguousarray(angles,dtype=np.float64)
+    order,starts,ends=grid_bin_cells(angles,bin_size/2.)
+    multipliers=np.asarray(get_multipliers(angles,order,starts,ends,bin_size,np.array(multipliers,dtype=np.float64).flatten())).flatten()
+    indices=np.flatnonzero(multipliers>-1)
+    return indices,multipliers[indices]
+
+
 cpdef bin_scatangle(sample_records,multipliers,bin_size):
-    cdef DTYPE_t[:,:,::1] angles=np.empty((len(sample_records),2,len(sample_records[0]['Name'])))
+    cdef Py_ssize_t nsta=len(sample_records[0]['Name'])
+    cdef DTYPE_t[:,::1] angles=np.empty((len(sample_records),2*nsta))
     cdef Py_ssize_t i
     cdef Py_ssize_t j
-    new_records=[]
-    new_multipliers=[]
-    for i,record in enumerate(sample_records):
-        # print i,record
-        for j in range(len(record['Name'])):
-            angles[i,0,j]=record['TakeOffAngle'][j,0]
-            angles[i,1,j]=record['Azimuth'][j,0]
-    # print multipliers,bin_size,angles
-    multipliers=np.asarray(get_multipliers(angles,bin_size,multipliers)).flatten()
     for i,record in enumerate(sample_records):
-        if multipliers[i]>0:
-            new_records.append(record)
-            new_multipliers.append(multipliers[i])
-    return new_records,new_multipliers
\ No newline at end of file
+        for j in range(nsta):
+            angles[i,j]=record['TakeOffAngle'][j,0]
+            angles[i,nsta+j]=record['Azimuth'][j,0]
+    indices,multipliers=bin_angles(angles,multipliers,bin_size)
+    return [sample_records[i] for i in indices],multipliers.tolist()
@@ -14,7 +14,11 @@ Extension for handling scatangle files (installed with the main module, but prov
 
 import os
 import glob
+import json
+import hashlib
+import itertools
 import time
+import struct
 import logging
 import operator
 
@@ -39,17 +43,501 @@ except Exception:
     _argparse = False
 
 
+# Binary scatangle file identifier, format version and file extension
+SCATANGLE_BINARY_MAGIC = b'MTFITSCB'
+SCATANGLE_BINARY_VERSION = 1
+SCATANGLE_BINARY_EXTENSION = '.scatbin'
+# Number of characters of the scatangle file to parse at a time
+SCATANGLE_CHUNK_SIZE = 2**22
+# Number of dimensions of the hash grid used for binning samples
+GRID_BIN_DIMENSIONS = 2
+# Number of location samples binned in each chunk when binning scatangle files in parallel
+BIN_SCATANGLE_CHUNK_SIZE = 20000
+# Number of bytes at the end of the binned part of a scatangle file checked for incremental binning
+BIN_STATE_TAIL_SIZE = 2**16
+
+
+def grid_bin_cells(values, tolerance, dimensions=GRID_BIN_DIMENSIONS):
+    """
+    Hash grid of the samples for binning
+
+    The samples are assigned to grid cells of size tolerance on the dimensions of the values with the largest spread, so
+    that all the samples with values within tolerance of a sample are in the neighbouring cells. The cell keys are int64, so
+    grid dimensions are dropped if the number of cells would overflow them (with no grid dimensions all the samples are
+    in the same cell, so every pair of samples is compared).
+
+    Args
+        values: numpy array of sample values (samples x values).
+        tolerance: float maximum difference for the samples to be binned together.
+
+    Keyword Args
+        dimensions:[GRID_BIN_DIMENSIONS] integer number of dimensions for the grid.
+
+    Returns
+        order,starts,ends: numpy array of the sample indices sorted by cell, and numpy arrays of the start and end positions
+            in order of the neighbouring cells for each sample (samples x neighbouring cells).
+    """
+    values = np.asarray(values, dtype=np.float64)
+    if not values.shape[0]:
+        return np.empty((0,), dtype=np.intp), np.empty((0, 1), dtype=np.intp), np.empty((0, 1), dtype=np.intp)
+    # Cells slightly larger than the tolerance, so rounding errors cannot move samples within tolerance further than the neighbouring cells
+    cell_size = tolerance*(1+1e-9)
+    minimum = values.min(axis=0)
+    spread = values.max(axis=0)-minimum
+    # Only use the grid dimensions (in order of spread) while the number of cells in the key range fits in int64
+    grid_dimensions = []
+    number_cells = 1
+    if cell_size <= 0:
+        dimensions = 0
+    for dimension in np.argsort(spread)[::-1][:dimensions]:
+        dimension_cells = spread[dimension]/cell_size+3
+        if not np.isfinite(dimension_cells) or number_cells*dimension_cells >= np.iinfo(np.int64).max/2:
+            break
+        number_cells *= int(dimension_cells)+1
+        grid_dimensions.append(dimension)
+    # Cell indices start at 1, so the neighbouring cells are all in the mixed radix cell key range
+    cells = np.floor((values[:, grid_dimensions]-minimum[grid_dimensions])/cell_size).astype(np.int64)+1
+    strides = np.cumprod(np.append(1, cells.max(axis=0)[:-1]+2)).astype(np.int64)[:len(grid_dimensions)]
+    keys = np.dot(cells, strides)
+    offsets = np.dot(np.array(list(itertools.product([-1, 0, 1], repeat=len(grid_dimensions))), dtype=np.int64).reshape(3**len(grid_dimensions), len(grid_dimensions)), strides)
+    order = np.argsort(keys, kind='mergesort')
+    neighbours = keys[:, np.newaxis]+offsets[np.newaxis, :]
+    starts = np.searchsorted(keys[order], neighbours, 'left')
+    ends = np.searchsorted(keys[order], neighbours, 'right')
+    return order.astype(np.intp), np.ascontiguousarray(starts, dtype=np.intp), np.ascontiguousarray(ends, dtype=np.intp)
+
+
+def grid_bin_samples(values, multipliers, tolerance):
+    """
+    Bin samples if all the differences between the sample values are less than the tolerance
+
+    The samples are binned in sample order, so each sample that has not been binned is the first sample in a new bin, with
+    all the later samples within tolerance of it that have not been binned, and the bin multiplier is the sum of the
+    sample multipliers (the same as comparing all the pairs of samples). The candidate samples are found from the
+    neighbouring cells in a hash grid of the samples (see grid_bin_cells), rather than comparing every pair of samples.
+
+    Args
+        values: numpy array of sample values (samples x values).
+        multipliers: list or numpy array of sample multipliers.
+        tolerance: float maximum difference for the samples to be binned together.
+
+    Returns
+        indices,multipliers: numpy array of the indices of the first sample in each bin and numpy array of the bin multipliers.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    multipliers = np.array(multipliers, dtype=np.float64).flatten()
+    order, starts, ends = grid_bin_cells(values, tolerance)
+    binned = np.ones((len(multipliers),), dtype=bool)
+    for u in range(len(multipliers)):
+        if not binned[u]:
+            continue
+        candidates = np.concatenate([order[start:end] for start, end in zip(starts[u], ends[u])])
+        candidates = candidates[(candidates > u) & binned[candidates]]
+        candidates = candidates[np.all(np.abs(values[candidates]-values[u]) < tolerance, axis=1)]
+        # Sum in the same order as the C extensions
+        for multiplier in multipliers[candidates]:
+            multipliers[u] += multiplier
+        binned[candidates] = False
+    indices = np.flatnonzero(binned)
+    return indices, multipliers[indices]
+
+
+def _parse_scatangle_lines(lines, multiplier=1.0):
+    """
+    Parses scatangle file lines into location sample records (private function)
+
+    Args
+        lines: list of scatangle file lines.
+
+    Keyword Args
+        multiplier:[1.0] float multiplier of the first sample if it has no multiplier line.
+
+    Returns
+        sample_records,multipliers,multiplier: list of location sample records, list of multipliers and the last multiplier.
+    """
+    multipliers = []
+    sample_records = []
+    record = {'Name': [], 'Azimuth': [], 'TakeOffAngle': []}
+    # Loop over lines
+    for line in lines:
+        if line.lstrip('\r') == '\n':
+            if len(record['Name']) and multiplier:
+                record['Azimuth'] = np.matrix(record['Azimuth']).T
+                record['TakeOffAngle'] = np.matrix(record['TakeOffAngle']).T
+                sample_records.append(record)
+                # Using multipliers therefore prob = 1
+                multipliers.append(multiplier)
+            record = {'Name': [], 'Azimuth': [], 'TakeOffAngle': []}
+        elif len(line.rstrip().rstrip('\r').split()) == 1:
+            try:
+                multiplier = float(line.rstrip().rstrip('\r'))
+            except Exception:
+                multiplier = 1.0
+        else:
+            record['Name'].append(line.split()[0])
+            record['Azimuth'].append(float(line.split()[1]))
+            record['TakeOffAngle'].append(float(line.rstrip().rstrip('\r').split()[2]))
+    if len(record['Name']):
+        record['Azimuth'] = np.matrix(record['Azimuth']).T
+        record['TakeOffAngle'] = np.matrix(record['TakeOffAngle']).T
+        sample_records.append(record)
+        multipliers.append(multiplier)
+    return sample_records, multipliers, multiplier
+
+
+def _subsample_scatangle_records(sample_records, multipliers, number_location_samples=0):
+    """
+    Randomly sub-samples the location sample records (private function)
+
+    Args
+        sample_records: list of location sample records.
+        multipliers: list of location sample multipliers.
+
+    Keyword Args
+        number_location_samples:[0] integer number of location samples to sub-sample (0 means to use all).
+
+    Returns
+        sample_records,multipliers: sub-sampled lists of location sample records and multipliers.
+    """
+    if number_location_samples and number_location_samples < len(sample_records):
+        try:
+            samples = np.random.choice(len(sample_records), number_location_samples, False)
+        except AttributeError:
+            i = 0
+            samples = np.array(list(set(np.random.randint(0, len(sample_records), len(sample_records)).tolist())))
+            while len(samples) < number_location_samples and i < 100:
+                samples = np.array(list(set(np.random.randint(0, len(sample_records), len(sample_records)).tolist())))
+                i += 1
+            if len(samples) < number_location_samples:
+                raise ValueError("Couldn't sample angle PDF")
+            else:
+                samples = samples[:len(sample_records)]
+        # Sample randomly from records, probability
+        sample_records = list(np.array(sample_records)[samples])
+        multipliers = list(np.array(multipliers)[samples])
+    return sample_records, multipliers
+
+
+def _scatangle_records(names, azimuth, takeoff_angle):
+    """
+    Returns the location sample records for the station angle arrays (private function)
+
+    Args
+        names: list of station names.
+        azimuth: numpy array of azimuths (location samples x stations).
+        takeoff_angle: numpy array of take-off angles (location samples x stations).
+
+    Returns
+        list of location sample records ({'Name':[...],'Azimuth':np.matrix,'TakeOffAngle':np.matrix}).
+    """
+    return [{'Name': list(names), 'Azimuth': np.matrix(azimuth[i], dtype=np.float64).T,
+             'TakeOffAngle': np.matrix(takeoff_angle[i], dtype=np.float64).T} for i in range(len(azimuth))]
+
+
+def _scatangle_station_names(text):
+    """Returns the station names of the first location sample in the scatangle text (private function)"""
+    names = []
+    for line in text.split('\n'):
+        line = line.split()
+        if len(line) >= 3:
+            names.append(line[0])
+        elif names and not line:
+            break
+    return names
+
+
+def _parse_scatangle_chunk(text, names, multiplier=1.0):
+    """
+    Parses a chunk of complete location samples from a scatangle file into station angle arrays (private function)
+
+    If all the samples in the chunk have a multiplier and the same stations in the same order as names, the chunk is
+    parsed in one vectorised pass over the tokens, otherwise the line parser is used and the stations are reordered to
+    match names. Samples with zero multipliers are dropped.
+
+    Args
+        text: str of complete scatangle location samples.
+        names: list of station names.
+
+    Keyword Args
+        multiplier:[1.0] float multiplier of the first sample if it has no multiplier line.
+
+    Returns
+        azimuth,takeoff_angle,multipliers,multiplier: numpy arrays of azimuths and take-off angles (location samples x stations),
+            numpy array of multipliers and the last multiplier.
+
+    Raises
+        ValueError: if the location sample stations do not match names.
+    """
+    number_stations = len(names)
+    tokens = text.split()
+    number_samples = len([sample for sample in text.split('\n\n') if sample.strip()])
+    if not number_samples:
+        return np.empty((0, number_stations)), np.empty((0, number_stations)), np.empty((0,)), multiplier
+    if len(tokens) == number_samples*(1+3*number_stations):
+        tokens = np.array(tokens).reshape(number_samples, 1+3*number_stations)
+        if np.all(tokens[:, 1::3] == np.array(names)):
+            try:
+                multipliers = tokens[:, 0].astype(np.float64)
+                azimuth = tokens[:, 2::3].astype(np.float64)
+                takeoff_angle = tokens[:, 3::3].astype(np.float64)
+            except ValueError:
+                pass
+            else:
+                if len(multipliers):
+                    multiplier = multipliers[-1]
+                nonzero = multipliers != 0
+                return azimuth[nonzero], takeoff_angle[nonzero], multipliers[nonzero], multiplier
+    # Fall back to the line parser
+    sample_records, multipliers, multiplier = _parse_scatangle_lines(text.splitlines(True), multiplier)
+    station_index = dict((name, j) for j, name in enumerate(names))
+    azimuth = np.empty((len(sample_records), number_stations))
+    takeoff_angle = np.empty((len(sample_records), number_stations))
+    for i, record in enumerate(sample_records):
+        if len(record['Name']) != number_stations or set(record['Name']) != set(names):
+            raise ValueError('Location sample stations do not match the first location sample stations')
+        indices = [station_index[name] for name in record['Name']]
+        azimuth[i, indices] = np.asarray(record['Azimuth']).flatten()
+        takeoff_angle[i, indices] = np.asarray(record['TakeOffAngle']).flatten()
+    return azimuth, takeoff_angle, np.array(multipliers, dtype=np.float64), multiplier
+
+
+class _LocationSampleReservoir(object):
+    """
+    Stores the location sample arrays, or a uniform random sub-sample of them if size is set (private class)
+
+    The sub-sample is updated a chunk at a time using reservoir sampling (each new sample replaces a random stored
+    sample with probability size/number of samples seen), so only size samples are stored.
+    """
+
+    def __init__(self, size=0):
+        self.size = size
+        self.count = 0
+        self.chunks = []
+        self.arrays = None
+
+    def add(self, *arrays):
+        """Adds a chunk of location sample arrays"""
+        number_samples = len(arrays[0])
+        if not self.size:
+            self.chunks.append(arrays)
+        else:
+            if self.arrays is None:
+                self.arrays = [np.empty((self.size,)+array.shape[1:], dtype=array.dtype) for array in arrays]
+            fill = min(max(self.size-self.count, 0), number_samples)
+            for reservoir, array in zip(self.arrays, arrays):
+                reservoir[self.count:self.count+fill] = array[:fill]
+            if fill < number_samples:
+                seen = np.arange(self.count+fill, self.count+number_samples)+1
+                replace = np.floor(np.random.rand(number_samples-fill)*seen).astype(np.intp)
+                # Later samples replace earlier samples with the same reservoir index
+                indices = np.flatnonzero(replace < self.size)[::-1]
+                replace, first = np.unique(replace[indices], return_index=True)
+                indices = indices[first]+fill
+                for reservoir, array in zip(self.arrays, arrays):
+                    reservoir[replace] = array[indices]
+        self.count += number_samples
+
+    def samples(self):
+        """Returns the stored location sample arrays"""
+        if not self.size:
+            return [np.concatenate(arrays) for arrays in zip(*self.chunks)]
+        return [reservoir[:min(self.size, self.count)] for reservoir in self.arrays]
+
+
+def read_scatangle(filename, number_location_samples=0, chunk_size=SCATANGLE_CHUNK_SIZE, offset=0):
+    """
+    Read station angles scatter file into station angle arrays
+
+    Reads the scatangle file (see parse_scatangle for the format) a chunk at a time, parsing each chunk of location samples
+    in one vectorised pass, into dense (location samples x stations) azimuth and take-off angle arrays. If
+    number_location_samples is set, the location samples are randomly sub-sampled while the file is read, so only the
+    sub-sampled location samples are stored. Binary scatangle files (see write_binary_scatangle) are also read.
+
+    The location samples must have the same stations (they are reordered to match the first location sample if the order
+    is different).
+
+    Args
+        filename: Angle scatter file name
+
+    Keyword Args
+        number_location_samples:[0] Number of samples to take from the full location PDF (0 means all samples)
+        chunk_size:[SCATANGLE_CHUNK_SIZE] Number of characters to read at a time.
+        offset:[0] File position to start reading from (must be the start of a location sample, e.g. the previous file size
+            if location samples have been appended to the file).
+
+    Returns
+        names,azimuth,takeoff_angle,multipliers: list of station names, numpy arrays of azimuths and take-off angles
+            (location samples x stations), and numpy array of the location sample multipliers.
+
+    Raises
+        ValueError: if the location samples have different stations or there are no location samples in the file.
+    """
+    if is_binary_scatangle(filename):
+        if offset:
+            raise ValueError('Binary scatangle files cannot be read from an offset')
+        return read_binary_scatangle(filename, number_location_samples)
+    names = None
+    multiplier = 1.0
+    reservoir = _LocationSampleReservoir(number_location_samples)
+    remainder = ''
+    with open(filename, 'r') as f:
+        f.seek(offset)
+        while True:
+            block = f.read(chunk_size)
+            text = remainder+block
+            if block:
+                # Split the text after the last complete location sample
+                boundary = text.rfind('\n\n')
+                if boundary < 0:
+                    remainder = text
+                    continue
+                text, remainder = text[:boundary+2], text[boundary+2:]
+            if not names:
+                names = _scatangle_station_names(text)
+            if names:
+                azimuth, takeoff_angle, multipliers, multiplier = _parse_scatangle_chunk(text, names, multiplier)
+                reservoir.add(azimuth, takeoff_angle, multipliers)
+            if not block:
+                break
+    if not names:
+        raise ValueError('No location samples in {}'.format(filename))
+    azimuth, takeoff_angle, multipliers = reservoir.samples()
+    return names, azimuth, takeoff_angle, multipliers
+
+
+def is_binary_scatangle(filename):
+    """
+    Checks if the file is a binary scatangle file
+
+    Args
+        filename: str file name.
+
+    Returns
+        bool: True if the file is a binary scatangle file.
+    """
+    with open(filename, 'rb') as f:
+        return f.read(len(SCATANGLE_BINARY_MAGIC)) == SCATANGLE_BINARY_MAGIC
+
+
+def write_binary_scatangle(filename, names, azimuth, takeoff_angle, multipliers, dtype=np.float64):
+    """
+    Write station angle arrays to a binary scatangle file
+
+    The binary scatangle file has the SCATANGLE_BINARY_MAGIC identifier, the format version and header size (little-endian
+    unsigned 32 bit integers), a JSON header with the station names, number of samples and stations and the angle data
+    type, followed by the little-endian float64 multipliers, and the azimuth and take-off angle (location samples x
+    stations) arrays, so that the arrays can be memory-mapped by read_binary_scatangle.
+
+    Args
+        filename: str name of file to output to.
+        names: list of station names.
+        azimuth: numpy array of azimuths (location samples x stations).
+        takeoff_angle: numpy array of take-off angles (location samples x stations).
+        multipliers: list or numpy array of location sample multipliers.
+
+    Keyword Args
+        dtype:[np.float64] numpy data type for the angles (float32 halves the file size, but the angles are converted to float64 when they are used).
+    """
+    dtype = np.dtype(dtype).newbyteorder('<')
+    azimuth = np.atleast_2d(np.asarray(azimuth, dtype=dtype))
+    takeoff_angle = np.atleast_2d(np.asarray(takeoff_angle, dtype=dtype))
+    multipliers = np.asarray(multipliers, dtype='<f8').flatten()
+    if azimuth.shape != takeoff_angle.shape or azimuth.shape != (len(multipliers), len(names)):
+        raise ValueError('Azimuth {} and take-off angle {} arrays do not match the {} samples and {} stations'.format(
+            azimuth.shape, takeoff_angle.shape, len(multipliers), len(names)))
+    header = json.dumps({'names': list(names), 'samples': azimuth.shape[0], 'stations': azimuth.shape[1],
+                         'dtype': dtype.str}).encode('utf-8')
+    # Pad the header so the arrays are aligned
+    header += b' '*(-(len(SCATANGLE_BINARY_MAGIC)+8+len(header)) % 16)
+    with open(filename, 'wb') as f:
+        f.write(SCATANGLE_BINARY_MAGIC)
+        f.write(struct.pack('<II', SCATANGLE_BINARY_VERSION, len(header)))
+        f.write(header)
+        f.write(multipliers.tobytes())
+        f.write(np.ascontiguousarray(azimuth).tobytes())
+        f.write(np.ascontiguousarray(takeoff_angle).tobytes())
+
+
+def read_binary_scatangle(filename, number_location_samples=0):
+    """
+    Read station angle arrays from a binary scatangle file
+
+    The arrays are memory-mapped (copy-on-write), so only the location samples used are read from disk.
+
+    Args
+        filename: Binary angle scatter file name
+
+    Keyword Args
+        number_location_samples:[0] Number of samples to take from the full location PDF (0 means all samples)
+
+    Returns
+        names,azimuth,takeoff_angle,multipliers: list of station names, numpy arrays of azimuths and take-off angles
+            (location samples x stations), and numpy array of the location sample multipliers.
+
+    Raises
+        ValueError: if the file is not a binary scatangle file.
+    """
+    with open(filename, 'rb') as f:
+        if f.read(len(SCATANGLE_BINARY_MAGIC)) != SCATANGLE_BINARY_MAGIC:
+            raise ValueError('{} is not a binary scatangle file'.format(filename))
+        version, header_size = struct.unpack('<II', f.read(8))
+        if version > SCATANGLE_BINARY_VERSION:
+            raise ValueError('Binary scatangle file version {} is not supported'.format(version))
+        header = json.loads(f.read(header_size).decode('utf-8'))
+    number_samples = header['samples']
+    shape = (number_samples, header['stations'])
+    dtype = np.dtype(header['dtype'])
+    if not number_samples:
+        return header['names'], np.empty(shape, dtype=dtype), np.empty(shape, dtype=dtype), np.empty((0,), dtype='<f8')
+    offset = len(SCATANGLE_BINARY_MAGIC)+8+header_size
+    multipliers = np.memmap(filename, dtype='<f8', mode='c', offset=offset, shape=(number_samples,))
+    offset += multipliers.nbytes
+    azimuth = np.memmap(filename, dtype=dtype, mode='c', offset=offset, shape=shape)
+    offset += azimuth.nbytes
+    takeoff_angle = np.memmap(filename, dtype=dtype, mode='c', offset=offset, shape=shape)
+    if number_location_samples and number_location_samples < number_samples:
+        samples = np.sort(np.random.choice(number_samples, number_location_samples, False))
+        multipliers = multipliers[samples]
+        azimuth = azimuth[samples]
+        takeoff_angle = takeoff_angle[samples]
+    return header['names'], azimuth, takeoff_angle, multipliers
+
+
+def convert_scatangle_to_binary(filename, output_filename=None, number_location_samples=0, dtype=np.float64):
+    """
+    Converts a scatangle file to a binary scatangle file
+
+    Args
+        filename: str scatangle file name.
+
+    Keyword Args
+        output_filename:[None] str binary scatangle file name (None replaces the extension with SCATANGLE_BINARY_EXTENSION).
+        number_location_samples:[0] integer number of location samples to sub-sample (0 means to use all).
+        dtype:[np.float64] numpy data type for the angles (float32 halves the file size, but the angles are converted to float64 when they are used).
+
+    Returns
+        str: binary scatangle file name.
+    """
+    if output_filename is None:
+        output_filename = os.path.splitext(filename)[0]+SCATANGLE_BINARY_EXTENSION
+    names, azimuth, takeoff_angle, multipliers = read_scatangle(filename, number_location_samples)
+    write_binary_scatangle(output_filename, names, azimuth, takeoff_angle, multipliers, dtype)
+    return output_filename
+
+
 def parse_scatangle(filename, number_location_samples=0, bin_size=0, _use_c=True):
     """
     Read station angles scatter file
 
     Reads the station angle scatter file. Expected format is given below. TakeOffAngle is 0 down (NED coordinate system).
     The probabilities are read in, so if Oct-tree or metropolis sampling is used, the probability values should be set to one.
+    The file is read using read_scatangle, so binary scatangle files can also be read.
 
     Args
         filename: Angle scatter file name
         location_samples:[Default=0] Number of samples to take from the full location PDF (0 means all samples)
         bin_size:[Default=1] Bin size for sample weighting in degrees (if 0 no binning used) - reduces the number of samples required for well constrained locations.
+            The samples are binned if all the angle differences are less than half the bin size (see grid_bin_samples).
 
     Returns
         Records,Probability: Angle Records and the probability for each sample.
@@ -100,54 +588,16 @@ def parse_scatangle(filename, number_location_samples=0, bin_size=0, _use_c=True
         S0263   258.4   120.7
 
     """
-    # Read file
-    with open(filename, 'r') as f:
-        station_file = f.readlines()
-    multipliers = []
-    sample_records = []
-    record = {'Name': [], 'Azimuth': [], 'TakeOffAngle': []}
-    multiplier = 1.0
-    # Loop over lines
-    for line in station_file:
-        if line.lstrip('\r') == '\n':
-            if len(record['Name']) and multiplier:
-                record['Azimuth'] = np.matrix(record['Azimuth']).T
-                record['TakeOffAngle'] = np.matrix(record['TakeOffAngle']).T
-                sample_records.append(record)
-                # Using multipliers therefore prob = 1
-                multipliers.append(multiplier)
-            record = {'Name': [], 'Azimuth': [], 'TakeOffAngle': []}
-        elif len(line.rstrip().rstrip('\r').split()) == 1:
-            try:
-                multiplier = float(line.rstrip().rstrip('\r'))
-            except Exception:
-                multiplier = 1.0
-        else:
-            record['Name'].append(line.split()[0])
-            record['Azimuth'].append(float(line.split()[1]))
-            record['TakeOffAngle'].append(float(line.rstrip().rstrip('\r').split()[2]))
-    if len(record['Name']):
-        record['Azimuth'] = np.matrix(record['Azimuth']).T
-        record['TakeOffAngle'] = np.matrix(record['TakeOffAngle']).T
-        sample_records.append(record)
-        multipliers.append(multiplier)
-    if number_location_samples and number_location_samples < len(sample_records):
-        try:
-            samples = np.random.choice(len(sample_records), number_location_samples, False)
-        except AttributeError:
-            i = 0
-            samples = np.array(list(set(np.random.randint(0, len(sample_records), len(sample_records)).tolist())))
-            while len(samples) < number_location_samples and i < 100:
-                samples = np.array(list(set(np.random.randint(0, len(sample_records), len(sample_records)).tolist())))
-                i += 1
-            if len(samples) < number_location_samples:
-                raise ValueError("Couldn't sample angle PDF")
-            else:
-                samples = samples[:len(sample_records)]
-        # Sample randomly from records, probability
-        sample_records = list(np.array(sample_records)[samples])
-        multipliers = list(np.array(multipliers)[samples])
-    new_multipliers = []
+    try:
+        names, azimuth, takeoff_angle, multipliers = read_scatangle(filename, number_location_samples)
+        sample_records = _scatangle_records(names, azimuth, takeoff_angle)
+        multipliers = multipliers.tolist()
+    except ValueError:
+        # Location samples with different stations, so use the records parser
+        logger.info('Location samples have different stations, using line parser')
+        with open(filename, 'r') as f:
+            sample_records, multipliers = _parse_scatangle_lines(f.readlines())[:2]
+        sample_records, multipliers = _subsample_scatangle_records(sample_records, multipliers, number_location_samples)
     if bin_size:
         old_size = len(sample_records)
         if cscatangle and _use_c:
@@ -158,21 +608,10 @@ def parse_scatangle(filename, number_location_samples=0, bin_size=0, _use_c=True
         else:
             logger.info('Python code used')
             t0 = time.time()
-            for i, record in enumerate(sample_records):
-                if not (i+1) % 10:
-                    logger.info('{} records completed'.format(i+1))
-                j = i+1
-                multiplier = multipliers[i]
-                while j < len(sample_records):
-                    toa_diff = sample_records[j]['TakeOffAngle']-record['TakeOffAngle']
-                    az_diff = sample_records[j]['Azimuth']-record['Azimuth']
-                    if np.max(np.abs(toa_diff)) < bin_size/2.0 and np.max(np.abs(az_diff)) < bin_size/2.0:
-                        multiplier += multipliers.pop(j)
-                        sample_records.pop(j)
-                    else:
-                        j += 1
-                new_multipliers.append(multiplier)
-            multipliers = new_multipliers
+            angles = np.array([np.append(np.asarray(record['TakeOffAngle']).flatten(), np.asarray(record['Azimuth']).flatten()) for record in sample_records])
+            indices, multipliers = grid_bin_samples(angles, multipliers, bin_size/2.0)
+            sample_records = [sample_records[i] for i in indices]
+            multipliers = multipliers.tolist()
             logger.info('Elapsed time = {}'.format(time.time()-t0))
         logger.info('{} degree binning reduced {}  samples to {} samples.'.format(bin_size, old_size, len(sample_records)))
     return sample_records, multipliers
@@ -200,23 +639,237 @@ def _output_scatangle(filename, samples, probabilities):
         f.write('\n'.join(output))
 
 
-def bin_scatangle(filename, number_location_samples=0, bin_size=1):
+def _output_scatangle_arrays(filename, names, azimuth, takeoff_angle, multipliers):
+    """
+    Output scatangle file from station angle arrays and multipliers.
+
+    Args
+        filename: str name of file to output to.
+        names: list of station names.
+        azimuth: numpy array of azimuths (location samples x stations).
+        takeoff_angle: numpy array of take-off angles (location samples x stations).
+        multipliers: list or numpy array of location sample multipliers.
+    """
+    with open(filename, 'w') as f:
+        for i, multiplier in enumerate(multipliers):
+            f.write(str(float(multiplier))+'\n')
+            f.write('\n'.join([st+'\t'+str(float(azimuth[i, j]))+'\t'+str(float(takeoff_angle[i, j])) for j, st in enumerate(names)]))
+            f.write('\n\n')
+
+
+def bin_angles(angles, multipliers, bin_size, _use_c=True):
+    """
+    Bin station angle samples, if all the differences in angles between the two samples are less than half the bin size
+
+    Args
+        angles: numpy array of station angles (location samples x angles).
+        multipliers: list or numpy array of location sample multipliers.
+        bin_size: float size of bin to stack samples over.
+
+    Returns
+        indices,multipliers: numpy array of the indices of the first sample in each bin and numpy array of the bin multipliers.
+    """
+    if cscatangle and _use_c:
+        return cscatangle.bin_angles(angles, multipliers, bin_size)
+    return grid_bin_samples(angles, multipliers, bin_size/2.0)
+
+
+class BinScatangleChunkTask(object):
+    """
+    Scatangle chunk binning task
+
+    Bins a chunk of the location samples from a scatangle file
+
+    Initialisation
+        Args
+            chunk: integer chunk index.
+            angles: numpy array of station angles (location samples x angles).
+            multipliers: numpy array of location sample multipliers.
+            bin_size: bin size.
+    """
+
+    def __init__(self, chunk, angles, multipliers, bin_size=1.0):
+        """
+        Initialisation of BinScatangleChunkTask
+
+        Args
+            chunk: integer chunk index.
+            angles: numpy array of station angles (location samples x angles).
+            multipliers: numpy array of location sample multipliers.
+            bin_size: bin size.
+        """
+        self.chunk = chunk
+        self.angles = angles
+        self.multipliers = multipliers
+        self.bin_size = bin_size
+
+    def __call__(self):
+        """
+        Runs the chunk binning task
+
+        Returns
+            chunk,indices,multipliers: chunk index and the bin_angles result, or 20 if an exception is thrown.
+        """
+        try:
+            return (self.chunk,)+tuple(bin_angles(self.angles, self.multipliers, self.bin_size))
+        except Exception:
+            logger.exception('Scatangle Chunk Bin Error')
+            return 20
+
+
+def _bin_angle_chunks(angles, multipliers, bin_size, job_pool=None, chunk_size=None):
+    """
+    Bin station angle samples in chunks (private function)
+
+    Chunking is opt-in: unless the job pool or chunk size is set, the samples are binned in a single pass (see bin_angles).
+    Otherwise the samples are split into chunks of chunk_size samples, which are binned separately, and the first samples
+    of the chunk bins are then binned together, in sample order, to merge the bins. This is faster for large numbers of
+    samples, but merged bins can contain samples up to the bin size from the first sample, rather than half the bin size,
+    so there can be fewer bins than from a single pass. For the same chunk size, the chunks are the same whether or not
+    the job pool is set (it is only used to bin the chunks in parallel), so the bins do not depend on the parallelisation.
+
+    Args
+        angles: numpy array of station angles (location samples x angles).
+        multipliers: numpy array of location sample multipliers.
+        bin_size: float size of bin to stack samples over.
+
+    Keyword Args
+        job_pool:[None] JobPool to bin the chunks in parallel (None bins the chunks in serial).
+        chunk_size:[None] integer number of location samples in each chunk (None uses BIN_SCATANGLE_CHUNK_SIZE if the job
+            pool is set, otherwise the samples are not chunked).
+
+    Returns
+        indices,multipliers: numpy array of the indices of the first sample in each bin and numpy array of the bin multipliers.
+    """
+    if chunk_size is None:
+        chunk_size = BIN_SCATANGLE_CHUNK_SIZE if job_pool is not None else 0
+    if not chunk_size or len(multipliers) <= chunk_size:
+        return bin_angles(angles, multipliers, bin_size)
+    starts = list(range(0, len(multipliers), chunk_size))
+    if job_pool is None:
+        results = [BinScatangleChunkTask(i, angles[start:start+chunk_size], multipliers[start:start+chunk_size], bin_size)()
+                   for i, start in enumerate(starts)]
+    else:
+        for i, start in enumerate(starts):
+            job_pool.custom_task(BinScatangleChunkTask, i, angles[start:start+chunk_size], multipliers[start:start+chunk_size], bin_size)
+        results = job_pool.all_results()
+    results = sorted([result for result in results if isinstance(result, tuple)], key=lambda result: result[0])
+    if len(results) != len(starts):
+        raise ValueError('Error binning scatangle chunks')
+    # Merge the chunk bins
+    indices = np.concatenate([starts[chunk]+chunk_indices for chunk, chunk_indices, chunk_multipliers in results])
+    merged_indices, merged_multipliers = bin_angles(angles[indices], np.concatenate([result[2] for result in results]), bin_size)
+    return indices[merged_indices], merged_multipliers
+
+
+def _bin_state_filename(filename):
+    """Returns the incremental binning state file name for the binned scatangle file (private function)"""
+    return os.path.join(os.path.dirname(filename), '.'+os.path.basename(filename)+'.bin_state')
+
+
+def _source_tail_hash(filename, size):
+    """Returns the SHA-1 hash of the BIN_STATE_TAIL_SIZE bytes before size in the file (private function)"""
+    with open(filename, 'rb') as f:
+        f.seek(max(size-BIN_STATE_TAIL_SIZE, 0))
+        return hashlib.sha1(f.read(min(size, BIN_STATE_TAIL_SIZE))).hexdigest()
+
+
+def _load_bin_state(filename, binned_filename, bin_size):
+    """
+    Loads the incremental binning state (private function)
+
+    Args
+        filename: str scatangle file name.
+        binned_filename: str binned scatangle file name.
+        bin_size: float size of bin to stack samples over.
+
+    Returns
+        int: size of the scatangle file that has been binned (0 if the binned file is missing or does not match).
+    """
+    state_filename = _bin_state_filename(binned_filename)
+    if not os.path.exists(state_filename) or not os.path.exists(binned_filename):
+        return 0
+    try:
+        with open(state_filename, 'r') as f:
+            state = json.load(f)
+        if state['bin_size'] != bin_size or state['size'] > os.path.getsize(filename):
+            return 0
+        if state['tail'] != _source_tail_hash(filename, state['size']):
+            return 0
+        return state['size']
+    except Exception:
+        logger.warning('Error reading scatangle binning state {}'.format(state_filename))
+        return 0
+
+
+def _save_bin_state(filename, binned_filename, bin_size, size):
+    """Saves the incremental binning state (private function)"""
+    with open(_bin_state_filename(binned_filename), 'w') as f:
+        json.dump({'bin_size': bin_size, 'size': size, 'tail': _source_tail_hash(filename, size)}, f)
+
+
+def bin_scatangle(filename, number_location_samples=0, bin_size=1, job_pool=None, incremental=False, chunk_size=None):
     """
     Bin scatangle samples into bins of size given by the bin size argument, if all the differences in angles for each station between the two samples are within that range
 
+    The samples are binned in a single pass, unless the job pool or chunk size is set, when they are binned in chunks (in parallel
+    if the job pool is set), which can merge samples up to the bin size apart into a bin (see _bin_angle_chunks). If incremental is set, and the
+    binned file was made from an earlier version of the file (with location samples appended to it since), only the
+    appended location samples are read and binned, and then merged with the existing bins. As with merging the chunk bins,
+    the merged bins can contain samples up to the bin size from the first sample, so the incremental result can differ
+    from binning the whole file again. The scatangle file should not be written to while it is being binned.
+
     Args
         filename: str of filename to read.
         number_location_samples:[0} integer number of location samples to sub-sample (0 means to use all).
         bin_size:[1.0] float size of bin to stack samples over.
+        job_pool:[None] JobPool to bin the chunks in parallel.
+        incremental:[False] boolean to only bin the location samples appended since the file was last binned (ignored if number_location_samples is set).
+        chunk_size:[None] integer number of location samples in each chunk (None uses BIN_SCATANGLE_CHUNK_SIZE if the job pool is set, otherwise the samples are not chunked).
     """
-    # Parse scatangle and bin
-    sample_records, multipliers = parse_scatangle(filename, number_location_samples, bin_size)
     old_filename = filename
     # Add _bin_ to filename
-    filename = ('_bin_'+str(bin_size)).join(os.path.splitext(filename))
+    binned_filename = ('_bin_'+str(bin_size)).join(os.path.splitext(filename))
+    incremental = incremental and not number_location_samples and not is_binary_scatangle(filename)
+    size = os.path.getsize(filename)
+    offset = _load_bin_state(filename, binned_filename, bin_size) if incremental else 0
+    if not incremental and os.path.exists(_bin_state_filename(binned_filename)):
+        # The binned file will no longer match the state
+        os.remove(_bin_state_filename(binned_filename))
+    if offset and offset == size:
+        logger.info('No new location samples in {}'.format(filename))
+        return old_filename, binned_filename
+    try:
+        names, azimuth, takeoff_angle, multipliers = read_scatangle(filename, number_location_samples, offset=offset)
+    except ValueError:
+        if offset:
+            raise
+        # Location samples with different stations, so parse and bin the records
+        sample_records, multipliers = parse_scatangle(filename, number_location_samples, bin_size)
+        _output_scatangle(binned_filename, sample_records, multipliers)
+        return old_filename, binned_filename
+    old_size = len(multipliers)
+    t0 = time.time()
+    indices, multipliers = _bin_angle_chunks(np.hstack([takeoff_angle, azimuth]), multipliers, bin_size, job_pool, chunk_size)
+    azimuth = azimuth[indices]
+    takeoff_angle = takeoff_angle[indices]
+    if offset:
+        binned_names, binned_azimuth, binned_takeoff_angle, binned_multipliers = read_scatangle(binned_filename)
+        if binned_names != names:
+            raise ValueError('Appended location sample stations do not match the binned location sample stations')
+        # Merge the new bins into the existing bins
+        azimuth = np.vstack([binned_azimuth, azimuth])
+        takeoff_angle = np.vstack([binned_takeoff_angle, takeoff_angle])
+        indices, multipliers = bin_angles(np.hstack([takeoff_angle, azimuth]), np.append(binned_multipliers, multipliers), bin_size)
+        azimuth = azimuth[indices]
+        takeoff_angle = takeoff_angle[indices]
+    logger.info('Elapsed time = {}'.format(time.time()-t0))
+    logger.info('{} degree binning reduced {}  samples to {} samples.'.format(bin_size, old_size, len(multipliers)))
     # Output to disk
-    _output_scatangle(filename, sample_records, multipliers)
-    return old_filename, filename
+    _output_scatangle_arrays(binned_filename, names, azimuth, takeoff_angle, multipliers)
+    if incremental:
+        _save_bin_state(filename, binned_filename, bin_size, size)
+    return old_filename, binned_filename
 
 
 class BinScatangleTask(object):
@@ -230,9 +883,10 @@ class BinScatangleTask(object):
             fid: Filename for MATLAB output.
             number_location_samples: number_location_samples.
             bin_size: bin size.
+            incremental: boolean to only bin the appended location samples.
     """
 
-    def __init__(self, fid, number_location_samples=0, bin_size=1.0):
+    def __init__(self, fid, number_location_samples=0, bin_size=1.0, incremental=False):
         """
         Initialisation of MatlabOutputTask
 
@@ -244,6 +898,7 @@ class BinScatangleTask(object):
         self.fid = fid
         self.number_location_samples = number_location_samples
         self.bin_size = bin_size
+        self.incremental = incremental
 
     def __call__(self):
         """
@@ -256,23 +911,28 @@ class BinScatangleTask(object):
 
         """
         try:
-            return bin_scatangle(self.fid, self.number_location_samples, self.bin_size)
+            return bin_scatangle(self.fid, self.number_location_samples, self.bin_size, incremental=self.incremental)
         except Exception:
             logger.exception('Scatangle Bin Error')
             return 20
 
 
-def bin_scatangle_files(files, number_location_samples=0, bin_scatangle_size=1.0, parallel=True, mpi=False, **kwargs):
+def bin_scatangle_files(files, number_location_samples=0, bin_scatangle_size=1.0, parallel=True, mpi=False, bin_scatangle_incremental=False, **kwargs):
     """
     Bin scatangle samples into bins of size given by the bin size argument,
     if all the differences in angles for each station between the two samples are within that range
 
+    If running in parallel with at least as many files as workers, each file is binned by one worker, otherwise the
+    location samples of each file are binned in chunks by the workers, and the chunk bins merged (see bin_scatangle). The
+    merged chunk bins can contain samples up to the bin size apart, so there can be fewer bins than when binning in serial.
+
     Args
         filename: str of filename to read.
         number_location_samples:[0} integer number of location samples to sub-sample (0 means to use all).
         bin_scatangle_size:[1.0] float size of bin to stack samples over.
         parallel:[True] boolean to run in parallel using job pool (overridden by mpi option).
         mpi: [False] boolean to run using MPI (ignores parallel flag).
+        bin_scatangle_incremental:[False] boolean to only bin the location samples appended to the files since they were last binned.
 
     Returns
         new_files:list of new file names
@@ -285,8 +945,6 @@ def bin_scatangle_files(files, number_location_samples=0, bin_scatangle_size=1.0
     # Make sure the files are a list
     if not isinstance(files, list):
         files = [files]
-    # Set parallel flag
-    parallel = parallel and not len(files) == 1
     # Get MPI parameters if running using MPI
     if mpi:
         try:
@@ -313,26 +971,32 @@ def bin_scatangle_files(files, number_location_samples=0, bin_scatangle_size=1.0
         for fn in data[comm.Get_rank()]:
             # If the filename is not blank, then bin it.
             if len(fn):
-                new_files[new_files.index(fn)] = bin_scatangle(fn, number_location_samples, bin_scatangle_size)[1]
+                new_files[new_files.index(fn)] = bin_scatangle(fn, number_location_samples, bin_scatangle_size, incremental=bin_scatangle_incremental)[1]
         end = True
         # Wait for end
         items = comm.gather(end, 0)
         if comm.Get_rank() == 0:
             for i in items:
                 assert i is True
-    elif parallel:
+    elif parallel and len(files) >= nworkers:
         # Loop over pool running tasks
         for fn in files:
-            job_pool.task(fn, number_location_samples, bin_scatangle_size)
+            job_pool.task(fn, number_location_samples, bin_scatangle_size, bin_scatangle_incremental)
         # Get results
         results = job_pool.all_results()
         for new_fn in results:
             new_files[new_files.index(new_fn[0])] = new_fn[1]
         job_pool.close()
+    elif parallel:
+        # Bin the chunks of each file in parallel
+        for fn in files:
+            new_files[new_files.index(fn)] = bin_scatangle(fn, number_location_samples, bin_scatangle_size, job_pool=job_pool,
+                                                           incremental=bin_scatangle_incremental)[1]
+        job_pool.close()
     else:
         # Run bin for each file
         for fn in files:
-            new_files[new_files.index(fn)] = bin_scatangle(fn, number_location_samples, bin_scatangle_size)[1]
+            new_files[new_files.index(fn)] = bin_scatangle(fn, number_location_samples, bin_scatangle_size, incremental=bin_scatangle_incremental)[1]
     return new_files
 
 
@@ -393,8 +1057,9 @@ def parser_check(parser, options, defaults):
 PARSER_DEFAULTS = {
           'bin_scatangle': False,
           'bin_size': 1.0,
+          'bin_scatangle_incremental': False,
           }
-PARSER_DEFAULT_TYPES = {'bin_scatangle': [bool], 'bin_size': [float]}
+PARSER_DEFAULT_TYPES = {'bin_scatangle': [bool], 'bin_size': [float], 'bin_scatangle_incremental': [bool]}
 
 
 def cmd_defaults():
@@ -415,12 +1080,18 @@ def cmd_opts(group, argparser=_argparse, defaults=PARSER_DEFAULTS):
                            dest="bin_scatangle")
         group.add_argument("--bin-size", "--binsize", "--bin_size", type=float, default=defaults['bin_size'],
                            help="Sets the scatangle bin size parameter [default={}]".format(defaults['bin_size']), dest="bin_scatangle_size")
+        group.add_argument("--bin-scatangle-incremental", "--binscatangleincremental", "--bin_scatangle_incremental", action="store_true",
+                           default=defaults['bin_scatangle_incremental'], help="Only bin the location samples appended to the scatangle files since they were last binned [default=False].",
+                           dest="bin_scatangle_incremental")
     else:
         group.add_option("--bin-scatangle", "--binscatangle", "--bin_scatangle",  action="store_true",
                          default=defaults['bin_scatangle'], help="Bin the scatangle file to reduce the number of samples [default=False]. --bin-size Sets the bin size parameter .",
                          dest="bin_scatangle")
         group.add_option("--bin-size", "--binsize", "--bin_size", type=float, default=defaults['bin_size'],
                          help="Sets the scatangle bin size parameter [default={}]".format(defaults['bin_size']), dest="bin_scatangle_size")
+        group.add_option("--bin-scatangle-incremental", "--binscatangleincremental", "--bin_scatangle_incremental", action="store_true",
+                         default=defaults['bin_scatangle_incremental'], help="Only bin the location samples appended to the scatangle files since they were last binned [default=False].",
+                         dest="bin_scatangle_incremental")
     return group, parser_check
 
 
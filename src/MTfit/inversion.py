@@ -15,7 +15,6 @@ Module containing the main inversion class, MTfit.inversion.Inversion class.
 import sys
 import os
 import glob
-import operator
 import time
 import gc
 import warnings
@@ -33,6 +32,15 @@ from math import ceil
 import numpy as np
 
 from .utilities.multiprocessing_helper import JobPool
+from .utilities.multiprocessing_helper import SharedArray
+from .utilities.multiprocessing_helper import share_array
+from .utilities.multiprocessing_helper import unshare_array
+from .utilities.multiprocessing_helper import unlink_arrays
+from .utilities.memory import collect
+from .utilities.memory import array_nbytes
+from .utilities.memory import set_gc_policy
+from .utilities.location_cache import LocationCache
+from .utilities.location_cache import data_hash
 from .utilities.file_io import parse_hyp
 from .utilities.file_io import parse_csv
 from .utilities.file_io import full_pdf_output_dicts
@@ -44,18 +52,24 @@ from .utilities.file_io import read_binary_output
 from .utilities.file_io import read_sf_output
 from .sampling import ln_bayesian_evidence
 from .algorithms import BaseAlgorithm
+from .algorithms.base import SeededRandomSample
+from .algorithms.base import QuasiRandomSampler
 from .algorithms import IterationSample
 from .algorithms import TimeSample
 from .algorithms import MarkovChainMonteCarloAlgorithmCreator
 from .probability import polarity_ln_pdf
 from .probability import LnPDF
+from .probability import PolarityStationOrder
 from .probability import polarity_probability_ln_pdf
 from .probability import amplitude_ratio_ln_pdf
+from .probability.backends import ForwardModelBackend
+from .probability.backends import get_backend
 from .probability import relative_amplitude_ratio_ln_pdf
 from .probability import ln_marginalise
 from .probability import dkl_estimate
 from .utilities.extensions import get_extensions
-from .extensions.scatangle import parse_scatangle
+from .extensions.scatangle import parse_scatangle, read_scatangle, grid_bin_samples, SCATANGLE_BINARY_EXTENSION
+from .extensions.scatangle import location_pdf_parser as scatangle_location_pdf_parser
 
 
 logger = logging.getLogger('MTfit.inversion')
@@ -105,20 +119,21 @@ class ForwardTask(object):
     """
     def __init__(self, mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
                  percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob, location_sample_multipliers=False, incorrect_polarity_prob=0, return_zero=False,
-                 reuse=False, marginalise=True, generate_samples=100000, cutoff=100000000, dc=False, extension_data={}):
+                 reuse=False, marginalise=True, generate_samples=100000, cutoff=100000000, dc=False, extension_data={}, number_threads=1, station_order=None, single_precision=False,
+                 ratio_pdf_max_error=0, backend=None, location_tolerance=0, location_subsample=0, sampler=None):
         """
         ForwardTask initialisation
 
         Args
             mt: numpy matrix object containing moment tensor 6 vectors.
-            a_polarity: Polarity observations station-ray 6 vector.
+            a_polarity: Polarity observations station-ray 6 vector (can be a SharedArray).
             error_polarity: Polarity observations error.
-            a1_amplitude_ratio: Amplitude ratio observations numerator station-ray 6 vector.
-            a2_amplitude_ratio: Amplitude ratio observations denominator station-ray 6 vector.
+            a1_amplitude_ratio: Amplitude ratio observations numerator station-ray 6 vector (can be a SharedArray).
+            a2_amplitude_ratio: Amplitude ratio observations denominator station-ray 6 vector (can be a SharedArray).
             amplitude_ratio: Observed amplitude ratio.
             percentage_error1_amplitude_ratio: Amplitude ratio observations percentage error for the numerator.
             percentage_error2_amplitude_ratio: Amplitude ratio observations percentage error for the denominator.
-            a_polarity_prob: Polarity PDF observations station-ray 6 vector.
+            a_polarity_prob: Polarity PDF observations station-ray 6 vector (can be a SharedArray).
             polarity_prob: Polarity PDF probability
             return_zero:[False] Boolean flag to return zero probability samples.
             reuse:[False] Boolean flag as to whether task is reused (mt changed and re-run...)
@@ -127,6 +142,14 @@ class ForwardTask(object):
             cutoff:[100000000] Max number of samples to try when generating samples.
             dc:[False] DC or MT when generating samples.
             extension_data:[{}] A dictionary of processed data for use by an MTfit.data_types extension.
+            number_threads:[1] Number of OpenMP threads to split the moment tensor samples across in the Cython forward model (requires the OpenMP build).
+            station_order:[None] PolarityStationOrder object to reorder the polarity stations for early rejection in the Cython forward model (None keeps the order).
+            single_precision:[False] Evaluate the Cython forward model with single precision station angle coefficients and moment tensors.
+            ratio_pdf_max_error:[0] Maximum relative error for the tabulated amplitude ratio PDFs in the Cython forward model (0 uses the exact PDF).
+            backend:[None] Name of the forward model backend (see MTfit.probability.backends) or ForwardModelBackend object (None selects the backend automatically).
+            location_tolerance:[0] Maximum fractional error in the marginalised PDF from stopping the location marginalisation once the remaining location samples cannot change it (0 evaluates all the location samples).
+            location_subsample:[0] Number of location samples to draw, with probability proportional to the location sample multipliers, for an unbiased estimate of the marginalised PDF (0 uses all the location samples).
+            sampler:[None] Callable returning the given number of moment tensor samples when generating samples (e.g. a QuasiRandomSampler, None uses pseudo-random samples).
         """
         self.mt = mt
         self.a_polarity = a_polarity
@@ -147,8 +170,67 @@ class ForwardTask(object):
         self.cutoff = cutoff
         self.generate_samples = 0
         self.extension_data = extension_data
+        self.number_threads = number_threads
+        self.station_order = station_order
+        self.single_precision = single_precision
+        self.ratio_pdf_max_error = ratio_pdf_max_error
+        self.location_tolerance = location_tolerance
+        self.location_subsample = location_subsample
+        self.sampler = sampler
         if isinstance(self.mt, bool) and cprobability is not False:
             self.generate_samples = generate_samples
+        # Resolve the forward model backend once rather than for every call
+        if not isinstance(backend, ForwardModelBackend):
+            backend = get_backend(backend, generate_samples=bool(self.generate_samples), number_threads=number_threads)
+        if self.generate_samples and (backend is None or not backend.generates_samples):
+            raise ValueError('Forward model backend {} cannot generate the moment tensor samples'.format(getattr(backend, 'name', None)))
+        self.backend = backend
+        # Keep shared memory handles alive while the array views are in use
+        self._shared_arrays = [u for u in [a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_prob] if isinstance(u, SharedArray)]
+
+    def _ln_location_sample_multipliers(self):
+        """
+        Returns the ln location sample multipliers (zeros if not set)
+
+        The location sample multipliers allow samples at the same location to be combined (easier on memory and computation to have 2
+        samples in the same place have double the probability).
+        """
+        n_location_samples = 1
+        for a in [self.a_polarity, self.a1_amplitude_ratio, self.a_polarity_prob]:
+            if isinstance(a, np.ndarray) and len(a.shape) > 2 and a.shape[1] > 1:
+                n_location_samples = a.shape[1]
+                break
+        if self.location_sample_multipliers:
+            return np.log(np.array(self.location_sample_multipliers).astype(np.float64, copy=False))
+        return np.zeros(n_location_samples)
+
+    def _subsample_locations(self, ln_location_sample_multipliers):
+        """
+        Draws location_subsample location samples with probability proportional to the location sample multipliers
+
+        Each draw is location sample v with probability w_v/W, where w_v are the multipliers and W their sum, so that W times the mean of
+        the likelihoods of the drawn samples is an unbiased estimate of the marginalised PDF. Repeated draws are combined, giving multipliers
+        of W/location_subsample times the number of draws. The samples are drawn for each call, so the moment tensor samples in a task
+        share the drawn location samples.
+
+        Args
+            ln_location_sample_multipliers: numpy array of ln location sample multipliers.
+
+        Returns
+            tuple of the polarity, amplitude ratio numerator, amplitude ratio denominator and polarity probability station angle coefficients
+            and ln location sample multipliers for the drawn location samples.
+        """
+        a_arrays = [self.a_polarity, self.a1_amplitude_ratio, self.a2_amplitude_ratio, self.a_polarity_prob]
+        n_location_samples = ln_location_sample_multipliers.shape[0]
+        if not self.marginalise or not self.location_subsample or self.location_subsample >= n_location_samples:
+            return tuple(a_arrays)+(ln_location_sample_multipliers,)
+        ln_total = np.logaddexp.reduce(ln_location_sample_multipliers)
+        samples, counts = np.unique(np.random.choice(n_location_samples, int(self.location_subsample),
+                                                     p=np.exp(ln_location_sample_multipliers-ln_total)), return_counts=True)
+        for i, a in enumerate(a_arrays):
+            if isinstance(a, np.ndarray) and a.ndim == 3 and a.shape[1] == n_location_samples:
+                a_arrays[i] = np.ascontiguousarray(a[:, samples, :])
+        return tuple(a_arrays)+(np.log(counts)+ln_total-np.log(self.location_subsample),)
 
     @memory_profile_test(_MEMTEST)
     def __call__(self):
@@ -161,6 +243,14 @@ class ForwardTask(object):
         global _VERBOSITY
         global _DEBUG
         try:
+            # Attach to station angle coefficients in shared memory
+            self.a_polarity = unshare_array(self.a_polarity)
+            self.a1_amplitude_ratio = unshare_array(self.a1_amplitude_ratio)
+            self.a2_amplitude_ratio = unshare_array(self.a2_amplitude_ratio)
+            self.a_polarity_prob = unshare_array(self.a_polarity_prob)
+            # Generate seeded random samples
+            if isinstance(self.mt, SeededRandomSample):
+                self.mt = self.mt()
             if _VERBOSITY >= 3:
                 try:
                     import memory_profiler
@@ -169,41 +259,34 @@ class ForwardTask(object):
                     memory_profiler = False
             if self.generate_samples or len(self.mt):
                 _return = False  # set _return flag to False before starting
-                if cprobability and not _CYTHON_TESTS and not _COMBINED_TESTS:
+                if not _CYTHON_TESTS and not _COMBINED_TESTS and self.backend is not None and (self.generate_samples or (not isinstance(self.mt, bool) and len(self.mt.shape) == 2 and any(
+                        isinstance(a, np.ndarray) for a in [self.a_polarity, self.a_polarity_prob, self.a1_amplitude_ratio]))):
                     try:
+                        backend = self.backend
                         # Get number of samples if not generating them
                         if not self.generate_samples:
                             N = self.mt.shape[1]
-                        # Check if there are location PDF samples.
-                        location_samples = False
-                        n_location_samples = 1
-                        if isinstance(self.a_polarity, np.ndarray) and len(self.a_polarity.shape) > 2 and self.a_polarity.shape[1] > 1:
-                            location_samples = True
-                            n_location_samples = self.a_polarity.shape[1]
-                        elif isinstance(self.a1_amplitude_ratio, np.ndarray) and len(self.a1_amplitude_ratio.shape) > 2 and self.a1_amplitude_ratio.shape[1] > 1:
-                            location_samples = True
-                            n_location_samples = self.a1_amplitude_ratio.shape[1]
-                        elif isinstance(self.a_polarity_prob, np.ndarray) and len(self.a_polarity_prob.shape) > 2 and self.a_polarity_prob.shape[1] > 1:
-                            location_samples = True
-                            n_location_samples = self.a_polarity_prob.shape[1]
-                        # Check location sample probabilities (easier on memory and computation to have 2 samples in the same place have double the probability)
-                        if self.location_sample_multipliers:
-                            ln_location_sample_multipliers = np.log(np.array(self.location_sample_multipliers).astype(np.float64, copy=False))
-                        else:
-                            ln_location_sample_multipliers = np.zeros(n_location_samples)
-                        # Try to use cprobabilities combined PDF code:
+                        # Check if there are location PDF samples and their probabilities
+                        ln_location_sample_multipliers = self._ln_location_sample_multipliers()
+                        a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_prob, ln_location_sample_multipliers = self._subsample_locations(
+                            ln_location_sample_multipliers)
+                        # Order the polarity stations so that most rejected samples stop at the first stations
+                        error_polarity, incorrect_polarity_prob = self.error_polarity, self.incorrect_polarity_prob
+                        if backend.early_rejection and self.station_order is not None and isinstance(a_polarity, np.ndarray) and a_polarity.ndim == 3:
+                            a_polarity, error_polarity, incorrect_polarity_prob = self.station_order(a_polarity, self.mt, error_polarity, incorrect_polarity_prob)
+                        # Evaluate the combined PDF using the forward model backend
+                        with warnings.catch_warnings():
+                            warnings.simplefilter("ignore")
+                            ln_p_total = backend.combined_ln_pdf(self.mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, self.amplitude_ratio,
+                                                                 self.percentage_error1_amplitude_ratio, self.percentage_error2_amplitude_ratio, a_polarity_prob, self.polarity_prob,
+                                                                 incorrect_polarity_prob, generate_samples=self.generate_samples, dc=self.dc, cutoff=self.cutoff,
+                                                                 marginalised=int(self.marginalise), location_samples_multipliers=ln_location_sample_multipliers,
+                                                                 number_threads=self.number_threads, single_precision=self.single_precision,
+                                                                 ratio_pdf_max_error=self.ratio_pdf_max_error, location_tolerance=self.location_tolerance,
+                                                                 sampler=self.sampler)
                         if self.generate_samples:
-                            ln_p_total, mt, N = cprobability.combined_ln_pdf(self.mt, self.a_polarity, self.error_polarity, self.a1_amplitude_ratio,
-                                                                             self.a2_amplitude_ratio, self.amplitude_ratio, self.percentage_error1_amplitude_ratio,
-                                                                             self.percentage_error2_amplitude_ratio, self.a_polarity_prob, self.polarity_prob,
-                                                                             self.incorrect_polarity_prob, generate_samples=self.generate_samples, dc=self.dc,
-                                                                             cutoff=self.cutoff, marginalised=int(self.marginalise), location_samples_multipliers=ln_location_sample_multipliers)
+                            ln_p_total, mt, N = ln_p_total
                             self.mt = np.asarray(mt)
-                        else:
-                            ln_p_total = cprobability.combined_ln_pdf(self.mt, self.a_polarity, self.error_polarity, self.a1_amplitude_ratio, self.a2_amplitude_ratio, self.amplitude_ratio,
-                                                                      self.percentage_error1_amplitude_ratio, self.percentage_error2_amplitude_ratio, self.a_polarity_prob, self.polarity_prob,
-                                                                      self.incorrect_polarity_prob, generate_samples=self.generate_samples, dc=self.dc, cutoff=self.cutoff,
-                                                                      marginalised=int(self.marginalise), location_samples_multipliers=ln_location_sample_multipliers)
                         # Handle extensions
                         if len(self.extension_data):
                             extension_names, extensions = get_extensions('MTfit.data_types')
@@ -211,7 +294,7 @@ class ForwardTask(object):
                                 try:
                                     if key in extension_names and 'relative' not in key:
                                         ln_p_ext = extensions[key](self.mt, **self.extension_data[key])
-                                        ln_p_total = cprobability.ln_combine(ln_p_total, ln_p_ext)
+                                        ln_p_total = backend.ln_combine(ln_p_total, ln_p_ext)
                                     else:
                                         raise KeyError('Extension {} function not found.'.format(key))
                                 except Exception:
@@ -226,13 +309,15 @@ class ForwardTask(object):
                         # Otherwise probability evaluation is complete so set return flag to True
                         _return = True
                     except Exception:
-                        # Exception in cprobabilities combined PDF - print error message
-                        logger.exception('Cython Combined PDFs failed')
+                        # Exception in the combined PDF - print error message
+                        logger.exception('Combined PDFs failed')
                 # Check if the combined PDF has been evaluated, otherwise evaluate individual PDFs
                 if not _return:
                     # Check if generating samples (MT is bool rather than np.array)
                     if isinstance(self.mt, bool):
-                        if self.dc:
+                        if self.sampler is not None:
+                            self.mt = self.sampler(self.generate_samples)
+                        elif self.dc:
                             self.mt = cprobability.random_dc(self.generate_samples)
                         else:
                             self.mt = cprobability.random_mt(self.generate_samples)
@@ -270,8 +355,6 @@ class ForwardTask(object):
                         # Exception - check if data exists and print output, otherwise ignore
                         if not isinstance(self.error_polarity, np.ndarray) and self.error_polarity:
                             logger.exception('Polarity Exception')
-                    # Force garbage collect to tidy memory
-                    gc.collect()
                     # If manual polarity data didn't work or doesn't exist, try automated polarities
                     if not manual_polarities:
                         try:
@@ -287,8 +370,6 @@ class ForwardTask(object):
                             # Exception  - check if data exists and print output, otherwise ignore
                             if not isinstance(self.a_polarity_prob, np.ndarray) and self.a_polarity_prob:
                                 logging.exception('Polarity PDF Exception')
-                        # Force garbage collect to tidy memory
-                        gc.collect()
                     # Check if  any probabilities are non zero otherwise return
                     if not ln_p_total.max() > -np.inf:
                         if not self._return_zero:
@@ -337,8 +418,6 @@ class ForwardTask(object):
                                     raise KeyError('Extension {} function not found.'.format(key))
                             except Exception:
                                 logging.exception('Exception for extension: {}'.format(key))
-                    # Clear the memory
-                    gc.collect()
                     if not _return:
                         # No data has been used, so print exceptions
                         logging.error('No data used in polarity, amplitude ratio or polarity PDF')
@@ -353,8 +432,11 @@ class ForwardTask(object):
                     # If there are location samples and the marginalise flag is set, then marginalise, trying to use Cython
                     if location_samples and self.marginalise:
                         ln_p_total = ln_marginalise(ln_p_total)
+                # Size of the temporary arrays for the garbage collection policy
+                nbytes = array_nbytes(self.mt, ln_p_total)
                 # Delete arrays to free memory if not reusing
                 if not self._reuse:
+                    nbytes += array_nbytes(self.a_polarity, self.a_polarity_prob, self.a1_amplitude_ratio, self.a2_amplitude_ratio)
                     del self.a_polarity
                     del self.a_polarity_prob
                     del self.a1_amplitude_ratio
@@ -366,7 +448,8 @@ class ForwardTask(object):
                     del self.error_polarity
                     del self.incorrect_polarity_prob
                     del self.location_sample_multipliers
-                    gc.collect()
+                # Collect garbage if required by the policy
+                collect(nbytes)
                 # Print end memory usage (Verbosity >=3)
                 if _VERBOSITY >= 3 and memory_profiler:
                     print('end usage {}'.format(memory_profiler.memory_usage()))
@@ -460,7 +543,14 @@ class McMCForwardTask(object):
         # Run forward tasks for MT samples
         forward = ForwardTask(mts, self.a_polarity, self.error_polarity, self.a1_amplitude_ratio, self.a2_amplitude_ratio, self.amplitude_ratio, self.percentage_error1_amplitude_ratio,
                               self.percentage_error2_amplitude_ratio, self.a_polarity_prob, self.polarity_prob, self.location_sample_multipliers, self.incorrect_polarity_prob, return_zero=True,
-                              reuse=True, marginalise=self.marginalise, extension_data=self.extension_data)
+                              reuse=True, marginalise=self.marginalise, extension_data=self.extension_data,
+                              station_order=None if self.algorithm_kwargs.get('no_station_ordering', False) else PolarityStationOrder(),
+                              single_precision=self.algorithm_kwargs.get('single_precision', False),
+                              ratio_pdf_max_error=self.algorithm_kwargs.get('ratio_pdf_max_error', 0),
+                              backend=self.algorithm_kwargs.get('backend', None),
+                              location_tolerance=self.algorithm_kwargs.get('location_tolerance', 0),
+                              location_subsample=self.algorithm_kwargs.get('location_subsample', 0),
+                              number_threads=self.algorithm_kwargs.get('number_threads', 1))
         while not end:
             forward.mt = mts
             result = forward()
@@ -482,7 +572,7 @@ class MultipleEventsForwardTask(object):
     def __init__(self, mts, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio,
                  a_polarity_prob, polarity_prob, a_relative_amplitude, relative_amplitude, percentage_error_relative_amplitude, relative_amplitude_stations, location_sample_multipliers=False,
                  incorrect_polarity_prob=0, minimum_number_intersections=2, return_zero=False, reuse=False, relative=False, location_sample_size=1, marginalise_relative=False,
-                 combine=True, extension_data=[]):
+                 combine=True, extension_data=[], number_threads=1):
         """
         Initialisation of MultipleEventsForwardTask
 
@@ -510,6 +600,7 @@ class MultipleEventsForwardTask(object):
             marginalise_relative:[False] Boolean flag to marginalise the location uncertainty between absolute and relative data.
             combine:[False] Boolean flag to combine the probabilities between multiple events.
             extension_data:[] A list of dictionaries of processed data for use by an MTfit.data_types extension.
+            number_threads:[1] Number of OpenMP threads to split the moment tensor samples across in the Cython forward model (requires the OpenMP build).
         """
         self.mts = mts
         self.a_polarity = a_polarity
@@ -543,6 +634,7 @@ class MultipleEventsForwardTask(object):
             # We would expect amplitude ratio location uncertainty to be minimal between co-located events
             # So probably need to remove any location uncertainty for the relative amplitude terms
         self.extension_data = extension_data
+        self.number_threads = number_threads
         if self._relative and not self._combine and self._return_zero:
             self._combine = True
 
@@ -606,7 +698,8 @@ class MultipleEventsForwardTask(object):
                 forward_task = ForwardTask(mt, a_polarity, self.error_polarity[i], a1_amplitude_ratio, a2_amplitude_ratio, self.amplitude_ratio[i],
                                            self.percentage_error1_amplitude_ratio[i], self.percentage_error2_amplitude_ratio[i], a_polarity_prob,
                                            self.polarity_prob[i], self.location_sample_multipliers, incorrect_polarity_prob, return_zero=True,
-                                           reuse=True, marginalise=self._marginalise_relative, extension_data=extension_data)
+                                           reuse=True, marginalise=self._marginalise_relative, extension_data=extension_data,
+                                           number_threads=self.number_threads)
                 if self._reuse:
                     self.forward_tasks.append(forward_task)
             elif self._reuse:
@@ -802,8 +895,11 @@ class MultipleEventsForwardTask(object):
                             except Exception as e:
                                 print('Exception for relative extension: {} - {}'.format(key, e))
 
-        # Delete attributes if not reusing and force garbage collection
+        # Size of the temporary arrays for the garbage collection policy
+        nbytes = array_nbytes(self.mts, ln_p_total, scale_factor, scale_factor_uncertainty)
+        # Delete attributes if not reusing and collect garbage if required by the policy
         if not self._reuse:
+            nbytes += array_nbytes(self.a_polarity, self.a_polarity_prob, self.a1_amplitude_ratio, self.a2_amplitude_ratio)
             del self.a_polarity
             del self.a_polarity_prob
             del self.a1_amplitude_ratio
@@ -815,7 +911,7 @@ class MultipleEventsForwardTask(object):
             del self.error_polarity
             del self.incorrect_polarity_prob
             del self.extension_data
-            gc.collect()
+        collect(nbytes)
         # Take non-zeros here?
         if np.isnan(ln_p_total).any() and _DEBUG:
             raise ValueError('NaN result')
@@ -1004,7 +1100,8 @@ class MultipleEventsMcMCForwardTask(McMCForwardTask):
                                            amplitude_ratio, percentage_error1_amplitude_ratio,
                                            percentage_error2_amplitude_ratio, a_polarity_prob,
                                            polarity_prob, self.location_sample_multipliers, incorrect_polarity_prob,
-                                           return_zero=False, reuse=False, extension_data=extension_data)
+                                           return_zero=False, reuse=False, extension_data=extension_data,
+                                           number_threads=self.algorithm_kwargs.get('number_threads', 1))
                 results.append(forward_task())
             mts, end = self.algorithm.iterate(results)
             iteration += 1
@@ -1018,7 +1115,8 @@ class MultipleEventsMcMCForwardTask(McMCForwardTask):
                                                                  self.minimum_number_intersections, return_zero=True, reuse=True,
                                                                  relative=self._relative, location_sample_size=location_sample_size,
                                                                  marginalise_relative=self._marginalise_relative,
-                                                                 extension_data=self.extension_data)
+                                                                 extension_data=self.extension_data,
+                                                                 number_threads=self.algorithm_kwargs.get('number_threads', 1))
         while not end:
             multiple_events_forward_task.mts = mts
             result = multiple_events_forward_task()
@@ -1327,9 +1425,25 @@ class Inversion(object):
             convert (bool):  Convert output moment tensors to Tape parameters, Hudson u&v coordinates and strike-dip-rake triples.
             discard (bool): [False] Probability cut-off for discarding samples Discarding samples - samples less than 1/(discard*n_samples) of the maximum likelihood value are discarded as negligeable. False means no samples are discarded.
             c_generate (bool): [False] Generate samples in the probability calculation when using Cython.
+            sampling (str): ['6sphere'] Random moment tensor sampling distribution (MTfit.sampling entry point). sobol uses scrambled Sobol quasi-random samples (including when using c_generate), which cover the source space more evenly, so the Bayesian evidence converges with fewer samples.
             generate_cutoff (int): Set number of samples to cut-off at when using c_generate (Default is the value of max_samples)
+            worker_generate (bool): [False] Generate the random moment tensor samples in the workers from independent seeded random number streams rather than in the main process.
+            streaming_discard (bool): [False] Apply the discard cut-off as the samples are added, rather than at the output, when using the Monte Carlo random sampling algorithms, so that the memory is bounded by the retained samples. The cut-off uses the maximum probability so far and max_samples (or the number of samples tried so far for the time algorithm). Dropped samples are still included in the Bayesian evidence.
+            max_retained_samples (int): [0] Maximum number of samples to retain, keeping the highest probability samples, when using the Monte Carlo random sampling algorithms (0 keeps all the non-zero samples). Dropped samples are still included in the Bayesian evidence.
+            seed (int): [None] Seed for the worker_generate random number streams, giving reproducible samples for a given seed.
+            gc_interval (int): [0] Number of forward model or McMC iterations between garbage collections (0 means only collect on allocation pressure).
+            gc_threshold (int): [268435456] Size in bytes of the temporary arrays released between garbage collections (0 means only collect on gc_interval).
             relative_loop (bool): [False] Loop over non-zero samples when using relative amplitudes.
-            bin_angle_coefficient_samples (int): [0] Bin size in degrees when binning angle coefficients (All station angle differences must be within this range for samples to fall in the same bin)
+            number_threads (int): [1] Number of OpenMP threads used by each process to evaluate the forward model in the Cython probability code, sharing one copy of the station and location arrays. Requires the C extensions to be built with OpenMP (MTFIT_OPENMP=1), otherwise the samples are evaluated serially.
+            single_precision (bool): [False] Use single precision (float32) station angle coefficients and moment tensor samples in the Cython forward model and the stored samples for single event inversions, halving their memory. The probabilities are still evaluated in double precision.
+            ratio_pdf_max_error (float): [0] Maximum relative error in the amplitude ratio PDFs when they are interpolated from tables rather than evaluated exactly in the Cython forward model (0 uses the exact PDF). Tabulating is several times faster for amplitude ratio inversions.
+            backend (str): [None] Name of the forward model backend used to evaluate the combined PDF (cython, cython-openmp, numpy-chunked or a backend installed using the MTfit.forward_model_backends entry point). None or auto selects the fastest available backend using a short calibration benchmark.
+            location_tolerance (float): [0] Maximum fractional error in the location marginalised PDF when stopping the marginalisation once the remaining location samples cannot change the result by more than this (the location samples are sorted by multiplier). 0 evaluates all the location samples.
+            location_subsample (int): [0] Number of location samples drawn, with probability proportional to the location sample multipliers, for each batch of moment tensor samples, giving an unbiased estimate of the location marginalised PDF. 0 uses all the location samples.
+            location_cache (bool): [False] Cache the parsed location PDF station angles, station angle coefficients and location sample multipliers in memory-mapped .npy files in a .<file name>.mtfit_cache directory next to each location PDF file, keyed by the file size, modification time and inode, so that reruns and recoveries using the same file load the cache rather than parsing the file. The cache is ignored if the file changes, but the caches for old versions of the file are not removed, so they must be deleted by hand.
+            location_cache_content_hash (bool): [False] Key the location cache by the hash of the location PDF file contents rather than the file size, modification time and inode, so that the cache is still used if the file is copied or touched, and changes that keep the size and modification time are detected. The file is read once in each run to calculate the hash.
+            no_station_ordering (bool): [False] Do not reorder the polarity stations during the random sampling so that the most discriminating stations are evaluated first (the reordering reduces the number of station evaluations for rejected samples in the Cython probability code).
+            bin_angle_coefficient_samples (int): [0] Bin size when binning angle coefficients (All station angle coefficient differences must be within this range for samples to fall in the same bin)
             no_station_distribution (bool): [True] Boolean flag to output station distribution or not.
             max_samples (int): [6000000] Max number of samples when using the iterate algorithm.
             max_time (int): [600] Max time when using the time algorithm.
@@ -1402,9 +1516,38 @@ class Inversion(object):
         self.normalise = kwargs.get('normalise', True)
         self.convert = kwargs.get('convert', False)
         self.discard = kwargs.get('discard', False)
+        self.streaming_discard = kwargs.get('streaming_discard', False)
+        self.max_retained_samples = kwargs.get('max_retained_samples', 0)
+        self.number_threads = max(int(kwargs.get('number_threads', 1)), 1)
+        self.station_ordering = not kwargs.get('no_station_ordering', False)
+        self.single_precision = kwargs.get('single_precision', False)
+        self.ratio_pdf_max_error = float(kwargs.get('ratio_pdf_max_error', 0))
+        self.location_tolerance = float(kwargs.get('location_tolerance', 0))
+        self.location_subsample = int(kwargs.get('location_subsample', 0))
+        if self.number_threads > 1 and not (cprobability and hasattr(cprobability, 'openmp_enabled') and cprobability.openmp_enabled()):
+            warnings.warn('number_threads set but the C probability extension is not built with OpenMP, so the forward model runs on one thread', RuntimeWarning)
         self.c_generate = kwargs.get('c_generate', False)
+        # Resolve the forward model backend once, before starting any workers, and check that it can generate the samples
+        # for the chosen algorithm (samples are only generated in the forward model for single event random sampling)
+        generate_samples = bool(self.c_generate and cprobability and number_events == 1 and algorithm.lower() in ['iterate', 'time'])
+        self.backend = get_backend(kwargs.get('backend', None), generate_samples=generate_samples, number_threads=self.number_threads)
+        if generate_samples and (self.backend is None or not self.backend.generates_samples):
+            raise ValueError('Forward model backend {} cannot generate the moment tensor samples, so cannot be used with c_generate'.format(
+                getattr(self.backend, 'name', kwargs.get('backend', None))))
+        # Pass the backend object and number of threads to the McMC forward tasks
+        kwargs['backend'] = self.backend
+        kwargs['number_threads'] = self.number_threads
+        self.worker_generate = kwargs.get('worker_generate', False)
+        # Quasi-random samples generated in the probability calculation (each worker scrambles its own copy of the sequence)
+        self.sampler = None
+        if self.c_generate and kwargs.get('sampling', False) == 'sobol':
+            self.sampler = QuasiRandomSampler(self.dc)
+        # Set the garbage collection policy before any workers are started
+        set_gc_policy(kwargs.get('gc_interval', None), kwargs.get('gc_threshold', None))
         self._relative_loop = kwargs.get('relative_loop', False)
         self.bin_angle_coefficient_samples = kwargs.get('bin_angle_coefficient_samples', 0)
+        self.location_cache = kwargs.get('location_cache', False)
+        self.location_cache_content_hash = kwargs.get('location_cache_content_hash', False)
         number_stations = 40
         self.location_pdf_files = False
         self.number_location_samples = 0
@@ -1433,12 +1576,12 @@ class Inversion(object):
                 self.location_pdf_files = glob.glob(location_pdf_file_path)
             # Get number of stations and number of location samples
             if not number_stations or not number_location_samples:
-                location_samples, location_sample_multipliers = self._read_location([u for u in self.location_pdf_files if len(u)][0])
+                location_coefficients, location_sample_multipliers = self._read_location_coefficients([u for u in self.location_pdf_files if len(u)][0])
                 if not number_location_samples:
-                    number_location_samples = len(location_samples)
-                number_stations = len(location_samples[0])
+                    number_location_samples = len(location_coefficients)
+                number_stations = len(location_coefficients.names)
                 # Clear results and garbage collect
-                del location_samples
+                del location_coefficients
                 del location_sample_multipliers
                 gc.collect()
         else:
@@ -1571,7 +1714,7 @@ class Inversion(object):
 
 
         """
-        parser_names, parsers = get_extensions('MTfit.location_pdf_parsers', {'.scatangle': parse_scatangle})
+        parser_names, parsers = get_extensions('MTfit.location_pdf_parsers', {'.scatangle': parse_scatangle, SCATANGLE_BINARY_EXTENSION: parse_scatangle})
         try:
             # Try to call the plugin for the correct extension
             try:
@@ -1591,6 +1734,64 @@ class Inversion(object):
             traceback.print_exc()
             return False
 
+    def _read_location_coefficients(self, filename):
+        """
+        Reads the location PDF file into a LocationSampleCoefficients object
+
+        Scatangle and binary scatangle files are read directly into the station angle arrays (see
+        MTfit.extensions.scatangle.read_scatangle), unless a different MTfit.location_pdf_parsers extension is installed
+        for the file extension. Other files are read using _read_location.
+
+        Args
+            filename: location PDF file name.
+
+        Returns
+            location_coefficients,location_sample_multipliers
+
+            location_coefficients: LocationSampleCoefficients object for the location samples.
+            location_sample_multipliers: list of location sample multipliers.
+        """
+        parser_names, parsers = get_extensions('MTfit.location_pdf_parsers', {'.scatangle': parse_scatangle, SCATANGLE_BINARY_EXTENSION: parse_scatangle})
+        # Only read the file directly if it would be parsed by the built-in scatangle parser
+        if parsers.get(os.path.splitext(filename)[1]) in [parse_scatangle, scatangle_location_pdf_parser]:
+            try:
+                names, azimuth, takeoff_angle, location_sample_multipliers = read_scatangle(filename)
+                return LocationSampleCoefficients(names, azimuth, takeoff_angle), location_sample_multipliers.tolist()
+            except ValueError:
+                # Location samples with different stations, so use the location PDF parsers
+                pass
+        location_samples, location_sample_multipliers = self._read_location(filename)
+        return location_sample_coefficients(location_samples), location_sample_multipliers
+
+    def _read_location_samples(self, filename):
+        """
+        Reads the location PDF file, using the location cache if location_cache is set
+
+        Args
+            filename: location PDF file name.
+
+        Returns
+            location_samples,location_sample_multipliers,location_coefficients
+
+            location_samples: LocationSampleRecords sequence of the location sample records.
+            location_sample_multipliers: list of location sample multipliers.
+            location_coefficients: LocationSampleCoefficients object for the location samples.
+        """
+        if not self.location_cache:
+            location_coefficients, location_sample_multipliers = self._read_location_coefficients(filename)
+            return location_coefficients.location_samples(), location_sample_multipliers, location_coefficients
+        # The cache is keyed on the file size, modification time and inode, so the file is not read on a cache hit (unless keyed on the file contents)
+        cache = LocationCache(filename, content_hash=self.location_cache_content_hash)
+        cached = cache.load_location_samples()
+        if cached is not None:
+            names, azimuth, takeoff_angle, location_sample_multipliers = cached
+            location_coefficients = LocationSampleCoefficients(names, azimuth, takeoff_angle, cache=cache)
+            return location_coefficients.location_samples(), location_sample_multipliers.tolist(), location_coefficients
+        location_coefficients, location_sample_multipliers = self._read_location_coefficients(filename)
+        location_coefficients.cache = cache
+        cache.save_location_samples(location_coefficients.names, location_coefficients.azimuth, location_coefficients.takeoff_angle, location_sample_multipliers)
+        return location_coefficients.location_samples(), location_sample_multipliers, location_coefficients
+
     def _set_logger(self, fid):
         """Sets file loggers up"""
         # now = datetime.datetime.now()
@@ -1617,6 +1818,13 @@ class Inversion(object):
 
         """
         self.McMC = False
+        # Seed for worker generated samples
+        seed = self.kwargs.get('seed', None)
+        if isinstance(seed, bool):
+            seed = None
+        elif seed is not None and self._MPI:
+            # Independent streams for each process
+            seed = [seed, self.comm.Get_rank()]
         # If no algorithm is set - use BaseAlgorithm (Will not behave as expected, but used for testing)
         if not self._algorithm_name:
             self.algorithm = BaseAlgorithm(number_samples=self.number_samples, dc=self.dc, quality_check=self._quality_check,
@@ -1639,9 +1847,13 @@ class Inversion(object):
                                              quality_check=self._quality_check, number_events=self.number_events,
                                              file_sample=self.file_sample, fname=self.kwargs.get('fid', 'MTfit_run'),
                                              file_safe=not self.kwargs.get('no_file_safe', False),
-                                             generate=single and self.c_generate, sampling=self.kwargs.get('sampling', False),
+                                             generate=single and self.c_generate, worker_generate=single and self.worker_generate, seed=seed,
+                                             streaming_discard=self.discard if self.streaming_discard else 0,
+                                             max_retained_samples=self.max_retained_samples,
+                                             sampling=self.kwargs.get('sampling', False),
                                              sampling_prior=self.kwargs.get('sampling_prior', False),
-                                             sample_distribution=self.kwargs.get('sample_distribution', False))
+                                             sample_distribution=self.kwargs.get('sample_distribution', False),
+                                             single_precision=self.single_precision)
             if single and self.c_generate:
                 # Set generate cutoff size
                 self.generate_samples = self.number_samples/5
@@ -1653,9 +1865,13 @@ class Inversion(object):
                                         quality_check=self._quality_check, number_events=self.number_events,
                                         file_sample=self.file_sample, fname=self.kwargs.get('fid', 'MTfit_run'),
                                         file_safe=not self.kwargs.get('no_file_safe', False),
-                                        generate=single and self.c_generate, sampling=self.kwargs.get('sampling', False),
+                                        generate=single and self.c_generate, worker_generate=single and self.worker_generate, seed=seed,
+                                        streaming_discard=self.discard if self.streaming_discard else 0,
+                                        max_retained_samples=self.max_retained_samples,
+                                        sampling=self.kwargs.get('sampling', False),
                                         sampling_prior=self.kwargs.get('sampling_prior', False),
-                                        sample_distribution=self.kwargs.get('sample_distribution', False))
+                                        sample_distribution=self.kwargs.get('sample_distribution', False),
+                                        single_precision=self.single_precision)
             if single and self.c_generate:
                 # Set generate sample size, cutoff is default or set in initialisation
                 self.generate_samples = self.number_samples/5
@@ -1867,7 +2083,10 @@ class Inversion(object):
                 if isinstance(binary_output, list) and len(binary_output) > 1:
                     for i, event_output in enumerate(binary_output):
                         for key in event_output.keys():
-                            if key in output[i].keys():
+                            if key == 'ln_dropped':
+                                # Combine the samples dropped while sampling
+                                output[i][key] = np.logaddexp(output[i].get(key, -np.inf), event_output[key])
+                            elif key in output[i].keys():
                                 if key == 'total_number_samples':
                                     output[i][key] += event_output[key]
                                 elif key in ['ln_bayesian_evidence', 'dkl']:
@@ -1876,7 +2095,10 @@ class Inversion(object):
                                     output[i][key] = np.append(output[i][key], event_output[key], 1)
                 else:
                     for key in binary_output.keys():
-                        if key in output.keys():
+                        if key == 'ln_dropped':
+                            # Combine the samples dropped while sampling
+                            output[key] = np.logaddexp(output.get(key, -np.inf), binary_output[key])
+                        elif key in output.keys():
                             if key == 'total_number_samples':
                                 output[key] += binary_output[key]
                             elif key in ['ln_bayesian_evidence', 'dkl']:
@@ -1927,6 +2149,9 @@ class Inversion(object):
                 if len(output):
                     print(output[i]['total_number_samples'])
                     output[i]['ln_bayesian_evidence'] = ln_bayesian_evidence(output[i], output[i]['total_number_samples'])
+                    if 'ln_dropped' in output[i]:
+                        # Include the samples dropped while sampling
+                        output[i]['ln_bayesian_evidence'] = np.logaddexp(output[i]['ln_bayesian_evidence'], output[i]['ln_dropped']-np.log(output[i]['total_number_samples']))
                     try:
                         if np.max(output[i]['g'])-np.min(output[i]['g']) < 0.000001 and np.abs(np.mean(output[i]['g'])) < 0.000001 and np.max(output[i]['d'])-np.min(output[i]['d']) < 0.000001 and np.abs(np.mean(output[i]['d'])) < 0.000001:
                             V = (2*np.pi*np.pi)
@@ -1941,6 +2166,9 @@ class Inversion(object):
                 return
             output['dV'] = 1
             output['ln_bayesian_evidence'] = ln_bayesian_evidence(output, output['total_number_samples'])
+            if 'ln_dropped' in output:
+                # Include the samples dropped while sampling
+                output['ln_bayesian_evidence'] = np.logaddexp(output['ln_bayesian_evidence'], output['ln_dropped']-np.log(output['total_number_samples']))
             try:
                 if np.max(output['g'])-np.min(output['g']) < 0.000001 and np.abs(np.mean(output['g'])) < 0.000001 and np.max(output['d'])-np.min(output['d']) < 0.000001 and np.abs(np.mean(output['d'])) < 0.000001:
                     V = (2*np.pi*np.pi)
@@ -1993,6 +2221,9 @@ class Inversion(object):
         elif not self._output_station_distribution:
             location_samples = False
             location_sample_multipliers = False
+        # Create the location sample records for the station distribution output
+        if isinstance(location_samples, LocationSampleRecords):
+            location_samples = list(location_samples)
         # Check if output data exists (or just outputting data)
         if not output_data and not kwargs.get('station_only', False):
             output_data, output_string = self.algorithm.output(self.normalise, self.convert, self.discard)
@@ -2069,15 +2300,16 @@ class Inversion(object):
         """
         location_samples = False
         location_sample_multipliers = False
+        location_coefficients = False
         # Check location PDF samples and set if they exist
         if self.location_pdf_files and len(self.location_pdf_files[i]):
-            location_samples, location_sample_multipliers = self._read_location(self.location_pdf_files[i])
+            location_samples, location_sample_multipliers, location_coefficients = self._read_location_samples(self.location_pdf_files[i])
             self.location_samples = location_samples
             self.location_sample_multipliers = location_sample_multipliers
             self.location_sample_multipliers_original = self.location_sample_multipliers[:]
         elif self.location_pdf_files and self._relative and not self._marginalise_relative:
             location_pdf_file = [location_pdf_file for location_pdf_file in self.location_pdf_files if len(location_pdf_file)][0]
-            location_samples, location_sample_multipliers = self._read_location(location_pdf_file)
+            location_samples, location_sample_multipliers, location_coefficients = self._read_location_samples(location_pdf_file)
             self.location_samples = location_samples
             self.location_sample_multipliers = location_sample_multipliers
             self.location_sample_multipliers_original = self.location_sample_multipliers[:]
@@ -2085,25 +2317,78 @@ class Inversion(object):
             self.location_samples = False
             self.location_sample_multipliers = False
             self.location_sample_multipliers_original = False
-        # Get station angles and measurements from data
-        a_polarity, error_polarity, incorrect_polarity_probability = polarity_matrix(event, location_samples)
-        a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio = amplitude_ratio_matrix(event, location_samples)
-        a_polarity_probability, polarity_probability, incorrect_polarity_probability_2 = polarity_probability_matrix(event, location_samples)
+        location_cache = location_coefficients.cache if location_coefficients else None
+        # Order the location samples by decreasing multiplier so that the bounded location marginalisation stops as early as possible
+        if self.location_tolerance > 0 and location_samples and location_sample_multipliers:
+            # The sorted location samples are stored in the location cache, so they are only sorted once
+            sorted_samples = location_cache.load_location_samples('sorted') if location_cache is not None else None
+            if sorted_samples is None:
+                order = np.argsort(-np.array(location_sample_multipliers, dtype=np.float64), kind='mergesort')
+                sorted_samples = (location_coefficients.names, location_coefficients.azimuth[order], location_coefficients.takeoff_angle[order],
+                                  np.array(location_sample_multipliers, dtype=np.float64)[order])
+                if location_cache is not None:
+                    location_cache.save_location_samples(*sorted_samples, key='sorted')
+            names, azimuth, takeoff_angle, location_sample_multipliers = sorted_samples
+            location_coefficients = LocationSampleCoefficients(names, azimuth, takeoff_angle, cache=location_cache, cache_key='sorted')
+            location_samples = location_coefficients.location_samples()
+            location_sample_multipliers = location_sample_multipliers.tolist()
+            self.location_samples = location_samples
+            self.location_sample_multipliers = location_sample_multipliers
+            self.location_sample_multipliers_original = self.location_sample_multipliers[:]
+        self.location_coefficients = location_coefficients
         # Extensions:
         extension_data = {}
         extension_names, extensions = get_extensions('MTfit.process_data_types')
         for ext in extension_names:
             extension_data[ext] = extensions[ext](event)
-        # Bin station location PDF samples
-        if self.bin_angle_coefficient_samples > 0 and location_samples:
-            (a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability, extension_data,
-             self.location_sample_multipliers) = bin_angle_coefficient_samples(a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability, self.location_sample_multipliers,
-                                                                               self.bin_angle_coefficient_samples, extension_data)
+        # Check the location cache for the station angle coefficients (the binning also changes the extension data, so these are not cached)
+        cache_key = False
+        cached = None
+        if location_cache is not None and not (self.bin_angle_coefficient_samples > 0 and len(extension_data)):
+            cache_key = data_hash(event, self.bin_angle_coefficient_samples, self.location_tolerance)
+            cached = location_cache.load(cache_key)
+        if cached is not None:
+            (a_polarity, error_polarity, incorrect_polarity_probability, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
+             percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, incorrect_polarity_probability_2, self.location_sample_multipliers) = cached
+            if isinstance(self.location_sample_multipliers, np.ndarray):
+                self.location_sample_multipliers = self.location_sample_multipliers.tolist()
+        else:
+            # Get station angles and measurements from data
+            a_polarity, error_polarity, incorrect_polarity_probability = polarity_matrix(event, location_coefficients)
+            a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio = amplitude_ratio_matrix(event,
+                                                                                                                                                                   location_coefficients)
+            a_polarity_probability, polarity_probability, incorrect_polarity_probability_2 = polarity_probability_matrix(event, location_coefficients)
+            # Bin station location PDF samples
+            if self.bin_angle_coefficient_samples > 0 and location_samples:
+                (a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability, extension_data,
+                 self.location_sample_multipliers) = bin_angle_coefficient_samples(a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability, self.location_sample_multipliers,
+                                                                                   extension_data, self.bin_angle_coefficient_samples)
+            if cache_key:
+                location_cache.save(cache_key, (a_polarity, error_polarity, incorrect_polarity_probability, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                                                percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability,
+                                                incorrect_polarity_probability_2, self.location_sample_multipliers))
         if isinstance(a_polarity, bool):
             incorrect_polarity_probability = incorrect_polarity_probability_2
         return (a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio,
                 a_polarity_probability, polarity_probability, incorrect_polarity_probability, extension_data)
 
+    def _coefficient_precision(self, *coefficients):
+        """Converts the station angle coefficients to single precision if single_precision is set
+
+        The kernels that generate the moment tensor samples are double precision, so the coefficients are kept
+        in double precision when the samples are generated in the forward model, rather than being copied
+        back to double precision in every ForwardTask.
+
+        Args
+            coefficients: station angle coefficient arrays (or False if not used).
+
+        Returns
+            list of station angle coefficient arrays.
+        """
+        if not self.single_precision or self.generate_samples:
+            return list(coefficients)
+        return [np.ascontiguousarray(coefficient, dtype=np.float32) if isinstance(coefficient, np.ndarray) else coefficient for coefficient in coefficients]
+
     def _fid(self, event, i, source='MT', single=False):
         """Generates event fid
 
@@ -2239,6 +2524,8 @@ class Inversion(object):
                 # Get station angle coefficients and data
                 (a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_probability,
                  polarity_probability, incorrect_polarity_probability, extension_data) = self._station_angles(event, i)
+                a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability = self._coefficient_precision(
+                    a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability)
                 # Update sample numbers
                 self._update_samples()
                 # Set algorithms
@@ -2354,7 +2641,7 @@ class Inversion(object):
                 extension_data.append(extension_data_i)
                 # If running relative get relative data
                 if self._relative:
-                    a_relative_amplitude_i, relative_amplitude_i, percentage_error_relative_amplitude_i, relative_amplitude_stations_i = relative_amplitude_ratio_matrix(event, self.location_samples)
+                    a_relative_amplitude_i, relative_amplitude_i, percentage_error_relative_amplitude_i, relative_amplitude_stations_i = relative_amplitude_ratio_matrix(event, self.location_coefficients)
                     a_relative_amplitude.append(a_relative_amplitude_i)
                     relative_amplitude.append(relative_amplitude_i)
                     percentage_error_relative_amplitude.append(percentage_error_relative_amplitude_i)
@@ -2466,15 +2753,32 @@ class Inversion(object):
                 del self.algorithm
                 gc.collect()
                 self._set_algorithm(single=True, **self.kwargs)
+                # After setting the algorithm, as the precision depends on whether the samples are generated in the forward model
+                a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability = self._coefficient_precision(
+                    a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_probability)
                 self._print('\nInitialisation Complete\n\nBeginning Inversion\n')
+                # Polarity station order for the event, updated from the samples as they are forward modelled
+                station_order = PolarityStationOrder() if self.station_ordering else None
                 # Run ForwardTasks
                 if self.pool:
+                    # Place the station angle coefficients in shared memory so they are not pickled for every task
+                    shared_a_polarity = share_array(a_polarity)
+                    shared_a1_amplitude_ratio = share_array(a1_amplitude_ratio)
+                    shared_a2_amplitude_ratio = share_array(a2_amplitude_ratio)
+                    shared_a_polarity_probability = share_array(a_polarity_probability)
+                    # Load the event data into the workers once, so each task only carries the moment tensor samples
+                    context_id = self.pool.load_context(shared_a_polarity, error_polarity, shared_a1_amplitude_ratio, shared_a2_amplitude_ratio, amplitude_ratio,
+                                                        percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, shared_a_polarity_probability,
+                                                        polarity_probability, self.location_sample_multipliers, incorrect_polarity_probability, return_zero, False, True,
+                                                        self.generate_samples, self.generate_cutoff, self.dc, extension_data,
+                                                        number_threads=self.number_threads, station_order=station_order, single_precision=self.single_precision,
+                                                        ratio_pdf_max_error=self.ratio_pdf_max_error, backend=self.backend,
+                                                        location_tolerance=self.location_tolerance, location_subsample=self.location_subsample,
+                                                        sampler=self.sampler)
                     # initialise all tasks
                     for i in range(self.pool.number_workers):
                         MTs, end = self._parse_job_result(False)
-                        self.pool.task(MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
-                                       percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, self.location_sample_multipliers,
-                                       incorrect_polarity_probability, return_zero, False, True, self.generate_samples, self.generate_cutoff, self.dc, extension_data)
+                        self.pool.context_task(context_id, MTs)
                 elif self._MPI:
                     end = False
                     # Carried out in each worker
@@ -2482,7 +2786,10 @@ class Inversion(object):
                     result = ForwardTask(MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
                                          percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, self.location_sample_multipliers,
                                          incorrect_polarity_probability, return_zero, generate_samples=self.generate_samples, cutoff=self.generate_cutoff,
-                                         dc=self.dc, extension_data=extension_data)()
+                                         dc=self.dc, extension_data=extension_data, number_threads=self.number_threads, station_order=station_order,
+                                         single_precision=self.single_precision, ratio_pdf_max_error=self.ratio_pdf_max_error,
+                                         backend=self.backend, location_tolerance=self.location_tolerance,
+                                         location_subsample=self.location_subsample, sampler=self.sampler)()
                     # Return to initiator algorithm
                 else:
                     MTs, end = self._parse_job_result(False)
@@ -2491,9 +2798,7 @@ class Inversion(object):
                     if self.pool:
                         result = self.pool.result()
                         MTs, end = self._parse_job_result(result)
-                        self.pool.task(MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
-                                       percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, self.location_sample_multipliers,
-                                       incorrect_polarity_probability, return_zero, False, True, self.generate_samples, self.generate_cutoff, self.dc, extension_data)
+                        self.pool.context_task(context_id, MTs)
                     elif self._MPI:
                         if not self.mpi_output:
                             # Handle result split and together using gather
@@ -2527,12 +2832,18 @@ class Inversion(object):
                         result = ForwardTask(MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
                                              percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, self.location_sample_multipliers,
                                              incorrect_polarity_probability, return_zero, generate_samples=self.generate_samples, cutoff=self.generate_cutoff, dc=self.dc,
-                                             extension_data=extension_data)()
+                                             extension_data=extension_data, number_threads=self.number_threads, station_order=station_order,
+                                             single_precision=self.single_precision, ratio_pdf_max_error=self.ratio_pdf_max_error,
+                                             backend=self.backend, location_tolerance=self.location_tolerance,
+                                             location_subsample=self.location_subsample, sampler=self.sampler)()
                     else:
                         result = ForwardTask(MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
                                              percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, self.location_sample_multipliers,
                                              incorrect_polarity_probability, return_zero, generate_samples=self.generate_samples, cutoff=self.generate_cutoff, dc=self.dc,
-                                             extension_data=extension_data)()
+                                             extension_data=extension_data, number_threads=self.number_threads, station_order=station_order,
+                                             single_precision=self.single_precision, ratio_pdf_max_error=self.ratio_pdf_max_error,
+                                             backend=self.backend, location_tolerance=self.location_tolerance,
+                                             location_subsample=self.location_subsample, sampler=self.sampler)()
                         MTs, end = self._parse_job_result(result)
                 # Get left over pool results
                 if self.pool:
@@ -2540,6 +2851,9 @@ class Inversion(object):
                     for result in results:
                         if result:
                             MTs, end = self._parse_job_result(result)
+                    # Free worker contexts and shared memory
+                    self.pool.clear_context(context_id)
+                    unlink_arrays(shared_a_polarity, shared_a1_amplitude_ratio, shared_a2_amplitude_ratio, shared_a_polarity_probability)
                 try:
                     self._print('Inversion completed\n\t'+'Elapsed time: '+str(time.time()-self.algorithm.start_time).split('.')[0]+' seconds\n\t'+str(self.algorithm.pdf_sample.n) +
                                 ' samples evaluated\n\t'+str(len(self.algorithm.pdf_sample.nonzero())) +
@@ -2646,7 +2960,7 @@ class Inversion(object):
                 extension_data.append(extension_data_i)
                 # If running relative get relative data
                 if self._relative:
-                    a_relative_amplitude_i, relative_amplitude_i, percentage_error_relative_amplitude_i, relative_amplitude_stations_i = relative_amplitude_ratio_matrix(event, self.location_samples)
+                    a_relative_amplitude_i, relative_amplitude_i, percentage_error_relative_amplitude_i, relative_amplitude_stations_i = relative_amplitude_ratio_matrix(event, self.location_coefficients)
                     a_relative_amplitude.append(a_relative_amplitude_i)
                     relative_amplitude.append(relative_amplitude_i)
                     percentage_error_relative_amplitude.append(percentage_error_relative_amplitude_i)
@@ -2668,7 +2982,8 @@ class Inversion(object):
                     self.pool.custom_task(MultipleEventsForwardTask, MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
                                           percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, a_relative_amplitude,
                                           relative_amplitude, percentage_error_relative_amplitude, relative_amplitude_stations, self.location_sample_multipliers, incorrect_polarity_probability, self.minimum_number_intersections,
-                                          False, False, self._relative, location_sample_size, self._marginalise_relative, not self._relative_loop, extension_data)
+                                          False, False, self._relative, location_sample_size, self._marginalise_relative, not self._relative_loop, extension_data,
+                                          self.number_threads)
             elif self._MPI:
                 end = False
                 # Carried out in each worker
@@ -2677,7 +2992,8 @@ class Inversion(object):
                                                    percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, a_relative_amplitude, relative_amplitude,
                                                    percentage_error_relative_amplitude, relative_amplitude_stations, self.location_sample_multipliers, incorrect_polarity_probability,
                                                    self.minimum_number_intersections, relative=self._relative, location_sample_size=location_sample_size,
-                                                   marginalise_relative=self._marginalise_relative, combine=not self._relative_loop, extension_data=extension_data)()
+                                                   marginalise_relative=self._marginalise_relative, combine=not self._relative_loop, extension_data=extension_data,
+                                                   number_threads=self.number_threads)()
             else:
                 MTs, end = self._parse_job_result(False)
             while not end:
@@ -2687,7 +3003,8 @@ class Inversion(object):
                     self.pool.custom_task(MultipleEventsForwardTask, MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
                                           percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability,
                                           a_relative_amplitude, relative_amplitude, percentage_error_relative_amplitude, relative_amplitude_stations, self.location_sample_multipliers, incorrect_polarity_probability,
-                                          self.minimum_number_intersections, False, False, self._relative, location_sample_size, self._marginalise_relative, not self._relative_loop, extension_data)
+                                          self.minimum_number_intersections, False, False, self._relative, location_sample_size, self._marginalise_relative, not self._relative_loop, extension_data,
+                                          self.number_threads)
                 elif self._MPI:
                     if not self.mpi_output:
                         items = self.comm.Gather(result, 0)
@@ -2719,13 +3036,15 @@ class Inversion(object):
                                                        percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, a_relative_amplitude, relative_amplitude,
                                                        percentage_error_relative_amplitude, relative_amplitude_stations, self.location_sample_multipliers, incorrect_polarity_probability,
                                                        self.minimum_number_intersections, relative=self._relative, location_sample_size=location_sample_size,
-                                                       marginalise_relative=self._marginalise_relative, combine=not self._relative_loop, extension_data=extension_data)()
+                                                       marginalise_relative=self._marginalise_relative, combine=not self._relative_loop, extension_data=extension_data,
+                                                       number_threads=self.number_threads)()
                 else:
                     result = MultipleEventsForwardTask(MTs, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
                                                        percentage_error2_amplitude_ratio, a_polarity_probability, polarity_probability, a_relative_amplitude, relative_amplitude,
                                                        percentage_error_relative_amplitude, relative_amplitude_stations, self.location_sample_multipliers, incorrect_polarity_probability,
                                                        self.minimum_number_intersections, relative=self._relative, location_sample_size=location_sample_size,
-                                                       marginalise_relative=self._marginalise_relative, combine=not self._relative_loop, extension_data=extension_data)()
+                                                       marginalise_relative=self._marginalise_relative, combine=not self._relative_loop, extension_data=extension_data,
+                                                       number_threads=self.number_threads)()
                     MTs, end = self._parse_job_result(result)
             # Get all pool results
             if self.pool:
@@ -2868,22 +3187,14 @@ def polarity_matrix(data, location_samples=False):
     incorrect_polarity_prob = 0
     # Check location samples
     if location_samples:
-        original_samples = [u.copy() for u in location_samples]
+        location_samples = location_sample_coefficients(location_samples)
     # Get polarity data
     for key in sorted([u for u in data.keys() if 'polarity' in u.lower() and 'prob' not in u.lower()]):
         mode = key.lower().split('polarity')[0]
         if location_samples:
-            location_samples = [u.copy() for u in original_samples]
-            selected_stations = sorted(list(set(location_samples[0]['Name']) & set(data[key]['Stations']['Name'])))
+            selected_stations, indices = location_samples.select_stations(data[key]['Stations']['Name'])
             n_stations = len(selected_stations)
-            indices = [location_samples[0]['Name'].index(u) for u in selected_stations]
-            angles = np.zeros((n_stations, len(location_samples), 6))
-            for i, sample in enumerate(location_samples):
-                sample['Name'] = operator.itemgetter(*indices)(sample['Name'])
-                sample['TakeOffAngle'] = sample['TakeOffAngle'][indices]
-                sample['Azimuth'] = sample['Azimuth'][indices]
-                angles[:, i, :] = station_angles(sample, mode)
-            angles = np.array(angles)
+            angles = location_samples.coefficients(mode, indices)
             # Fix for station order change with location samples
             indices = [data[key]['Stations']['Name'].index(u) for u in selected_stations]
             # Get measured and errors from location sample indices
@@ -2949,22 +3260,14 @@ def polarity_probability_matrix(data, location_samples=False):
     incorrect_polarity_prob = 0
     # Check location samples and get sample
     if location_samples:
-        original_samples = [u.copy() for u in location_samples]
+        location_samples = location_sample_coefficients(location_samples)
     # Loop over polarity prob data
     for key in sorted([u for u in data.keys() if 'polarity' in u.lower() and 'prob' in u.lower()]):
         mode = key.lower().split('polarity')[0]
         # If location samples, then select stations appropriately
         if location_samples:
-            location_samples = [u.copy() for u in original_samples]
-            selected_stations = sorted(list(set(location_samples[0]['Name']) & set(data[key]['Stations']['Name'])))
-            indices = [location_samples[0]['Name'].index(u) for u in selected_stations]
-            angles = np.zeros((len(selected_stations), len(location_samples), 6))
-            for i, sample in enumerate(location_samples):
-                sample['Name'] = operator.itemgetter(*indices)(sample['Name'])
-                sample['TakeOffAngle'] = sample['TakeOffAngle'][indices]
-                sample['Azimuth'] = sample['Azimuth'][indices]
-                angles[:, i, :] = station_angles(sample, mode)
-            angles = np.array(angles)
+            selected_stations, indices = location_samples.select_stations(data[key]['Stations']['Name'])
+            angles = location_samples.coefficients(mode, indices)
             indices = [data[key]['Stations']['Name'].index(u) for u in selected_stations]
             measured = data[key]['Measured'][indices]
             if data[key].__contains__('IncorrectPolarityProbability'):
@@ -3021,7 +3324,7 @@ def amplitude_ratio_matrix(data, location_samples=False):
     percentage_error2 = False
     amplitude_ratio = False
     if location_samples:
-        original_samples = [u.copy() for u in location_samples]
+        location_samples = location_sample_coefficients(location_samples)
     # Loop over data and get amplitude ratio data
     for key in sorted([u for u in data.keys() if 'amplituderatio' in u.lower() or 'amplitude_ratio' in u.lower()]):
         phase = key.replace('_', '').lower().split('amplituderatio')[0]
@@ -3030,20 +3333,8 @@ def amplitude_ratio_matrix(data, location_samples=False):
         phase.replace('_', '')
         # If location samples, get intersection stations and data
         if location_samples:
-            location_samples = [u.copy() for u in original_samples]
-            selected_stations = sorted(list(set(location_samples[0]['Name']) & set(data[key]['Stations']['Name'])))
-            indices = [location_samples[0]['Name'].index(u) for u in selected_stations]
-            angles1 = np.zeros((len(selected_stations), len(location_samples), 6))
-            angles2 = np.zeros((len(selected_stations), len(location_samples), 6))
-            for i, sample in enumerate(location_samples):
-                sample['Name'] = operator.itemgetter(*indices)(sample['Name'])
-                sample['TakeOffAngle'] = sample['TakeOffAngle'][indices]
-                sample['Azimuth'] = sample['Azimuth'][indices]
-                angles1[:, i, :] = station_angles(sample, phase.split('/')[0])
-                angles2[:, i, :] = station_angles(sample, phase.split('/')[1])
-            angles1 = np.array(angles1)
-            angles2 = np.array(angles2)
-            angles = [angles1, angles2]
+            selected_stations, indices = location_samples.select_stations(data[key]['Stations']['Name'])
+            angles = [location_samples.coefficients(phase.split('/')[0], indices), location_samples.coefficients(phase.split('/')[1], indices)]
             indices = [data[key]['Stations']['Name'].index(u) for u in selected_stations]
             _measured = data[key]['Measured'][indices]
             error = data[key]['Error'][indices]
@@ -3095,7 +3386,7 @@ def relative_amplitude_ratio_matrix(data, location_samples=False):
     relative_amplitude_stations = []
     relative_amplitude = False
     if location_samples:
-        original_samples = [u.copy() for u in location_samples]
+        location_samples = location_sample_coefficients(location_samples)
     # Loop over data and get amplitude data
     for key in sorted([u for u in data.keys() if 'amplitude' in u.lower() and 'ratio' not in u.lower()]):
         phase = key.replace('_', '').lower().split('amplitude')[0]
@@ -3104,16 +3395,8 @@ def relative_amplitude_ratio_matrix(data, location_samples=False):
         phase = phase.rstrip('q')
         # If location samples, get intersection stations and data
         if location_samples:
-            location_samples = [u.copy() for u in original_samples]
-            selected_stations = sorted(list(set(location_samples[0]['Name']) & set(data[key]['Stations']['Name'])))
-            indices = [location_samples[0]['Name'].index(u) for u in selected_stations]
-            angles = np.zeros((len(selected_stations), len(location_samples), 6))
-            for i, sample in enumerate(location_samples):
-                sample['Name'] = operator.itemgetter(*indices)(sample['Name'])
-                sample['TakeOffAngle'] = sample['TakeOffAngle'][indices]
-                sample['Azimuth'] = sample['Azimuth'][indices]
-                angles[:, i, :] = station_angles(sample, phase)
-            angles = np.array(angles)
+            selected_stations, indices = location_samples.select_stations(data[key]['Stations']['Name'])
+            angles = location_samples.coefficients(phase, indices)
             relative_amplitude_stations.extend(selected_stations)
             indices = [data[key]['Stations']['Name'].index(u) for u in selected_stations]
             measured = data[key]['Measured'][indices]
@@ -3249,34 +3532,247 @@ def station_angles(stations, phase, radians=False):
     takeoff_angle = np.array(takeoff_angle)
     # Get phase
     phase = phase.lower().rstrip('q')
-    # Calculate angles
-    if phase.lower() == 'p':
-        return np.matrix(np.array([np.cos(azimuth)*np.cos(azimuth)*np.sin(takeoff_angle)*np.sin(takeoff_angle),
-                         np.sin(azimuth)*np.sin(azimuth)*np.sin(takeoff_angle)*np.sin(takeoff_angle),
-                         np.cos(takeoff_angle)*np.cos(takeoff_angle),
-                         (np.sqrt(2))*np.sin(azimuth)*np.cos(azimuth)*np.sin(takeoff_angle)*np.sin(takeoff_angle),
-                         (np.sqrt(2))*np.cos(azimuth)*np.cos(takeoff_angle)*np.sin(takeoff_angle),
-                         (np.sqrt(2))*np.sin(azimuth)*np.cos(takeoff_angle)*np.sin(takeoff_angle)]).T)
-    elif phase.lower() == 'sh':
-        return np.matrix(np.array([-np.sin(azimuth)*np.cos(azimuth)*np.sin(takeoff_angle),
-                         np.sin(azimuth)*np.cos(azimuth)*np.sin(takeoff_angle),
-                         0*azimuth,
-                         (1/np.sqrt(2))*np.cos(2*azimuth)*np.sin(takeoff_angle),
-                         -(1/np.sqrt(2))*np.sin(azimuth)*np.cos(takeoff_angle),
-                         (1/np.sqrt(2))*np.cos(azimuth)*np.cos(takeoff_angle)]).T)
-    elif phase.lower() == 'sv':
-        return np.matrix(np.array([np.cos(azimuth)*np.cos(azimuth)*np.sin(takeoff_angle)*np.cos(takeoff_angle),
-                         np.sin(azimuth)*np.sin(azimuth)*np.sin(takeoff_angle)*np.cos(takeoff_angle),
-                         -np.sin(takeoff_angle)*np.cos(takeoff_angle),
-                         np.sqrt(2)*np.cos(azimuth)*np.sin(azimuth)*np.sin(takeoff_angle)*np.cos(takeoff_angle),
-                         (1/np.sqrt(2))*np.cos(azimuth)*np.cos(2*takeoff_angle),
-                         (1/np.sqrt(2))*np.sin(azimuth)*np.cos(2*takeoff_angle)]).T)
-    elif len(phase.split('/')) == 2:
+    if len(phase.split('/')) == 2:
         numerator = station_angles(stations, phase.split('/')[0], radians)
         denominator = station_angles(stations, phase.split('/')[1], radians)
         return (numerator, denominator)
+    # Calculate angles
+    return np.matrix(station_angle_coefficients(azimuth.flatten(), takeoff_angle.flatten(), phase, radians=True))
+
+
+def station_angle_coefficients(azimuth, takeoff_angle, phase, radians=False):
+    """
+    Calculates the station MT coefficients for arrays of station angles.
+
+    Vectorised form of station_angles for azimuth and take-off angle arrays of any shape (e.g. location samples x stations).
+    TakeOffAngle 0 down (as this is positive z-axis in NED system.
+
+    Args
+        azimuth: numpy array of azimuths.
+        takeoff_angle: numpy array of take-off angles (same shape as azimuth).
+        phase: 'P','SH','SV' - the component for which to calculate the station angles.
+        radians:[False] Boolean flag to set radians true or false
+
+    Returns
+        numpy array of station angle MT coefficients with shape azimuth.shape+(6,).
+    """
+    azimuth = np.asarray(azimuth, dtype=np.float64)
+    takeoff_angle = np.asarray(takeoff_angle, dtype=np.float64)
+    # Radian conversion if not radians
+    if not radians:
+        azimuth = azimuth*np.pi/180
+        takeoff_angle = takeoff_angle*np.pi/180
+    cos_azimuth = np.cos(azimuth)
+    sin_azimuth = np.sin(azimuth)
+    cos_takeoff_angle = np.cos(takeoff_angle)
+    sin_takeoff_angle = np.sin(takeoff_angle)
+    phase = phase.lower().rstrip('q')
+    if phase == 'p':
+        coefficients = [cos_azimuth*cos_azimuth*sin_takeoff_angle*sin_takeoff_angle,
+                        sin_azimuth*sin_azimuth*sin_takeoff_angle*sin_takeoff_angle,
+                        cos_takeoff_angle*cos_takeoff_angle,
+                        (np.sqrt(2))*sin_azimuth*cos_azimuth*sin_takeoff_angle*sin_takeoff_angle,
+                        (np.sqrt(2))*cos_azimuth*cos_takeoff_angle*sin_takeoff_angle,
+                        (np.sqrt(2))*sin_azimuth*cos_takeoff_angle*sin_takeoff_angle]
+    elif phase == 'sh':
+        coefficients = [-sin_azimuth*cos_azimuth*sin_takeoff_angle,
+                        sin_azimuth*cos_azimuth*sin_takeoff_angle,
+                        0*azimuth,
+                        (1/np.sqrt(2))*np.cos(2*azimuth)*sin_takeoff_angle,
+                        -(1/np.sqrt(2))*sin_azimuth*cos_takeoff_angle,
+                        (1/np.sqrt(2))*cos_azimuth*cos_takeoff_angle]
+    elif phase == 'sv':
+        coefficients = [cos_azimuth*cos_azimuth*sin_takeoff_angle*cos_takeoff_angle,
+                        sin_azimuth*sin_azimuth*sin_takeoff_angle*cos_takeoff_angle,
+                        -sin_takeoff_angle*cos_takeoff_angle,
+                        np.sqrt(2)*cos_azimuth*sin_azimuth*sin_takeoff_angle*cos_takeoff_angle,
+                        (1/np.sqrt(2))*cos_azimuth*np.cos(2*takeoff_angle),
+                        (1/np.sqrt(2))*sin_azimuth*np.cos(2*takeoff_angle)]
     else:
         raise ValueError('{} phase not recognised.'.format(phase))
+    return np.stack(coefficients, axis=-1)
+
+
+class LocationSampleRecords(object):
+    """
+    Location sample records for stacked location sample station angles
+
+    Sequence of location sample records ({'Name':[...],'Azimuth':np.matrix,'TakeOffAngle':np.matrix}) created from the
+    (location samples x stations) azimuth and take-off angle arrays when they are accessed, so that the records are only
+    created if they are used (e.g. for the station distribution output).
+
+    Initialisation
+        Args
+            names: list of station names.
+            azimuth: numpy array of azimuths (location samples x stations).
+            takeoff_angle: numpy array of take-off angles (location samples x stations).
+
+    """
+
+    def __init__(self, names, azimuth, takeoff_angle):
+        """
+        LocationSampleRecords initialisation
+
+        Args
+            names: list of station names.
+            azimuth: numpy array of azimuths (location samples x stations).
+            takeoff_angle: numpy array of take-off angles (location samples x stations).
+        """
+        self.names = list(names)
+        self.azimuth = azimuth
+        self.takeoff_angle = takeoff_angle
+
+    def __len__(self):
+        """Number of location samples"""
+        return self.azimuth.shape[0]
+
+    def __getitem__(self, index):
+        """Returns the location sample record for an integer index, or a LocationSampleRecords object for a slice"""
+        if isinstance(index, slice):
+            return LocationSampleRecords(self.names, self.azimuth[index], self.takeoff_angle[index])
+        if index < -len(self) or index >= len(self):
+            raise IndexError('Location sample index {} out of range'.format(index))
+        return {'Name': list(self.names), 'Azimuth': np.matrix(self.azimuth[index]).T, 'TakeOffAngle': np.matrix(self.takeoff_angle[index]).T}
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class LocationSampleCoefficients(object):
+    """
+    Station angle MT coefficients for the location PDF samples
+
+    Stacks the station angles from the location samples into (location samples x stations) azimuth and take-off angle
+    arrays, and calculates the station angle MT coefficients for all the location samples in one vectorised pass
+    for each phase. The coefficients for each phase are calculated once and shared between the data types, with the
+    stations selected using index arrays. As in the location PDF parsers, the location samples are expected to have
+    the same stations in the same order. If a LocationCache is set, the coefficients for each phase are stored in, and
+    memory-mapped from, the cache.
+
+    Initialisation
+        Args
+            names: list of station names.
+            azimuth: numpy array of azimuths (location samples x stations).
+            takeoff_angle: numpy array of take-off angles (location samples x stations).
+
+        Keyword Args
+            cache:[None] LocationCache for the location PDF file.
+            cache_key:[None] LocationCache entry key for the coefficients (e.g. for reordered location samples).
+
+    """
+
+    def __init__(self, names, azimuth, takeoff_angle, cache=None, cache_key=None):
+        """
+        LocationSampleCoefficients initialisation
+
+        Args
+            names: list of station names.
+            azimuth: numpy array of azimuths (location samples x stations).
+            takeoff_angle: numpy array of take-off angles (location samples x stations).
+
+        Keyword Args
+            cache:[None] LocationCache for the location PDF file.
+            cache_key:[None] LocationCache entry key for the coefficients (e.g. for reordered location samples).
+        """
+        self.names = list(names)
+        self.cache = cache
+        self.cache_key = cache_key
+        self.azimuth = np.atleast_2d(np.asarray(azimuth, dtype=np.float64))
+        self.takeoff_angle = np.atleast_2d(np.asarray(takeoff_angle, dtype=np.float64))
+        if self.azimuth.shape != self.takeoff_angle.shape or self.azimuth.shape[1] != len(self.names):
+            raise ValueError('Location sample azimuth {} and take-off angle {} arrays do not match the {} stations'.format(
+                self.azimuth.shape, self.takeoff_angle.shape, len(self.names)))
+        # Index of the first occurrence of each station name
+        self._station_index = {}
+        for j, name in enumerate(self.names):
+            self._station_index.setdefault(name, j)
+        self._coefficients = {}
+
+    @classmethod
+    def from_location_samples(cls, location_samples):
+        """
+        Stacks the station angles from a list of location sample records
+
+        Args
+            location_samples: list of location sample records ({'Name':[...],'Azimuth':np.matrix,'TakeOffAngle':np.matrix}).
+
+        Returns
+            LocationSampleCoefficients object.
+        """
+        azimuth = np.array([np.asarray(sample['Azimuth'], dtype=np.float64).flatten() for sample in location_samples])
+        takeoff_angle = np.array([np.asarray(sample['TakeOffAngle'], dtype=np.float64).flatten() for sample in location_samples])
+        return cls(location_samples[0]['Name'], azimuth, takeoff_angle)
+
+    def __len__(self):
+        """Number of location samples"""
+        return self.azimuth.shape[0]
+
+    def location_samples(self):
+        """
+        Returns the location sample records
+
+        The records are created when they are accessed (see LocationSampleRecords).
+
+        Returns
+            LocationSampleRecords sequence of location sample records ({'Name':[...],'Azimuth':np.matrix,'TakeOffAngle':np.matrix}).
+        """
+        return LocationSampleRecords(self.names, self.azimuth, self.takeoff_angle)
+
+    def select_stations(self, stations):
+        """
+        Selects the location sample stations that are in the stations list
+
+        Args
+            stations: list of station names.
+
+        Returns
+            (selected_stations, indices) tuple of the sorted list of selected station names and the numpy index array of the
+            selected stations in the location samples.
+        """
+        selected_stations = sorted(list(set(self.names) & set(stations)))
+        return selected_stations, np.array([self._station_index[u] for u in selected_stations], dtype=np.intp)
+
+    def coefficients(self, phase, indices=None):
+        """
+        Returns the station angle MT coefficients for the phase
+
+        Args
+            phase: 'P','SH','SV' - the component for which to calculate the station angles.
+
+        Keyword Args
+            indices:[None] numpy index array of the stations to select (None returns all the stations).
+
+        Returns
+            numpy array of station angle MT coefficients (stations x location samples x 6).
+        """
+        phase = phase.lower().rstrip('q')
+        if phase not in self._coefficients and self.cache is not None:
+            self._coefficients[phase] = self.cache.load_array('coefficients_'+phase, self.cache_key)
+        if self._coefficients.get(phase, None) is None:
+            self._coefficients[phase] = np.ascontiguousarray(station_angle_coefficients(self.azimuth.T, self.takeoff_angle.T, phase))
+            if self.cache is not None:
+                self._coefficients[phase] = self.cache.save_array('coefficients_'+phase, self._coefficients[phase], self.cache_key)
+        if indices is None:
+            return self._coefficients[phase]
+        return self._coefficients[phase][indices]
+
+
+def location_sample_coefficients(location_samples):
+    """
+    Returns the LocationSampleCoefficients for the location samples
+
+    Args
+        location_samples: list of location sample records, LocationSampleRecords or LocationSampleCoefficients object.
+
+    Returns
+        LocationSampleCoefficients object.
+    """
+    if isinstance(location_samples, LocationSampleCoefficients):
+        return location_samples
+    if isinstance(location_samples, LocationSampleRecords):
+        return LocationSampleCoefficients(location_samples.names, location_samples.azimuth, location_samples.takeoff_angle)
+    return LocationSampleCoefficients.from_location_samples(location_samples)
 
 
 #
@@ -3625,6 +4121,8 @@ def bin_angle_coefficient_samples(a_polarity, a1_amplitude_ratio, a2_amplitude_r
     Carry out the binning over the station ray path coefficent samples
 
     Unlike the bin_scatangle function, this accounts for variations in angle dependencies.
+    Samples are binned if all the coefficient differences are less than epsilon, with the candidate samples found using a hash
+    grid rather than comparing every pair of samples (see MTfit.extensions.scatangle.grid_bin_samples).
 
     Args
          a_polarity: np.array of polarity station coefficent data.
@@ -3632,6 +4130,7 @@ def bin_angle_coefficient_samples(a_polarity, a1_amplitude_ratio, a2_amplitude_r
          a2_amplitude_ratio: np.array of amplitude ratio denominator station coefficient data.
          a_polarity_prob: np.array of polarity prob stationcoefficient data.
          location_sample_multipliers: location sample probabilities.
+         extension_data: dict of extension data (the coefficient arrays are binned).
          epsilon:[0] allowed difference for the samples to be binned together.
 
     Returns
@@ -3651,40 +4150,24 @@ def bin_angle_coefficient_samples(a_polarity, a1_amplitude_ratio, a2_amplitude_r
         else:
             print('Py')
             t0 = time.time()
-            multipliers = []
-            no_pop = np.ones((len(location_sample_multipliers),), dtype=bool)
-            for i in range(len(location_sample_multipliers)):
-                multiplier = location_sample_multipliers[i]
-                for j in range(i, len(location_sample_multipliers)):
-                    if no_pop[j]:
-                        diff_polarity = 0
-                        if not isinstance(a_polarity, bool):
-                            diff_polarity = a_polarity[:, i, :]-a_polarity[:, j, :]
-                        diff_polarity = 0
-                        if not isinstance(a1_amplitude_ratio, bool):
-                            diff_a1_amplitude_ratio = a1_amplitude_ratio[:, i, :]-a1_amplitude_ratio[:, j, :]
-                        diff_polarity = 0
-                        if not isinstance(a2_amplitude_ratio, bool):
-                            diff_a2_amplitude_ratio = a2_amplitude_ratio[:, i, :]-a2_amplitude_ratio[:, j, :]
-                        diff_polarity = 0
-                        if not isinstance(a_polarity_prob, bool):
-                            diff_polarity_prob = a_polarity_prob[:, i, :]-a_polarity_prob[:, j, :]
-                        if np.max([np.max(np.abs(diff_polarity)), np.max(np.abs(diff_a1_amplitude_ratio)), np.max(np.abs(diff_a2_amplitude_ratio)), np.max(np.abs(diff_polarity_prob))]) < epsilon:
-                            multiplier += location_sample_multipliers[j]
-                            no_pop[j] = 0
-                multipliers.append(multiplier)
+            coefficients = [np.transpose(a, (1, 0, 2)).reshape(len(location_sample_multipliers), -1)
+                            for a in [a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_prob] if not isinstance(a, bool)]
+            if not len(coefficients):
+                return a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_prob, extension_data, list(location_sample_multipliers)
+            indices, multipliers = grid_bin_samples(np.hstack(coefficients), location_sample_multipliers, epsilon)
+            multipliers = multipliers.tolist()
             print('Pytime = {}'.format(time.time()-t0))
             if not isinstance(a_polarity, bool):
-                a_polarity = a_polarity[:, no_pop, :]
+                a_polarity = a_polarity[:, indices, :]
             if not isinstance(a1_amplitude_ratio, bool):
-                a1_amplitude_ratio = a1_amplitude_ratio[:, no_pop, :]
+                a1_amplitude_ratio = a1_amplitude_ratio[:, indices, :]
             if not isinstance(a2_amplitude_ratio, bool):
-                a2_amplitude_ratio = a2_amplitude_ratio[:, no_pop, :]
+                a2_amplitude_ratio = a2_amplitude_ratio[:, indices, :]
             if not isinstance(a_polarity_prob, bool):
-                a_polarity_prob = a_polarity_prob[:, no_pop, :]
+                a_polarity_prob = a_polarity_prob[:, indices, :]
             for key in extension_data.keys():
                 for k in extension_data[key].keys():
                     if k[:2] == 'a_' or k[0] == 'a' and k[2] == '_':
-                        extension_data[key][k] = extension_data[key][k][:, no_pop, :]
+                        extension_data[key][k] = extension_data[key][k][:, indices, :]
         print('Epsilon = {} reduced {} samples to {} records.'.format(epsilon, len(location_sample_multipliers), len(multipliers)))
     return a_polarity, a1_amplitude_ratio, a2_amplitude_ratio, a_polarity_prob, extension_data, multipliers
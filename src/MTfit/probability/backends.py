@@ -0,0 +1,296 @@
+"""
+backends.py
+***********
+
+Forward model backends for MTfit, used by the ForwardTask to evaluate the combined ln PDF of the
+polarity, polarity probability and amplitude ratio data.
+
+The default backends are:
+
+    * cython - the Cython combined_ln_pdf (cprobability), evaluated on one thread.
+    * cython-openmp - the Cython combined_ln_pdf split across number_threads OpenMP threads (requires the OpenMP build).
+    * numpy-chunked - the memory bounded NumPy combined_ln_pdf, which does not require the C extensions.
+
+Other backends can be installed using the MTfit.forward_model_backends entry point, and are selected by name (e.g.
+using the backend option in the Inversion object), or automatically using a short calibration benchmark of the
+available backends.
+"""
+
+
+# **Restricted:  For Non-Commercial Use Only**
+# This code is protected intellectual property and is available solely for teaching
+# and non-commercially funded academic research purposes.
+#
+# Applications for commercial use should be made to Schlumberger or the University of Cambridge.
+
+
+import time
+import logging
+
+import numpy as np
+
+from .probability import combined_ln_pdf
+from ..utilities.extensions import get_extensions
+
+logger = logging.getLogger('MTfit.probability.backends')
+
+
+try:
+    from . import cprobability
+except ImportError:
+    cprobability = None
+except Exception:
+    logger.exception('Error importing c extension')
+    cprobability = None
+
+
+# Size of the calibration benchmark (moment tensor samples, stations and location samples)
+_CALIBRATION_SIZE = (2000, 20, 10)
+
+# Backends selected by the calibration benchmark for each (generate_samples, number_threads) pair
+_SELECTED_BACKENDS = {}
+
+
+class ForwardModelBackend(object):
+    """
+    Base class for forward model backends
+
+    A backend evaluates the combined ln PDF for the moment tensor samples, with the same arguments and return values
+    as cprobability.combined_ln_pdf. Backends installed using the MTfit.forward_model_backends entry point should
+    inherit from this class and set the name attribute, overriding the available and combined_ln_pdf methods.
+    """
+
+    name = None
+    # Backend can generate the moment tensor samples while evaluating the ln PDF
+    generates_samples = False
+    # Backend rejects samples station by station, so benefits from the polarity station ordering
+    early_rejection = False
+
+    def available(self):
+        """Returns True if the backend can be used (e.g. the required extensions are built)"""
+        return True
+
+    def combined_ln_pdf(self, mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
+                        percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob, incorrect_polarity_prob=0, generate_samples=0, cutoff=100000000,
+                        dc=False, marginalised=False, location_samples_multipliers=np.array([0.]), number_threads=1, single_precision=False,
+                        ratio_pdf_max_error=0, location_tolerance=0, sampler=None):
+        """
+        Calculates the combined ln PDF for the moment tensor samples
+
+        Args
+            mt: np.array - 2 dimensional numpy array of moment tensor 6 vector samples
+            a_polarity: np.array - 3 dimensional numpy array of polarity station coefficients (stations x location samples x 6)
+            error_polarity: np.array - 1 dimensional array of fractional polarity uncertainties.
+            a1_amplitude_ratio: np.array - 3 dimensional numpy array of amplitude ratio numerator station coefficients.
+            a2_amplitude_ratio: np.array - 3 dimensional numpy array of amplitude ratio denominator station coefficients.
+            amplitude_ratio: np.array - 1 dimensional array of observed amplitude ratios.
+            percentage_error1_amplitude_ratio: np.array - 1 dimensional array of fractional numerator uncertainties.
+            percentage_error2_amplitude_ratio: np.array - 1 dimensional array of fractional denominator uncertainties.
+            a_polarity_prob: np.array - 3 dimensional numpy array of polarity probability station coefficients.
+            polarity_prob: tuple - tuple of positive and negative polarity probability arrays.
+
+        Optional Args
+            incorrect_polarity_prob: float or np.array (default=0) - probability of a receiver orientation error.
+            generate_samples: int (default=0) - number of samples to generate (0 evaluates mt).
+            cutoff: int (default=100000000) - maximum number of samples to try when generating samples.
+            dc: bool (default=False) - generate double-couple samples.
+            marginalised: bool (default=False) - marginalise over the location samples.
+            location_samples_multipliers: np.array (default=np.array([0.])) - ln location sample multipliers.
+            number_threads: int (default=1) - number of threads requested for the forward model.
+            single_precision: bool (default=False) - use single precision station coefficients and moment tensors.
+            ratio_pdf_max_error: float (default=0) - maximum relative error for tabulated amplitude ratio PDFs.
+            location_tolerance: float (default=0) - maximum fractional error in the marginalised PDF from stopping the location
+                marginalisation early (0 evaluates all the location samples).
+            sampler: callable (default=None) - called with the number of samples to generate the moment tensor samples when generating
+                samples (e.g. a QuasiRandomSampler), None uses pseudo-random samples.
+
+        Returns
+            np.array - ln PDF array (or tuple of ln PDF, moment tensors and number of samples tried if generating samples).
+        """
+        raise NotImplementedError('combined_ln_pdf not implemented for backend {}'.format(self.name))
+
+    def ln_combine(self, ln_p1, ln_p2):
+        """
+        Combines two ln PDF arrays
+
+        Args
+            ln_p1: np.array - ln PDF array.
+            ln_p2: np.array - ln PDF array.
+
+        Returns
+            np.array - combined ln PDF array.
+        """
+        return ln_p1+ln_p2
+
+
+class CythonBackend(ForwardModelBackend):
+    """Cython forward model backend, evaluating the samples on one thread"""
+
+    name = 'cython'
+    generates_samples = True
+    early_rejection = True
+
+    def available(self):
+        return bool(cprobability)
+
+    def _number_threads(self, number_threads):
+        return 1
+
+    def combined_ln_pdf(self, mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
+                        percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob, incorrect_polarity_prob=0, generate_samples=0, cutoff=100000000,
+                        dc=False, marginalised=False, location_samples_multipliers=np.array([0.]), number_threads=1, single_precision=False,
+                        ratio_pdf_max_error=0, location_tolerance=0, sampler=None):
+        if generate_samples:
+            return cprobability.combined_ln_pdf(mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                                                percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob,
+                                                incorrect_polarity_prob, generate_samples=generate_samples, dc=dc, cutoff=cutoff, marginalised=int(marginalised),
+                                                location_samples_multipliers=location_samples_multipliers, single_precision=single_precision,
+                                                location_tolerance=location_tolerance, sampler=sampler)
+        return cprobability.combined_ln_pdf(mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                                            percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob,
+                                            incorrect_polarity_prob, dc=dc, cutoff=cutoff, marginalised=int(marginalised),
+                                            location_samples_multipliers=location_samples_multipliers, number_threads=self._number_threads(number_threads),
+                                            single_precision=single_precision, ratio_pdf_max_error=ratio_pdf_max_error,
+                                            location_tolerance=location_tolerance)
+
+    def ln_combine(self, ln_p1, ln_p2):
+        return cprobability.ln_combine(ln_p1, ln_p2)
+
+
+class CythonOpenMPBackend(CythonBackend):
+    """Cython forward model backend, splitting the samples across number_threads OpenMP threads"""
+
+    name = 'cython-openmp'
+
+    def available(self):
+        return bool(cprobability) and hasattr(cprobability, 'openmp_enabled') and bool(cprobability.openmp_enabled())
+
+    def _number_threads(self, number_threads):
+        return number_threads
+
+
+class NumpyChunkedBackend(ForwardModelBackend):
+    """Memory bounded NumPy forward model backend (see probability.combined_ln_pdf)"""
+
+    name = 'numpy-chunked'
+
+    def combined_ln_pdf(self, mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, percentage_error1_amplitude_ratio,
+                        percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob, incorrect_polarity_prob=0, generate_samples=0, cutoff=100000000,
+                        dc=False, marginalised=False, location_samples_multipliers=np.array([0.]), number_threads=1, single_precision=False,
+                        ratio_pdf_max_error=0, location_tolerance=0, sampler=None):
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            return combined_ln_pdf(mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                                   percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob,
+                                   incorrect_polarity_prob, generate_samples=generate_samples, dc=dc, cutoff=cutoff, marginalised=int(marginalised),
+                                   location_samples_multipliers=location_samples_multipliers, single_precision=single_precision,
+                                   location_tolerance=location_tolerance)
+
+
+default_backends = {'cython': CythonBackend, 'cython-openmp': CythonOpenMPBackend, 'numpy-chunked': NumpyChunkedBackend}
+
+
+def get_backends():
+    """
+    Returns the available forward model backends
+
+    The default backends are combined with any installed using the MTfit.forward_model_backends entry point (either a
+    ForwardModelBackend subclass or instance). Backends that are not available (e.g. missing C extensions) are ignored.
+
+    Returns
+        dict - dictionary of backend name: ForwardModelBackend instance pairs.
+    """
+    names, plugins = get_extensions('MTfit.forward_model_backends', default_backends)
+    backends = {}
+    for name in sorted(names):
+        try:
+            backend = plugins[name]
+            if isinstance(backend, type):
+                backend = backend()
+            if backend.available():
+                backends[name] = backend
+        except Exception:
+            logger.exception('Error loading forward model backend: {}'.format(name))
+    return backends
+
+
+def _calibration_data(number_samples, number_stations, number_location_samples):
+    """Returns random polarity and amplitude ratio data for the calibration benchmark"""
+    state = np.random.RandomState(0)
+    mt = state.randn(6, number_samples)
+    mt /= np.sqrt(np.sum(mt*mt, 0))
+    a = state.randn(number_stations, number_location_samples, 6)
+    # Polarities consistent with the first sample
+    a_polarity = a*np.sign(np.tensordot(a, mt[:, 0], 1))[:, :, np.newaxis]
+    error_polarity = 0.1*np.ones(number_stations)
+    a1 = state.randn(number_stations, number_location_samples, 6)
+    a2 = state.randn(number_stations, number_location_samples, 6)
+    amplitude_ratio = np.abs(np.tensordot(a1[:, 0, :], mt[:, 0], 1)/np.tensordot(a2[:, 0, :], mt[:, 0], 1))
+    percentage_error = 0.1*np.ones(number_stations)
+    return (mt, a_polarity, error_polarity, a1, a2, amplitude_ratio, percentage_error, percentage_error, False, False)
+
+
+def calibrate(backends, number_threads=1, size=_CALIBRATION_SIZE, repeats=3):
+    """
+    Times the backends on a small random polarity and amplitude ratio problem
+
+    Args
+        backends: dict - dictionary of backend name: ForwardModelBackend instance pairs.
+
+    Optional Args
+        number_threads: int (default=1) - number of threads requested for the forward model.
+        size: tuple (default=_CALIBRATION_SIZE) - number of moment tensor samples, stations and location samples.
+        repeats: int (default=3) - number of timed evaluations for each backend (the fastest is used).
+
+    Returns
+        dict - dictionary of backend name: time (s) pairs, with inf for backends that failed.
+    """
+    args = _calibration_data(*size)
+    multipliers = np.zeros(size[2])
+    times = {}
+    for name, backend in backends.items():
+        times[name] = np.inf
+        try:
+            for i in range(repeats):
+                t0 = time.time()
+                backend.combined_ln_pdf(*args, marginalised=True, location_samples_multipliers=multipliers, number_threads=number_threads)
+                times[name] = min(times[name], time.time()-t0)
+        except Exception:
+            logger.exception('Forward model backend {} failed in calibration'.format(name))
+    return times
+
+
+def get_backend(name=None, generate_samples=False, number_threads=1):
+    """
+    Returns the forward model backend
+
+    If the name is None or 'auto', the fastest available backend in the calibration benchmark is selected (the
+    calibration is only run once for each number of threads in a process).
+
+    Args
+        name: str (default=None) - name of the backend (None or 'auto' selects the backend automatically).
+
+    Optional Args
+        generate_samples: bool (default=False) - the backend needs to generate the moment tensor samples.
+        number_threads: int (default=1) - number of threads requested for the forward model.
+
+    Returns
+        ForwardModelBackend - backend object (None if no suitable backend is available).
+
+    Raises
+        ValueError: if the named backend is not available.
+    """
+    backends = get_backends()
+    if name not in [None, 'auto']:
+        if name not in backends:
+            raise ValueError('Forward model backend {} not available, the available backends are: {}'.format(name, ', '.join(sorted(backends.keys()))))
+        return backends[name]
+    backends = dict((key, backend) for key, backend in backends.items() if backend.generates_samples or not generate_samples)
+    if len(backends) < 2:
+        return list(backends.values())[0] if len(backends) else None
+    key = (bool(generate_samples), number_threads, tuple(sorted(backends.keys())))
+    if key not in _SELECTED_BACKENDS:
+        times = calibrate(backends, number_threads)
+        _SELECTED_BACKENDS[key] = min(sorted(times.keys()), key=lambda u: times[u])
+        logger.info('Forward model backend calibration: {} - using {}'.format(
+            ', '.join(['{}: {:.4f}s'.format(u, times[u]) for u in sorted(times.keys())]), _SELECTED_BACKENDS[key]))
+    return backends[_SELECTED_BACKENDS[key]]
@@ -12,13 +12,20 @@ import numpy as np
 cimport numpy as np
 from cython.view cimport array as cvarray
 from cpython cimport bool
+from cython.parallel cimport prange, threadid
+from scipy.linalg.cython_blas cimport dgemm, sgemm
 import unittest
 # DTYPE=np.float64
 # ctypedef np.float64_t DTYPE_t
 ctypedef double DTYPE_t
 ctypedef long long LONG
+ctypedef unsigned long long BITSET_t
+# Station angle coefficients and MT samples in the (non-generating) ln PDF loops can be single or double precision
+ctypedef fused FLOAT_t:
+    float
+    DTYPE_t
 # ctypedef long long
-from libc.stdlib cimport rand, RAND_MAX
+from libc.stdlib cimport rand, RAND_MAX, malloc, free
 IF UNAME_SYSNAME == "Windows":
     from libc.math cimport HUGE_VAL as inf
 ELSE:
@@ -36,9 +43,30 @@ from libc.math cimport M_PI as pi
 from libc.math cimport M_SQRT2 as sqrt2
 cdef DTYPE_t RAND_MAX_D=<DTYPE_t> RAND_MAX
 
-cdef DTYPE_t cutoff=0.0 #Ratio PDF cutoff to approximate as Gaussian - improve calculation speed at the expense of some accuracy
-#corresponds to the Percentage error in the denominator as this governs the deviation of the ratio PDF from the Gaussian
-# 0.1 seems good by eye, little deviation over a range of percentage unc in x
+cdef extern from *:
+    """
+    #ifdef _OPENMP
+    #define MTFIT_OPENMP 1
+    #else
+    #define MTFIT_OPENMP 0
+    #endif
+    """
+    int MTFIT_OPENMP
+
+# Tabulated ratio PDF grid (see ratio_pdf_table): ln(z*|muy/mux|) range, starting and maximum number of grid intervals, and
+# ln PDF values below which the exact ratio PDF is used (so that zero probabilities are unchanged)
+cdef DTYPE_t RATIO_TABLE_RANGE=10.0
+cdef Py_ssize_t RATIO_TABLE_MIN_NODES=64
+cdef Py_ssize_t RATIO_TABLE_MAX_NODES=16384
+cdef DTYPE_t RATIO_TABLE_LN_MIN=-700.0
+
+cdef struct RatioTable:
+    Py_ssize_t nodes # Grid intervals
+    DTYPE_t u_min
+    DTYPE_t inv_h
+    DTYPE_t*ln_z # ln observed ratio for each station
+    DTYPE_t*values # ln ratio PDF at the grid nodes for each station (stations x nodes+1)
+    DTYPE_t*slopes # Gradient at the grid nodes multiplied by the grid spacing (stations x nodes+1)
 
 #cdef bool bc=True
 
@@ -232,22 +260,56 @@ cdef inline DTYPE_t pol_prob_pdf(DTYPE_t x,DTYPE_t p,DTYPE_t n,DTYPE_t i) nogil:
 cdef inline DTYPE_t ar_pdf(DTYPE_t z,DTYPE_t mux,DTYPE_t muy,DTYPE_t psx,DTYPE_t psy) nogil:
     cdef double sqrtpi=sqrt(pi)
     cdef DTYPE_t a,b1,b2,c,d1,d2,f1,f2,sx,sy
-    if psy<cutoff:
-        a=fabs(mux/muy)
-        sx=a*sqrt((psx*psx)+(psy*psy))
-        return gaussian_pdf(z,a,sx)+gaussian_pdf(-z,a,sx)
-    else:
-        sx=psx*fabs(mux)
-        sy=psy*fabs(muy)
-        a=sqrt(z*z/(sx*sx)+1/(sy*sy))
-        b1=mux*z/(sx*sx)+muy/(sy*sy)
-        b2=-mux*z/(sx*sx)+muy/(sy*sy)
-        c=mux*mux/(sx*sx)+muy*muy/(sy*sy)
-        d1=exp((b1*b1-c*a*a)/(2*a*a))
-        f1=0.5*(1+erf(b1/(sqrt2*a)))
-        d2=exp((b2*b2-c*a*a)/(2*a*a))
-        f2=0.5*(1+erf(b2/(sqrt2*a)))
-        return b1*d1/(sx*sy*a*a*a*sqrt2*sqrtpi)*(2*f1-1)+2/(pi*sx*sy*a*a)*exp(-c/2)+b2*d2/(sx*sy*a*a*a*sqrt2*sqrtpi)*(2*f2-1)
+    sx=psx*fabs(mux)
+    sy=psy*fabs(muy)
+    a=sqrt(z*z/(sx*sx)+1/(sy*sy))
+    b1=mux*z/(sx*sx)+muy/(sy*sy)
+    b2=-mux*z/(sx*sx)+muy/(sy*sy)
+    c=mux*mux/(sx*sx)+muy*muy/(sy*sy)
+    d1=exp((b1*b1-c*a*a)/(2*a*a))
+    f1=0.5*(1+erf(b1/(sqrt2*a)))
+    d2=exp((b2*b2-c*a*a)/(2*a*a))
+    f2=0.5*(1+erf(b2/(sqrt2*a)))
+    return b1*d1/(sx*sy*a*a*a*sqrt2*sqrtpi)*(2*f1-1)+2/(pi*sx*sy*a*a)*exp(-c/2)+b2*d2/(sx*sy*a*a*a*sqrt2*sqrtpi)*(2*f2-1)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+@cython.cdivision(True)
+cdef inline DTYPE_t hermite(DTYPE_t*values,DTYPE_t*slopes,Py_ssize_t i,DTYPE_t t) nogil:
+    """Cubic Hermite interpolation between nodes i and i+1 at fraction t of the interval (slopes scaled by the spacing)"""
+    cdef DTYPE_t t1=1-t
+    return t1*t1*((1+2*t)*values[i]+t*slopes[i])+t*t*((3-2*t)*values[i+1]-t1*slopes[i+1])
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+@cython.cdivision(True)
+cdef inline DTYPE_t ar_ln_pdf(DTYPE_t z,DTYPE_t mux,DTYPE_t muy,DTYPE_t psx,DTYPE_t psy,RatioTable*ratio_table,Py_ssize_t u) nogil:
+    """ln ratio PDF for station u, using the tabulated ratio PDF if ratio_table is not NULL
+
+    The ratio PDF of |X/Y| with percentage errors psx and psy scales with the ratio of the means, r=|mux/muy|, so that
+    p(z)=g(z/r)/r, where g is the ratio PDF for unit means. ln g is tabulated against ln(z/r) for each station. Values
+    outside the table, next to zero probability nodes or with very small probabilities use the exact ratio PDF.
+    """
+    cdef DTYPE_t s,t,ln_g
+    cdef Py_ssize_t i
+    cdef Py_ssize_t nodes
+    if ratio_table!=NULL:
+        nodes=ratio_table.nodes
+        s=log(fabs(z*muy/mux))
+        if s>=ratio_table.u_min and s<-ratio_table.u_min:
+            t=(s-ratio_table.u_min)*ratio_table.inv_h
+            i=<Py_ssize_t>t
+            if i>=nodes:
+                i=nodes-1
+            t-=i
+            i+=u*(nodes+1)
+            if ratio_table.values[i]>RATIO_TABLE_LN_MIN and ratio_table.values[i+1]>RATIO_TABLE_LN_MIN:
+                ln_g=hermite(ratio_table.values,ratio_table.slopes,i,t)
+                if ln_g>RATIO_TABLE_LN_MIN:
+                    return ln_g+s-ratio_table.ln_z[u]
+    return log(ar_pdf(z,mux,muy,psx,psy))
 
 #
 # Station Loops
@@ -256,8 +318,8 @@ cdef inline DTYPE_t ar_pdf(DTYPE_t z,DTYPE_t mux,DTYPE_t muy,DTYPE_t psx,DTYPE_t
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void station_polarity_ln_pdf(DTYPE_t*a,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*sigma,DTYPE_t*incorrect_polarity_prob,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
-    cdef DTYPE_t x=0.0
+cdef void station_polarity_ln_pdf(FLOAT_t*a,FLOAT_t*mt,DTYPE_t*ln_P,DTYPE_t*sigma,DTYPE_t*incorrect_polarity_prob,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
+    cdef FLOAT_t x=0.0
     # print '===========',ipmax,umax
     for u from 0<=u<umax:
         x=0.
@@ -278,8 +340,8 @@ cdef void station_polarity_ln_pdf(DTYPE_t*a,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*sigm
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void station_polarity_probability_ln_pdf(DTYPE_t*a,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
-    cdef DTYPE_t x=0.0
+cdef void station_polarity_probability_ln_pdf(FLOAT_t*a,FLOAT_t*mt,DTYPE_t*ln_P,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
+    cdef FLOAT_t x=0.0
     for u from 0<=u<umax:
         x=0
         for k from 0<=k<kmax:# loop over num mt samples and make x
@@ -294,9 +356,9 @@ cdef void station_polarity_probability_ln_pdf(DTYPE_t*a,DTYPE_t*mt,DTYPE_t*ln_P,
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void station_ar_ln_pdf(DTYPE_t*ax,DTYPE_t*ay,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*psx,DTYPE_t*psy,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
-    cdef DTYPE_t mux=0.0
-    cdef DTYPE_t muy=0.0
+cdef void station_ar_ln_pdf(FLOAT_t*ax,FLOAT_t*ay,FLOAT_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*psx,DTYPE_t*psy,RatioTable*ratio_table,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
+    cdef FLOAT_t mux=0.0
+    cdef FLOAT_t muy=0.0
     # print '---------'
     for u from 0<=u<umax:
         mux=0
@@ -305,7 +367,7 @@ cdef void station_ar_ln_pdf(DTYPE_t*ax,DTYPE_t*ay,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_
             mux+=ax[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
             muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
         #First index is station, second is locaton sample, last is MT sample
-        ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+        ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
         # print ln_P[index]
         if ln_P[index]==-inf:
             return 
@@ -313,10 +375,10 @@ cdef void station_ar_ln_pdf(DTYPE_t*ax,DTYPE_t*ay,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void station_combined_polarity_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,DTYPE_t*ay,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*sigma,DTYPE_t*incorrect_polarity_prob,DTYPE_t*psx,DTYPE_t*psy,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uarmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
-    cdef DTYPE_t x=0.0
-    cdef DTYPE_t mux=0.0
-    cdef DTYPE_t muy=0.0
+cdef void station_combined_polarity_ar_ln_pdf(FLOAT_t*a,FLOAT_t*ax,FLOAT_t*ay,FLOAT_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*sigma,DTYPE_t*incorrect_polarity_prob,DTYPE_t*psx,DTYPE_t*psy,RatioTable*ratio_table,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uarmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
+    cdef FLOAT_t x=0.0
+    cdef FLOAT_t mux=0.0
+    cdef FLOAT_t muy=0.0
     cdef Py_ssize_t utmin=umax
     cdef Py_ssize_t utmax=uarmax
     if umax>uarmax:
@@ -334,9 +396,9 @@ cdef void station_combined_polarity_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,DTYPE_t*ay,DT
                 mux+=ax[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                 muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
             if ipmax==1:
-                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[0]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[0]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
             else:
-                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[u]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[u]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
             # print 'b',x,mux,muy,sigma[u],z[u],psx[u],psy[u],'=',ln_P[index]
         elif u>=umax:#Only AR
             mux=0.
@@ -345,9 +407,9 @@ cdef void station_combined_polarity_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,DTYPE_t*ay,DT
                 mux+=ax[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                 muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
             if ipmax==1:
-                ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
             else:
-                ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
             # print 'ar',mux,muy,z[u],psx[u],psy[u],'=',ln_P[index]
         else: #only Pol
             x=0.
@@ -365,10 +427,10 @@ cdef void station_combined_polarity_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,DTYPE_t*ay,DT
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void station_combined_polarity_probability_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,DTYPE_t*ay,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,DTYPE_t*psx,DTYPE_t*psy,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uarmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
-    cdef DTYPE_t mux=0.0
-    cdef DTYPE_t muy=0.0
-    cdef DTYPE_t x=0.0    
+cdef void station_combined_polarity_probability_ar_ln_pdf(FLOAT_t*a,FLOAT_t*ax,FLOAT_t*ay,FLOAT_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,DTYPE_t*psx,DTYPE_t*psy,RatioTable*ratio_table,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uarmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
+    cdef FLOAT_t mux=0.0
+    cdef FLOAT_t muy=0.0
+    cdef FLOAT_t x=0.0    
     cdef Py_ssize_t utmin=umax
     cdef Py_ssize_t utmax=uarmax
     if umax>uarmax:
@@ -385,9 +447,9 @@ cdef void station_combined_polarity_probability_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,D
                 muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
             #First index is station, second is locaton sample, last is MT sample
             if ipmax==1:
-                ln_P[index]+=log(pol_prob_pdf(x,positive_probability[u],negative_probability[u],incorrect_polarity_prob[0]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=log(pol_prob_pdf(x,positive_probability[u],negative_probability[u],incorrect_polarity_prob[0]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
             else:
-                ln_P[index]+=log(pol_prob_pdf(x,positive_probability[u],negative_probability[u],incorrect_polarity_prob[u]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=log(pol_prob_pdf(x,positive_probability[u],negative_probability[u],incorrect_polarity_prob[u]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
         elif u>=umax:#Only AR
             mux=0.
             muy=0.
@@ -395,9 +457,9 @@ cdef void station_combined_polarity_probability_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,D
                 mux+=ax[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                 muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
             if ipmax==1:
-                ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
             else:
-                ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))   
+                ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)   
         else: #only Polprob
             x=0.
             for k from 0<=k<kmax:# loop over num mt samples and make x
@@ -412,11 +474,11 @@ cdef void station_combined_polarity_probability_ar_ln_pdf(DTYPE_t*a,DTYPE_t*ax,D
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void station_combined_all_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*ax,DTYPE_t*ay,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,DTYPE_t*psx,DTYPE_t*psy,DTYPE_t*sigma,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uarmax,Py_ssize_t uprobmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
-    cdef DTYPE_t mux=0.0
-    cdef DTYPE_t muy=0.0
-    cdef DTYPE_t x=0.0 
-    cdef DTYPE_t x1=0.0     
+cdef void station_combined_all_ln_pdf(FLOAT_t*a,FLOAT_t*a_prob,FLOAT_t*ax,FLOAT_t*ay,FLOAT_t*mt,DTYPE_t*ln_P,DTYPE_t*z,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,DTYPE_t*psx,DTYPE_t*psy,RatioTable*ratio_table,DTYPE_t*sigma,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uarmax,Py_ssize_t uprobmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
+    cdef FLOAT_t mux=0.0
+    cdef FLOAT_t muy=0.0
+    cdef FLOAT_t x=0.0 
+    cdef FLOAT_t x1=0.0     
     cdef Py_ssize_t utmin=umax
     cdef Py_ssize_t utmax=uarmax
     if umax>uarmax:
@@ -439,9 +501,9 @@ cdef void station_combined_all_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*ax,DTYPE_
                 muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
             #First index is station, second is locaton sample, last is MT sample
             if ipmax==1:
-                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[0]))+log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[0]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[0]))+log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[0]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
             else:
-                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[u]))+log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[u]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[u]))+log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[u]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
         elif u>=umax:#AR +pol?
             if u>=uprobmax:#AR Only
                 mux=0.
@@ -450,9 +512,9 @@ cdef void station_combined_all_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*ax,DTYPE_
                     mux+=ax[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                     muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                 if ipmax==1:
-                    ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                    ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
                 else:
-                    ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))   
+                    ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)   
             else:#AR +pol prob
                 x1=0
                 mux=0
@@ -463,9 +525,9 @@ cdef void station_combined_all_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*ax,DTYPE_
                     muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                 #First index is station, second is locaton sample, last is MT sample
                 if ipmax==1:
-                    ln_P[index]+=log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[0]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                    ln_P[index]+=log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[0]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
                 else:
-                    ln_P[index]+=log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[u]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                    ln_P[index]+=log(pol_prob_pdf(x1,positive_probability[u],negative_probability[u],incorrect_polarity_prob[u]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
         elif u>=uprobmax:#AR +pol?
             if u>=umax:#AR Only
                 mux=0.
@@ -474,9 +536,9 @@ cdef void station_combined_all_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*ax,DTYPE_
                     mux+=ax[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                     muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                 if ipmax==1:
-                    ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                    ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
                 else:
-                    ln_P[index]+=log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))   
+                    ln_P[index]+=ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)   
             else:#AR +pol prob
                 x1=0
                 mux=0
@@ -487,9 +549,9 @@ cdef void station_combined_all_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*ax,DTYPE_
                     muy+=ay[u*vmax*kmax+v*kmax+k]*mt[k*wmax+w]
                 #First index is station, second is locaton sample, last is MT sample
                 if ipmax==1:
-                    ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[0]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                    ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[0]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
                 else:
-                    ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[u]))+log(ar_pdf(z[u],mux,muy,psx[u],psy[u]))
+                    ln_P[index]+=log(pol_pdf(x,sigma[u],incorrect_polarity_prob[u]))+ar_ln_pdf(z[u],mux,muy,psx[u],psy[u],ratio_table,u)
         else:#Pol prob +pol?
             if u>=uprobmax:#Pol Only
                 x=0.
@@ -516,11 +578,11 @@ cdef void station_combined_all_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*ax,DTYPE_
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void station_combined_pol_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*mt,DTYPE_t*ln_P,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,DTYPE_t*sigma,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uprobmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
-    cdef DTYPE_t mux=0.0
-    cdef DTYPE_t muy=0.0
-    cdef DTYPE_t x=0.0 
-    cdef DTYPE_t x1=0.0     
+cdef void station_combined_pol_ln_pdf(FLOAT_t*a,FLOAT_t*a_prob,FLOAT_t*mt,DTYPE_t*ln_P,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,DTYPE_t*sigma,Py_ssize_t ipmax,Py_ssize_t v,Py_ssize_t umax,Py_ssize_t uprobmax,Py_ssize_t vmax,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t index) nogil:
+    cdef FLOAT_t mux=0.0
+    cdef FLOAT_t muy=0.0
+    cdef FLOAT_t x=0.0 
+    cdef FLOAT_t x1=0.0     
     cdef Py_ssize_t utmin=umax
     cdef Py_ssize_t utmax=uprobmax
     if umax>uprobmax:
@@ -568,7 +630,7 @@ cdef void station_combined_pol_ln_pdf(DTYPE_t*a,DTYPE_t*a_prob,DTYPE_t*mt,DTYPE_
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:,::1] mt,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier) nogil:
+cdef void c_polarity_ln_pdf(DTYPE_t*ln_P,FLOAT_t[:,:,::1] a_arr, FLOAT_t [:,::1] mt,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
     """Calculates probability of a positive polarity
 
     Calculates the probability of a positive polarity observation given a theoretical amplitude X and a fractional uncertainty sigma. Handles zero uncertainty.
@@ -583,23 +645,29 @@ cdef void c_polarity_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:,::1]
     cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]#MT elementssamples
-    cdef DTYPE_t[:,:,::1]a=a_arr
+    cdef FLOAT_t[:,:,::1]a=a_arr
     cdef DTYPE_t[::1]sigma=sigma_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef DTYPE_t max_ln_p_loc=-inf
     cdef Py_ssize_t u,v,w,k
-    cdef DTYPE_t x=0.0
-    for w from 0<=w<wmax:
+    cdef Py_ssize_t vend=0
+    cdef FLOAT_t x=0.0
+    for w from w_start<=w<w_end:
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
                 station_polarity_ln_pdf(&a[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&sigma[0],&incorrect_polarity_prob[0],ipmax,v,umax,vmax,kmax,wmax,w,v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
             else:
@@ -609,10 +677,102 @@ cdef void c_polarity_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:,::1]
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
                 station_polarity_ln_pdf(&a[0,0,0],&mt[0,0],&ln_P[00],&sigma[0],&incorrect_polarity_prob[0], ipmax, v, umax,vmax,kmax,wmax, w, v*wmax+w)
 
+# Number of MT samples tested together in the zero uncertainty polarity loop (bits in BITSET_t)
+cdef enum:
+    SIGN_BLOCK=64
+
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_probability_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr, DTYPE_t [:,::1] mt,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier) nogil:
+cdef void c_polarity_sign_ln_pdf(DTYPE_t*ln_P,FLOAT_t[:,:,::1] a_arr, FLOAT_t [:,::1] mt,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
+    """Calculates the polarity ln PDF for zero uncertainties and incorrect polarity probabilities
+
+    With zero uncertainty the polarity PDF is 1 if the theoretical amplitude has the observed sign and 0 otherwise, so the
+    ln PDF for a location sample is the location sample multiplier or -inf, and only the signs of the amplitudes are needed.
+    The MT samples are tested in blocks of SIGN_BLOCK samples, keeping a list of the samples that have passed all the stations
+    so far, so that each station only evaluates the surviving samples and the block stops at the first station rejecting all of
+    them. The survivors for each location sample are packed into a bitset, and ln_P is evaluated from the bitsets.
+
+    Amplitudes that are exactly zero are undefined for zero uncertainty, so blocks containing them are evaluated using the
+    station loop (c_polarity_ln_pdf), giving the same result as c_polarity_ln_pdf for all the samples.
+    """
+    cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
+    cdef Py_ssize_t vmax=a_arr.shape[1]#Location Sample
+    cdef Py_ssize_t wmax=mt.shape[1]#MT samples
+    cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
+    cdef FLOAT_t*a=&a_arr[0,0,0]
+    cdef FLOAT_t*m=&mt[0,0]
+    cdef FLOAT_t*row
+    cdef Py_ssize_t u,v,w,w0,j,k,n,block,number_survivors
+    cdef Py_ssize_t survivor_index[SIGN_BLOCK]
+    cdef bint zero_amplitude
+    cdef FLOAT_t x=0.0
+    cdef DTYPE_t max_ln_p_loc=-inf
+    cdef BITSET_t*survivors=<BITSET_t*>malloc(vmax*sizeof(BITSET_t))
+    if survivors==NULL:
+        c_polarity_ln_pdf(ln_P,a_arr,mt,sigma_arr,incorrect_polarity_prob_arr,marginalised,ln_P_loc_samples,location_samples_multiplier,NULL,w_start,w_end)
+        return
+    for w0 from w_start<=w0<w_end by SIGN_BLOCK:
+        block=SIGN_BLOCK
+        if w0+block>w_end:
+            block=w_end-w0
+        zero_amplitude=False
+        for v from 0<=v<vmax:
+            number_survivors=block
+            for j from 0<=j<block:
+                survivor_index[j]=j
+            for u from 0<=u<umax:
+                n=0
+                row=a+u*vmax*kmax+v*kmax
+                for j from 0<=j<number_survivors:
+                    w=w0+survivor_index[j]
+                    if kmax==6:
+                        x=row[0]*m[w]+row[1]*m[wmax+w]+row[2]*m[2*wmax+w]+row[3]*m[3*wmax+w]+row[4]*m[4*wmax+w]+row[5]*m[5*wmax+w]
+                    else:
+                        x=0.
+                        for k from 0<=k<kmax:
+                            x+=row[k]*m[k*wmax+w]
+                    if x>0:
+                        survivor_index[n]=survivor_index[j]
+                        n+=1
+                    elif x==0:
+                        zero_amplitude=True
+                number_survivors=n
+                if number_survivors==0:
+                    break
+            survivors[v]=0
+            for j from 0<=j<number_survivors:
+                survivors[v]|=(<BITSET_t>1)<<survivor_index[j]
+        if zero_amplitude:
+            c_polarity_ln_pdf(ln_P,a_arr,mt,sigma_arr,incorrect_polarity_prob_arr,marginalised,ln_P_loc_samples,location_samples_multiplier,NULL,w0,w0+block)
+            continue
+        for j from 0<=j<block:
+            w=w0+j
+            if marginalised>0:
+                max_ln_p_loc=-inf
+                for v from 0<=v<vmax:
+                    if (survivors[v]>>j)&1:
+                        max_ln_p_loc=fmax(max_ln_p_loc,location_samples_multiplier[v])
+                if max_ln_p_loc>-inf:
+                    ln_P[w]=0.0
+                    for v from 0<=v<vmax:
+                        if (survivors[v]>>j)&1:
+                            ln_P[w]+=exp(location_samples_multiplier[v]-max_ln_p_loc)
+                    ln_P[w]=log(ln_P[w])+max_ln_p_loc
+                else:
+                    ln_P[w]=-inf
+            else:
+                for v from 0<=v<vmax:
+                    if (survivors[v]>>j)&1:
+                        ln_P[v*wmax+w]=location_samples_multiplier[v]
+                    else:
+                        ln_P[v*wmax+w]=-inf
+    free(survivors)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+cdef void c_polarity_probability_ln_pdf(DTYPE_t*ln_P,FLOAT_t[:,:,::1]  a_arr, FLOAT_t [:,::1] mt,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
     """Calculates probability of a given amplitude giving an observed polarity probability
 
     Calculates the probability of a given polarity probability observation given a theoretical amplitude X and a fractional uncertainty sigma. Handles zero uncertainty.
@@ -627,24 +787,30 @@ cdef void c_polarity_probability_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr, DT
     cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]#MT elementssamples
-    cdef DTYPE_t[:,:,::1]a=a_arr
+    cdef FLOAT_t[:,:,::1]a=a_arr
     cdef DTYPE_t[::1]positive_probability=positive_probability_arr
     cdef DTYPE_t[::1]negative_probability=negative_probability_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef Py_ssize_t u,v,w,k
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t max_ln_p_loc=-inf
     ## log(location_samples_multiplier) is  ln_P_loc_samples initialisation
-    for w from 0<=w<wmax:
+    for w from w_start<=w<w_end:
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
                 station_polarity_probability_ln_pdf(&a[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],ipmax,v,umax,vmax,kmax,wmax,w,v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
             else:
@@ -657,7 +823,7 @@ cdef void c_polarity_probability_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr, DT
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_amplitude_ratio_ln_pdf(DTYPE_t*ln_P,DTYPE_t[::1]  z_arr, DTYPE_t [:,::1] mt,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier) nogil:
+cdef void c_amplitude_ratio_ln_pdf(DTYPE_t*ln_P,DTYPE_t[::1]  z_arr, FLOAT_t [:,::1] mt,FLOAT_t[:,:,::1]  ax_arr,FLOAT_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,RatioTable*ratio_table,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
     """Calculates Amplitude Ratio Probability
 
     Calculates the Ratio pdf (D. Hinkley, On the ratio of two correlated normal random variables, 1969, Biometrika vol 56 pp 635-639).
@@ -671,24 +837,30 @@ cdef void c_amplitude_ratio_ln_pdf(DTYPE_t*ln_P,DTYPE_t[::1]  z_arr, DTYPE_t [:,
     cdef Py_ssize_t vmax=ax_arr.shape[1]#Location Sample
     cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t kmax=ax_arr.shape[2]#MT elementssamples
-    cdef DTYPE_t[:,:,::1]ax=ax_arr
-    cdef DTYPE_t[:,:,::1]ay=ay_arr
+    cdef FLOAT_t[:,:,::1]ax=ax_arr
+    cdef FLOAT_t[:,:,::1]ay=ay_arr
     cdef DTYPE_t[::1]z=z_arr
     cdef DTYPE_t[::1]psx=psx_arr
     cdef DTYPE_t[::1]psy=psy_arr
     cdef Py_ssize_t u,v,w,k
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t max_ln_p_loc=-inf
-    for w from 0<=w<wmax:
+    for w from w_start<=w<w_end:
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&psx[0],&psy[0],v,umax,vmax,kmax,wmax,w,v)
+                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&psx[0],&psy[0],ratio_table,v,umax,vmax,kmax,wmax,w,v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
             else:
@@ -696,7 +868,7 @@ cdef void c_amplitude_ratio_ln_pdf(DTYPE_t*ln_P,DTYPE_t[::1]  z_arr, DTYPE_t [:,
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
-                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&psx[0],&psy[0],  v, umax,vmax,kmax,wmax, w, v*wmax+w)
+                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&psx[0],&psy[0],ratio_table,  v, umax,vmax,kmax,wmax, w, v*wmax+w)
 
 #
 # Cython Combined ln PDF loops 
@@ -705,7 +877,7 @@ cdef void c_amplitude_ratio_ln_pdf(DTYPE_t*ln_P,DTYPE_t[::1]  z_arr, DTYPE_t [:,
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_prob_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:,::1] mt,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier) nogil:
+cdef void c_polarity_prob_combined_ln_pdf(DTYPE_t* ln_P,FLOAT_t[:,:,::1] a_arr, FLOAT_t [:,::1] mt,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,FLOAT_t[:,:,::1]  ax_arr,FLOAT_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,RatioTable*ratio_table,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
     #cdefs
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uarmax=ax_arr.shape[0]#Station Sample AR
@@ -713,9 +885,9 @@ cdef void c_polarity_prob_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,
     cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]
-    cdef DTYPE_t[:,:,::1]a=a_arr
-    cdef DTYPE_t[:,:,::1]ax=ax_arr
-    cdef DTYPE_t[:,:,::1]ay=ay_arr
+    cdef FLOAT_t[:,:,::1]a=a_arr
+    cdef FLOAT_t[:,:,::1]ax=ax_arr
+    cdef FLOAT_t[:,:,::1]ay=ay_arr
     cdef DTYPE_t[::1]z=z_arr
     cdef DTYPE_t[::1]positive_probability=positive_probability_arr
     cdef DTYPE_t[::1]negative_probability=negative_probability_arr
@@ -723,18 +895,24 @@ cdef void c_polarity_prob_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,
     cdef DTYPE_t[::1]psy=psy_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef Py_ssize_t u,v,w,k
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t max_ln_p_loc=-inf
-    for w from 0<=w<wmax:
+    for w from w_start<=w<w_end:
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v) 
+                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],ratio_table, ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v) 
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
             else:
@@ -742,12 +920,12 @@ cdef void c_polarity_prob_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
-                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v*wmax+w) 
+                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],ratio_table, ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v*wmax+w) 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_ar_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr,  DTYPE_t [:,::1]mt,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr, DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier) nogil:
+cdef void c_polarity_ar_ln_pdf(DTYPE_t*ln_P,FLOAT_t[:,:,::1] a_arr,  FLOAT_t [:,::1]mt,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr, FLOAT_t[:,:,::1]  ax_arr,FLOAT_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,RatioTable*ratio_table,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uarmax=ax_arr.shape[0]#Station Sample AR
     cdef Py_ssize_t vmax=a_arr.shape[1]#Location Sample
@@ -755,9 +933,10 @@ cdef void c_polarity_ar_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr,  DTYPE_t [:,
     cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]
     cdef Py_ssize_t u,v,w,k
-    cdef DTYPE_t[:,:,::1]a=a_arr
-    cdef DTYPE_t[:,:,::1]ax=ax_arr
-    cdef DTYPE_t[:,:,::1]ay=ay_arr
+    cdef Py_ssize_t vend=0
+    cdef FLOAT_t[:,:,::1]a=a_arr
+    cdef FLOAT_t[:,:,::1]ax=ax_arr
+    cdef FLOAT_t[:,:,::1]ay=ay_arr
     cdef DTYPE_t[::1]z=z_arr
     cdef DTYPE_t[::1]sigma=sigma_arr
     cdef DTYPE_t[::1]psx=psx_arr
@@ -765,22 +944,27 @@ cdef void c_polarity_ar_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr,  DTYPE_t [:,
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef DTYPE_t max_ln_p_loc=-inf
     # print umax,uarmax
-    for w from 0<=w<wmax:
+    for w from w_start<=w<w_end:
         # if vmax==1:
         #     ln_P[0*wmax+w]=location_samples_multiplier[0]
-        #     station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v*wmax+w)
+        #     station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],ratio_table, ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v*wmax+w)
         # el
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v)
+                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],ratio_table, ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
                 # print max_ln_p_loc
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
             else:
@@ -788,12 +972,12 @@ cdef void c_polarity_ar_ln_pdf(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr,  DTYPE_t [:,
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
-                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v*wmax+w)
+                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],ratio_table, ipmax, v, umax,uarmax,vmax,kmax,wmax, w, v*wmax+w)
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_all_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:,::1] mt,DTYPE_t[::1] sigma_arr,DTYPE_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier) nogil:
+cdef void c_all_combined_ln_pdf(DTYPE_t* ln_P,FLOAT_t[:,:,::1] a_arr, FLOAT_t [:,::1] mt,DTYPE_t[::1] sigma_arr,FLOAT_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,FLOAT_t[:,:,::1]  ax_arr,FLOAT_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,RatioTable*ratio_table,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
     #cdefs
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uprobmax=a_prob_arr.shape[0]#Station Sample Pol Prob
@@ -802,10 +986,10 @@ cdef void c_all_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:
     cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]
-    cdef DTYPE_t[:,:,::1]a=a_arr
-    cdef DTYPE_t[:,:,::1]ax=ax_arr
-    cdef DTYPE_t[:,:,::1]ay=ay_arr
-    cdef DTYPE_t[:,:,::1]a_prob=a_prob_arr
+    cdef FLOAT_t[:,:,::1]a=a_arr
+    cdef FLOAT_t[:,:,::1]ax=ax_arr
+    cdef FLOAT_t[:,:,::1]ay=ay_arr
+    cdef FLOAT_t[:,:,::1]a_prob=a_prob_arr
     cdef DTYPE_t[::1]z=z_arr
     cdef DTYPE_t[::1]positive_probability=positive_probability_arr
     cdef DTYPE_t[::1]negative_probability=negative_probability_arr
@@ -814,18 +998,24 @@ cdef void c_all_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:
     cdef DTYPE_t[::1]psy=psy_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef Py_ssize_t u,v,w,k
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t max_ln_p_loc=-inf
-    for w from 0<=w<wmax:
+    for w from w_start<=w<w_end:
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v) 
+                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],ratio_table,&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v) 
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
             else:
@@ -833,12 +1023,12 @@ cdef void c_all_combined_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
-                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v*wmax+w) 
+                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],ratio_table,&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v*wmax+w) 
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_combined_pol_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:,::1] mt,DTYPE_t[::1] sigma_arr,DTYPE_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier) nogil:
+cdef void c_combined_pol_ln_pdf(DTYPE_t* ln_P,FLOAT_t[:,:,::1] a_arr, FLOAT_t [:,::1] mt,DTYPE_t[::1] sigma_arr,FLOAT_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
     #cdefs
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uprobmax=a_prob_arr.shape[0]#Station Sample Pol Prob
@@ -846,25 +1036,31 @@ cdef void c_combined_pol_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:
     cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]
-    cdef DTYPE_t[:,:,::1]a=a_arr
-    cdef DTYPE_t[:,:,::1]a_prob=a_prob_arr
+    cdef FLOAT_t[:,:,::1]a=a_arr
+    cdef FLOAT_t[:,:,::1]a_prob=a_prob_arr
     cdef DTYPE_t[::1]positive_probability=positive_probability_arr
     cdef DTYPE_t[::1]negative_probability=negative_probability_arr
     cdef DTYPE_t[::1]sigma=sigma_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef Py_ssize_t u,v,w,k
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t max_ln_p_loc=-inf
-    for w from 0<=w<wmax:
+    for w from w_start<=w<w_end:
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
                 station_combined_pol_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&mt[0,0],&ln_P_loc_samples[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&sigma[0], ipmax, v, umax,uprobmax,vmax,kmax,wmax, w, v) 
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
             else:
@@ -874,6 +1070,168 @@ cdef void c_combined_pol_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
                 station_combined_pol_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&mt[0,0],&ln_P[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&sigma[0], ipmax, v, umax,uprobmax,vmax,kmax,wmax, w, v*wmax+w) 
 
+#
+# Sample axis dispatch (thread parallel)
+#
+
+cdef enum:
+    ALL_COMBINED_KERNEL=0
+    COMBINED_POL_KERNEL=1
+    POLARITY_AR_KERNEL=2
+    POLARITY_PROB_COMBINED_KERNEL=3
+    POLARITY_KERNEL=4
+    POLARITY_PROBABILITY_KERNEL=5
+    AMPLITUDE_RATIO_KERNEL=6
+    POLARITY_SIGN_KERNEL=7
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+cdef void c_combined_ln_pdf(int kernel,DTYPE_t*ln_P,FLOAT_t [:,::1] mt,FLOAT_t[:,:,::1] a_arr,DTYPE_t[::1] sigma_arr,FLOAT_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,FLOAT_t[:,:,::1]  ax_arr,FLOAT_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,RatioTable*ratio_table,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
+    """Calls the ln PDF loop for the data types given by kernel over the MT samples w_start to w_end
+
+    Each call needs its own ln_P_loc_samples buffer, so that disjoint sample ranges can be evaluated by different threads.
+    If ln_location_bound is not NULL (see ln_location_bounds), the marginalisation over the location samples stops early,
+    so the zero uncertainty polarity kernel, which evaluates all the location samples together, uses the station loop instead.
+    """
+    if kernel==ALL_COMBINED_KERNEL:
+        c_all_combined_ln_pdf(ln_P,a_arr,mt,sigma_arr,a_prob_arr,positive_probability_arr,negative_probability_arr,incorrect_polarity_prob_arr,z_arr,ax_arr,ay_arr,psx_arr,psy_arr,ratio_table,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==COMBINED_POL_KERNEL:
+        c_combined_pol_ln_pdf(ln_P,a_arr,mt,sigma_arr,a_prob_arr,positive_probability_arr,negative_probability_arr,incorrect_polarity_prob_arr,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==POLARITY_AR_KERNEL:
+        c_polarity_ar_ln_pdf(ln_P,a_arr,mt,sigma_arr,incorrect_polarity_prob_arr,z_arr,ax_arr,ay_arr,psx_arr,psy_arr,ratio_table,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==POLARITY_PROB_COMBINED_KERNEL:
+        c_polarity_prob_combined_ln_pdf(ln_P,a_prob_arr,mt,positive_probability_arr,negative_probability_arr,incorrect_polarity_prob_arr,z_arr,ax_arr,ay_arr,psx_arr,psy_arr,ratio_table,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==POLARITY_KERNEL:
+        c_polarity_ln_pdf(ln_P,a_arr,mt,sigma_arr,incorrect_polarity_prob_arr,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==POLARITY_PROBABILITY_KERNEL:
+        c_polarity_probability_ln_pdf(ln_P,a_prob_arr,mt,positive_probability_arr,negative_probability_arr,incorrect_polarity_prob_arr,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==AMPLITUDE_RATIO_KERNEL:
+        c_amplitude_ratio_ln_pdf(ln_P,z_arr,mt,ax_arr,ay_arr,psx_arr,psy_arr,ratio_table,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==POLARITY_SIGN_KERNEL and ln_location_bound!=NULL:
+        c_polarity_ln_pdf(ln_P,a_arr,mt,sigma_arr,incorrect_polarity_prob_arr,marginalised,ln_P_loc_samples,location_samples_multiplier,ln_location_bound,w_start,w_end)
+    elif kernel==POLARITY_SIGN_KERNEL:
+        c_polarity_sign_ln_pdf(ln_P,a_arr,mt,sigma_arr,incorrect_polarity_prob_arr,marginalised,ln_P_loc_samples,location_samples_multiplier,w_start,w_end)
+
+#
+# BLAS blocked loops
+#
+
+# The blocked loop is used when there are at least BLOCK_MIN_ROWS amplitudes per MT sample (stations x location samples), with blocks
+# sized so that the amplitudes buffer has about BLOCK_AMPLITUDES elements (512kB), between BLOCK_MIN_SAMPLES and BLOCK_MAX_SAMPLES
+# MT samples.
+cdef Py_ssize_t BLOCK_MIN_ROWS=256
+cdef Py_ssize_t BLOCK_AMPLITUDES=65536
+cdef Py_ssize_t BLOCK_MIN_SAMPLES=16
+cdef Py_ssize_t BLOCK_MAX_SAMPLES=1024
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+cdef inline void block_amplitudes(FLOAT_t*a,FLOAT_t*mt,FLOAT_t*x,Py_ssize_t rows,Py_ssize_t kmax,Py_ssize_t wmax,Py_ssize_t w,Py_ssize_t block) nogil:
+    """Calculates the amplitudes x[j*rows+row] for the rows of a (rows x kmax) and the MT samples w to w+block (mt is kmax x wmax) using dgemm (sgemm for single precision)
+
+    The arrays are C ordered, so in column major terms this is the product a^T^T mt[:,w:w+block]^T^T.
+    """
+    cdef char transa='T'
+    cdef char transb='T'
+    cdef int m=rows
+    cdef int n=block
+    cdef int k=kmax
+    cdef int lda=kmax
+    cdef int ldb=wmax
+    cdef int ldc=rows
+    cdef FLOAT_t alpha=1.0
+    cdef FLOAT_t beta=0.0
+    if rows>0 and block>0:
+        if FLOAT_t is float:
+            sgemm(&transa,&transb,&m,&n,&k,&alpha,a,&lda,mt+w,&ldb,&beta,x,&ldc)
+        else:
+            dgemm(&transa,&transb,&m,&n,&k,&alpha,a,&lda,mt+w,&ldb,&beta,x,&ldc)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+cdef inline DTYPE_t station_amplitudes_ln_pdf(DTYPE_t ln_P,FLOAT_t*x,FLOAT_t*x_prob,FLOAT_t*x_ax,FLOAT_t*x_ay,DTYPE_t*sigma,DTYPE_t*positive_probability,DTYPE_t*negative_probability,DTYPE_t*incorrect_polarity_prob,Py_ssize_t ipmax,DTYPE_t*z,DTYPE_t*psx,DTYPE_t*psy,RatioTable*ratio_table,Py_ssize_t umax,Py_ssize_t uprobmax,Py_ssize_t uarmax) nogil:
+    """Adds the station ln PDFs to ln_P from precalculated station amplitudes for one location and MT sample (see c_blocked_ln_pdf)
+
+    Stations are combined in the same order as the station loops, stopping when the probability is zero.
+    """
+    cdef Py_ssize_t u
+    cdef Py_ssize_t ip
+    cdef Py_ssize_t utmax=umax
+    cdef DTYPE_t term
+    if uprobmax>utmax:
+        utmax=uprobmax
+    if uarmax>utmax:
+        utmax=uarmax
+    for u from 0<=u<utmax:
+        ip=0
+        if ipmax>1:
+            ip=u
+        term=0.0
+        if u<umax:
+            term+=log(pol_pdf(x[u],sigma[u],incorrect_polarity_prob[ip]))
+        if u<uprobmax:
+            term+=log(pol_prob_pdf(x_prob[u],positive_probability[u],negative_probability[u],incorrect_polarity_prob[ip]))
+        if u<uarmax:
+            term+=ar_ln_pdf(z[u],x_ax[u],x_ay[u],psx[u],psy[u],ratio_table,u)
+        ln_P+=term
+        if ln_P==-inf:
+            return ln_P
+    return ln_P
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.nonecheck(False)
+cdef void c_blocked_ln_pdf(DTYPE_t*ln_P,FLOAT_t [:,::1] mt,FLOAT_t[:,:,::1] a_t,DTYPE_t[::1] sigma,FLOAT_t[:,:,::1] a_prob_t,DTYPE_t[::1]  positive_probability,DTYPE_t[::1]  negative_probability,DTYPE_t[::1]  incorrect_polarity_prob,DTYPE_t[::1]  z,FLOAT_t[:,:,::1]  ax_t,FLOAT_t[:,:,::1]  ay_t,DTYPE_t[::1] psx,DTYPE_t[::1] psy,RatioTable*ratio_table,Py_ssize_t umax,Py_ssize_t uprobmax,Py_ssize_t uarmax,Py_ssize_t vmax,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,FLOAT_t*amplitudes,Py_ssize_t block_size,Py_ssize_t w_start,Py_ssize_t w_end) nogil:
+    """Calculates the ln PDF for the MT samples w_start to w_end in blocks of block_size samples
+
+    The station angle coefficients are location sample ordered (a_t is location samples x stations x 6, i.e. a transposed),
+    so that the theoretical amplitudes for a block are calculated as one matrix product for each data type ((location samples
+    x stations) x MT samples) into the amplitudes buffer (size (umax+uprobmax+2*uarmax)*vmax*block_size), with the stations
+    for each MT and location sample contiguous. The PDFs are then evaluated elementwise. Data types not used have zero
+    stations (umax, uprobmax or uarmax).
+    """
+    cdef Py_ssize_t wmax=mt.shape[1]
+    cdef Py_ssize_t kmax=mt.shape[0]
+    cdef Py_ssize_t ipmax=incorrect_polarity_prob.shape[0]
+    cdef Py_ssize_t v,w,w0,j,block
+    cdef DTYPE_t max_ln_p_loc=-inf
+    cdef FLOAT_t*x
+    cdef FLOAT_t*x_prob
+    cdef FLOAT_t*x_ax
+    cdef FLOAT_t*x_ay
+    for w0 from w_start<=w0<w_end by block_size:
+        block=block_size
+        if w0+block>w_end:
+            block=w_end-w0
+        x=amplitudes
+        x_prob=x+umax*vmax*block
+        x_ax=x_prob+uprobmax*vmax*block
+        x_ay=x_ax+uarmax*vmax*block
+        block_amplitudes(&a_t[0,0,0],&mt[0,0],x,umax*vmax,kmax,wmax,w0,block)
+        block_amplitudes(&a_prob_t[0,0,0],&mt[0,0],x_prob,uprobmax*vmax,kmax,wmax,w0,block)
+        block_amplitudes(&ax_t[0,0,0],&mt[0,0],x_ax,uarmax*vmax,kmax,wmax,w0,block)
+        block_amplitudes(&ay_t[0,0,0],&mt[0,0],x_ay,uarmax*vmax,kmax,wmax,w0,block)
+        for j from 0<=j<block:
+            w=w0+j
+            if marginalised>0:
+                max_ln_p_loc=-inf
+                for v from 0<=v<vmax:
+                    ln_P_loc_samples[v]=station_amplitudes_ln_pdf(location_samples_multiplier[v],x+(j*vmax+v)*umax,x_prob+(j*vmax+v)*uprobmax,x_ax+(j*vmax+v)*uarmax,x_ay+(j*vmax+v)*uarmax,&sigma[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],ipmax,&z[0],&psx[0],&psy[0],ratio_table,umax,uprobmax,uarmax)
+                    max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                if max_ln_p_loc>-inf:
+                    ln_P[w]=0.0
+                    for v from 0<=v<vmax:
+                        ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
+                    ln_P[w]=log(ln_P[w])+max_ln_p_loc
+                else:
+                    ln_P[w]=-inf
+            else:
+                for v from 0<=v<vmax:
+                    ln_P[v*wmax+w]=station_amplitudes_ln_pdf(location_samples_multiplier[v],x+(j*vmax+v)*umax,x_prob+(j*vmax+v)*uprobmax,x_ax+(j*vmax+v)*uarmax,x_ay+(j*vmax+v)*uarmax,&sigma[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],ipmax,&z[0],&psx[0],&psy[0],ratio_table,umax,uprobmax,uarmax)
+
 #
 # Cython ln PDF generating loops 
 #
@@ -881,7 +1239,7 @@ cdef void c_combined_pol_ln_pdf(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t [:
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t * mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,LONG* n_tried,LONG cutoff,LONG* cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier):
+cdef void c_polarity_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t * mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,LONG* n_tried,LONG cutoff,LONG* cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,sampler):
     """Calculates probability of a positive polarity
 
     Calculates the probability of a positive polarity observation given a theoretical amplitude X and a fractional uncertainty sigma. Handles zero uncertainty.
@@ -898,6 +1256,7 @@ cdef void c_polarity_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t * m
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]#MT elementssamples
     cdef Py_ssize_t u,v,w,k,t
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t x=0.0
     cdef bool ok=False
     cdef DTYPE_t[:,::1]test_mt=np.empty((6,tmax))
@@ -905,10 +1264,7 @@ cdef void c_polarity_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t * m
     cdef DTYPE_t[::1]sigma=sigma_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef DTYPE_t max_ln_p_loc=-inf
-    if dc:
-        test_mt=rand_dc(tmax)
-    else:
-        test_mt=rand_mt(tmax)
+    test_mt=test_samples(tmax,dc,sampler)
     w=0
     t=0
     while w<wmax:
@@ -919,21 +1275,23 @@ cdef void c_polarity_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t * m
             cut_ind[0]=w
             return
         if t>=tmax:
-            if dc:
-                test_mt=rand_dc(tmax)
-            else:
-                test_mt=rand_mt(tmax)
+            test_mt=test_samples(tmax,dc,sampler)
             t=0
         ok=False
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
                 station_polarity_ln_pdf(&a[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&sigma[0],&incorrect_polarity_prob[0],ipmax,v,umax,vmax,kmax,tmax,t,v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
                 if ln_P[w]>-inf:
@@ -955,7 +1313,7 @@ cdef void c_polarity_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t * m
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_probability_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,LONG* n_tried,LONG cutoff,LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier):
+cdef void c_polarity_probability_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,LONG* n_tried,LONG cutoff,LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,sampler):
     """Calculates probability of a given amplitude giving an observed polarity probability
 
     Calculates the probability of a given polarity probability observation given a theoretical amplitude X and a fractional uncertainty sigma. Handles zero uncertainty.
@@ -971,6 +1329,7 @@ cdef void c_polarity_probability_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]#MT elementssamples
     cdef Py_ssize_t u,v,w,k,t
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t x=0.0
     cdef bool ok=False
     cdef DTYPE_t[:,::1]test_mt=np.empty((6,tmax))
@@ -979,10 +1338,7 @@ cdef void c_polarity_probability_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr
     cdef DTYPE_t[::1]negative_probability=negative_probability_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef DTYPE_t max_ln_p_loc=-inf
-    if dc:
-        test_mt=rand_dc(tmax)
-    else:
-        test_mt=rand_mt(tmax)
+    test_mt=test_samples(tmax,dc,sampler)
     w=0
     t=0
     while w<wmax:
@@ -993,21 +1349,23 @@ cdef void c_polarity_probability_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr
             cut_ind[0]=w
             return
         if t>=tmax:
-            if dc:
-                test_mt=rand_dc(tmax)
-            else:
-                test_mt=rand_mt(tmax)
+            test_mt=test_samples(tmax,dc,sampler)
             t=0
         ok=False
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
                 station_polarity_probability_ln_pdf(&a[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],ipmax,v,umax,vmax,kmax,tmax,t,v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
                 if ln_P[w]>-inf:
@@ -1029,7 +1387,7 @@ cdef void c_polarity_probability_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1]  a_arr
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_amplitude_ratio_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[::1]  z_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff,LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier):
+cdef void c_amplitude_ratio_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[::1]  z_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff,LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,sampler):
     """Calculates Amplitude Ratio Probability
 
     Calculates the Ratio pdf (D. Hinkley, On the ratio of two correlated normal random variables, 1969, Biometrika vol 56 pp 635-639).
@@ -1045,6 +1403,7 @@ cdef void c_amplitude_ratio_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[::1]  z_arr, DTYPE_
     cdef Py_ssize_t tmax=wmax*4#MT test samples
     cdef Py_ssize_t kmax=ax_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t u,v,w,k,t
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t mux=0.0
     cdef DTYPE_t muy=0.0
     cdef bool ok=False
@@ -1055,10 +1414,7 @@ cdef void c_amplitude_ratio_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[::1]  z_arr, DTYPE_
     cdef DTYPE_t[::1]psx=psx_arr
     cdef DTYPE_t[::1]psy=psy_arr
     cdef DTYPE_t max_ln_p_loc=-inf
-    if dc:
-        test_mt=rand_dc(tmax)
-    else:
-        test_mt=rand_mt(tmax)
+    test_mt=test_samples(tmax,dc,sampler)
     w=0
     t=0
     while w<wmax:
@@ -1070,22 +1426,24 @@ cdef void c_amplitude_ratio_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[::1]  z_arr, DTYPE_
             return
         
         if t>=tmax:
-            if dc:
-                test_mt=rand_dc(tmax)
-            else:
-                test_mt=rand_mt(tmax)
+            test_mt=test_samples(tmax,dc,sampler)
             t=0
         ok=False
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&psx[0],&psy[0],v,umax,vmax,kmax,tmax,t,v)
+                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&psx[0],&psy[0],NULL,v,umax,vmax,kmax,tmax,t,v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
                 if ln_P[w]>-inf:
@@ -1093,7 +1451,7 @@ cdef void c_amplitude_ratio_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[::1]  z_arr, DTYPE_
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]            
-                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&psx[0],&psy[0],  v, umax,vmax,kmax,tmax, t, v*wmax+w)   
+                station_ar_ln_pdf(&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&psx[0],&psy[0],NULL,  v, umax,vmax,kmax,tmax, t, v*wmax+w)   
                 if  ln_P[v*wmax+w]>-inf:
                     ok=True
         if ok:
@@ -1111,7 +1469,7 @@ cdef void c_amplitude_ratio_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[::1]  z_arr, DTYPE_
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_prob_combined_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff,LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier):
+cdef void c_polarity_prob_combined_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff,LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,sampler):
     #cdefs
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uarmax=ax_arr.shape[0]#Station Sample AR
@@ -1121,6 +1479,7 @@ cdef void c_polarity_prob_combined_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_ar
     cdef Py_ssize_t kmax=a_arr.shape[2]#MT elementssamples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]
     cdef Py_ssize_t u,v,w,k,t
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t x=0.0
     cdef DTYPE_t mux=0.0
     cdef DTYPE_t muy=0.0
@@ -1136,10 +1495,7 @@ cdef void c_polarity_prob_combined_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_ar
     cdef DTYPE_t[::1]psy=psy_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef DTYPE_t max_ln_p_loc=-inf
-    if dc:
-        test_mt=rand_dc(tmax)
-    else:
-        test_mt=rand_mt(tmax)
+    test_mt=test_samples(tmax,dc,sampler)
     w=0
     t=0
     while w<wmax:
@@ -1150,22 +1506,24 @@ cdef void c_polarity_prob_combined_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_ar
             cut_ind[0]=w
             return
         if t>=tmax:
-            if dc:
-                test_mt=rand_dc(tmax)
-            else:
-                test_mt=rand_mt(tmax)
+            test_mt=test_samples(tmax,dc,sampler)
             t=0
         ok=False
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v) 
+                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],NULL, ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v) 
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
                 if ln_P[w]>-inf:
@@ -1174,7 +1532,7 @@ cdef void c_polarity_prob_combined_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_ar
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
-                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v*wmax+w) 
+                station_combined_polarity_probability_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],NULL, ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v*wmax+w) 
                 if ln_P[v*wmax+w]>-inf:
                     ok=True
         if ok:
@@ -1188,7 +1546,7 @@ cdef void c_polarity_prob_combined_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_ar
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_polarity_ar_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr, DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff, LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier):
+cdef void c_polarity_ar_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[::1] incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr, DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff, LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,sampler):
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uarmax=ax_arr.shape[0]#Station Sample AR
     cdef Py_ssize_t vmax=a_arr.shape[1]#Location Sample
@@ -1197,6 +1555,7 @@ cdef void c_polarity_ar_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t
     # cdef Py_ssize_t wmax=mt.shape[1]#MT samples
     cdef Py_ssize_t ipmax=incorrect_polarity_prob_arr.shape[0]
     cdef Py_ssize_t u,v,w,k,t
+    cdef Py_ssize_t vend=0
     # cdef DTYPE_t[:,:,::1]  ln_P=np.zeros((umax,vmax,wmax)) 
     cdef DTYPE_t x=0.0
     cdef DTYPE_t mux=0.0
@@ -1212,10 +1571,7 @@ cdef void c_polarity_ar_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t
     cdef DTYPE_t[::1]psy=psy_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
 
-    if dc:
-        test_mt=rand_dc(tmax)
-    else:
-        test_mt=rand_mt(tmax)
+    test_mt=test_samples(tmax,dc,sampler)
     w=0
     t=0
     while w<wmax:
@@ -1226,22 +1582,24 @@ cdef void c_polarity_ar_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t
             cut_ind[0]=w
             return
         if t>=tmax:
-            if dc:
-                test_mt=rand_dc(tmax)
-            else:
-                test_mt=rand_mt(tmax)
+            test_mt=test_samples(tmax,dc,sampler)
             t=0
         ok=False
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v)
+                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],NULL, ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v)
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
                 if ln_P[w]>-inf:
@@ -1249,7 +1607,7 @@ cdef void c_polarity_ar_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
-                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0], ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v*wmax+w)
+                station_combined_polarity_ar_ln_pdf(&a[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&sigma[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],NULL, ipmax, v, umax,uarmax,vmax,kmax,tmax, t, v*wmax+w)
                 if ln_P[v*wmax+w]>-inf:
                     ok=True
         if ok:
@@ -1263,7 +1621,7 @@ cdef void c_polarity_ar_ln_pdf_gen(DTYPE_t*ln_P,DTYPE_t[:,:,::1] a_arr, DTYPE_t
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_all_combined_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff, LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier):
+cdef void c_all_combined_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,DTYPE_t[::1]  z_arr,DTYPE_t[:,:,::1]  ax_arr,DTYPE_t[:,:,::1]  ay_arr,DTYPE_t[::1] psx_arr,DTYPE_t[::1] psy_arr,LONG* n_tried,LONG cutoff, LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,sampler):
     #cdefs
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uprobmax=a_prob_arr.shape[0]#Station Sample Pol Prob
@@ -1284,11 +1642,9 @@ cdef void c_all_combined_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t
     cdef DTYPE_t[::1]psy=psy_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef Py_ssize_t u,v,w,k
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t max_ln_p_loc=-inf
-    if dc:
-        test_mt=rand_dc(tmax)
-    else:
-        test_mt=rand_mt(tmax)
+    test_mt=test_samples(tmax,dc,sampler)
     w=0
     t=0
     while w<wmax:
@@ -1299,22 +1655,24 @@ cdef void c_all_combined_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t
             cut_ind[0]=w
             return
         if t>=tmax:
-            if dc:
-                test_mt=rand_dc(tmax)
-            else:
-                test_mt=rand_mt(tmax)
+            test_mt=test_samples(tmax,dc,sampler)
             t=0
         ok=False
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
-                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v) 
+                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],NULL,&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v) 
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
                 if ln_P[w]>-inf:
@@ -1322,7 +1680,7 @@ cdef void c_all_combined_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t
         else:
             for v from 0<=v<vmax:
                 ln_P[v*wmax+w]=location_samples_multiplier[v]
-                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v*wmax+w) 
+                station_combined_all_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&ax[0,0,0],&ay[0,0,0],&test_mt[0,0],&ln_P[0],&z[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&psx[0],&psy[0],NULL,&sigma[0], ipmax, v, umax,uarmax,uprobmax,vmax,kmax,wmax, w, v*wmax+w) 
                 if ln_P[v*wmax+w]>-inf:
                     ok=True
         if ok:
@@ -1336,7 +1694,7 @@ cdef void c_all_combined_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
-cdef void c_combined_pol_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,LONG* n_tried,LONG cutoff, LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier):
+cdef void c_combined_pol_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t *mt,Py_ssize_t wmax,DTYPE_t[::1] sigma_arr,DTYPE_t[:,:,::1] a_prob_arr,DTYPE_t[::1]  positive_probability_arr,DTYPE_t[::1]  negative_probability_arr,DTYPE_t[::1]  incorrect_polarity_prob_arr,LONG* n_tried,LONG cutoff, LONG*cut_ind,bool dc,int marginalised,DTYPE_t*ln_P_loc_samples,DTYPE_t*location_samples_multiplier,DTYPE_t*ln_location_bound,sampler):
     #cdefs
     cdef Py_ssize_t umax=a_arr.shape[0]#Station Sample
     cdef Py_ssize_t uprobmax=a_prob_arr.shape[0]#Station Sample Pol Prob
@@ -1351,11 +1709,9 @@ cdef void c_combined_pol_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t
     cdef DTYPE_t[::1]sigma=sigma_arr
     cdef DTYPE_t[::1]incorrect_polarity_prob=incorrect_polarity_prob_arr
     cdef Py_ssize_t u,v,w,k
+    cdef Py_ssize_t vend=0
     cdef DTYPE_t max_ln_p_loc=-inf
-    if dc:
-        test_mt=rand_dc(tmax)
-    else:
-        test_mt=rand_mt(tmax)
+    test_mt=test_samples(tmax,dc,sampler)
     w=0
     t=0
     while w<wmax:
@@ -1366,22 +1722,24 @@ cdef void c_combined_pol_ln_pdf_gen(DTYPE_t* ln_P,DTYPE_t[:,:,::1] a_arr,DTYPE_t
             cut_ind[0]=w
             return
         if t>=tmax:
-            if dc:
-                test_mt=rand_dc(tmax)
-            else:
-                test_mt=rand_mt(tmax)
+            test_mt=test_samples(tmax,dc,sampler)
             t=0
         ok=False
         if marginalised>0:
             max_ln_p_loc=-inf
+            vend=vmax
             #loc_samples_multiplier
             for v from 0<=v<vmax:
                 ln_P_loc_samples[v]=location_samples_multiplier[v]
                 station_combined_pol_ln_pdf(&a[0,0,0],&a_prob[0,0,0],&test_mt[0,0],&ln_P_loc_samples[0],&positive_probability[0],&negative_probability[0],&incorrect_polarity_prob[0],&sigma[0], ipmax, v, umax,uprobmax,vmax,kmax,wmax, w, v) 
                 max_ln_p_loc=fmax(max_ln_p_loc,ln_P_loc_samples[v])
+                # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                if ln_location_bound!=NULL and max_ln_p_loc>ln_location_bound[v+1]:
+                    vend=v+1
+                    break
             if max_ln_p_loc>-inf:
                 ln_P[w]=0.0
-                for v from 0<=v<vmax:
+                for v from 0<=v<vend:
                     ln_P[w]+=exp(ln_P_loc_samples[v]-max_ln_p_loc)
                 ln_P[w]=log(ln_P[w])+max_ln_p_loc
                 if ln_P[w]>-inf:
@@ -1422,7 +1780,7 @@ def polarity_ln_pdf(a,mt_arr,sigma,incorrect_polarity_prob=np.array([0.]),genera
     cdef DTYPE_t[::1] location_samples_multiplier=location_samples_multipliers 
     cdef DTYPE_t[::1] ln_P_loc_samples=np.empty(location_samples_multipliers.shape)
     if generate_samples:
-        c_polarity_ln_pdf_gen(&ln_P[0,0],a,&mt[0,0],wmax,sigma,incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+        c_polarity_ln_pdf_gen(&ln_P[0,0],a,&mt[0,0],wmax,sigma,incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],NULL,None)
         if cut_ind<0:
             # no non_zero samples
             return np.array([]),np.array([[],[],[],[],[],[]]),n_tried
@@ -1431,9 +1789,24 @@ def polarity_ln_pdf(a,mt_arr,sigma,incorrect_polarity_prob=np.array([0.]),genera
             ln_P=ln_P[:,:cut_ind]
             mt=mt[:,:cut_ind]
         return np.asarray(ln_P),np.asarray(mt),n_tried  
-    c_polarity_ln_pdf(&ln_P[0,0],a,mt,sigma,incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+    if zero_polarity_uncertainty(sigma,incorrect_polarity_prob,umax):
+        c_polarity_sign_ln_pdf[DTYPE_t](&ln_P[0,0],a,mt,sigma,incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],0,wmax)
+    else:
+        c_polarity_ln_pdf[DTYPE_t](&ln_P[0,0],a,mt,sigma,incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],NULL,0,wmax)
     return np.asarray(ln_P)
 
+def zero_polarity_uncertainty(sigma,incorrect_polarity_prob,Py_ssize_t umax):
+    """Returns True if the polarity uncertainties and incorrect polarity probabilities are all zero
+
+    The polarity PDF is then a sign test, evaluated using c_polarity_sign_ln_pdf.
+
+    Args
+        sigma: Polarity uncertainties.
+        incorrect_polarity_prob: Incorrect polarity probabilities.
+        umax: Number of stations.
+    """
+    return not np.any(np.asarray(sigma)[:umax]) and not np.any(np.asarray(incorrect_polarity_prob)[:umax])
+
 def polarity_probability_ln_pdf(  a, mt_arr,positive_probability,negative_probability,incorrect_polarity_prob=np.array([0.]),generate_samples=0,cutoff=1000000000,dc=False,int marginalised=0,location_samples_multipliers=np.array([0.])):
     if generate_samples:
         mt_arr=np.empty((a.shape[2],generate_samples))
@@ -1451,7 +1824,7 @@ def polarity_probability_ln_pdf(  a, mt_arr,positive_probability,negative_probab
     cdef LONG cut_ind=0
     cdef DTYPE_t[:,::1] ln_P=np.empty((vmax,wmax))  
     if generate_samples:
-        c_polarity_probability_ln_pdf_gen(&ln_P[0,0],a,&mt[0,0],wmax,positive_probability, negative_probability,incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+        c_polarity_probability_ln_pdf_gen(&ln_P[0,0],a,&mt[0,0],wmax,positive_probability, negative_probability,incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],NULL,None)
         if cut_ind<0:
             # no non_zero samples
             return np.array([]),np.array([[],[],[],[],[],[]]),n_tried
@@ -1460,7 +1833,7 @@ def polarity_probability_ln_pdf(  a, mt_arr,positive_probability,negative_probab
             ln_P=ln_P[:,:cut_ind]
             mt=mt[:,:cut_ind]
         return np.asarray(ln_P),np.asarray(mt),n_tried  
-    c_polarity_probability_ln_pdf(&ln_P[0,0],a, mt, positive_probability, negative_probability,incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+    c_polarity_probability_ln_pdf[DTYPE_t](&ln_P[0,0],a, mt, positive_probability, negative_probability,incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],NULL,0,wmax)
     return np.asarray(ln_P)
 
 def amplitude_ratio_ln_pdf( z, mt_arr,ax,ay, psx, psy,generate_samples=0,cutoff=1000000000,dc=False,int marginalised=0,location_samples_multipliers=np.array([0.])):
@@ -1480,7 +1853,7 @@ def amplitude_ratio_ln_pdf( z, mt_arr,ax,ay, psx, psy,generate_samples=0,cutoff=
     cdef LONG cut_ind=0
     cdef DTYPE_t[:,::1] ln_P=np.empty((vmax,wmax))  
     if generate_samples:
-        c_amplitude_ratio_ln_pdf_gen(&ln_P[0,0],z,&mt[0,0],wmax,ax,ay,psx,psy,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+        c_amplitude_ratio_ln_pdf_gen(&ln_P[0,0],z,&mt[0,0],wmax,ax,ay,psx,psy,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],NULL,None)
         if cut_ind<0:
             # no non_zero samples
             return np.array([]),np.array([[],[],[],[],[],[]]),n_tried
@@ -1489,13 +1862,328 @@ def amplitude_ratio_ln_pdf( z, mt_arr,ax,ay, psx, psy,generate_samples=0,cutoff=
             ln_P=ln_P[:,:cut_ind]
             mt=mt[:,:cut_ind]
         return np.asarray(ln_P),np.asarray(mt),n_tried  
-    c_amplitude_ratio_ln_pdf(&ln_P[0,0],z, mt,ax,ay,psx,psy,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+    c_amplitude_ratio_ln_pdf[DTYPE_t](&ln_P[0,0],z, mt,ax,ay,psx,psy,NULL,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],NULL,0,wmax)
     return np.asarray(ln_P)
 
 def log0test():
     return log(0)==-inf
 
-def combined_ln_pdf(mt_arr,a_polarity,error_polarity,a1_amplitude_ratio,a2_amplitude_ratio,amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,a_polarity_prob,polarity_prob,incorrect_polarity_prob=0,generate_samples=0,cutoff=1000000000,dc=False,marginalised=False,location_samples_multipliers=np.array([0.])):
+def openmp_enabled():
+    """Returns True if the module was built with OpenMP, so that number_threads>1 runs in parallel"""
+    return MTFIT_OPENMP==1
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+cdef _threaded_combined_ln_pdf(int kernel,DTYPE_t[:,::1] ln_P,FLOAT_t[:,::1] mt,a_polarity,error_polarity,a_polarity_prob,polarity_prob,incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,int marginalised,DTYPE_t[::1] location_samples_multiplier,int number_threads,block_size=0,ratio_table=None,ln_location_bound=None):
+    """Evaluates the ln PDF loop for kernel, splitting the MT samples into chunks across number_threads OpenMP threads
+
+    If block_size is greater than 0, the BLAS blocked loop (c_blocked_ln_pdf) is used with blocks of block_size samples,
+    otherwise the station loops are used. If None, the block size is chosen using default_block_size. The zero uncertainty
+    polarity kernel (POLARITY_SIGN_KERNEL) always uses its own sign test blocks.
+
+    The blocked loop calculates all the amplitudes for a block, so it loses the saving from the station loops stopping at
+    the first zero probability station, and the amplitude calculation is only a small part of the cost compared to the
+    erf and log evaluations. Consequently it is only faster for many location samples with few zero probability samples
+    (see MTfit.tests.benchmarking.blocked_ln_pdf_benchmarks), and the station loops are the default.
+
+    The station angle coefficients and data are shared between the threads, and each chunk has its own location samples buffer.
+    Without an OpenMP build the chunks are evaluated serially.
+
+    The station angle coefficients and MT samples are either double or single precision (FLOAT_t, the single precision
+    amplitudes are accumulated in single precision), while the PDFs and ln_P are double precision.
+
+    If ratio_table is a RatioPDFTable (see ratio_pdf_table) for the amplitude ratio percentage errors, the amplitude ratio
+    PDFs are interpolated from the table.
+
+    If ln_location_bound is set (see ln_location_bounds), the marginalisation over the location samples stops once the
+    remaining samples cannot change the result by more than the tolerance, using the station loops.
+    """
+    cdef Py_ssize_t wmax=mt.shape[1]
+    cdef Py_ssize_t chunk
+    cdef Py_ssize_t number_chunks=1
+    # Placeholders are used for the data types not used by the kernel
+    cdef FLOAT_t[:,:,::1] a_pol
+    cdef DTYPE_t[::1] sigma
+    cdef FLOAT_t[:,:,::1] a_prob
+    cdef DTYPE_t[::1] positive_probability
+    cdef DTYPE_t[::1] negative_probability
+    cdef DTYPE_t[::1] incorrect=incorrect_polarity_prob
+    dtype=np.float64
+    if FLOAT_t is float:
+        dtype=np.float32
+    if not isinstance(a_polarity, bool):
+        a_pol=a_polarity
+        sigma=error_polarity
+    else:
+        a_pol=np.zeros((1,1,1),dtype=dtype)
+        sigma=np.zeros(1)
+    if not isinstance(a_polarity_prob, bool):
+        a_prob=a_polarity_prob
+        positive_probability=polarity_prob[0]
+        negative_probability=polarity_prob[1]
+    else:
+        a_prob=np.zeros((1,1,1),dtype=dtype)
+        positive_probability=np.zeros(1)
+        negative_probability=positive_probability
+    cdef FLOAT_t[:,:,::1] ax
+    cdef FLOAT_t[:,:,::1] ay
+    cdef DTYPE_t[::1] z
+    cdef DTYPE_t[::1] psx
+    cdef DTYPE_t[::1] psy
+    if not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
+        ax=a1_amplitude_ratio
+        ay=a2_amplitude_ratio
+        z=amplitude_ratio
+        psx=percentage_error1_amplitude_ratio
+        psy=percentage_error2_amplitude_ratio
+    else:
+        ax=np.zeros((1,1,1),dtype=dtype)
+        ay=ax
+        z=np.zeros(1)
+        psx=z
+        psy=z
+    cdef RatioTable table
+    cdef RatioTable*table_pointer=NULL
+    cdef DTYPE_t[::1] ln_z
+    cdef DTYPE_t[:,::1] table_values
+    cdef DTYPE_t[:,::1] table_slopes
+    if ratio_table is not None and not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
+        with np.errstate(divide='ignore'):
+            ln_z=np.log(np.asarray(amplitude_ratio,dtype=np.float64))
+        table_values=ratio_table.values
+        table_slopes=ratio_table.slopes
+        table.nodes=ratio_table.nodes
+        table.u_min=-ratio_table.u_range
+        table.inv_h=ratio_table.nodes/(2*ratio_table.u_range)
+        table.ln_z=&ln_z[0]
+        table.values=&table_values[0,0]
+        table.slopes=&table_slopes[0,0]
+        table_pointer=&table
+    # Stations for each data type (0 if not used) for the blocked loop
+    cdef Py_ssize_t umax=0
+    cdef Py_ssize_t uprobmax=0
+    cdef Py_ssize_t uarmax=0
+    cdef Py_ssize_t vmax=location_samples_multiplier.shape[0]
+    if not isinstance(a_polarity, bool):
+        umax=a_pol.shape[0]
+        vmax=a_pol.shape[1]
+    if not isinstance(a_polarity_prob, bool):
+        uprobmax=a_prob.shape[0]
+        vmax=a_prob.shape[1]
+    if not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
+        uarmax=ax.shape[0]
+        vmax=ax.shape[1]
+    if block_size is None:
+        block_size=default_block_size((umax+uprobmax+2*uarmax)*vmax)
+    cdef Py_ssize_t block=min(max(block_size,0),wmax)
+    if kernel==POLARITY_SIGN_KERNEL:
+        # The sign test only needs the amplitudes of the surviving samples
+        block=0
+    cdef DTYPE_t[::1] location_bound
+    cdef DTYPE_t*location_bound_pointer=NULL
+    if ln_location_bound is not None and marginalised>0:
+        # The blocked loop calculates the amplitudes for all the location samples, so the station loops are used
+        block=0
+        location_bound=np.ascontiguousarray(ln_location_bound,dtype=np.float64)
+        location_bound_pointer=&location_bound[0]
+    cdef FLOAT_t[:,:,::1] a_pol_t=a_pol
+    cdef FLOAT_t[:,:,::1] a_prob_t=a_prob
+    cdef FLOAT_t[:,:,::1] ax_t=ax
+    cdef FLOAT_t[:,:,::1] ay_t=ay
+    if block>0:
+        # Location sample ordered coefficients for the blocked loop
+        a_pol_t=np.ascontiguousarray(np.transpose(a_pol,(1,0,2)))
+        a_prob_t=np.ascontiguousarray(np.transpose(a_prob,(1,0,2)))
+        ax_t=np.ascontiguousarray(np.transpose(ax,(1,0,2)))
+        ay_t=np.ascontiguousarray(np.transpose(ay,(1,0,2)))
+    if number_threads>1 and wmax>1:
+        # Several chunks per thread to balance the early exits for zero probability samples
+        number_chunks=min(wmax,4*number_threads)
+    cdef Py_ssize_t[::1] chunk_bounds=np.linspace(0,wmax,number_chunks+1).astype(np.intp)
+    cdef DTYPE_t[:,::1] ln_P_loc_samples=np.empty((number_chunks,max(location_samples_multiplier.shape[0],1)))
+    # Amplitudes buffer for each thread
+    cdef FLOAT_t[:,::1] amplitudes=np.empty((max(number_threads,1),max((umax+uprobmax+2*uarmax)*vmax*block,1)),dtype=dtype)
+    if number_chunks==1:
+        if block>0:
+            c_blocked_ln_pdf(&ln_P[0,0],mt,a_pol_t,sigma,a_prob_t,positive_probability,negative_probability,incorrect,z,ax_t,ay_t,psx,psy,table_pointer,umax,uprobmax,uarmax,vmax,marginalised,&ln_P_loc_samples[0,0],&location_samples_multiplier[0],&amplitudes[0,0],block,0,wmax)
+        else:
+            c_combined_ln_pdf(kernel,&ln_P[0,0],mt,a_pol,sigma,a_prob,positive_probability,negative_probability,incorrect,z,ax,ay,psx,psy,table_pointer,marginalised,&ln_P_loc_samples[0,0],&location_samples_multiplier[0],location_bound_pointer,0,wmax)
+        return
+    for chunk in prange(number_chunks,nogil=True,schedule='dynamic',num_threads=number_threads):
+        if block>0:
+            c_blocked_ln_pdf(&ln_P[0,0],mt,a_pol_t,sigma,a_prob_t,positive_probability,negative_probability,incorrect,z,ax_t,ay_t,psx,psy,table_pointer,umax,uprobmax,uarmax,vmax,marginalised,&ln_P_loc_samples[chunk,0],&location_samples_multiplier[0],&amplitudes[threadid(),0],block,chunk_bounds[chunk],chunk_bounds[chunk+1])
+        else:
+            c_combined_ln_pdf(kernel,&ln_P[0,0],mt,a_pol,sigma,a_prob,positive_probability,negative_probability,incorrect,z,ax,ay,psx,psy,table_pointer,marginalised,&ln_P_loc_samples[chunk,0],&location_samples_multiplier[0],location_bound_pointer,chunk_bounds[chunk],chunk_bounds[chunk+1])
+
+#
+# Tabulated ratio PDF
+#
+
+class RatioPDFTable(object):
+    """Tabulated ln ratio PDFs for a set of amplitude ratio percentage errors (see ratio_pdf_table)
+
+    Attributes
+        values: numpy array of ln ratio PDFs for unit means at the grid nodes (stations x nodes+1).
+        slopes: numpy array of the gradients of values at the grid nodes multiplied by the grid spacing.
+        nodes: Number of grid intervals.
+        u_range: Grid range, the grid is from -u_range to u_range in ln(z*|muy/mux|).
+        max_error: Maximum absolute error in the ln ratio PDF (i.e. relative error in the ratio PDF).
+        tabulated: numpy boolean array, True for the stations that use the table (False if the error could not be reached).
+    """
+
+    def __init__(self,values,slopes,u_range,max_error,tabulated):
+        self.values=values
+        self.slopes=slopes
+        self.nodes=values.shape[1]-1
+        self.u_range=u_range
+        self.max_error=max_error
+        self.tabulated=tabulated
+
+    def ln_pdf(self,z,mux,muy,psx,psy):
+        """Returns the tabulated ln ratio PDFs for the stations
+
+        Args
+            z: numpy array of observed amplitude ratios.
+            mux: numpy array of numerator amplitudes.
+            muy: numpy array of denominator amplitudes.
+            psx: numpy array of numerator percentage errors (as used for the table).
+            psy: numpy array of denominator percentage errors (as used for the table).
+
+        Returns
+            numpy array of ln ratio PDFs
+        """
+        cdef DTYPE_t[::1] z_arr=np.ascontiguousarray(z,dtype=np.float64)
+        cdef DTYPE_t[::1] mux_arr=np.ascontiguousarray(mux,dtype=np.float64)
+        cdef DTYPE_t[::1] muy_arr=np.ascontiguousarray(muy,dtype=np.float64)
+        cdef DTYPE_t[::1] psx_arr=np.ascontiguousarray(psx,dtype=np.float64)
+        cdef DTYPE_t[::1] psy_arr=np.ascontiguousarray(psy,dtype=np.float64)
+        cdef DTYPE_t[:,::1] values=self.values
+        cdef DTYPE_t[:,::1] slopes=self.slopes
+        cdef DTYPE_t[::1] ln_z
+        with np.errstate(divide='ignore'):
+            ln_z=np.log(np.asarray(z_arr))
+        cdef RatioTable table
+        table.nodes=self.nodes
+        table.u_min=-self.u_range
+        table.inv_h=self.nodes/(2*self.u_range)
+        table.ln_z=&ln_z[0]
+        table.values=&values[0,0]
+        table.slopes=&slopes[0,0]
+        cdef DTYPE_t[::1] ln_p=np.empty(z_arr.shape[0])
+        cdef Py_ssize_t u
+        for u from 0<=u<z_arr.shape[0]:
+            ln_p[u]=ar_ln_pdf(z_arr[u],mux_arr[u],muy_arr[u],psx_arr[u],psy_arr[u],&table,u)
+        return np.asarray(ln_p)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void ratio_table_nodes(DTYPE_t[:,::1] values,DTYPE_t[:,::1] slopes,DTYPE_t[::1] psx,DTYPE_t[::1] psy,DTYPE_t u_range) nogil:
+    """Evaluates the ln ratio PDFs for unit means and their gradients (scaled by the spacing) at the grid nodes"""
+    cdef Py_ssize_t nodes=values.shape[1]-1
+    cdef DTYPE_t h=2*u_range/nodes
+    cdef DTYPE_t delta=1e-5
+    cdef DTYPE_t s,f_plus,f_minus
+    cdef Py_ssize_t u,i
+    for u from 0<=u<values.shape[0]:
+        for i from 0<=i<=nodes:
+            s=-u_range+i*h
+            values[u,i]=log(ar_pdf(exp(s),1.,1.,psx[u],psy[u]))
+            f_plus=log(ar_pdf(exp(s+delta),1.,1.,psx[u],psy[u]))
+            f_minus=log(ar_pdf(exp(s-delta),1.,1.,psx[u],psy[u]))
+            slopes[u,i]=h*(f_plus-f_minus)/(2*delta)
+            if not (f_plus>-inf and f_minus>-inf and values[u,i]>-inf and slopes[u,i]==slopes[u,i]):
+                # Use the exact PDF next to zero probabilities
+                values[u,i]=-inf
+                slopes[u,i]=0
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void ratio_table_errors(DTYPE_t[:,::1] values,DTYPE_t[:,::1] slopes,DTYPE_t[::1] psx,DTYPE_t[::1] psy,DTYPE_t u_range,DTYPE_t[::1] errors) nogil:
+    """Calculates the maximum interpolation error for each station at the quarter points of the grid intervals"""
+    cdef Py_ssize_t nodes=values.shape[1]-1
+    cdef DTYPE_t h=2*u_range/nodes
+    cdef DTYPE_t t,exact,interpolated
+    cdef Py_ssize_t u,i,j
+    for u from 0<=u<values.shape[0]:
+        errors[u]=0
+        for i from 0<=i<nodes:
+            if not (values[u,i]>RATIO_TABLE_LN_MIN and values[u,i+1]>RATIO_TABLE_LN_MIN):
+                continue
+            for j from 1<=j<4:
+                t=0.25*j
+                interpolated=hermite(&values[u,0],&slopes[u,0],i,t)
+                if interpolated<=RATIO_TABLE_LN_MIN:
+                    continue
+                exact=log(ar_pdf(exp(-u_range+(i+t)*h),1.,1.,psx[u],psy[u]))
+                if not fabs(exact-interpolated)<=errors[u]:
+                    errors[u]=fabs(exact-interpolated)
+
+_ratio_pdf_tables={}
+
+def ratio_pdf_table(percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,max_error=1e-4):
+    """Tabulates the amplitude ratio PDFs for the percentage errors to a maximum relative error
+
+    The ratio PDF (ar_pdf) of the absolute ratio of two Gaussian amplitudes with means mux and muy and percentage errors
+    psx and psy only depends on the ratio of the means, r=|mux/muy|, as p(z)=g(z/r)/r, where g is the ratio PDF for
+    unit means. So ln g is tabulated for each station against ln(z/r) on a uniform grid over +/-RATIO_TABLE_RANGE, and
+    evaluated using cubic Hermite interpolation, needing a single log call rather than the exp and erf calls of the
+    exact PDF.
+
+    The grid spacing is halved until the maximum interpolation error in ln g at the quarter points of the grid
+    intervals is less than max_error for all the stations, or the grid has RATIO_TABLE_MAX_NODES intervals. Stations
+    that still have larger errors use the exact PDF. The exact PDF is also used outside the grid and for very small
+    probabilities, so that zero probabilities are unchanged.
+
+    The tables are cached for the percentage errors and max_error.
+
+    Args
+        percentage_error1_amplitude_ratio: numpy array of numerator percentage errors.
+        percentage_error2_amplitude_ratio: numpy array of denominator percentage errors.
+
+    Keyword Args
+        max_error:[1e-4] Maximum absolute error in the ln ratio PDF (relative error in the ratio PDF).
+
+    Returns
+        RatioPDFTable
+    """
+    if max_error<=0:
+        raise ValueError('Ratio PDF table max_error must be positive: '+str(max_error))
+    psx=np.ascontiguousarray(percentage_error1_amplitude_ratio,dtype=np.float64).flatten()
+    psy=np.ascontiguousarray(percentage_error2_amplitude_ratio,dtype=np.float64).flatten()
+    key=(psx.tobytes(),psy.tobytes(),float(max_error))
+    if key in _ratio_pdf_tables:
+        return _ratio_pdf_tables[key]
+    nodes=RATIO_TABLE_MIN_NODES
+    errors=np.empty(psx.shape[0])
+    while True:
+        values=np.empty((psx.shape[0],nodes+1))
+        slopes=np.empty((psx.shape[0],nodes+1))
+        ratio_table_nodes(values,slopes,psx,psy,RATIO_TABLE_RANGE)
+        ratio_table_errors(values,slopes,psx,psy,RATIO_TABLE_RANGE,errors)
+        if (errors<=max_error).all() or nodes>=RATIO_TABLE_MAX_NODES:
+            break
+        nodes*=2
+    tabulated=errors<=max_error
+    values[~tabulated,:]=-inf
+    slopes[~tabulated,:]=0
+    if len(_ratio_pdf_tables)>=8:
+        _ratio_pdf_tables.clear()
+    _ratio_pdf_tables[key]=RatioPDFTable(values,slopes,RATIO_TABLE_RANGE,max_error,tabulated)
+    return _ratio_pdf_tables[key]
+
+def default_block_size(Py_ssize_t rows):
+    """Returns the number of MT samples in each block for the BLAS blocked loop, or 0 to use the station loops
+
+    Args
+        rows: Number of amplitudes for each MT sample (stations x location samples, for each station angle coefficient array).
+    """
+    if rows<BLOCK_MIN_ROWS:
+        return 0
+    return max(BLOCK_MIN_SAMPLES,min(BLOCK_MAX_SAMPLES,BLOCK_AMPLITUDES//rows))
+
+def combined_ln_pdf(mt_arr,a_polarity,error_polarity,a1_amplitude_ratio,a2_amplitude_ratio,amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,a_polarity_prob,polarity_prob,incorrect_polarity_prob=0,generate_samples=0,cutoff=1000000000,dc=False,marginalised=False,location_samples_multipliers=np.array([0.]),number_threads=1,block_size=0,single_precision=False,ratio_pdf_max_error=0,location_tolerance=0,sampler=None):
     if isinstance(incorrect_polarity_prob, int) and incorrect_polarity_prob == 0:
         incorrect_polarity_prob=np.array([0.])
     generate_mts=False  
@@ -1518,37 +2206,48 @@ def combined_ln_pdf(mt_arr,a_polarity,error_polarity,a1_amplitude_ratio,a2_ampli
         location_samples_multipliers=np.zeros((vmax))
     if marginalised>0:
         vmax=1
+    # Single precision station angle coefficients and MT samples (the generating loops are double precision)
+    coefficient_dtype=np.float64
+    cdef DTYPE_t[:,::1] mt
+    cdef float[:,::1] mt_single
     if generate_samples:
         generate_mts=True
         mt_arr=np.empty((kmax,generate_samples))
-    cdef DTYPE_t[:,::1] mt=mt_arr
+    elif single_precision:
+        coefficient_dtype=np.float32
+        mt_arr=np.ascontiguousarray(mt_arr,dtype=np.float32)
+    elif isinstance(mt_arr, np.ndarray) and mt_arr.dtype!=np.float64:
+        mt_arr=np.ascontiguousarray(mt_arr,dtype=np.float64)
+    if coefficient_dtype==np.float32:
+        mt_single=mt_arr
+    else:
+        mt=mt_arr
     cdef DTYPE_t[::1] location_samples_multiplier=location_samples_multipliers
     cdef DTYPE_t[::1] ln_P_loc_samples=np.empty(location_samples_multipliers.shape)
-    cdef Py_ssize_t wmax=mt.shape[1]
+    cdef Py_ssize_t wmax=mt_arr.shape[1]
     cdef LONG n_tried=0
     cdef LONG cut_ind=0
     cdef DTYPE_t[:,::1] ln_P=np.empty((vmax,wmax))  
+    cdef int kernel=-1
     # data preparation
-    if isinstance(a_polarity, np.ndarray) and a_polarity.dtype!=np.float64:
-        a_polarity=a_polarity.astype(np.float64,copy=False)
-    if isinstance(mt, np.ndarray) and mt.dtype!=np.float64:
-        mt=mt.astype(np.float64,copy=False)
+    if isinstance(a_polarity, np.ndarray) and a_polarity.dtype!=coefficient_dtype:
+        a_polarity=a_polarity.astype(coefficient_dtype,copy=False)
     if isinstance(error_polarity, np.ndarray) and error_polarity.dtype!=np.float64:
         error_polarity=error_polarity.astype(np.float64,copy=False)
     if isinstance(incorrect_polarity_prob, np.ndarray) and incorrect_polarity_prob.dtype!=np.float64:
         incorrect_polarity_prob=incorrect_polarity_prob.astype(np.float64,copy=False)
-    if isinstance(a1_amplitude_ratio, np.ndarray) and a1_amplitude_ratio.dtype!=np.float64:
-        a1_amplitude_ratio=a1_amplitude_ratio.astype(np.float64,copy=False)
-    if isinstance(a2_amplitude_ratio, np.ndarray) and a2_amplitude_ratio.dtype!=np.float64:
-        a2_amplitude_ratio=a2_amplitude_ratio.astype(np.float64,copy=False)
+    if isinstance(a1_amplitude_ratio, np.ndarray) and a1_amplitude_ratio.dtype!=coefficient_dtype:
+        a1_amplitude_ratio=a1_amplitude_ratio.astype(coefficient_dtype,copy=False)
+    if isinstance(a2_amplitude_ratio, np.ndarray) and a2_amplitude_ratio.dtype!=coefficient_dtype:
+        a2_amplitude_ratio=a2_amplitude_ratio.astype(coefficient_dtype,copy=False)
     if isinstance(amplitude_ratio, np.ndarray) and amplitude_ratio.dtype!=np.float64:
         amplitude_ratio=amplitude_ratio.astype(np.float64,copy=False)
     if isinstance(percentage_error1_amplitude_ratio, np.ndarray) and percentage_error1_amplitude_ratio.dtype!=np.float64:
         percentage_error1_amplitude_ratio=percentage_error1_amplitude_ratio.astype(np.float64,copy=False)
     if isinstance(percentage_error2_amplitude_ratio, np.ndarray) and percentage_error2_amplitude_ratio.dtype!=np.float64:
         percentage_error2_amplitude_ratio=percentage_error2_amplitude_ratio.astype(np.float64,copy=False)
-    if isinstance(a_polarity_prob, np.ndarray) and a_polarity_prob.dtype!=np.float64:
-        a_polarity_prob=a_polarity_prob.astype(np.float64,copy=False)
+    if isinstance(a_polarity_prob, np.ndarray) and a_polarity_prob.dtype!=coefficient_dtype:
+        a_polarity_prob=a_polarity_prob.astype(coefficient_dtype,copy=False)
     if isinstance(polarity_prob, np.ndarray) and polarity_prob.dtype!=np.float64:
         polarity_prob=polarity_prob.astype(np.float64,copy=False)
     #
@@ -1575,44 +2274,71 @@ def combined_ln_pdf(mt_arr,a_polarity,error_polarity,a1_amplitude_ratio,a2_ampli
         raise IndexError('Bounds Exception for polarity probability observations.\nShape: '+str(polarity_prob[0].shape)+'\nincompatible with number of receivers:\n'+str(a_polarity_prob.shape[0]))
     if not isinstance(a_polarity_prob, bool) and a_polarity_prob.shape[0]>polarity_prob[1].shape[0]:
         raise IndexError('Bounds Exception for polarity probability observations.\nShape: '+str(polarity_prob[1].shape)+'\nincompatible with number of receivers:\n'+str(a_polarity_prob.shape[0]))
+    # Bounds on the remaining location samples for the bounded location marginalisation
+    ln_location_bound=None
+    cdef DTYPE_t[::1] location_bound
+    cdef DTYPE_t*location_bound_pointer=NULL
+    if marginalised>0 and location_tolerance>0:
+        from .probability import ln_likelihood_upper_bound, ln_location_bounds
+        bound_data={}
+        if not isinstance(a_polarity_prob, bool):
+            bound_data['polarity_prob']=[polarity_prob[0][:a_polarity_prob.shape[0]],polarity_prob[1][:a_polarity_prob.shape[0]]]
+        if not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
+            bound_data['amplitude_ratio']=amplitude_ratio[:a1_amplitude_ratio.shape[0]]
+            bound_data['percentage_error1_amplitude_ratio']=percentage_error1_amplitude_ratio[:a1_amplitude_ratio.shape[0]]
+            bound_data['percentage_error2_amplitude_ratio']=percentage_error2_amplitude_ratio[:a1_amplitude_ratio.shape[0]]
+            bound_data['ratio_pdf_max_error']=ratio_pdf_max_error
+        ln_location_bound=ln_location_bounds(location_samples_multipliers,location_tolerance,ln_likelihood_upper_bound(**bound_data))
+        location_bound=ln_location_bound
+        location_bound_pointer=&location_bound[0]
     #
     # Call loop functions
     #
     if not isinstance(a_polarity_prob, bool) and not isinstance(a_polarity, bool) and not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
         if generate_mts:
-            c_all_combined_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,a_polarity_prob,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])   
+            c_all_combined_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,a_polarity_prob,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],location_bound_pointer,sampler)   
         else:
-            c_all_combined_ln_pdf(&ln_P[0,0],a_polarity,mt,error_polarity,a_polarity_prob,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            kernel=ALL_COMBINED_KERNEL
     elif not isinstance(a_polarity_prob, bool) and not isinstance(a_polarity, bool):
         if generate_mts:
-            c_combined_pol_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,a_polarity_prob,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])   
+            c_combined_pol_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,a_polarity_prob,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],location_bound_pointer,sampler)   
         else:
-            c_combined_pol_ln_pdf(&ln_P[0,0],a_polarity,mt,error_polarity,a_polarity_prob,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            kernel=COMBINED_POL_KERNEL
     elif not isinstance(a_polarity, bool) and not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
         if generate_mts:
-            c_polarity_ar_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])   
+            c_polarity_ar_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],location_bound_pointer,sampler)   
         else:
-            c_polarity_ar_ln_pdf(&ln_P[0,0],a_polarity,mt,error_polarity,incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            kernel=POLARITY_AR_KERNEL
     elif not isinstance(a_polarity_prob, bool) and not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
         if generate_mts:
-            c_polarity_prob_combined_ln_pdf_gen(&ln_P[0,0],a_polarity_prob,&mt[0,0],wmax,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            c_polarity_prob_combined_ln_pdf_gen(&ln_P[0,0],a_polarity_prob,&mt[0,0],wmax,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],location_bound_pointer,sampler)
         else:
-            c_polarity_prob_combined_ln_pdf(&ln_P[0,0],a_polarity_prob,mt,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            kernel=POLARITY_PROB_COMBINED_KERNEL
     elif not isinstance(a_polarity, bool):
         if generate_mts:
-            c_polarity_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            c_polarity_ln_pdf_gen(&ln_P[0,0],a_polarity,&mt[0,0],wmax,error_polarity,incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],location_bound_pointer,sampler)
+        elif zero_polarity_uncertainty(error_polarity,incorrect_polarity_prob,umax):
+            kernel=POLARITY_SIGN_KERNEL
         else:
-            c_polarity_ln_pdf(&ln_P[0,0],a_polarity,mt,error_polarity,incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            kernel=POLARITY_KERNEL
     elif not isinstance(a_polarity_prob, bool):
         if generate_mts:
-            c_polarity_probability_ln_pdf_gen(&ln_P[0,0],a_polarity_prob,&mt[0,0],wmax,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            c_polarity_probability_ln_pdf_gen(&ln_P[0,0],a_polarity_prob,&mt[0,0],wmax,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],location_bound_pointer,sampler)
         else:
-            c_polarity_probability_ln_pdf(&ln_P[0,0],a_polarity_prob,mt,polarity_prob[0],polarity_prob[1],incorrect_polarity_prob,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            kernel=POLARITY_PROBABILITY_KERNEL
     elif not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
         if generate_mts:
-            c_amplitude_ratio_ln_pdf_gen(&ln_P[0,0],amplitude_ratio,&mt[0,0],wmax,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            c_amplitude_ratio_ln_pdf_gen(&ln_P[0,0],amplitude_ratio,&mt[0,0],wmax,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,&n_tried,cutoff,&cut_ind,dc,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0],location_bound_pointer,sampler)
         else:
-            c_amplitude_ratio_ln_pdf(&ln_P[0,0],amplitude_ratio,mt,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,marginalised,&ln_P_loc_samples[0],&location_samples_multiplier[0])
+            kernel=AMPLITUDE_RATIO_KERNEL
+    # Tabulated amplitude ratio PDFs (the generating loops use the exact ratio PDF)
+    ratio_table=None
+    if kernel>=0 and ratio_pdf_max_error>0 and not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
+        ratio_table=ratio_pdf_table(percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,ratio_pdf_max_error)
+    if kernel>=0 and coefficient_dtype==np.float32:
+        _threaded_combined_ln_pdf[float](kernel,ln_P,mt_single,a_polarity,error_polarity,a_polarity_prob,polarity_prob,incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,marginalised,location_samples_multiplier,number_threads,block_size,ratio_table,ln_location_bound)
+    elif kernel>=0:
+        _threaded_combined_ln_pdf[DTYPE_t](kernel,ln_P,mt,a_polarity,error_polarity,a_polarity_prob,polarity_prob,incorrect_polarity_prob,amplitude_ratio,a1_amplitude_ratio,a2_amplitude_ratio,percentage_error1_amplitude_ratio,percentage_error2_amplitude_ratio,marginalised,location_samples_multiplier,number_threads,block_size,ratio_table,ln_location_bound)
     if generate_samples:
         if cut_ind<0:
             # no non_zero samples
@@ -1621,6 +2347,8 @@ def combined_ln_pdf(mt_arr,a_polarity,error_polarity,a1_amplitude_ratio,a2_ampli
             #ended prematurely
             ln_P=ln_P[:,:cut_ind]
             mt=mt[:,:cut_ind]
+        if single_precision:
+            return np.asarray(ln_P),np.asarray(mt).astype(np.float32),n_tried
         return np.asarray(ln_P),np.asarray(mt),n_tried  
     return np.asarray(ln_P)
 
@@ -1970,58 +2698,44 @@ cpdef random_mt(int x):
 cpdef random_dc(int x):
     return np.asarray(rand_dc(x))
 
+cdef DTYPE_t[:,::1] test_samples(int x,bool dc,sampler):
+    """Returns x test moment tensor samples for the generating loops, from sampler(x) if set, otherwise pseudo-random samples"""
+    if sampler is not None:
+        return np.ascontiguousarray(sampler(x),dtype=np.float64)
+    if dc:
+        return rand_dc(x)
+    return rand_mt(x)
+
 
 @cython.boundscheck(False)
 @cython.wraparound(False)
 @cython.nonecheck(False)
 @cython.cdivision(True)
-cdef DTYPE_t[::1] get_angle_coeff_multipliers(DTYPE_t[:,:,::1] a_polarity,DTYPE_t[:,:,::1] a1_amplitude_ratio,DTYPE_t[:,:,::1] a2_amplitude_ratio,DTYPE_t[:,:,::1] a_polarity_prob,DTYPE_t[::1] multipliers,DTYPE_t epsilon) nogil:
-    cdef Py_ssize_t nsamples
-    cdef Py_ssize_t nsta
-    cdef Py_ssize_t kmax
-    cdef int polarity=0
-    cdef int amplitude_ratio=0
-    cdef int polarity_prob=0
-    if a_polarity.shape[0]>0:
-        nsta=a_polarity.shape[0]
-        nsamples=a_polarity.shape[1]
-        kmax=a_polarity.shape[2]
-        pol=1
-    if a1_amplitude_ratio.shape[0]>0:
-        if pol==0:
-            nsta=a1_amplitude_ratio.shape[0]
-            nsamples=a1_amplitude_ratio.shape[1]
-            kmax=a1_amplitude_ratio.shape[2]
-        amplitude_ratio=1
-    if a_polarity_prob.shape[0]>0:
-        if pol==0:
-            if amplitude_ratio==0:
-                nsta=a_polarity_prob.shape[0]
-                nsamples=a_polarity_prob.shape[1]
-                kmax=a_polarity_prob.shape[2]
-        polarity_prob=1
+cdef DTYPE_t[::1] get_angle_coeff_multipliers(DTYPE_t[:,::1] coefficients,Py_ssize_t[::1] order,Py_ssize_t[:,::1] starts,Py_ssize_t[:,::1] ends,DTYPE_t[::1] multipliers,DTYPE_t epsilon) nogil:
+    # Only the samples in the neighbouring hash grid cells (starts to ends in order) can be within epsilon
+    cdef Py_ssize_t nsamples=coefficients.shape[0]
+    cdef Py_ssize_t ncoefficients=coefficients.shape[1]
+    cdef Py_ssize_t ncells=starts.shape[1]
     cdef Py_ssize_t u
+    cdef Py_ssize_t v
     cdef Py_ssize_t w
+    cdef Py_ssize_t c
+    cdef Py_ssize_t p
     cdef int ok=1
     for u in range(nsamples):
         if multipliers[u]==-1:
             continue
-        for v in range(u,nsamples):  
-            if multipliers[v]>-1:
-                ok=1
-                for w in range(nsta):
-                    for k in range(kmax):
-                        if pol>0:
-                            ok*=(fabs(a_polarity[w,u,k]-a_polarity[w,v,k])<epsilon)
-                        if polarity_prob>0:
-                            ok*=(fabs(a_polarity_prob[w,u,k]-a_polarity_prob[w,v,k])<epsilon)
-                        if amplitude_ratio>0:
-                            ok*=(fabs(a1_amplitude_ratio[w,u,k]-a1_amplitude_ratio[w,v,k])<epsilon)*(fabs(a2_amplitude_ratio[w,u,k]-a2_amplitude_ratio[w,v,k])<epsilon)
-                    if ok==0:
-                        break
-                if w==nsta-1 and ok>0:
-                    multipliers[u]+=multipliers[v]
-                    if v>u:
+        for c in range(ncells):
+            for p in range(starts[u,c],ends[u,c]):
+                v=order[p]
+                if v>u and multipliers[v]>-1:
+                    ok=1
+                    for w in range(ncoefficients):
+                        if fabs(coefficients[u,w]-coefficients[v,w])>=epsilon:
+                            ok=0
+                            break
+                    if ok>0:
+                        multipliers[u]+=multipliers[v]
                         multipliers[v]=-1
     return multipliers
 
@@ -2030,49 +2744,35 @@ cdef DTYPE_t[::1] get_angle_coeff_multipliers(DTYPE_t[:,:,::1] a_polarity,DTYPE_
 @cython.nonecheck(False)
 @cython.cdivision(True)
 cpdef bin_angle_coefficient_samples(a_polarity,a1_amplitude_ratio,a2_amplitude_ratio,a_polarity_prob,location_sample_multipliers,ext_data,epsilon):
-    cdef DTYPE_t[::1] multipliers=np.array(location_sample_multipliers)
-    new_records=[]
+    from MTfit.extensions.scatangle import grid_bin_cells
+    cdef DTYPE_t[::1] multipliers=np.array(location_sample_multipliers,dtype=np.float64).flatten()
+    cdef Py_ssize_t nsamples=multipliers.shape[0]
     new_multipliers=[]
-    polarity=False
-    amplitude_ratio=False
-    polarity_prob=False
+    coefficients=[]
+    for a in [a_polarity,a1_amplitude_ratio,a2_amplitude_ratio,a_polarity_prob]:
+        if not isinstance(a, bool):
+            coefficients.append(np.transpose(a,(1,0,2)).reshape(nsamples,-1))
+    if not len(coefficients):
+        return a_polarity,a1_amplitude_ratio,a2_amplitude_ratio,a_polarity_prob,ext_data,list(location_sample_multipliers)
+    coefficients=np.ascontiguousarray(np.hstack(coefficients),dtype=np.float64)
+    order,starts,ends=grid_bin_cells(coefficients,epsilon)
+    multipliers=get_angle_coeff_multipliers(coefficients,order,starts,ends,multipliers,epsilon)
+    binned=np.asarray(multipliers)>-1
+    cdef Py_ssize_t i
+    for i in range(nsamples):
+        if binned[i]:
+            new_multipliers.append(multipliers[i])
     if not isinstance(a_polarity, bool):
-        polarity=True
-    else:
-        a_polarity=np.empty((0,0,0))
+        a_polarity=np.ascontiguousarray(a_polarity[:,binned,:])
     if not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
-        amplitude_ratio=True
-    else:
-        a1_amplitude_ratio=np.empty((0,0,0))
-        a2_amplitude_ratio=np.empty((0,0,0))
+        a1_amplitude_ratio=np.ascontiguousarray(a1_amplitude_ratio[:,binned,:])
+        a2_amplitude_ratio=np.ascontiguousarray(a2_amplitude_ratio[:,binned,:])
     if not isinstance(a_polarity_prob, bool):
-        polarity_prob=True
-    else:
-        a_polarity_prob=np.empty((0,0,0))
-    # print multipliers,bin_size,angles
-    multipliers=np.asarray(get_angle_coeff_multipliers(a_polarity,a1_amplitude_ratio,a2_amplitude_ratio,a_polarity_prob,np.array(location_sample_multipliers,dtype=np.longlong),epsilon)).flatten()
-    cdef Py_ssize_t i
-    for i,record in enumerate(multipliers):
-        if multipliers[i]>0:
-            new_multipliers.append(multipliers[i])
-    if polarity:
-        a_polarity=np.ascontiguousarray(a_polarity[:,np.asarray(multipliers)>0,:])
-    else:
-        a_polarity=False
-    if amplitude_ratio:
-        a1_amplitude_ratio=np.ascontiguousarray(a1_amplitude_ratio[:,np.asarray(multipliers)>0,:])
-        a2_amplitude_ratio=np.ascontiguousarray(a2_amplitude_ratio[:,np.asarray(multipliers)>0,:])
-    else:
-        a1_amplitude_ratio=False
-        a2_amplitude_ratio=False
-    if  polarity_prob:
-        a_polarity_prob=np.ascontiguousarray(a_polarity_prob[:,np.asarray(multipliers)>0,:])
-    else:
-        a_polarity_prob=False
+        a_polarity_prob=np.ascontiguousarray(a_polarity_prob[:,binned,:])
     for key in ext_data.keys():
         for k in ext_data[key].keys():
             if k[:2]=='a_' or k[0]=='a' and k[2]=='_':
-                ext_data[key][k]=np.ascontiguousarray(ext_data[key][k][:,np.asarray(multipliers)>0,:])
+                ext_data[key][k]=np.ascontiguousarray(ext_data[key][k][:,binned,:])
     return a_polarity,a1_amplitude_ratio,a2_amplitude_ratio,a_polarity_prob,ext_data,new_multipliers
 
 @cython.boundscheck(False)
@@ -2142,6 +2842,204 @@ class cProbabilityTestCase(unittest.TestCase):
         py_p = ratio_pdf(0.4, 0.2, 0.5, 0.4*0.2, 0.5*0.5)
         self.assertAlmostEqual(c_p, py_p, 1)
 
+    def test_combined_ln_pdf_number_threads(self):
+        np.random.seed(0)
+        a=np.random.randn(5,3,6)
+        a1=np.random.randn(5,3,6)
+        a2=np.random.randn(5,3,6)
+        mt=np.random.randn(6,101)
+        mt/=np.sqrt((mt*mt).sum(0))
+        error=0.3*np.ones(5)
+        z=np.abs(np.random.randn(5))
+        pe=0.2*np.ones(5)
+        for marginalised in [0,1]:
+            for args in [(a,error,False,False,False,False,False,False,False),(a,error,a1,a2,z,pe,pe,False,False),(False,False,a1,a2,z,pe,pe,False,False)]:
+                ln_p=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3))
+                ln_p_threaded=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3),number_threads=3)
+                self.assertEqual(ln_p.shape,ln_p_threaded.shape)
+                self.assertTrue(np.array_equal(ln_p,ln_p_threaded))
+
+    def test_combined_ln_pdf_block_size(self):
+        np.random.seed(0)
+        a=np.random.randn(5,3,6)
+        a1=np.random.randn(5,3,6)
+        a2=np.random.randn(5,3,6)
+        mt=np.random.randn(6,101)
+        mt/=np.sqrt((mt*mt).sum(0))
+        error=0.3*np.ones(5)
+        z=np.abs(np.random.randn(5))
+        pe=0.2*np.ones(5)
+        polarity_prob=[np.random.rand(5),np.random.rand(5)]
+        for marginalised in [0,1]:
+            for args in [(a,error,False,False,False,False,False,False,False),(a,error,a1,a2,z,pe,pe,a,polarity_prob),(False,False,a1,a2,z,pe,pe,False,False),(False,False,False,False,False,False,False,a,polarity_prob)]:
+                ln_p=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3))
+                for block_size,number_threads in [(16,1),(1000,1),(None,1),(7,3)]:
+                    ln_p_blocked=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3),block_size=block_size,number_threads=number_threads)
+                    self.assertEqual(ln_p.shape,ln_p_blocked.shape)
+                    self.assertTrue(np.array_equal(np.isinf(ln_p),np.isinf(ln_p_blocked)))
+                    self.assertTrue(np.allclose(ln_p[np.isfinite(ln_p)],ln_p_blocked[np.isfinite(ln_p)],rtol=1e-10,atol=1e-10))
+
+    def test_combined_ln_pdf_single_precision(self):
+        np.random.seed(0)
+        a=np.random.randn(5,3,6)
+        a1=np.random.randn(5,3,6)
+        a2=np.random.randn(5,3,6)
+        mt=np.random.randn(6,101)
+        mt/=np.sqrt((mt*mt).sum(0))
+        error=0.3*np.ones(5)
+        z=np.abs(np.random.randn(5))
+        pe=0.2*np.ones(5)
+        polarity_prob=[np.random.rand(5),np.random.rand(5)]
+        for marginalised in [0,1]:
+            for args in [(a,error,False,False,False,False,False,False,False),(a,error,a1,a2,z,pe,pe,a,polarity_prob),(False,False,a1,a2,z,pe,pe,False,False)]:
+                ln_p=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3))
+                for block_size in [0,None]:
+                    ln_p_single=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3),block_size=block_size,single_precision=True)
+                    self.assertEqual(ln_p.shape,ln_p_single.shape)
+                    self.assertTrue(np.array_equal(np.isinf(ln_p),np.isinf(ln_p_single)))
+                    finite=np.isfinite(ln_p)
+                    self.assertTrue((np.abs(ln_p[finite]-ln_p_single[finite])<=1e-3*(1+np.abs(ln_p[finite]))).all())
+        ln_p,mts,n_tried=combined_ln_pdf(mt,a,error,False,False,False,False,False,False,False,generate_samples=20,location_samples_multipliers=np.zeros(3),single_precision=True)
+        self.assertEqual(mts.dtype,np.float32)
+        self.assertEqual(mts.shape[0],6)
+
+    def test_combined_ln_pdf_sampler(self):
+        from MTfit.algorithms.base import QuasiRandomSampler
+        np.random.seed(0)
+        a=np.random.randn(5,3,6)
+        error=0.3*np.ones(5)
+        for dc in [False,True]:
+            ln_p,mts,n_tried=combined_ln_pdf(np.empty((6,20)),a,error,False,False,False,False,False,False,False,generate_samples=20,dc=dc,location_samples_multipliers=np.zeros(3),marginalised=1,sampler=QuasiRandomSampler(dc,3))
+            # Non-zero uncertainty so all the samples are kept
+            self.assertEqual(mts.shape,(6,20))
+            self.assertTrue(np.allclose(mts,QuasiRandomSampler(dc,3)(20)))
+
+    def test_bin_angle_coefficient_samples(self):
+        from MTfit.extensions.scatangle import grid_bin_samples
+        np.random.seed(0)
+        a=np.random.randn(4,20,6)
+        # Duplicate samples
+        a[:,10:,:]=a[:,:10,:]+0.01
+        a1=np.random.randn(4,20,6)
+        a1[:,10:,:]=a1[:,:10,:]
+        multipliers=np.random.rand(20).tolist()
+        ext_data={'test':{'a_test':np.random.randn(2,20,6)}}
+        a_polarity,a1_amplitude_ratio,a2_amplitude_ratio,a_polarity_prob,ext_data,new_multipliers=bin_angle_coefficient_samples(a,a1,a1.copy(),False,multipliers,ext_data,0.1)
+        indices,grid_multipliers=grid_bin_samples(np.hstack([np.transpose(a,(1,0,2)).reshape(20,-1),np.transpose(a1,(1,0,2)).reshape(20,-1),np.transpose(a1,(1,0,2)).reshape(20,-1)]),multipliers,0.1)
+        self.assertEqual(len(new_multipliers),len(indices))
+        self.assertEqual(len(new_multipliers),10)
+        self.assertAlmostEqual(sum(new_multipliers),sum(multipliers))
+        self.assertEqual(new_multipliers,grid_multipliers.tolist())
+        self.assertTrue(np.array_equal(a_polarity,a[:,indices,:]))
+        self.assertTrue(np.array_equal(a1_amplitude_ratio,a1[:,indices,:]))
+        self.assertFalse(a_polarity_prob)
+        self.assertEqual(ext_data['test']['a_test'].shape,(2,len(indices),6))
+
+    def test_ratio_pdf_table(self):
+        from MTfit.probability.probability import ratio_pdf
+        np.random.seed(0)
+        psx=np.array([0.1,0.01,0.5,0.3])
+        psy=np.array([0.1,0.02,0.8,0.05])
+        table=ratio_pdf_table(psx,psy,1e-6)
+        self.assertTrue(table.tabulated.all())
+        self.assertTrue(ratio_pdf_table(psx,psy,1e-6) is table)
+        self.assertTrue(ratio_pdf_table(psx,psy,1e-3).nodes<=table.nodes)
+        self.assertRaises(ValueError,ratio_pdf_table,psx,psy,0)
+        for i in range(20):
+            z=np.abs(np.random.randn(4))*3
+            mux=np.random.randn(4)
+            muy=np.random.randn(4)
+            ln_p=np.log(ratio_pdf(z,mux,muy,psx*np.abs(mux),psy*np.abs(muy))+ratio_pdf(-z,mux,muy,psx*np.abs(mux),psy*np.abs(muy)))
+            ln_p_table=table.ln_pdf(z,mux,muy,psx,psy)
+            self.assertTrue(np.array_equal(np.isfinite(ln_p),np.isfinite(ln_p_table)))
+            self.assertTrue((np.abs(ln_p-ln_p_table)[np.isfinite(ln_p)]<1e-6).all())
+        # Zero amplitudes and ratios outside the table use the exact PDF
+        z=np.array([1.,1.,1e-10,1.])
+        mux=np.array([0.,1.,1.,1.])
+        muy=np.array([1.,0.,1.,1.])
+        ln_p_table=table.ln_pdf(z,mux,muy,psx,psy)
+        for u in range(3):
+            ln_p=np.log(ar_pdf(z[u],mux[u],muy[u],psx[u],psy[u]))
+            self.assertTrue(ln_p_table[u]==ln_p or (np.isnan(ln_p_table[u]) and np.isnan(ln_p)))
+
+    def test_combined_ln_pdf_ratio_pdf_max_error(self):
+        np.random.seed(0)
+        a=np.random.randn(5,3,6)
+        a1=np.random.randn(5,3,6)
+        a2=np.random.randn(5,3,6)
+        mt=np.random.randn(6,101)
+        mt/=np.sqrt((mt*mt).sum(0))
+        error=0.3*np.ones(5)
+        z=np.abs(np.random.randn(5))
+        pe=0.2*np.ones(5)
+        polarity_prob=[np.random.rand(5),np.random.rand(5)]
+        for marginalised in [0,1]:
+            for args in [(a,error,a1,a2,z,pe,pe,a,polarity_prob),(a,error,a1,a2,z,pe,pe,False,False),(False,False,a1,a2,z,pe,pe,a,polarity_prob),(False,False,a1,a2,z,pe,pe,False,False)]:
+                ln_p=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3))
+                for block_size in [0,16]:
+                    ln_p_table=combined_ln_pdf(mt,*args,marginalised=marginalised,location_samples_multipliers=np.zeros(3),block_size=block_size,ratio_pdf_max_error=1e-5)
+                    self.assertTrue(np.array_equal(np.isinf(ln_p),np.isinf(ln_p_table)))
+                    # Errors of up to 1e-5 for each of the 5 stations
+                    self.assertTrue((np.abs(ln_p-ln_p_table)[np.isfinite(ln_p)]<5e-5).all())
+
+    def test_combined_ln_pdf_location_tolerance(self):
+        np.random.seed(0)
+        a=np.random.randn(5,40,6)
+        a1=np.random.randn(5,40,6)
+        a2=np.random.randn(5,40,6)
+        mt=np.random.randn(6,101)
+        mt/=np.sqrt((mt*mt).sum(0))
+        error=0.3*np.ones(5)
+        z=np.abs(np.random.randn(5))
+        pe=0.2*np.ones(5)
+        polarity_prob=[np.random.rand(5),np.random.rand(5)]
+        multipliers=np.sort(-np.random.rand(40)*20)[::-1].copy()
+        for args in [(a,error,a1,a2,z,pe,pe,a,polarity_prob),(a,error,False,False,z,pe,pe,False,False),(a,np.zeros(5),False,False,z,pe,pe,False,False),(False,False,a1,a2,z,pe,pe,False,False)]:
+            ln_p=np.asarray(combined_ln_pdf(mt,*args,marginalised=1,location_samples_multipliers=multipliers))
+            for tolerance in [1e-2,1e-12]:
+                ln_p_bounded=np.asarray(combined_ln_pdf(mt,*args,marginalised=1,location_samples_multipliers=multipliers,location_tolerance=tolerance))
+                self.assertTrue(np.array_equal(np.isinf(ln_p),np.isinf(ln_p_bounded)))
+                # The bounded marginalisation underestimates the PDF by less than the tolerance
+                difference=(ln_p-ln_p_bounded)[np.isfinite(ln_p)]
+                self.assertTrue((difference>-1e-12).all())
+                self.assertTrue((difference<-np.log(1-tolerance)+1e-12).all())
+
+    def test_polarity_sign_ln_pdf(self):
+        np.random.seed(0)
+        a=np.random.randn(5,3,6)
+        mt=np.random.randn(6,201)
+        mt/=np.sqrt((mt*mt).sum(0))
+        # Make some samples pass all the stations for the first location sample
+        mt[:,:50]*=np.sign(np.tensordot(a[:,0,:],mt[:,:50],1)).min(0)
+        a[:,0,:]*=np.sign(np.tensordot(a[:,0,:],mt[:,:50],1)).min(1).reshape(5,1)
+        multipliers=np.log(np.array([0.2,0.3,0.5]))
+        tiny_error=np.zeros(5)
+        tiny_error[0]=1e-300
+        self.assertTrue(zero_polarity_uncertainty(np.zeros(5),np.array([0.]),5))
+        self.assertFalse(zero_polarity_uncertainty(tiny_error,np.array([0.]),5))
+        self.assertFalse(zero_polarity_uncertainty(np.zeros(5),0.1*np.ones(5),5))
+        for marginalised in [0,1]:
+            # tiny_error uses the station loop with the same (zero uncertainty) probabilities
+            ln_p=combined_ln_pdf(mt,a,tiny_error,False,False,False,False,False,False,False,marginalised=marginalised,location_samples_multipliers=multipliers)
+            self.assertTrue(np.isfinite(ln_p).any())
+            for number_threads in [1,3]:
+                ln_p_sign=combined_ln_pdf(mt,a,np.zeros(5),False,False,False,False,False,False,False,marginalised=marginalised,location_samples_multipliers=multipliers,number_threads=number_threads)
+                self.assertTrue(np.array_equal(ln_p,ln_p_sign))
+            ln_p_sign=polarity_ln_pdf(a,mt,np.zeros(5),marginalised=marginalised,location_samples_multipliers=multipliers)
+            self.assertTrue(np.array_equal(ln_p,ln_p_sign))
+        # Zero amplitudes use the station loop for the block
+        mt[:,70]=0
+        ln_p=combined_ln_pdf(mt,a,tiny_error,False,False,False,False,False,False,False,location_samples_multipliers=multipliers)
+        ln_p_sign=combined_ln_pdf(mt,a,np.zeros(5),False,False,False,False,False,False,False,location_samples_multipliers=multipliers)
+        self.assertTrue(np.array_equal(ln_p[:,:64],ln_p_sign[:,:64]))
+        self.assertTrue(np.array_equal(ln_p[:,128:],ln_p_sign[:,128:]))
+
+    def test_default_block_size(self):
+        self.assertEqual(default_block_size(10),0)
+        self.assertEqual(default_block_size(256),256)
+        self.assertEqual(default_block_size(1000),65)
+        self.assertEqual(default_block_size(100000),16)
+
     def test_dkl(self):
         x=np.linspace(0,10,100)
         from scipy.stats import norm as normalDist
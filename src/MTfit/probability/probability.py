@@ -18,15 +18,11 @@ additional pdf specific operations.
 
 
 import warnings
-import gc
 import sys
 import operator
 import logging
 
 import numpy as np
-from scipy.stats import norm as gaussian
-from scipy.stats import beta
-from scipy.special import erf
 
 from ..utilities import C_EXTENSION_FALLBACK_LOG_MSG
 
@@ -53,6 +49,13 @@ _C_LIB_TESTS = False
 # Value of a very small non-zero number for handling zero error values
 _SMALL_NUMBER = 0.000000000000000000000001
 
+# Maximum number of theoretical amplitudes in each block of the NumPy combined_ln_pdf (the temporary arrays are a few
+# times this size)
+_COMBINED_BLOCK_ELEMENTS = 1048576
+
+# Maximum number of location samples in each block of the NumPy combined_ln_pdf for the bounded location marginalisation
+_BOUNDED_LOCATION_BLOCK = 32
+
 # TODO - tidy and refactor code to avoid duplication
 
 
@@ -159,6 +162,7 @@ def polarity_ln_pdf(a, mt, sigma, incorrect_polarity_probability=0.0, _use_c=Non
                 incorrect_polarity_probability = np.expand_dims(
                     incorrect_polarity_probability, 1)
         # Calculate probability
+        from scipy.special import erf
         ln_p = np.log((0.5 * (1 + erf(X / (np.sqrt(2) * sigma)))) *
                       (1 - incorrect_polarity_probability) +
                       (0.5 * (1 + erf(-X / (np.sqrt(2) * sigma)))) *
@@ -525,6 +529,286 @@ def relative_amplitude_ratio_ln_pdf(x_1, x_2, mt_1, mt_2, a_1, a_2, percentage_e
     return ln_p, scale, scale_uncertainty
 
 
+def _polarity_block_ln_pdf(x, sigma, incorrect_polarity_probability):
+    """Polarity ln PDFs summed over the stations for theoretical amplitudes x (stations x location samples x samples)"""
+    from scipy.special import erf
+    ln_p = np.log(0.5*((1-incorrect_polarity_probability)*(1+erf(x/(np.sqrt(2)*sigma))) +
+                       incorrect_polarity_probability*(1+erf(-x/(np.sqrt(2)*sigma)))))
+    return ln_p.sum(0)
+
+
+def _polarity_probability_block_ln_pdf(x, positive_probability, negative_probability, incorrect_polarity_probability):
+    """Polarity probability ln PDFs summed over the stations for theoretical amplitudes x (stations x location samples x samples)"""
+    p = np.where(x > 0, (1-incorrect_polarity_probability)*positive_probability+incorrect_polarity_probability*negative_probability,
+                 (1-incorrect_polarity_probability)*negative_probability+incorrect_polarity_probability*positive_probability)
+    p[x == 0] = 0.5
+    return np.log(p).sum(0)
+
+
+def _amplitude_ratio_block_ln_pdf(mu_x, mu_y, ratio, percentage_error_x, percentage_error_y):
+    """Amplitude ratio ln PDFs summed over the stations for theoretical amplitudes mu_x and mu_y (stations x location samples x samples)"""
+    mu_x = np.abs(mu_x)
+    mu_y = np.abs(mu_y)
+    numerator_error = percentage_error_x*mu_x
+    denominator_error = percentage_error_y*mu_y
+    ln_p = np.log(ratio_pdf(ratio, mu_x, mu_y, numerator_error, denominator_error) +
+                  ratio_pdf(-ratio, mu_x, mu_y, numerator_error, denominator_error))
+    return ln_p.sum(0)
+
+
+def _ln_sum_exp(ln_p):
+    """ln of the sum of exp(ln_p) over the first axis, scaled by the maximum (as the Cython marginalisation)"""
+    ln_max = ln_p.max(0)
+    finite = ln_max > -np.inf
+    result = -np.inf*np.ones(ln_max.shape)
+    result[finite] = np.log(np.exp(ln_p[:, finite]-ln_max[finite]).sum(0))+ln_max[finite]
+    return result
+
+
+def ratio_pdf_bound(percentage_error_x, percentage_error_y, ln_ratio_range=12., margin=1e-3):
+    """
+    Upper bound on the amplitude ratio PDF times the observed ratio
+
+    The PDF of the absolute ratio |X/Y| of two Gaussian amplitudes with percentage errors only depends on the ratio of
+    the means, r=|mu_x/mu_y|, as p(z)=g(z/r)/r, where g is the ratio PDF for unit means. So z*p(z)=t*g(t) with t=z/r, and
+    the maximum of t*g(t) bounds z*p(z) for all the moment tensor and location samples. The maximum is found on a grid
+    in ln t, which is refined around the largest value, and increased by the margin.
+
+    Args
+        percentage_error_x: np.array - numerator percentage errors.
+        percentage_error_y: np.array - denominator percentage errors.
+
+    Optional Args
+        ln_ratio_range: float (default=12.) - range of ln t for the grid.
+        margin: float (default=1e-3) - fractional margin added to the maximum.
+
+    Returns
+        np.array - upper bound on z times the ratio PDF for each station (inf if either percentage error is not positive).
+    """
+    percentage_error_x = np.abs(np.array(percentage_error_x, dtype=np.float64).flatten())
+    percentage_error_y = np.abs(np.array(percentage_error_y, dtype=np.float64).flatten())
+    bound = np.inf*np.ones(percentage_error_x.shape)
+    valid = (percentage_error_x > 0) & (percentage_error_y > 0)
+    if not valid.any():
+        return bound
+    psx = percentage_error_x[valid][:, np.newaxis]
+    psy = percentage_error_y[valid][:, np.newaxis]
+
+    def scaled_pdf(ln_t):
+        t = np.exp(ln_t)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+            p = t*(ratio_pdf(t, 1., 1., psx, psy)+ratio_pdf(-t, 1., 1., psx, psy))
+        p[~np.isfinite(p)] = 0
+        return p
+
+    # Coarse grid over the range and a fine grid around t=1 for small percentage errors
+    width = np.minimum(np.sqrt(psx*psx+psy*psy), 1.)
+    ln_t = np.append(np.linspace(-ln_ratio_range, ln_ratio_range, 2401)*np.ones(psx.shape),
+                     np.linspace(-20., 20., 801)*width, 1)
+    ln_t.sort(1)
+    for i in range(3):
+        p = scaled_pdf(ln_t)
+        index = p.argmax(1)
+        lower = ln_t[np.arange(ln_t.shape[0]), np.maximum(index-1, 0)][:, np.newaxis]
+        upper = ln_t[np.arange(ln_t.shape[0]), np.minimum(index+1, ln_t.shape[1]-1)][:, np.newaxis]
+        ln_t = lower+(upper-lower)*np.linspace(0, 1, 101)
+    bound[valid] = np.maximum(p.max(1), scaled_pdf(ln_t).max(1))*(1+margin)
+    return bound
+
+
+def ln_likelihood_upper_bound(polarity_prob=False, amplitude_ratio=False, percentage_error1_amplitude_ratio=False,
+                              percentage_error2_amplitude_ratio=False, ratio_pdf_max_error=0):
+    """
+    Upper bound on the combined ln PDF for any moment tensor and location sample
+
+    The polarity PDFs are at most 1, the polarity probability PDFs are at most the larger of the positive and negative
+    probabilities (or 0.5 for a zero amplitude), and the amplitude ratio PDFs are bounded using ratio_pdf_bound. The
+    data arrays should only contain the stations used (unused data types are False, as for combined_ln_pdf).
+
+    Optional Args
+        polarity_prob: list (default=False) - positive and negative polarity probability arrays.
+        amplitude_ratio: np.array (default=False) - observed amplitude ratios.
+        percentage_error1_amplitude_ratio: np.array (default=False) - amplitude ratio numerator percentage errors.
+        percentage_error2_amplitude_ratio: np.array (default=False) - amplitude ratio denominator percentage errors.
+        ratio_pdf_max_error: float (default=0) - maximum error in the tabulated ln ratio PDFs.
+
+    Returns
+        float - upper bound on the ln PDF.
+    """
+    ln_bound = 0.
+    if not isinstance(polarity_prob, bool):
+        max_probability = np.maximum(np.maximum(np.asarray(polarity_prob[0], dtype=np.float64).flatten(),
+                                                np.asarray(polarity_prob[1], dtype=np.float64).flatten()), 0.5)
+        ln_bound += np.log(max_probability).sum()
+    if not isinstance(amplitude_ratio, bool):
+        ratio = np.abs(np.asarray(amplitude_ratio, dtype=np.float64).flatten())
+        with np.errstate(divide='ignore'):
+            ln_bound += (np.log(ratio_pdf_bound(percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio)) -
+                         np.log(ratio)).sum()
+        ln_bound += ratio_pdf_max_error*ratio.shape[0]
+    return ln_bound
+
+
+def ln_location_bounds(location_samples_multipliers, tolerance, ln_likelihood_bound):
+    """
+    ln bounds on the remaining location samples for the bounded location marginalisation
+
+    Element v is the ln of the sum of the multipliers of location samples v onwards, times the likelihood bound and
+    divided by the tolerance, so that, once the marginalised PDF up to location sample v-1 exceeds element v, the
+    remaining location samples can change it by less than the tolerance (as a fraction). The last element is -inf.
+
+    Args
+        location_samples_multipliers: np.array - ln location sample multipliers.
+        tolerance: float - maximum fractional error in the marginalised PDF.
+        ln_likelihood_bound: float - upper bound on the ln PDF (e.g. from ln_likelihood_upper_bound).
+
+    Returns
+        np.array - ln bounds (number of location samples + 1).
+    """
+    if tolerance <= 0:
+        raise ValueError('Location tolerance must be positive: '+str(tolerance))
+    location_samples_multipliers = np.asarray(location_samples_multipliers, dtype=np.float64).flatten()
+    with np.errstate(invalid='ignore'):
+        tail = np.logaddexp.accumulate(location_samples_multipliers[::-1])[::-1]+ln_likelihood_bound-np.log(tolerance)
+    tail[np.isnan(tail)] = np.inf
+    return np.append(tail, -np.inf)
+
+
+def combined_ln_pdf(mt, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                    percentage_error1_amplitude_ratio, percentage_error2_amplitude_ratio, a_polarity_prob, polarity_prob,
+                    incorrect_polarity_prob=0, generate_samples=0, cutoff=1000000000, dc=False, marginalised=False,
+                    location_samples_multipliers=np.array([0.]), number_threads=1, block_size=0, single_precision=False,
+                    ratio_pdf_max_error=0, location_tolerance=0, block_elements=_COMBINED_BLOCK_ELEMENTS):
+    """
+    Calculate the combined ln PDF for the polarity, polarity probability and amplitude ratio data using NumPy
+
+    Memory bounded NumPy version of cprobability.combined_ln_pdf, with the same arguments and results, for use when
+    the C extensions are not built. The python PDFs (e.g. polarity_ln_pdf) calculate the theoretical amplitudes for all
+    the stations, location samples and moment tensor samples at once, whereas this evaluates them in blocks of moment
+    tensor samples and location samples, with at most block_elements amplitudes in each block. The data types are
+    evaluated in turn (polarities, polarity probabilities, then amplitude ratios), skipping the samples that already
+    have zero probability. If marginalised, the location samples are marginalised using a running log-sum-exp over the
+    location sample blocks, so that only the marginalised result is stored. If location_tolerance is set, the
+    marginalisation for each moment tensor sample stops once the remaining location samples cannot change the result by
+    more than the tolerance (see ln_location_bounds).
+
+    Unused data types are set to False, as for cprobability.combined_ln_pdf.
+
+    Args
+        mt: np.array - 2 dimensional numpy array of moment tensor 6 vector samples.
+        a_polarity: np.array - polarity station coefficients (stations x location samples x 6).
+        error_polarity: np.array - polarity fractional uncertainties.
+        a1_amplitude_ratio: np.array - amplitude ratio numerator station coefficients.
+        a2_amplitude_ratio: np.array - amplitude ratio denominator station coefficients.
+        amplitude_ratio: np.array - observed amplitude ratios.
+        percentage_error1_amplitude_ratio: np.array - amplitude ratio numerator percentage errors.
+        percentage_error2_amplitude_ratio: np.array - amplitude ratio denominator percentage errors.
+        a_polarity_prob: np.array - polarity probability station coefficients.
+        polarity_prob: list - positive and negative polarity probability arrays.
+
+    Optional Args
+        incorrect_polarity_prob: float or np.array (default=0) - probability of a receiver orientation error.
+        generate_samples: int (default=0) - not supported, generating samples requires the C extension.
+        cutoff: int (default=1000000000) - unused (sample generation).
+        dc: bool (default=False) - unused (sample generation).
+        marginalised: bool (default=False) - marginalise over the location samples.
+        location_samples_multipliers: np.array (default=np.array([0.])) - ln location sample multipliers (ignored
+                if the length is not the number of location samples).
+        number_threads: int (default=1) - unused (the BLAS library used by NumPy may be threaded).
+        block_size: int (default=0) - number of moment tensor samples in each block (0 uses block_elements).
+        single_precision: bool (default=False) - calculate the theoretical amplitudes in single precision.
+        ratio_pdf_max_error: float (default=0) - unused, the exact ratio PDF is used.
+        location_tolerance: float (default=0) - maximum fractional error in the marginalised PDF from stopping the
+                location marginalisation early (0 evaluates all the location samples).
+        block_elements: int (default=_COMBINED_BLOCK_ELEMENTS) - maximum number of theoretical amplitudes in each block.
+
+    Returns
+        np.array - ln PDF (location samples x moment tensor samples, or 1 x moment tensor samples if marginalised).
+    """
+    if generate_samples:
+        raise NotImplementedError('Generating samples in combined_ln_pdf requires the C extension')
+    dtype = np.float32 if single_precision else np.float64
+    mt = np.asarray(mt).astype(dtype, copy=False)
+    incorrect_polarity_prob = np.asarray(incorrect_polarity_prob, dtype=np.float64).flatten()
+    # Data types as (PDF function, station coefficient arrays, data arrays broadcast over the amplitudes)
+    data = []
+    bound_data = {}
+    if not isinstance(a_polarity, bool):
+        a_polarity = np.asarray(a_polarity).astype(dtype, copy=False)
+        sigma = np.array(error_polarity, dtype=np.float64).flatten()[:a_polarity.shape[0]]
+        sigma[sigma == 0] = _SMALL_NUMBER
+        incorrect = incorrect_polarity_prob if incorrect_polarity_prob.shape[0] == 1 else incorrect_polarity_prob[:a_polarity.shape[0]]
+        data.append((_polarity_block_ln_pdf, [a_polarity], [sigma, incorrect]))
+    if not isinstance(a_polarity_prob, bool):
+        a_polarity_prob = np.asarray(a_polarity_prob).astype(dtype, copy=False)
+        positive_probability = np.asarray(polarity_prob[0], dtype=np.float64).flatten()[:a_polarity_prob.shape[0]]
+        negative_probability = np.asarray(polarity_prob[1], dtype=np.float64).flatten()[:a_polarity_prob.shape[0]]
+        incorrect = incorrect_polarity_prob if incorrect_polarity_prob.shape[0] == 1 else incorrect_polarity_prob[:a_polarity_prob.shape[0]]
+        bound_data['polarity_prob'] = [positive_probability, negative_probability]
+        data.append((_polarity_probability_block_ln_pdf, [a_polarity_prob], [positive_probability, negative_probability, incorrect]))
+    if not isinstance(a1_amplitude_ratio, bool) and not isinstance(a2_amplitude_ratio, bool):
+        a1_amplitude_ratio = np.asarray(a1_amplitude_ratio).astype(dtype, copy=False)
+        a2_amplitude_ratio = np.asarray(a2_amplitude_ratio).astype(dtype, copy=False)
+        number_stations = a1_amplitude_ratio.shape[0]
+        ratio = np.asarray(amplitude_ratio, dtype=np.float64).flatten()[:number_stations]
+        percentage_error_x = np.abs(np.array(percentage_error1_amplitude_ratio, dtype=np.float64).flatten()[:number_stations])
+        percentage_error_y = np.abs(np.array(percentage_error2_amplitude_ratio, dtype=np.float64).flatten()[:number_stations])
+        percentage_error_x[percentage_error_x == 0] = _SMALL_NUMBER
+        percentage_error_y[percentage_error_y == 0] = _SMALL_NUMBER
+        bound_data.update({'amplitude_ratio': ratio, 'percentage_error1_amplitude_ratio': percentage_error_x,
+                           'percentage_error2_amplitude_ratio': percentage_error_y})
+        data.append((_amplitude_ratio_block_ln_pdf, [a1_amplitude_ratio, a2_amplitude_ratio], [ratio, percentage_error_x, percentage_error_y]))
+    if not len(data):
+        raise ValueError('No data for combined_ln_pdf')
+    number_samples = mt.shape[1]
+    number_location_samples = data[0][1][0].shape[1]
+    location_samples_multipliers = np.asarray(location_samples_multipliers, dtype=np.float64).flatten()
+    if location_samples_multipliers.shape[0] != number_location_samples:
+        location_samples_multipliers = np.zeros(number_location_samples)
+    # Block sizes
+    rows = max(sum(coefficient.shape[0] for pdf, coefficients, parameters in data for coefficient in coefficients), 1)
+    location_block = max(min(number_location_samples, block_elements//rows), 1)
+    ln_location_bound = None
+    if marginalised and location_tolerance > 0:
+        ln_location_bound = ln_location_bounds(location_samples_multipliers, location_tolerance,
+                                               ln_likelihood_upper_bound(**bound_data))
+        # Smaller location blocks so that the marginalisation can stop early
+        location_block = min(location_block, _BOUNDED_LOCATION_BLOCK)
+    sample_block = block_size if block_size and block_size > 0 else max(block_elements//(rows*location_block), 1)
+    if marginalised:
+        ln_p = -np.inf*np.ones((1, number_samples))
+    else:
+        ln_p = np.empty((number_location_samples, number_samples))
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore', under='ignore'):
+        for w0 in range(0, number_samples, sample_block):
+            mt_block = mt[:, w0:w0+sample_block]
+            # Samples still being marginalised
+            active = np.arange(mt_block.shape[1])
+            for v0 in range(0, number_location_samples, location_block):
+                if not len(active):
+                    break
+                v1 = min(v0+location_block, number_location_samples)
+                ln_p_block = np.zeros((v1-v0, active.shape[0]))+location_samples_multipliers[v0:v1, np.newaxis]
+                non_zero = np.arange(active.shape[0])
+                for pdf, coefficients, parameters in data:
+                    if not len(non_zero):
+                        break
+                    amplitudes = [np.tensordot(coefficient[:, v0:v1, :], mt_block[:, active[non_zero]], 1).astype(np.float64, copy=False) for coefficient in coefficients]
+                    ln_p_data = pdf(*(amplitudes+[parameter.reshape(-1, 1, 1) for parameter in parameters]))
+                    ln_p_data[np.isnan(ln_p_data)] = -np.inf
+                    ln_p_block[:, non_zero] += ln_p_data
+                    non_zero = non_zero[(ln_p_block[:, non_zero] > -np.inf).any(0)]
+                ln_p_block[np.isnan(ln_p_block)] = -np.inf
+                if marginalised:
+                    ln_p[0, w0+active] = np.logaddexp(ln_p[0, w0+active], _ln_sum_exp(ln_p_block))
+                    if ln_location_bound is not None:
+                        # Stop when the remaining location samples cannot change the sum by more than the tolerance
+                        active = active[ln_p[0, w0+active] <= ln_location_bound[v1]]
+                else:
+                    ln_p[v0:v1, w0:w0+mt_block.shape[1]] = ln_p_block
+    return ln_p
+
+
 def scale_estimator(observed_ratio, mu_x, mu_y, percentage_error_x, percentage_error_y):
     """
     Estimate the scale factor between the two events given the observed_ratio
@@ -651,6 +935,7 @@ def gaussian_pdf(x, mu, sigma):
             np.array([np.kron(mu, np.ones(x.shape[1])).T]).T, np.ones(x.shape[2]))
         sigma = np.kron(
             np.array([np.kron(sigma, np.ones(x.shape[1])).T]).T, np.ones(x.shape[2]))
+    from scipy.stats import norm as gaussian
     return gaussian.pdf(x, loc=mu, scale=sigma)
 
 
@@ -677,6 +962,7 @@ def gaussian_cdf(x, mu, sigma):
         sigma[sigma == 0] = _SMALL_NUMBER
     elif sigma == 0:
         sigma = _SMALL_NUMBER
+    from scipy.stats import norm as gaussian
     return gaussian.cdf(x, loc=mu, scale=sigma)
 
 
@@ -759,7 +1045,6 @@ def ratio_pdf(z, mu_x, mu_y, sigma_x, sigma_y, corr=0):
     del b
     del c
     del d
-    gc.collect()
     return p
 
 
@@ -779,6 +1064,7 @@ def beta_pdf(x, a, b):
         np.array of probabilities
 
     """
+    from scipy.stats import beta
     return beta.pdf(x, a, b)
 
 
@@ -1006,6 +1292,192 @@ def dkl_estimate(ln_pdf, V, N):
     return np.sum(np.array(ln_pdf)*np.array(pdf) + np.array(pdf)*np.log(V), -1)*dV
 
 
+def polarity_station_rejections(a, mt, sigma, incorrect_polarity_probability=0.0):
+    """
+    Calculate which polarity stations give zero probability
+
+    Evaluates the polarity PDF (see polarity_ln_pdf) for each station and returns whether it is zero,
+    i.e. whether the station rejects the sample.
+
+    Args
+        a: np.array - 3 dimensional numpy array of station coefficients (stations x location samples x 6)
+        mt: np.array - 2 dimensional numpy array of moment tensor 6 vector samples
+        sigma: np.array - 1 dimensional array of fractional uncertainties.
+
+    Optional Args
+        incorrect_polarity_probability: float or np.array (default=0) - probability of a receiver orientation error.
+
+    Returns
+        np.array - boolean array of rejections (stations x (location samples*moment tensor samples))
+    """
+    from scipy.special import erf
+    number_stations = a.shape[0]
+    x = np.tensordot(a, mt, 1).reshape(number_stations, -1)
+    sigma = np.asarray(sigma, dtype=np.float64)[:number_stations].reshape(-1, 1)
+    incorrect_polarity_probability = np.asarray(incorrect_polarity_probability, dtype=np.float64).flatten()
+    if incorrect_polarity_probability.shape[0] > 1:
+        incorrect_polarity_probability = incorrect_polarity_probability[:number_stations].reshape(-1, 1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p = 0.5*((1-incorrect_polarity_probability)*(1+erf(x/(np.sqrt(2)*sigma))) +
+                 incorrect_polarity_probability*(1+erf(-x/(np.sqrt(2)*sigma))))
+    return p <= 0
+
+
+def greedy_station_order(rejections):
+    """
+    Order the stations by the number of samples each rejects that are not rejected by the stations before it
+
+    Stations that do not reject any remaining samples are left in their original order at the end.
+
+    Args
+        rejections: np.array - boolean array of rejections (stations x samples), see polarity_station_rejections.
+
+    Returns
+        np.array - station order.
+    """
+    number_stations = rejections.shape[0]
+    remaining = np.ones(rejections.shape[1], dtype=bool)
+    unused = np.ones(number_stations, dtype=bool)
+    order = []
+    for i in range(number_stations):
+        counts = np.where(unused, rejections[:, remaining].sum(1), -1)
+        station = int(np.argmax(counts))
+        if counts[station] <= 0:
+            break
+        order.append(station)
+        unused[station] = False
+        remaining &= ~rejections[station]
+    return np.array(order+list(np.nonzero(unused)[0]), dtype=np.intp)
+
+
+def station_evaluations(rejections, order=None):
+    """
+    Mean number of stations evaluated for each rejected sample, stopping at the first rejecting station
+
+    Args
+        rejections: np.array - boolean array of rejections (stations x samples), see polarity_station_rejections.
+
+    Optional Args
+        order: np.array (default=None) - station order, None uses the original order.
+
+    Returns
+        float - mean number of station evaluations for the rejected samples (0 if none are rejected).
+    """
+    if order is not None:
+        rejections = rejections[order]
+    rejected = rejections.any(0)
+    if not rejected.any():
+        return 0.
+    return float(np.mean(np.argmax(rejections[:, rejected], 0)+1))
+
+
+class PolarityStationOrder(object):
+
+    """
+    Polarity station order for early rejection
+
+    The Cython polarity loops stop evaluating the stations at the first station with zero probability, so for
+    polarity data with small errors, where most random samples are rejected, the number of station evaluations
+    depends on the station order. PolarityStationOrder tracks the station rejections on a subset of the moment
+    tensor samples as they are forward modelled, and periodically reorders the stations so that the most
+    discriminating stations (rejecting most of the samples not rejected by earlier stations) are first.
+
+    Reordering the stations does not change the probabilities (apart from the rounding in the sum over the stations).
+    """
+
+    def __init__(self, interval=20, number_test_samples=1000, max_rejections=20000, max_test_size=1000000):
+        """
+        Initialisation of PolarityStationOrder
+
+        Keyword Args
+            interval:[20] Number of calls between updates of the station order.
+            number_test_samples:[1000] Maximum number of moment tensor samples to test each update.
+            max_rejections:[20000] Number of tested (location and moment tensor) samples to keep for the ordering.
+            max_test_size:[1000000] Maximum number of amplitudes (stations x location samples x moment tensor samples) to evaluate each update.
+        """
+        self.interval = max(int(interval), 1)
+        self.number_test_samples = number_test_samples
+        self.max_rejections = max_rejections
+        self.max_test_size = max_test_size
+        self.order = None
+        self.number_calls = 0
+        self.rejections = None
+        self._reordered = None
+
+    def update(self, a, mt, sigma, incorrect_polarity_probability=0.0):
+        """
+        Tests the stations on a subset of the samples and updates the station order
+
+        Args
+            a: np.array - 3 dimensional numpy array of station coefficients (stations x location samples x 6)
+            mt: np.array - 2 dimensional numpy array of moment tensor 6 vector samples
+            sigma: np.array - 1 dimensional array of fractional uncertainties.
+
+        Optional Args
+            incorrect_polarity_probability: float or np.array (default=0) - probability of a receiver orientation error.
+
+        Returns
+            np.array - station order.
+        """
+        number_stations, number_location_samples = a.shape[:2]
+        mt = np.asarray(mt)
+        number_samples = min(mt.shape[1], self.number_test_samples)
+        mt = mt[:, np.linspace(0, mt.shape[1]-1, number_samples).astype(np.intp)]
+        number_location_samples = max(min(number_location_samples, self.max_test_size//(number_stations*number_samples)), 1)
+        a = a[:, np.linspace(0, a.shape[1]-1, number_location_samples).astype(np.intp), :]
+        rejections = polarity_station_rejections(a, mt, sigma, incorrect_polarity_probability)
+        if self.rejections is not None and self.rejections.shape[0] == number_stations:
+            rejections = np.append(self.rejections, rejections, 1)
+        self.rejections = rejections[:, -self.max_rejections:]
+        self.order = greedy_station_order(self.rejections)
+        logger.debug('Polarity station order: {} - mean station evaluations per rejected sample {} (original order {})'.format(
+            self.order, station_evaluations(self.rejections, self.order), station_evaluations(self.rejections)))
+        return self.order
+
+    def __call__(self, a, mt, sigma, incorrect_polarity_probability=0.0):
+        """
+        Returns the station coefficients, errors and incorrect polarity probabilities in the station order
+
+        The order is updated using mt every interval calls. If the samples are not known (mt is False, e.g. when
+        generating the samples in the Cython code), random moment tensor samples are used for the update.
+
+        Args
+            a: np.array - 3 dimensional numpy array of station coefficients (stations x location samples x 6)
+            mt: np.array - 2 dimensional numpy array of moment tensor 6 vector samples
+            sigma: np.array - 1 dimensional array of fractional uncertainties.
+
+        Optional Args
+            incorrect_polarity_probability: float or np.array (default=0) - probability of a receiver orientation error.
+
+        Returns
+            (np.array, np.array, float or np.array) - tuple of reordered a, sigma and incorrect_polarity_probability.
+        """
+        if self.number_calls % self.interval == 0:
+            if not isinstance(mt, np.ndarray) or mt.ndim != 2 or not mt.shape[1]:
+                # Samples uniformly distributed on the unit 6-sphere
+                mt = np.random.randn(6, self.number_test_samples)
+                mt /= np.sqrt(np.sum(mt*mt, 0))
+            self.update(a, mt, sigma, incorrect_polarity_probability)
+        self.number_calls += 1
+        if self.order is None or self.order.shape[0] != a.shape[0] or np.all(self.order == np.arange(a.shape[0])):
+            return a, sigma, incorrect_polarity_probability
+        # Keep the reordered coefficients while the order and the inputs are unchanged
+        inputs = (a, sigma, incorrect_polarity_probability)
+        if (self._reordered is not None and all(x is y for x, y in zip(self._reordered[0], inputs)) and
+                np.array_equal(self._reordered[1], self.order)):
+            return self._reordered[2]
+        order = self.order
+        reordered_sigma = np.append(np.asarray(sigma)[order], np.asarray(sigma)[a.shape[0]:])
+        reordered_incorrect_polarity_probability = incorrect_polarity_probability
+        if isinstance(incorrect_polarity_probability, np.ndarray) and incorrect_polarity_probability.size > 1:
+            incorrect_polarity_probability = incorrect_polarity_probability.flatten()
+            reordered_incorrect_polarity_probability = np.append(incorrect_polarity_probability[order],
+                                                                 incorrect_polarity_probability[a.shape[0]:])
+        reordered = (np.ascontiguousarray(a[order]), reordered_sigma, reordered_incorrect_polarity_probability)
+        self._reordered = (inputs, order.copy(), reordered)
+        return reordered
+
+
 class LnPDF(object):
 
     """
@@ -21,6 +21,7 @@ import numpy as np
 
 from .probability import LnPDF
 from .probability import dkl_estimate
+from .probability import ln_marginalise
 from .probability.probability import _6sphere_prior
 from .utilities.file_io import convert_keys_to_unicode
 from .utilities.file_io import unique_columns
@@ -31,32 +32,168 @@ if sys.version_info.major >= 3:
     long = int
 
 
-__all__ = ['Sample', 'FileSample', 'ln_bayesian_evidence', '_convert', '_6sphere_prior']
+__all__ = ['Sample', 'SampleStore', 'ChainSample', 'FileSample', 'ln_bayesian_evidence', '_convert', '_6sphere_prior']
+
+
+class SampleStore(object):
+    """
+    Columnar store for samples
+
+    Each column is a contiguous array with the samples along the last axis (e.g. the moment tensors, ln_pdf and
+    scale factors). The capacity grows geometrically when it is reached, so appending N samples copies O(N) values
+    in total, and finalize returns trimmed views of the stored samples without copying.
+    """
+
+    growth_factor = 2
+
+    def __init__(self, capacity=100000, **columns):
+        """
+        SampleStore initialisation
+
+        Args
+            capacity:[100000] Initial number of samples to allocate.
+            columns: Shapes (excluding the sample axis) of columns to allocate, either as a shape tuple
+                or a (shape, dtype) tuple. Other columns are allocated when they are first appended.
+
+        Returns
+            SampleStore object
+
+        """
+        self.capacity = max(int(capacity), 0)
+        self.size = 0
+        self.columns = {}
+        for key, shape in columns.items():
+            dtype = np.float64
+            if len(shape) == 2 and isinstance(shape[0], tuple):
+                shape, dtype = shape
+            self.columns[key] = self._allocate(tuple(shape), dtype, self.capacity)
+
+    def __len__(self):
+        """Returns the number of stored samples."""
+        return self.size
+
+    @staticmethod
+    def _allocate(shape, dtype, capacity):
+        if np.dtype(dtype) == object:
+            return np.empty(shape+(capacity,), dtype=object)
+        return np.zeros(shape+(capacity,), dtype=dtype)
+
+    def reserve(self, size):
+        """
+        Grows the capacity (geometrically) so that there is space for size samples.
+
+        Args
+            size: number of samples required.
+
+        Returns
+            None
+        """
+        if size <= self.capacity:
+            return
+        capacity = max(int(size), int(self.growth_factor*self.capacity))
+        for key, column in self.columns.items():
+            new_column = self._allocate(column.shape[:-1], column.dtype, capacity)
+            new_column[..., :self.size] = column[..., :self.size]
+            self.columns[key] = new_column
+        self.capacity = capacity
+
+    def append(self, columns):
+        """
+        Appends samples to the store, writing them in place.
+
+        Args
+            columns: dict of arrays with the samples along the last axis (must be the same length).
+
+        Returns
+            None
+
+        Raises
+            ValueError: Columns have different numbers of samples or shapes that do not match the stored columns.
+        """
+        columns = dict((key, np.asarray(value)) for key, value in columns.items())
+        lengths = set(value.shape[-1] if value.ndim else 1 for value in columns.values())
+        if len(lengths) > 1:
+            raise ValueError('Columns must have the same number of samples')
+        if not len(lengths) or not list(lengths)[0]:
+            return
+        number_samples = lengths.pop()
+        for key, value in columns.items():
+            if key in self.columns and self.columns[key].shape[:-1] != value.shape[:-1]:
+                raise ValueError('Column {} shape {} does not match the stored shape {}'.format(key, value.shape[:-1], self.columns[key].shape[:-1]))
+        self.reserve(self.size+number_samples)
+        for key, value in columns.items():
+            if key not in self.columns:
+                dtype = value.dtype if value.dtype.kind in 'iuO' else np.float64
+                self.columns[key] = self._allocate(value.shape[:-1], dtype, self.capacity)
+            self.columns[key][..., self.size:self.size+number_samples] = value
+        self.size += number_samples
+
+    def keep(self, indices):
+        """
+        Keeps only the given samples, compacting them in place at the start of the columns.
+
+        Args
+            indices: sorted indices of the samples to keep.
+
+        Returns
+            None
+        """
+        number_samples = len(indices)
+        for column in self.columns.values():
+            column[..., :number_samples] = column[..., indices]
+        self.size = number_samples
+
+    def finalize(self):
+        """
+        Returns the stored samples
+
+        Returns
+            dict: views of the columns trimmed to the number of samples (not copied).
+        """
+        return dict((key, column[..., :self.size]) for key, column in self.columns.items())
 
 
 class Sample(object):
     """Sample object for storing source pdf samples."""
 
-    def __init__(self, initial_sample_size=100000, number_events=1, prior=_6sphere_prior):
+    def __init__(self, initial_sample_size=100000, number_events=1, prior=_6sphere_prior, discard=0, n_samples=0, max_retained=0, dtype=np.float64):
         """
         Sample initialisation
 
+        Samples can be dropped as they are added, so that the memory is bounded by the retained rather than the
+        evaluated samples. Setting discard drops the samples that Sample.output would discard (less than
+        1/(discard*n_samples) of the running maximum probability), and setting max_retained keeps only the
+        highest probability samples. The dropped samples are still included in the Bayesian evidence.
+
         Args
             initial_sample_size:[100000] Initial size for MT vector
             number_events:[1] Number of events in sample (allows for sampling multiple event joint PDF)
             prior:[6sphere]
+            discard:[0] Discard cut-off for dropping samples as they are added (0 keeps all the samples).
+            n_samples:[0] Expected total number of samples for the discard cut-off (if less than the number of
+                samples tried so far, that is used, which can drop samples that are retained by the final cut-off).
+            max_retained:[0] Maximum number of samples to retain (0 keeps all the samples).
+            dtype:[np.float64] Data type for storing the moment tensors (np.float32 halves the memory).
 
         Returns
             Sample object
 
         """
-        self.moment_tensors = np.matrix(np.zeros((number_events*6, initial_sample_size)))
+        self._store = SampleStore(initial_sample_size, moment_tensors=((number_events*6,), dtype))
         self.n = 0
-        self.ln_pdf = LnPDF()
         self.number_events = number_events
         self._initial_sample_size = initial_sample_size
         self._i = 0
+        self._dV = 1
         self._prior = prior
+        self.discard = discard
+        self.n_samples = n_samples
+        self.max_retained = max_retained
+        self.number_dropped = 0
+        self._ln_max = -np.inf
+        self._ln_dropped = -np.inf
+        self._retained_size = 0
+        self.finalize()
 
     def append(self, moment_tensors, ln_pdf, n, scale_factor=False, extensions_scale_factor=False):
         """
@@ -93,42 +230,105 @@ class Sample(object):
         if isinstance(ln_pdf, (np.ndarray, float, int, np.float64, np.float32)):
             ln_pdf = LnPDF(ln_pdf)
         # Get non-zero probability samples
-        moment_tensors = moment_tensors[:, ln_pdf.nonzero()]
-        # Check scale factor
-        if not isinstance(scale_factor, bool):
-            if not isinstance(scale_factor, dict):  # single event
-                scale_factor = scale_factor[ln_pdf.nonzero()]
-        if isinstance(extensions_scale_factor, dict) and len(extensions_scale_factor):
-            for key in extensions_scale_factor.keys():
-                extensions_scale_factor[key] = extensions_scale_factor[key][ln_pdf.nonzero()]
+        non_zero = ln_pdf.nonzero()
+        moment_tensors = moment_tensors[:, non_zero]
         # Check if there are non-zero moment tensor samples
         if moment_tensors.shape[0]*moment_tensors.shape[1] > 0:  # Has samples
-            if len(ln_pdf.nonzero()) != moment_tensors.shape[1]:
+            if len(non_zero) != moment_tensors.shape[1]:
                 raise ValueError('Moment Tensor shape[2] and ln_pdf shape[2] must be the same')
-            # Check if moment tensor sampling array has enough spare elements
-            size_check = self.moment_tensors.shape[1]-self._i > moment_tensors.shape[1]
-            # If size-check fails, append new zero samples to the array
-            while not size_check:
-                self.moment_tensors = np.append(self.moment_tensors, np.zeros((self.number_events*6, self._initial_sample_size)),
-                                                axis=1)
-                size_check = self.moment_tensors.shape[1]-self._i > moment_tensors.shape[1]
-            # Set moment tensor samples in array
-            self.moment_tensors[:, self._i:self._i+moment_tensors.shape[1]] = moment_tensors
-            # Handle scale factors
+            if not self._i:
+                self._dV = ln_pdf.dV
+            columns = {'moment_tensors': moment_tensors, 'ln_pdf': ln_pdf[:, non_zero]}
+            # Handle scale factors (arrays of dicts containing mu and s)
             if not isinstance(scale_factor, bool):
-                # Scale factor dict containing mu and s
-                self.scale_factor = np.append(self.scale_factor, scale_factor)
+                if isinstance(scale_factor, dict):
+                    scale_factor = [scale_factor]
+                else:  # single event
+                    scale_factor = scale_factor[non_zero]
+                columns['scale_factor'] = scale_factor
             if isinstance(extensions_scale_factor, dict) and len(extensions_scale_factor):
-                # Scale factor dict containing mu and s
                 for key in extensions_scale_factor.keys():
-                    if key in self.extensions_scale_factor.keys():
-                        self.extensions_scale_factor[key] = np.append(self.extensions_scale_factor[key], extensions_scale_factor[key])
-                    else:
-                        self.extensions_scale_factor[key] = extensions_scale_factor[key]
-            # Append to PDF
-            self.ln_pdf.append(ln_pdf[:, ln_pdf.nonzero()])
+                    columns[('extensions_scale_factor', key)] = extensions_scale_factor[key][non_zero]
+            if self.discard or self.max_retained:
+                columns = self._retain(columns)
+            # Write the samples in place
+            self._store.append(columns)
+            if (self.discard or self.max_retained) and len(self._store) >= 2*max(self._retained_size, self.max_retained, 1):
+                self._prune()
             # Update moment tensor index
-            self._i += moment_tensors.shape[1]
+            self._i = len(self._store)
+            self.finalize()
+
+    def _marginal_ln_pdf(self, ln_pdf):
+        """Marginalised ln_pdf (over the location samples) for the retention cut-offs"""
+        if ln_pdf.shape[0] == 1:
+            return np.asarray(ln_pdf).flatten()
+        return np.asarray(ln_marginalise(np.asarray(ln_pdf), axis=0, dV=self._dV)).flatten()
+
+    def _ln_threshold(self):
+        """ln_pdf cut-off for the discard (the same as LnPDF.nonzero)"""
+        n_samples = max(self.n_samples, self.n)
+        if not self.discard or not n_samples:
+            return -np.inf
+        return self._ln_max-np.log(self.discard*n_samples)
+
+    def _drop(self, moment_tensors, ln_pdf):
+        """Adds the dropped samples to the Bayesian evidence sum"""
+        if not len(ln_pdf):
+            return
+        if self._prior is not _6sphere_prior:
+            p = 1.0
+            for i in range(self.number_events):
+                converted = output_convert(np.asarray(moment_tensors)[6*i:6*(i+1), :])
+                p *= self._prior(converted['g'], converted['d'])
+            ln_pdf = ln_pdf+np.log(p)
+        self._ln_dropped = np.logaddexp(self._ln_dropped, np.logaddexp.reduce(ln_pdf))
+        self.number_dropped += len(ln_pdf)
+
+    def _retain(self, columns):
+        """Drops new samples below the discard cut-off"""
+        ln_pdf = self._marginal_ln_pdf(columns['ln_pdf'])
+        self._ln_max = max(self._ln_max, ln_pdf.max())
+        retain = ln_pdf > self._ln_threshold()
+        if retain.all():
+            return columns
+        self._drop(columns['moment_tensors'][:, ~retain], ln_pdf[~retain])
+        return dict((key, np.asarray(value)[..., retain]) for key, value in columns.items())
+
+    def _prune(self):
+        """Drops stored samples below the (updated) discard cut-off or outside the max_retained highest probabilities"""
+        columns = self._store.finalize()
+        ln_pdf = self._marginal_ln_pdf(columns['ln_pdf'])
+        retain = ln_pdf > self._ln_threshold()
+        if self.max_retained and retain.sum() > self.max_retained:
+            indices = np.flatnonzero(retain)
+            retain[:] = False
+            retain[indices[np.argpartition(ln_pdf[indices], -self.max_retained)[-self.max_retained:]]] = True
+        if not retain.all():
+            self._drop(columns['moment_tensors'][:, ~retain], ln_pdf[~retain])
+            self._store.keep(np.flatnonzero(retain))
+        self._retained_size = len(self._store)
+
+    def finalize(self):
+        """
+        Sets the moment_tensors, ln_pdf and scale factor attributes to views of the stored samples.
+
+        The views are trimmed to the number of samples but not copied.
+
+        Returns
+            (np.matrix, LnPDF): moment tensors and LnPDF of the stored samples.
+        """
+        columns = self._store.finalize()
+        self.moment_tensors = np.asmatrix(columns['moment_tensors'])
+        self.ln_pdf = LnPDF(dV=self._dV)
+        if 'ln_pdf' in columns:
+            self.ln_pdf._ln_pdf = np.asmatrix(columns['ln_pdf'])
+        if 'scale_factor' in columns:
+            self.scale_factor = columns['scale_factor']
+        for key in columns.keys():
+            if isinstance(key, tuple):
+                self.extensions_scale_factor[key[1]] = columns[key]
+        return self.moment_tensors, self.ln_pdf
 
     def output(self, normalise=True, convert=False, n_samples=0, discard=10000, mcmc=False):
         """
@@ -148,6 +348,11 @@ class Sample(object):
             ValueError: No nonzero probability samples.
 
         """
+        # Drop any remaining samples outside the retention cut-offs
+        if self.discard or self.max_retained:
+            self._prune()
+            self._i = len(self._store)
+            self.finalize()
         # Gets normalised and unnormalised pdfs
         ln_pdf = self.ln_pdf.output(normalise)
         un_normalised_ln_pdf = self.ln_pdf.output(normalise=False)
@@ -158,7 +363,7 @@ class Sample(object):
             return {'probability': []}, output_string
         # Get max probability solutions
         output_string += 'Sample Max Probability: '+str(ln_pdf.max())+'\n'
-        moment_tensors = self.moment_tensors[:, :self._i]
+        moment_tensors = self.moment_tensors
         if len(ln_pdf.shape) > 1:
             max_p_mt = unique_columns(moment_tensors[:, np.array(ln_pdf == np.max(ln_pdf._ln_pdf))[0]])
         else:
@@ -173,6 +378,8 @@ class Sample(object):
             non_zero = ln_pdf.nonzero(discard=discard, n_samples=n_samples)
             if discard and n_samples:
                 output_string += 'After discard, '+str(non_zero.shape[0])+' samples remain\n\n'
+            if self.number_dropped:
+                output_string += str(self.number_dropped)+' samples dropped while sampling\n\n'
             if len(ln_pdf.shape) > 1:
                 probability = np.exp(ln_pdf[:, non_zero])
             else:
@@ -201,6 +408,11 @@ class Sample(object):
             try:
                 if not mcmc:
                     output['ln_bayesian_evidence'] = ln_bayesian_evidence(output, n_samples, self._prior)
+                    if self.number_dropped:
+                        # Include the samples dropped while sampling
+                        output['ln_bayesian_evidence'] = np.logaddexp(output['ln_bayesian_evidence'], self._ln_dropped-np.log(n_samples))
+                        # Kept so that combined (MPI) outputs can include the dropped samples
+                        output['ln_dropped'] = self._ln_dropped
             except Exception:  # Should fail when McMC and not MC
                 pass
             try:
@@ -248,6 +460,145 @@ class Sample(object):
         return self.ln_pdf.nonzero()
 
 
+class ChainSample(Sample):
+    """
+    Sample object for storing Markov chain samples.
+
+    The arrays are preallocated from the chain length and filled in place. Repeated samples (rejected proposals)
+    are run-length encoded by increasing the multiplicity of the last sample rather than adding duplicate columns,
+    and are only expanded when the samples are output.
+    """
+
+    def __init__(self, chain_length=1000000, number_events=1, prior=_6sphere_prior):
+        """
+        ChainSample initialisation
+
+        Args
+            chain_length:[1000000] Length of the Markov chain, used as the preallocated size.
+            number_events:[1] Number of events in sample (allows for sampling multiple event joint PDF)
+            prior:[6sphere]
+
+        Returns
+            ChainSample object
+
+        """
+        size = max(int(chain_length), 1)
+        self._store = SampleStore(size, moment_tensors=(number_events*6,), ln_pdf=(1,), multiplicity=((), np.int64))
+        self.n = 0
+        self.number_events = number_events
+        self._initial_sample_size = size
+        self._i = 0
+        self._dV = 1
+        self._prior = prior
+
+    @property
+    def ln_pdf(self):
+        """LnPDF of the samples (with the repeated samples expanded)"""
+        return self.expand()[1]
+
+    def append(self, moment_tensors, ln_pdf, n, scale_factor=False, extensions_scale_factor=False, multiplicity=1):
+        """
+        Appends new samples to the chain, extending the arrays if the preallocated size is reached.
+
+        Args
+            moment_tensors: numpy matrix of moment tensors to append.
+            ln_pdf: numpy matrix/array, float or PDF object containing marginalised ln_pdf samples corresponding to the moment tensors in moment_tensors (must be same length).
+            n: number of tried samples (including zero probability samples).
+            scale_factor:[False] scale_factor estimates for relative amplitude inversion.
+            extensions_scale_factor:[False] not supported for Markov chain samples.
+            multiplicity:[1] number of repeats of each sample (integer or array).
+
+        Returns
+            None
+
+        """
+        # Check if moment tensors are a list (multiple events) and convert to the correct format
+        if isinstance(moment_tensors, list) and isinstance(moment_tensors[0], np.ndarray):
+            moment_tensors = np.array(moment_tensors)
+            moment_tensors = np.matrix(moment_tensors.reshape(moment_tensors.shape[0]*moment_tensors.shape[1], moment_tensors.shape[2]))
+        if isinstance(ln_pdf, LnPDF):
+            ln_pdf = ln_pdf._ln_pdf
+        ln_pdf = np.array(ln_pdf, dtype=np.float64).flatten()
+        if moment_tensors.shape[1] != ln_pdf.shape[0]:
+            raise ValueError('Moment Tensor shape[2] and ln_pdf shape[2] must be the same')
+        self.n += n
+        multiplicity = np.ones(ln_pdf.shape, dtype=np.int64)*multiplicity
+        # Get non-zero probability samples
+        non_zero = np.logical_and(ln_pdf > -np.inf, multiplicity > 0)
+        if not non_zero.all():
+            moment_tensors = moment_tensors[:, non_zero]
+            ln_pdf = ln_pdf[non_zero]
+            multiplicity = multiplicity[non_zero]
+            if not isinstance(scale_factor, bool):
+                scale_factor = scale_factor[non_zero]
+        columns = {'moment_tensors': moment_tensors, 'ln_pdf': ln_pdf[np.newaxis, :], 'multiplicity': multiplicity}
+        if not isinstance(scale_factor, bool):
+            columns['scale_factor'] = np.ravel(scale_factor)
+        self._store.append(columns)
+        self._i = len(self._store)
+
+    def repeat(self, n=1):
+        """
+        Repeats the last sample
+
+        Args
+            n:[1] number of repeats.
+
+        Returns
+            bool: True if there is a sample to repeat.
+        """
+        if not self._i:
+            return False
+        self._store.columns['multiplicity'][self._i-1] += n
+        self.n += n
+        return True
+
+    def extend(self, other):
+        """
+        Appends the samples from another ChainSample (e.g. to merge chains).
+
+        Args
+            other: ChainSample object.
+
+        Returns
+            None
+        """
+        columns = other._store.finalize()
+        self.append(columns['moment_tensors'], columns['ln_pdf'], other.n, columns.get('scale_factor', False),
+                    multiplicity=columns['multiplicity'])
+
+    def expand(self):
+        """
+        Expands the repeated samples
+
+        Returns
+            (np.matrix, LnPDF): moment tensors and LnPDF including the repeated samples.
+        """
+        columns = self._store.finalize()
+        multiplicity = columns['multiplicity']
+        moment_tensors = np.asmatrix(np.repeat(columns['moment_tensors'], multiplicity, axis=1))
+        ln_pdf = LnPDF(dV=self._dV)
+        ln_pdf._ln_pdf = np.asmatrix(np.repeat(columns['ln_pdf'], multiplicity, axis=1))
+        return moment_tensors, ln_pdf
+
+    finalize = expand
+
+    def output(self, *args, **kwargs):
+        """
+        Returns nonzero probability samples in a dictionary, with the repeated samples expanded.
+
+        See Sample.output for the arguments.
+        """
+        columns = self._store.finalize()
+        sample = Sample(initial_sample_size=0, number_events=self.number_events, prior=self._prior)
+        scale_factor = False
+        if 'scale_factor' in columns:
+            scale_factor = np.repeat(columns['scale_factor'], columns['multiplicity'])
+        moment_tensors, ln_pdf = self.expand()
+        sample.append(moment_tensors, ln_pdf, self.n, scale_factor)
+        return sample.output(*args, **kwargs)
+
+
 class FileSample(Sample):
     """
     FileSample object stores sample values on disk rather than in memory (writes to disk each time)
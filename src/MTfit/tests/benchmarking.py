@@ -6,6 +6,7 @@ Module containing benchmarking tests for the different algorithms and example da
 import sys
 import time
 import os
+import subprocess
 try:
     import cPickle as pickle
 except ImportError:
@@ -16,7 +17,11 @@ import numpy as np
 from MTfit.inversion import Inversion, ForwardTask
 from MTfit.probability.probability import polarity_ln_pdf, amplitude_ratio_ln_pdf
 from MTfit.sampling import convert_keys_to_unicode
-from MTfit.algorithms.markov_chain_monte_carlo import MarkovChainMonteCarloAlgorithmCreator
+from MTfit.algorithms.markov_chain_monte_carlo import McMCAlgorithmCreator
+from MTfit.utilities.memory import DEFAULT_GC_INTERVAL
+from MTfit.utilities.memory import DEFAULT_GC_THRESHOLD
+from MTfit.utilities.memory import get_gc_policy
+from MTfit.utilities.memory import set_gc_policy
 
 DEFAULT_SAMPLE_RANGE = [10000, 50000, 80000, 100000, 200000, 500000, 700000,
                         1000000, 3000000, 5000000, 7000000, 100000000]
@@ -38,7 +43,7 @@ def run_benchmarks():
     results = algorithm_benchmarks(data_file)
     # delete data file
     _delete_default_event(data_file)
-    print results
+    print(results)
 
 
 def algorithm_benchmarks(event_file, scatter_file=None, algorithm=None, plot=False, save_matlab=True, matlab_version='7.3',
@@ -76,7 +81,7 @@ def _run_benchmarks(event_file, scatter_file, algorithm, sample_range, iteration
     results = {'samples': {}}
     # Benchmark sample steps
     for nsamples in sample_range:
-        print '\n\n==================\nRunning benchmark for '+str(nsamples)+' samples and algorithm '+str(algorithm)+'\n\n==================\n\n'
+        print('\n\n==================\nRunning benchmark for '+str(nsamples)+' samples and algorithm '+str(algorithm)+'\n\n==================\n\n')
         if mt:
             test_inversion = Inversion(data_file=event_file, angle_scatter_file_path=scatter_file,
                                        algorithm=algorithm, parallel=False, dc=False, max_samples=nsamples,
@@ -97,13 +102,13 @@ def _run_benchmarks(event_file, scatter_file, algorithm, sample_range, iteration
             if nsamples not in results['samples']:
                 results['samples'][nsamples] = {}
             results['samples'][nsamples]['DC'] = times
-        print '\n\n==================\nBenchmark for '+str(nsamples)+' samples and algorithm '+str(algorithm)+' complete\n\n==================\n\n'
+        print('\n\n==================\nBenchmark for '+str(nsamples)+' samples and algorithm '+str(algorithm)+' complete\n\n==================\n\n')
     results['iteration_step'] = {}
     # Benchmark iteration steps
     calculated_iteration_size = test_inversion.number_samples
     for i in iteration_size_range:
         if i <= calculated_iteration_size:
-            print '\n\n==================\nRunning benchmark for '+str(i)+' iteration samples and algorithm '+str(algorithm)+'\n\n==================\n\n'
+            print('\n\n==================\nRunning benchmark for '+str(i)+' iteration samples and algorithm '+str(algorithm)+'\n\n==================\n\n')
             results['iteration_step'][i] = {}
             if mt:
                 test_inversion = Inversion(data_file=event_file, angle_scatter_file_path=scatter_file,
@@ -154,7 +159,7 @@ def _iteration_step_time(test_inversion, repeat_times):
         else:
             (a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, error1_amplitude_ratio, error2_amplitude_ratio,
              a_polarity_prob, polarity_prob, error_polarity_prob) = test_inversion._station_angles(test_inversion.data[0], 0)
-            algorithm = MarkovChainMonteCarloAlgorithmCreator(**test_inversion.algorithm_kwargs)
+            algorithm = McMCAlgorithmCreator(**test_inversion.algorithm_kwargs)
             mts, end = algorithm.initialise()
             starttime = default_timer()
             forward = ForwardTask(mts, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio, error1_amplitude_ratio, error2_amplitude_ratio, a_polarity_prob, polarity_prob, error_polarity_prob, return_zero=True, reuse=True)
@@ -1925,3 +1930,187 @@ def probability_cython_benchmarks(n=1):
         times.append(endtime-starttime)
         print('\tCython time '+str(endtime-starttime))
     print('\nCython Avg ', sum(times)/n)
+
+
+STARTUP_COMMANDS = [('import MTfit', 'import MTfit'),
+                    ('MTfit --help', 'from MTfit.run import run; run(["--help"])')]
+
+
+def startup_benchmarks(n=5, executable=None):
+    """
+    Benchmark the MTfit import and command line startup (wall) times
+
+    Each command is run in a new python process so that the module import times are included.
+
+    Keyword Args
+        n:[5] Number of times to run each command.
+        executable:[sys.executable] Python executable to use.
+
+    Returns
+        dict: dictionary of command name: list of wall times (s).
+    """
+    if executable is None:
+        executable = sys.executable
+    with open(os.devnull, 'w') as devnull:
+        # Run once so that the file system and bytecode caches are populated
+        subprocess.call([executable, '-c', 'import MTfit'], stdout=devnull, stderr=devnull)
+        results = {}
+        for name, command in STARTUP_COMMANDS:
+            print('\n'+name)
+            times = []
+            for i in range(n):
+                starttime = default_timer()
+                subprocess.call([executable, '-c', command], stdout=devnull, stderr=devnull)
+                endtime = default_timer()
+                print('\tWall time '+str(endtime-starttime))
+                times.append(endtime-starttime)
+            print('\n'+name+' Avg '+str(sum(times)/n)+' Min '+str(min(times)))
+            results[name] = times
+    return results
+
+
+GC_POLICIES = [('gc.collect every step', dict(interval=1, threshold=0)),
+               ('default policy', dict(interval=DEFAULT_GC_INTERVAL, threshold=DEFAULT_GC_THRESHOLD))]
+
+
+def gc_benchmarks(number_steps=500, number_stations=20, n=3):
+    """
+    Benchmark the McMC steps per second for the garbage collection policies
+
+    Compares a full collection on every forward model call and McMC step (the previous behaviour) with the
+    default policy, which only collects on allocation pressure, for a synthetic polarity only event.
+
+    Keyword Args
+        number_steps:[500] Number of McMC steps to time (after the initialisation).
+        number_stations:[20] Number of stations in the synthetic event.
+        n:[3] Number of times to run each policy.
+
+    Returns
+        dict: dictionary of policy name: list of steps per second.
+    """
+    np.random.seed(0)
+    a = np.random.randn(number_stations, 6)
+    mt = np.array([1., -1., 0., 0.3, 0., 0.])
+    a_polarity = np.multiply(a, np.sign(a.dot(mt))[:, np.newaxis]).reshape(number_stations, 1, 6)
+    error_polarity = 0.1*np.ones(number_stations)
+    policy = get_gc_policy()
+    interval, threshold = policy.interval, policy.threshold
+    results = {}
+    try:
+        for name, policy_kwargs in GC_POLICIES:
+            set_gc_policy(**policy_kwargs)
+            print('\n'+name)
+            steps_per_second = []
+            for i in range(n):
+                algorithm = McMCAlgorithmCreator(chain_length=10*number_steps, learning_length=100, min_number_initialisation_samples=3000)
+                mts, end = algorithm.initialise()
+                forward = ForwardTask(mts, a_polarity, error_polarity, False, False, False, False, False, False, False,
+                                      return_zero=True, reuse=True)
+                while algorithm._initialising:
+                    forward.mt = mts
+                    mts, end = algorithm.iterate(forward())
+                starttime = default_timer()
+                for j in range(number_steps):
+                    forward.mt = mts
+                    mts, end = algorithm.iterate(forward())
+                endtime = default_timer()
+                print('\tSteps per second '+str(number_steps/(endtime-starttime)))
+                steps_per_second.append(number_steps/(endtime-starttime))
+            print('\n'+name+' Avg '+str(sum(steps_per_second)/n)+' Max '+str(max(steps_per_second)))
+            results[name] = steps_per_second
+    finally:
+        set_gc_policy(interval, threshold)
+    return results
+
+
+def blocked_ln_pdf_benchmarks(number_samples=20000, number_stations=20, location_samples_range=[1, 50, 200, 1000], n=3):
+    """
+    Benchmark the Cython combined_ln_pdf station loops against the BLAS blocked loop
+
+    Times the polarity and amplitude ratio ln PDF for a synthetic event with increasing numbers of location samples,
+    using the station loops (block_size=0) and the blocked loop with the block size from default_block_size.
+
+    Keyword Args
+        number_samples:[20000] Number of moment tensor samples.
+        number_stations:[20] Number of stations in the synthetic event.
+        location_samples_range:[[1, 50, 200, 1000]] Numbers of location samples to time.
+        n:[3] Number of times to run each case.
+
+    Returns
+        dict: dictionary of (number of location samples, loop) : list of times (s).
+    """
+    from MTfit.probability import cprobability
+    np.random.seed(0)
+    mts = np.random.randn(6, number_samples)
+    mts /= np.sqrt((mts*mts).sum(0))
+    error_polarity = 0.1*np.ones(number_stations)
+    amplitude_ratio = np.abs(np.random.randn(number_stations))
+    percentage_error = 0.1*np.ones(number_stations)
+    results = {}
+    for number_location_samples in location_samples_range:
+        a_polarity = np.random.randn(number_stations, number_location_samples, 6)
+        a1_amplitude_ratio = np.random.randn(number_stations, number_location_samples, 6)
+        a2_amplitude_ratio = np.random.randn(number_stations, number_location_samples, 6)
+        for name, block_size in [('station loops', 0), ('blocked', None)]:
+            print('\n'+str(number_location_samples)+' location samples: '+name)
+            times = []
+            for i in range(n):
+                starttime = default_timer()
+                cprobability.combined_ln_pdf(mts, a_polarity, error_polarity, a1_amplitude_ratio, a2_amplitude_ratio, amplitude_ratio,
+                                             percentage_error, percentage_error, False, False, marginalised=1,
+                                             location_samples_multipliers=np.zeros(number_location_samples), block_size=block_size)
+                endtime = default_timer()
+                print('\tCython time '+str(endtime-starttime))
+                times.append(endtime-starttime)
+            print('\n'+name+' Avg '+str(sum(times)/n)+' Min '+str(min(times)))
+            results[(number_location_samples, name)] = times
+    return results
+
+
+def quasi_random_benchmarks(sample_range=[1024, 4096, 16384, 65536], number_stations=10, reference_samples=4194304, n=20):
+    """
+    Benchmark the Bayesian evidence error for the pseudo-random and scrambled Sobol quasi-random samples
+
+    Estimates the evidence (the mean of the likelihood for samples from the uniform prior) for a synthetic polarity
+    only event with increasing numbers of full moment tensor and double-couple samples, and compares the root mean
+    square relative error, over n independent estimates, to a reference value from reference_samples pseudo-random
+    samples. The quasi-random samples reach the same error with fewer forward model evaluations.
+
+    Keyword Args
+        sample_range:[[1024, 4096, 16384, 65536]] Numbers of samples to estimate the evidence from.
+        number_stations:[10] Number of stations in the synthetic event.
+        reference_samples:[4194304] Number of pseudo-random samples for the reference evidence.
+        n:[20] Number of independent estimates for each case.
+
+    Returns
+        dict: dictionary of (dc, number of samples, sampling) : root mean square relative evidence error.
+    """
+    from MTfit.algorithms.base import QuasiRandomSampler, SeededRandomSample
+    np.random.seed(0)
+    a = np.random.randn(number_stations, 6)
+    mt = np.array([1., -1., 0., 0.3, 0., 0.])
+    a_polarity = np.matrix(np.multiply(a, np.sign(a.dot(mt))[:, np.newaxis]))
+    error_polarity = 0.3*np.ones(number_stations)
+
+    def pseudo_random_sampler(seed, dc):
+        seed_sequence = np.random.SeedSequence(seed)
+        return lambda number_samples: SeededRandomSample(seed_sequence.spawn(1)[0], number_samples, dc)()
+
+    def evidence(sampler, number_samples, block_size=65536):
+        likelihood_sum = 0
+        for i in range(0, number_samples, block_size):
+            mts = sampler(min(block_size, number_samples-i))
+            likelihood_sum += np.sum(np.exp(polarity_ln_pdf(a_polarity, mts, error_polarity, _use_c=False)))
+        return likelihood_sum/number_samples
+
+    results = {}
+    for dc in [False, True]:
+        reference = evidence(pseudo_random_sampler(0, dc), reference_samples)
+        for number_samples in sample_range:
+            for name, sampler in [('pseudo-random', pseudo_random_sampler), ('sobol', QuasiRandomSampler)]:
+                errors = [evidence(sampler(i+1, dc) if name == 'pseudo-random' else sampler(dc, i+1), number_samples)/reference-1
+                          for i in range(n)]
+                rms = np.sqrt(np.mean(np.square(errors)))
+                print(('DC ' if dc else 'MT ')+str(number_samples)+' samples '+name+' RMS evidence error '+str(rms))
+                results[(dc, number_samples, name)] = rms
+    return results
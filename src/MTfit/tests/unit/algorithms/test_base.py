@@ -109,6 +109,53 @@ class BaseAlgorithmTestCase(unittest.TestCase):
         self.assertEqual(self.base_algorithm.random_sample(), 5)
         self.base_algorithm.random_model.assert_called_once_with(self.base_algorithm.number_samples)
 
+    def test_random_sample_worker_generate(self):
+        self.tearDown()
+        self.setUp(worker_generate=True, seed=5)
+        sample = self.base_algorithm.random_sample()
+        self.assertTrue(isinstance(sample, base.SeededRandomSample))
+        self.assertEqual(len(sample), self.base_algorithm.number_samples)
+        # Each task has a new stream
+        self.assertFalse((sample() == self.base_algorithm.random_sample()()).all())
+        # Reproducible for the same seed
+        self.tearDown()
+        self.setUp(worker_generate=True, seed=5)
+        self.assertTrue((sample() == self.base_algorithm.random_sample()()).all())
+        # Not used for other sampling models
+        self.base_algorithm.basic_cdc = True
+        self.base_algorithm.random_basic_cdc = mock.MagicMock(return_value=5)
+        self.assertEqual(self.base_algorithm.random_sample(), 5)
+
+    def test_random_sample_default_sampling(self):
+        # No sampling kwarg
+        self.base_algorithm = base.BaseAlgorithm()
+        self.assertFalse(self.base_algorithm.quasi_random)
+        self.assertEqual(self.base_algorithm.random_mt.__name__, '_6sphere_random_mt')
+        self.assertEqual(self.base_algorithm.random_sample().shape, (6, self.base_algorithm.number_samples))
+
+    def test_random_sample_sobol(self):
+        self.tearDown()
+        self.setUp(sampling='sobol')
+        self.assertTrue(self.base_algorithm.quasi_random)
+        self.assertEqual(self.base_algorithm.random_mt.__name__, '_sobol_random_mt')
+        mts = self.base_algorithm.random_sample()
+        self.assertEqual(mts.shape, (6, self.base_algorithm.number_samples))
+        self.assertFalse((mts == self.base_algorithm.random_sample()).all())
+        self.base_algorithm.dc = True
+        mts = self.base_algorithm.random_sample()
+        self.assertAlmostEqual(np.abs(np.sum(mts[:3, :], axis=0)).max(), 0)
+        self.tearDown()
+        self.setUp(sampling='sobol', worker_generate=True, seed=5)
+        sample = self.base_algorithm.random_sample()
+        self.assertTrue(isinstance(sample, base.SeededRandomSample))
+        self.assertTrue(sample.quasi_random)
+
+    def test_random_sample_single_precision(self):
+        self.tearDown()
+        self.setUp(single_precision=True)
+        self.assertEqual(self.base_algorithm.random_sample().dtype, np.float32)
+        self.assertEqual(self.base_algorithm.pdf_sample._store.columns['moment_tensors'].dtype, np.float32)
+
     def test_random_sample_random_mt(self):
         self.base_algorithm.dc = False
         self.base_algorithm.basic_cdc = False
@@ -193,3 +240,59 @@ class BaseAlgorithmTestCase(unittest.TestCase):
             logger.info.assert_called_once_with(C_EXTENSION_FALLBACK_LOG_MSG)
             self.assertEqual(res.shape, (6, 10))
             self.assertAlmostEqual(np.prod(np.sum(np.multiply(res, res), axis=0)), 1)
+
+
+class SeededRandomSampleTestCase(unittest.TestCase):
+
+    def test___call__(self):
+        seeded_sample = base.SeededRandomSample(3, 100)
+        res = seeded_sample()
+        self.assertEqual(res.shape, (6, 100))
+        self.assertAlmostEqual(np.prod(np.sum(np.multiply(res, res), axis=0)), 1)
+        self.assertTrue((res == base.SeededRandomSample(3, 100)()).all())
+        self.assertFalse((res == base.SeededRandomSample(4, 100)()).all())
+
+    def test___call___dtype(self):
+        res = base.SeededRandomSample(3, 100, dtype=np.float32)()
+        self.assertEqual(res.dtype, np.float32)
+        self.assertTrue(np.allclose(res, base.SeededRandomSample(3, 100)(), atol=1e-6))
+
+    def test___call___dc(self):
+        res = base.SeededRandomSample(3, 100, dc=True)()
+        self.assertEqual(res.shape, (6, 100))
+        self.assertAlmostEqual(np.prod(np.sum(np.multiply(res, res), axis=0)), 1)
+        # DC has zero trace and zero determinant
+        self.assertAlmostEqual(np.abs(np.sum(res[:3, :], axis=0)).max(), 0)
+        self.assertTrue((res == base.SeededRandomSample(3, 100, dc=True)()).all())
+
+
+class QuasiRandomSamplerTestCase(unittest.TestCase):
+
+    def test___call__(self):
+        sampler = base.QuasiRandomSampler(seed=3)
+        res = sampler(64)
+        self.assertEqual(res.shape, (6, 64))
+        self.assertAlmostEqual(np.prod(np.sum(np.multiply(res, res), axis=0)), 1)
+        # Continues the sequence
+        self.assertTrue((np.hstack([res, sampler(64)]) == base.QuasiRandomSampler(seed=3)(128)).all())
+        self.assertFalse((res == base.QuasiRandomSampler(seed=4)(64)).all())
+
+    def test___call___dtype(self):
+        res = base.QuasiRandomSampler(seed=3, dtype=np.float32)(64)
+        self.assertEqual(res.dtype, np.float32)
+        self.assertTrue(np.allclose(res, base.QuasiRandomSampler(seed=3)(64), atol=1e-6))
+
+    def test___call___dc(self):
+        res = base.QuasiRandomSampler(dc=True, seed=3)(64)
+        self.assertEqual(res.shape, (6, 64))
+        self.assertAlmostEqual(np.prod(np.sum(np.multiply(res, res), axis=0)), 1)
+        # DC has zero trace and zero determinant
+        self.assertAlmostEqual(np.abs(np.sum(res[:3, :], axis=0)).max(), 0)
+        M = np.array([[res[0, 0], res[3, 0]/np.sqrt(2), res[4, 0]/np.sqrt(2)],
+                      [res[3, 0]/np.sqrt(2), res[1, 0], res[5, 0]/np.sqrt(2)],
+                      [res[4, 0]/np.sqrt(2), res[5, 0]/np.sqrt(2), res[2, 0]]])
+        self.assertAlmostEqual(np.linalg.det(M), 0)
+
+    def test_seeded_random_sample(self):
+        res = base.SeededRandomSample(3, 64, dc=True, quasi_random=True)()
+        self.assertTrue((res == base.QuasiRandomSampler(dc=True, seed=3)(64)).all())
@@ -14,6 +14,11 @@ from MTfit.algorithms.markov_chain_monte_carlo import MarginalisedMetropolisHast
 from MTfit.algorithms.markov_chain_monte_carlo import MarginalisedMetropolisHastingsGaussianTape
 from MTfit.algorithms.markov_chain_monte_carlo import IterativeMultipleTryTransDMetropolisHastingsGaussianTape
 from MTfit.algorithms.markov_chain_monte_carlo import McMCAlgorithmCreator
+from MTfit.algorithms.markov_chain_monte_carlo import MultipleChainMetropolisHastingsGaussianTape
+from MTfit.algorithms.markov_chain_monte_carlo import gelman_rubin
+from MTfit.algorithms.markov_chain_monte_carlo import temperature_ladder
+from MTfit.probability import LnPDF
+from MTfit.sampling import ChainSample
 import MTfit.algorithms.markov_chain_monte_carlo as markov_chain_monte_carlo
 from MTfit.utilities import C_EXTENSION_FALLBACK_LOG_MSG
 from MTfit.utilities.unittest_utils import get_extension_skip_if_args
@@ -466,6 +471,32 @@ class IterativeMetropolisHastingsGaussianTapeTestCase(TestCase):
                                                 'ln_pdf': 1.0, 'N': 1})
         self.assertEqual(self.mcmc_algorithm.pdf_sample.ln_pdf.shape, (1, 2))
 
+    def test__add_chain_sample(self):
+        self.mcmc_algorithm = IterativeMetropolisHastingsGaussianTape(learning_length=0, chain_length=10)
+        self.assertIsInstance(self.mcmc_algorithm.pdf_sample, ChainSample)
+        self.assertEqual(self.mcmc_algorithm.pdf_sample._store.capacity, 10)
+        x0 = self.mcmc_algorithm.convert_sample(np.matrix([[1.], [0], [0], [0], [0], [0]]))
+        x1 = self.mcmc_algorithm.convert_sample(np.matrix([[0.], [1.], [0], [0], [0], [0]]))
+        self.mcmc_algorithm._add_new(x0, -1., False)
+        # Rejected proposals repeat the current sample
+        self.mcmc_algorithm._add_old()
+        self.mcmc_algorithm._add_old()
+        self.mcmc_algorithm._add_new(x1, -2., False)
+        self.assertEqual(self.mcmc_algorithm.pdf_sample._i, 2)
+        self.assertEqual(list(self.mcmc_algorithm.pdf_sample._store.finalize()['multiplicity']), [3, 1])
+        self.assertEqual(len(self.mcmc_algorithm.pdf_sample), 4)
+        self.assertEqual(self.mcmc_algorithm.pdf_sample.ln_pdf.shape, (1, 4))
+        # Sample changed without being recorded (e.g. replica exchange)
+        self.mcmc_algorithm.xi = x0
+        self.mcmc_algorithm._add_old()
+        self.assertEqual(self.mcmc_algorithm.pdf_sample._i, 3)
+        output, output_string = self.mcmc_algorithm.output(True, False, 0)
+        self.assertEqual(output['moment_tensor_space'].shape, (6, 5))
+        self.assertAlmostEqual(output['moment_tensor_space'][0, 2], 1.)
+        self.assertAlmostEqual(output['moment_tensor_space'][1, 3], 1.)
+        self.assertAlmostEqual(output['moment_tensor_space'][0, 4], 1.)
+        self.assertEqual(output['total_number_samples'], 5)
+
  
 class IterativeTransDMetropolisHastingsGaussianTapeTestCase(TestCase):
 
@@ -1614,3 +1645,137 @@ class McMCAlgorithmCreatorTestCase(TestCase):
         self.assertIsInstance(obj, IterativeMultipleTryMetropolisHastingsGaussianTape)
         obj = McMCAlgorithmCreator(mode='asafa')
         self.assertIsInstance(obj, IterativeMetropolisHastingsGaussianTape)
+        obj = McMCAlgorithmCreator(number_chains=2)
+        self.assertIsInstance(obj, MultipleChainMetropolisHastingsGaussianTape)
+        self.assertIsInstance(obj.chains[0], IterativeMetropolisHastingsGaussianTape)
+        obj = McMCAlgorithmCreator(number_chains=2, trans_dimensional=True)
+        self.assertIsInstance(obj, MultipleChainMetropolisHastingsGaussianTape)
+        self.assertIsInstance(obj.chains[0], IterativeTransDMetropolisHastingsGaussianTape)
+        obj = McMCAlgorithmCreator(number_chains=2, number_events=2)
+        self.assertIsInstance(obj, IterativeMultipleTryMetropolisHastingsGaussianTape)
+
+
+class MultipleChainFunctionsTestCase(TestCase):
+
+    def test_temperature_ladder(self):
+        self.assertEqual(temperature_ladder(3), [1., 1., 1.])
+        self.assertEqual(temperature_ladder(3, 0.5), [1., 1., 1.])
+        temperatures = temperature_ladder(3, 16.)
+        self.assertAlmostEqual(temperatures[0], 1.)
+        self.assertAlmostEqual(temperatures[1], 4.)
+        self.assertAlmostEqual(temperatures[2], 16.)
+        self.assertEqual(temperature_ladder(1, 16.), [1.])
+
+    def test_gelman_rubin(self):
+        np.random.seed(0)
+        chains = [np.random.randn(2, 2000) for i in range(4)]
+        potential_scale_reduction = gelman_rubin(chains)
+        self.assertEqual(list(potential_scale_reduction.shape), [2])
+        self.assertTrue((np.abs(potential_scale_reduction-1) < 0.01).all())
+        # Single chain
+        self.assertTrue((np.abs(gelman_rubin(chains[:1])-1) < 0.02).all())
+        # Not converged
+        chains[0] = chains[0]+3
+        self.assertTrue((gelman_rubin(chains) > 1.1).all())
+        # Different lengths
+        chains[1] = chains[1][:, :1000]
+        self.assertEqual(list(gelman_rubin(chains).shape), [2])
+        # Too short
+        self.assertTrue(np.isnan(gelman_rubin([np.random.randn(2, 3)])).all())
+        self.assertEqual(list(gelman_rubin([]).shape), [0])
+
+
+class MultipleChainMetropolisHastingsGaussianTapeTestCase(TestCase):
+
+    def setUp(self):
+        self.mcmc_algorithm = MultipleChainMetropolisHastingsGaussianTape(number_chains=3, max_temperature=4., chain_length=10,
+                                                                         learning_length=0)
+
+    def tearDown(self):
+        del self.mcmc_algorithm
+
+    def _result(self, mts, ln_pdf):
+        return {'moment_tensors': mts, 'ln_pdf': LnPDF(np.array(ln_pdf, ndmin=2)), 'n': mts.shape[1]}
+
+    def test___init__(self):
+        self.assertEqual(len(self.mcmc_algorithm.chains), 3)
+        self.assertAlmostEqual(self.mcmc_algorithm.temperatures[1], 2.)
+        self.assertEqual(self.mcmc_algorithm._cold, [0])
+        self.assertTrue(self.mcmc_algorithm.chains[0].record_samples)
+        self.assertFalse(self.mcmc_algorithm.chains[1].record_samples)
+        self.assertEqual(self.mcmc_algorithm.chains[0].chain_length, 10)
+        # Tempered chain samples are not stored
+        self.assertEqual(self.mcmc_algorithm.chains[0].pdf_sample._store.capacity, 10)
+        self.assertEqual(self.mcmc_algorithm.chains[1].pdf_sample._store.capacity, 1)
+        mcmc_algorithm = MultipleChainMetropolisHastingsGaussianTape(number_chains=4, chain_length=10)
+        self.assertEqual(mcmc_algorithm._cold, [0, 1, 2, 3])
+        self.assertEqual(mcmc_algorithm.chains[0].chain_length, 3)
+        with self.assertRaises(ValueError):
+            MultipleChainMetropolisHastingsGaussianTape(number_chains=2, temperatures=[1., 2., 3.])
+        with self.assertRaises(ValueError):
+            MultipleChainMetropolisHastingsGaussianTape(number_chains=2, temperatures=[2., 3.])
+
+    def test__batch(self):
+        mts = self.mcmc_algorithm._batch([np.matrix(np.ones((6, 2))), None, np.matrix(np.zeros((6, 3)))])
+        self.assertEqual(list(mts.shape), [6, 5])
+        self.assertEqual(self.mcmc_algorithm._slices, [(0, 2), (2, 2), (2, 5)])
+
+    def test_initialise(self):
+        mts, end = self.mcmc_algorithm.initialise()
+        self.assertFalse(end)
+        self.assertEqual(list(mts.shape), [6, 3])
+        self.assertEqual(self.mcmc_algorithm._slices, [(0, 1), (1, 2), (2, 3)])
+
+    def test_iterate(self):
+        mts, end = self.mcmc_algorithm.initialise()
+        # Positive ln_pdf so the first samples are always accepted
+        mts, end = self.mcmc_algorithm.iterate(self._result(mts, [1., 2., 3.]))
+        self.assertFalse(end)
+        self.assertEqual(list(mts.shape), [6, 3])
+        # Tempered ln_likelihood
+        self.assertAlmostEqual(self.mcmc_algorithm.chains[0].ln_likelihood_xi, 1.)
+        self.assertAlmostEqual(self.mcmc_algorithm.chains[1].ln_likelihood_xi, 1.)
+        self.assertAlmostEqual(self.mcmc_algorithm.chains[2].ln_likelihood_xi, 0.75)
+        # Run to the end of the chain
+        while not end:
+            mts, end = self.mcmc_algorithm.iterate(self._result(mts, -np.random.rand(mts.shape[1])))
+        self.assertEqual(mts, [])
+        self.assertTrue(self.mcmc_algorithm._ended[0])
+        self.assertEqual(self.mcmc_algorithm.total_number_samples, 10)
+
+    def test__exchange(self):
+        mts, end = self.mcmc_algorithm.initialise()
+        self.mcmc_algorithm.iterate(self._result(mts, [1., 2., 3.]))
+        chains = self.mcmc_algorithm.chains
+        xi = [chain.xi for chain in chains]
+        # Hotter chain has higher likelihood so always accepted
+        self.mcmc_algorithm._set_state(chains[0], xi[0], -10., False)
+        self.mcmc_algorithm._set_state(chains[1], xi[1], -1., False)
+        self.mcmc_algorithm._step = 2*self.mcmc_algorithm.exchange_interval
+        self.assertEqual(self.mcmc_algorithm._exchange(), [0, 1])
+        self.assertEqual(chains[0].xi, xi[1])
+        self.assertEqual(chains[1].xi, xi[0])
+        self.assertAlmostEqual(chains[0].ln_likelihood_xi, -2.)
+        self.assertAlmostEqual(chains[1].ln_likelihood_xi, -5.)
+        self.assertEqual(self.mcmc_algorithm._exchange_accepted, [1, 0])
+        self.assertEqual(self.mcmc_algorithm._exchange_tried, [1, 0])
+        self.assertEqual(list(self.mcmc_algorithm.exchange_acceptance_rate()), [1., 0.])
+        # Odd pairs
+        self.mcmc_algorithm._step = self.mcmc_algorithm.exchange_interval
+        self.mcmc_algorithm._set_state(chains[2], xi[2], -np.inf, False)
+        self.assertEqual(self.mcmc_algorithm._exchange(), [])
+        self.assertEqual(self.mcmc_algorithm._exchange_tried, [1, 0])
+
+    def test_output(self):
+        mcmc_algorithm = MultipleChainMetropolisHastingsGaussianTape(number_chains=2, chain_length=20, learning_length=0)
+        mts, end = mcmc_algorithm.initialise()
+        while not end:
+            mts, end = mcmc_algorithm.iterate(self._result(mts, -np.random.rand(mts.shape[1])))
+        output, output_string = mcmc_algorithm.output(True, False, 0)
+        self.assertEqual(output['total_number_samples'], 20)
+        # Each chain includes the current sample at the end of the chain
+        self.assertEqual(list(output['moment_tensor_space'].shape), [6, 22])
+        self.assertEqual(output['number_chains'], 2)
+        self.assertEqual(list(output['gelman_rubin'].shape), [6])
+        self.assertEqual(list(output['temperatures']), [1., 1.])
+        self.assertTrue('Gelman-Rubin' in output_string)
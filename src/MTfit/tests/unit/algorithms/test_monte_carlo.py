@@ -157,3 +157,19 @@ class IterationSampleTestCase(unittest.TestCase):
         self.assertEqual(moment_tensors.shape, (6, self.iteration_sample.number_samples))
         self.assertTrue(end)
         self.assertEqual(self.iteration_sample.iteration, 6)
+
+    def test_iterate_max_retained_samples(self):
+        self.iteration_sample = IterationSample(max_samples=30000, max_retained_samples=100, streaming_discard=10000)
+        self.assertEqual(self.iteration_sample.pdf_sample.max_retained, 100)
+        self.assertEqual(self.iteration_sample.pdf_sample.discard, 10000)
+        self.assertEqual(self.iteration_sample.pdf_sample.n_samples, 30000)
+        self.iteration_sample.initialise()
+        for i in range(3):
+            moment_tensors, end = self.iteration_sample.iterate({'moment_tensors': self.iteration_sample.random_mt(),
+                                                                 'ln_pdf': np.random.rand(1, self.iteration_sample.number_samples),
+                                                                 'n': self.iteration_sample.number_samples})
+            self.assertTrue(self.iteration_sample.pdf_sample._i <= 200)
+        self.assertEqual(self.iteration_sample.number_non_zero(), 30000)
+        self.assertTrue(end)
+        output, output_string = self.iteration_sample.output(discard=0)
+        self.assertEqual(output['moment_tensor_space'].shape[1], 100)
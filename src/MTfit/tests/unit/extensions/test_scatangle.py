@@ -149,3 +149,183 @@ class ScatangleTestCase(unittest.TestCase):
         self.assertEqual(len(AC), 1)
         self.assertEqual(BPy, BC)
         os.remove('test.scatangle')
+
+    def test_read_scatangle(self):
+        open('test.scatangle', 'w').write(self.station_angles())
+        names, azimuth, takeoff_angle, multipliers = scatangle.read_scatangle('test.scatangle')
+        A, B = scatangle._parse_scatangle_lines(open('test.scatangle').readlines())[:2]
+        self.assertEqual(names, A[0]['Name'])
+        self.assertEqual(azimuth.shape, (2, 26))
+        self.assertEqual(takeoff_angle.shape, (2, 26))
+        self.assertEqual(multipliers.tolist(), B)
+        for i, record in enumerate(A):
+            self.assertEqual(azimuth[i].tolist(), record['Azimuth'].flatten().tolist()[0])
+            self.assertEqual(takeoff_angle[i].tolist(), record['TakeOffAngle'].flatten().tolist()[0])
+        # Chunks
+        open('test.scatangle', 'w').write('\n'.join([self.station_angles() for i in range(40)]))
+        names, azimuth, takeoff_angle, multipliers = scatangle.read_scatangle('test.scatangle')
+        chunk_names, chunk_azimuth, chunk_takeoff_angle, chunk_multipliers = scatangle.read_scatangle('test.scatangle', chunk_size=1000)
+        self.assertEqual(names, chunk_names)
+        self.assertEqual(azimuth.shape, (80, 26))
+        self.assertEqual(azimuth.tolist(), chunk_azimuth.tolist())
+        self.assertEqual(takeoff_angle.tolist(), chunk_takeoff_angle.tolist())
+        self.assertEqual(multipliers.tolist(), chunk_multipliers.tolist())
+        # Sub-sampling
+        names, azimuth, takeoff_angle, multipliers = scatangle.read_scatangle('test.scatangle', 5, chunk_size=1000)
+        self.assertEqual(azimuth.shape, (5, 26))
+        self.assertEqual(takeoff_angle.shape, (5, 26))
+        self.assertEqual(len(multipliers), 5)
+        self.assertTrue(set(azimuth[:, 0].tolist()).issubset(set([231.1, 230.9])))
+
+    def test_read_scatangle_station_order(self):
+        samples = self.station_angles().split('\n\n')
+        lines = samples[1].split('\n')
+        samples[1] = '\n'.join([lines[0]]+lines[1:][::-1])
+        open('test.scatangle', 'w').write('\n\n'.join(samples))
+        names, azimuth, takeoff_angle, multipliers = scatangle.read_scatangle('test.scatangle')
+        self.assertEqual(azimuth.shape, (2, 26))
+        self.assertEqual(azimuth[1, names.index('S0271')], 230.9)
+        self.assertEqual(takeoff_angle[1, names.index('S0236')], 118.7)
+        # Different stations
+        samples[1] = '\n'.join(lines[:-1])
+        open('test.scatangle', 'w').write('\n\n'.join(samples))
+        with self.assertRaises(ValueError):
+            scatangle.read_scatangle('test.scatangle')
+        A, B = parse_scatangle('test.scatangle')
+        self.assertEqual(len(A), 2)
+        self.assertEqual(len(A[1]['Name']), 25)
+
+    def test_binary_scatangle(self):
+        open('test.scatangle', 'w').write(self.station_angles())
+        self.assertFalse(scatangle.is_binary_scatangle('test.scatangle'))
+        binary_filename = scatangle.convert_scatangle_to_binary('test.scatangle')
+        self.assertEqual(binary_filename, 'test'+scatangle.SCATANGLE_BINARY_EXTENSION)
+        self.assertTrue(scatangle.is_binary_scatangle(binary_filename))
+        names, azimuth, takeoff_angle, multipliers = scatangle.read_scatangle('test.scatangle')
+        binary_names, binary_azimuth, binary_takeoff_angle, binary_multipliers = scatangle.read_binary_scatangle(binary_filename)
+        self.assertEqual(names, binary_names)
+        self.assertEqual(azimuth.tolist(), binary_azimuth.tolist())
+        self.assertEqual(str(binary_azimuth.dtype), 'float64')
+        self.assertEqual(takeoff_angle.tolist(), binary_takeoff_angle.tolist())
+        self.assertEqual(multipliers.tolist(), binary_multipliers.tolist())
+        A, B = parse_scatangle('test.scatangle')
+        binary_A, binary_B = scatangle.location_pdf_parser(binary_filename)
+        self.assertEqual(B, binary_B)
+        self.assertEqual(A[0]['Name'], binary_A[0]['Name'])
+        self.assertEqual(A[1]['Azimuth'].tolist(), binary_A[1]['Azimuth'].tolist())
+        self.assertEqual(len(scatangle.read_scatangle(binary_filename, 1)[1]), 1)
+        with self.assertRaises(ValueError):
+            scatangle.read_binary_scatangle('test.scatangle')
+        del binary_azimuth, binary_takeoff_angle, binary_multipliers, binary_A
+        os.remove(binary_filename)
+
+    def test_grid_bin_samples(self):
+        import numpy as np
+        np.random.seed(0)
+        values = np.random.rand(200, 8)*np.array([1, 1, 1, 1, 10, 10, 10, 10])
+        multipliers = np.random.rand(200)
+        for tolerance in [0.1, 0.5, 2]:
+            # Pairwise binning
+            binned = np.ones(200, dtype=bool)
+            pairwise_multipliers = multipliers.copy()
+            for u in range(200):
+                if binned[u]:
+                    for v in range(u+1, 200):
+                        if binned[v] and np.all(np.abs(values[u]-values[v]) < tolerance):
+                            pairwise_multipliers[u] += pairwise_multipliers[v]
+                            binned[v] = False
+            indices, grid_multipliers = scatangle.grid_bin_samples(values, multipliers, tolerance)
+            self.assertEqual(indices.tolist(), np.flatnonzero(binned).tolist())
+            self.assertTrue(np.allclose(grid_multipliers, pairwise_multipliers[binned]))
+            self.assertAlmostEqual(grid_multipliers.sum(), multipliers.sum())
+        indices, grid_multipliers = scatangle.grid_bin_samples(np.empty((0, 8)), [], 1)
+        self.assertEqual(len(indices), 0)
+        # Number of cells overflows the int64 keys, so grid dimensions are dropped
+        values = np.array([[0., 0.], [1e6, 1e6], [1e-12, 0.], [1e6, 1e6-1e-12]])
+        order, starts, ends = scatangle.grid_bin_cells(values, 1e-11)
+        self.assertEqual(starts.shape[1], 3)
+        indices, grid_multipliers = scatangle.grid_bin_samples(values, np.ones(4), 1e-11)
+        self.assertEqual(indices.tolist(), [0, 1])
+        self.assertEqual(grid_multipliers.tolist(), [2., 2.])
+        indices, grid_multipliers = scatangle.grid_bin_samples(values, np.ones(4), 1e20)
+        self.assertEqual(indices.tolist(), [0])
+
+    def test_bin_scatangle(self):
+        open('test.scatangle', 'w').write('\n'.join([self.station_angles() for i in range(40)]))
+        old_filename, binned_filename = scatangle.bin_scatangle('test.scatangle', bin_size=1)
+        self.assertEqual(old_filename, 'test.scatangle')
+        self.assertEqual(binned_filename, 'test_bin_1.scatangle')
+        A, B = parse_scatangle('test.scatangle', bin_size=1)
+        binned_A, binned_B = parse_scatangle(binned_filename)
+        self.assertEqual(len(binned_A), len(A))
+        self.assertAlmostEqual(sum(binned_B), sum(B))
+        self.assertEqual(binned_A[0]['Azimuth'].tolist(), A[0]['Azimuth'].tolist())
+        self.assertFalse(os.path.exists(scatangle._bin_state_filename(binned_filename)))
+
+    def test_bin_angle_chunks(self):
+        import numpy as np
+
+        class SerialJobPool(object):
+
+            def __init__(self):
+                self.results = []
+
+            def custom_task(self, task, *args):
+                self.results.append(task(*args)())
+
+            def all_results(self):
+                results = self.results[::-1]
+                self.results = []
+                return results
+
+        np.random.seed(0)
+        angles = np.random.rand(100, 6)*4
+        angles[50:] = angles[:50]+0.1
+        multipliers = np.random.rand(100)
+        indices, binned_multipliers = scatangle._bin_angle_chunks(angles, multipliers, 1.0)
+        self.assertEqual(indices.tolist(), scatangle.bin_angles(angles, multipliers, 1.0)[0].tolist())
+        chunk_indices, chunk_multipliers = scatangle._bin_angle_chunks(angles, multipliers, 1.0, SerialJobPool(), 30)
+        self.assertAlmostEqual(chunk_multipliers.sum(), multipliers.sum())
+        self.assertTrue(len(chunk_indices) <= 50)
+        self.assertEqual(chunk_indices.tolist(), sorted(chunk_indices.tolist()))
+        self.assertEqual(chunk_indices.tolist(), indices.tolist())
+        # Same chunks without the job pool
+        serial_indices, serial_multipliers = scatangle._bin_angle_chunks(angles, multipliers, 1.0, None, 30)
+        self.assertEqual(serial_indices.tolist(), chunk_indices.tolist())
+        self.assertEqual(serial_multipliers.tolist(), chunk_multipliers.tolist())
+        # Chunk bins are looser than a single pass, so the samples are only chunked if requested
+        angles = np.array([[0., 0.], [0., 0.9], [0., 0.45], [0., 0.85]])
+        multipliers = np.ones(4)
+        self.assertEqual(scatangle._bin_angle_chunks(angles, multipliers, 1.0, None, 2)[1].tolist(), [3., 1.])
+        with mock.patch('MTfit.extensions.scatangle.BIN_SCATANGLE_CHUNK_SIZE', 2):
+            indices, binned_multipliers = scatangle._bin_angle_chunks(angles, multipliers, 1.0)
+            self.assertEqual(indices.tolist(), scatangle.bin_angles(angles, multipliers, 1.0)[0].tolist())
+            self.assertEqual(binned_multipliers.tolist(), [2., 2.])
+            scatangle._output_scatangle_arrays('test.scatangle', ['S01'], angles[:, 1:], angles[:, :1], multipliers)
+            binned_filename = scatangle.bin_scatangle('test.scatangle', bin_size=1)[1]
+            self.assertEqual(parse_scatangle(binned_filename)[1], [2., 2.])
+
+    def test_bin_scatangle_incremental(self):
+        samples = self.station_angles()
+        open('test.scatangle', 'w').write(samples)
+        binned_filename = scatangle.bin_scatangle('test.scatangle', bin_size=1, incremental=True)[1]
+        self.assertTrue(os.path.exists(scatangle._bin_state_filename(binned_filename)))
+        self.assertEqual(parse_scatangle(binned_filename)[1], [1009.4])
+        # Append samples
+        open('test.scatangle', 'a').write(samples.replace('504.7', '10.0').replace('S0271   231.1', 'S0271   100.1').replace('S0271   230.9', 'S0271   100.0'))
+        with mock.patch('MTfit.extensions.scatangle.read_scatangle', wraps=scatangle.read_scatangle) as read_scatangle:
+            scatangle.bin_scatangle('test.scatangle', bin_size=1, incremental=True)
+            self.assertEqual(read_scatangle.call_args_list[0][1]['offset'], len(samples))
+        A, B = parse_scatangle(binned_filename)
+        self.assertEqual(B, [1009.4, 20.0])
+        self.assertEqual(A[1]['Azimuth'][0, 0], 100.1)
+        # No new samples
+        with mock.patch('MTfit.extensions.scatangle.read_scatangle') as read_scatangle:
+            scatangle.bin_scatangle('test.scatangle', bin_size=1, incremental=True)
+            self.assertFalse(read_scatangle.called)
+        # Changed file
+        open('test.scatangle', 'w').write(samples.replace('504.7', '1.0'))
+        scatangle.bin_scatangle('test.scatangle', bin_size=1, incremental=True)
+        self.assertEqual(parse_scatangle(binned_filename)[1], [2.0])
+        scatangle.bin_scatangle('test.scatangle', bin_size=1)
+        self.assertFalse(os.path.exists(scatangle._bin_state_filename(binned_filename)))
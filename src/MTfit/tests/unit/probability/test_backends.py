@@ -0,0 +1,99 @@
+"""
+test_backends.py
+****************
+
+Tests for src/probability/backends.py
+"""
+
+import unittest
+import sys
+
+import numpy as np
+
+from MTfit.utilities.unittest_utils import TestCase
+from MTfit.utilities.unittest_utils import get_extension_skip_if_args
+from MTfit.probability import backends
+from MTfit.probability.backends import ForwardModelBackend
+from MTfit.probability.backends import NumpyChunkedBackend
+from MTfit.probability.backends import get_backends
+from MTfit.probability.backends import get_backend
+from MTfit.probability.backends import calibrate
+
+if sys.version_info >= (3, 3):
+    from unittest import mock
+else:
+    import mock
+
+C_EXTENSIONS = get_extension_skip_if_args('MTfit.probability.cprobability')
+
+
+class DummyBackend(ForwardModelBackend):
+
+    name = 'dummy'
+
+    def combined_ln_pdf(self, mt, *args, **kwargs):
+        return np.zeros(mt.shape[1])
+
+
+class BackendsTestCase(TestCase):
+
+    def setUp(self):
+        self.selected_backends = backends._SELECTED_BACKENDS.copy()
+        backends._SELECTED_BACKENDS.clear()
+
+    def tearDown(self):
+        backends._SELECTED_BACKENDS.clear()
+        backends._SELECTED_BACKENDS.update(self.selected_backends)
+
+    def test_get_backends(self):
+        available_backends = get_backends()
+        self.assertTrue('numpy-chunked' in available_backends)
+        self.assertTrue(isinstance(available_backends['numpy-chunked'], NumpyChunkedBackend))
+        self.assertEqual('cython' in available_backends, not C_EXTENSIONS[0])
+        # Entry point backends can be classes or instances, and unavailable backends are ignored
+        unavailable = DummyBackend()
+        unavailable.available = lambda: False
+        with mock.patch('MTfit.probability.backends.get_extensions',
+                        return_value=(['numpy-chunked', 'dummy', 'unavailable'], {'numpy-chunked': NumpyChunkedBackend, 'dummy': DummyBackend(),
+                                                                                   'unavailable': unavailable})):
+            available_backends = get_backends()
+        self.assertEqual(sorted(available_backends.keys()), ['dummy', 'numpy-chunked'])
+
+    def test_get_backend(self):
+        self.assertEqual(get_backend('numpy-chunked').name, 'numpy-chunked')
+        self.assertRaises(ValueError, get_backend, 'not-a-backend')
+        with mock.patch('MTfit.probability.backends.get_backends', return_value={'numpy-chunked': NumpyChunkedBackend()}):
+            self.assertEqual(get_backend().name, 'numpy-chunked')
+            # No calibration with a single backend
+            self.assertEqual(backends._SELECTED_BACKENDS, {})
+            # The NumPy backend cannot generate samples
+            self.assertTrue(get_backend(generate_samples=True) is None)
+        with mock.patch('MTfit.probability.backends.get_backends', return_value={'numpy-chunked': NumpyChunkedBackend(), 'dummy': DummyBackend()}):
+            with mock.patch('MTfit.probability.backends.calibrate', return_value={'numpy-chunked': 1., 'dummy': 0.1}) as calibrate_mock:
+                self.assertEqual(get_backend('auto').name, 'dummy')
+                # The calibration result is cached
+                self.assertEqual(get_backend(None).name, 'dummy')
+                self.assertEqual(calibrate_mock.call_count, 1)
+                get_backend(number_threads=2)
+                self.assertEqual(calibrate_mock.call_count, 2)
+
+    def test_calibrate(self):
+        times = calibrate({'numpy-chunked': NumpyChunkedBackend(), 'base': ForwardModelBackend()}, size=(100, 5, 2), repeats=1)
+        self.assertTrue(0 < times['numpy-chunked'] < np.inf)
+        self.assertEqual(times['base'], np.inf)
+
+    @unittest.skipIf(*C_EXTENSIONS)
+    def test_combined_ln_pdf(self):
+        available_backends = get_backends()
+        args = backends._calibration_data(500, 10, 5)
+        multipliers = np.log(np.arange(1., 6.))
+        ln_pdf = np.asarray(available_backends['cython'].combined_ln_pdf(*args, marginalised=True, location_samples_multipliers=multipliers)).flatten()
+        numpy_ln_pdf = np.asarray(available_backends['numpy-chunked'].combined_ln_pdf(*args, marginalised=True,
+                                                                                     location_samples_multipliers=multipliers)).flatten()
+        self.assertEqual(np.isfinite(ln_pdf).tolist(), np.isfinite(numpy_ln_pdf).tolist())
+        self.assertAlmostEqual(np.abs(ln_pdf-numpy_ln_pdf)[np.isfinite(ln_pdf)].max(), 0, 8)
+        # Bounded location marginalisation
+        for backend in ['cython', 'numpy-chunked']:
+            bounded_ln_pdf = np.asarray(available_backends[backend].combined_ln_pdf(*args, marginalised=True, location_samples_multipliers=multipliers,
+                                                                                     location_tolerance=1e-3)).flatten()
+            self.assertTrue(((ln_pdf-bounded_ln_pdf)[np.isfinite(ln_pdf)] < 1.1e-3).all())
@@ -11,6 +11,10 @@ from MTfit.probability.probability import gaussian_pdf
 from MTfit.probability.probability import ratio_pdf
 from MTfit.probability.probability import amplitude_ratio_ln_pdf
 from MTfit.probability.probability import relative_amplitude_ratio_ln_pdf
+from MTfit.probability.probability import combined_ln_pdf
+from MTfit.probability.probability import ratio_pdf_bound
+from MTfit.probability.probability import ln_likelihood_upper_bound
+from MTfit.probability.probability import ln_location_bounds
 from MTfit.probability.probability import scale_estimator
 from MTfit.probability.probability import ln_marginalise
 from MTfit.probability.probability import ln_normalise
@@ -19,6 +23,10 @@ from MTfit.probability.probability import model_probabilities
 from MTfit.probability.probability import dkl
 from MTfit.probability.probability import dkl_estimate
 from MTfit.probability.probability import LnPDF
+from MTfit.probability.probability import polarity_station_rejections
+from MTfit.probability.probability import greedy_station_order
+from MTfit.probability.probability import station_evaluations
+from MTfit.probability.probability import PolarityStationOrder
 from MTfit.probability import probability
 from MTfit.utilities import C_EXTENSION_FALLBACK_LOG_MSG
 from MTfit.utilities.unittest_utils import get_extension_skip_if_args
@@ -824,6 +832,96 @@ class ProbabilityTestCase(TestCase):
                                np.log(2.8209507386866988)+np.log(0.42262614), 4)  # Values checked against working MATLAB code
         logger.info.assert_not_called()
 
+    @mock.patch('MTfit.probability.probability.logger')
+    def test_combined_ln_pdf(self, logger):
+        np.random.seed(0)
+        a = np.random.randn(5, 3, 6)
+        a1 = np.random.randn(5, 3, 6)
+        a2 = np.random.randn(5, 3, 6)
+        mt = np.random.randn(6, 101)
+        mt /= np.sqrt((mt*mt).sum(0))
+        error = 0.3*np.ones(5)
+        z = np.abs(np.random.randn(5))
+        pe = 0.2*np.ones(5)
+        polarity_prob = [np.random.rand(5), np.random.rand(5)]
+        multipliers = np.log(np.array([0.2, 0.3, 0.5]))
+        with PythonOnly():
+            ln_p_polarity = polarity_ln_pdf(a, mt, error.copy(), 0.1)
+            ln_p_polarity_probability = polarity_probability_ln_pdf(a, mt, polarity_prob[0], polarity_prob[1], 0.1)
+            ln_p_amplitude_ratio = amplitude_ratio_ln_pdf(z, mt, a1, a2, pe.copy(), pe.copy())
+        for args, ln_p in [((a, error, False, False, False, False, False, False, False), ln_p_polarity),
+                           ((False, False, a1, a2, z, pe, pe, a, polarity_prob), ln_p_polarity_probability+ln_p_amplitude_ratio),
+                           ((a, error, a1, a2, z, pe, pe, a, polarity_prob), ln_p_polarity+ln_p_polarity_probability+ln_p_amplitude_ratio)]:
+            ln_p = ln_p+multipliers.reshape(3, 1)
+            for block_elements in [1000000, 7]:
+                result = combined_ln_pdf(mt, *args, incorrect_polarity_prob=0.1, location_samples_multipliers=multipliers, block_elements=block_elements)
+                self.assertEqual(result.shape, (3, 101))
+                self.assertTrue(np.array_equal(np.isfinite(result), np.isfinite(ln_p)))
+                self.assertTrue(np.allclose(result[np.isfinite(ln_p)], ln_p[np.isfinite(ln_p)]))
+                result = combined_ln_pdf(mt, *args, incorrect_polarity_prob=0.1, location_samples_multipliers=multipliers, block_elements=block_elements,
+                                         marginalised=True)
+                self.assertEqual(result.shape, (1, 101))
+                self.assertTrue(np.allclose(result[0], ln_marginalise(ln_p), equal_nan=True))
+        self.assertTrue(np.array_equal(combined_ln_pdf(mt, a, error, False, False, False, False, False, False, False, block_size=10),
+                                       combined_ln_pdf(mt, a, error, False, False, False, False, False, False, False)))
+        ln_p = combined_ln_pdf(mt, a, error, False, False, False, False, False, False, False)
+        ln_p_single = combined_ln_pdf(mt, a, error, False, False, False, False, False, False, False, single_precision=True)
+        self.assertTrue(np.array_equal(np.isfinite(ln_p), np.isfinite(ln_p_single)))
+        self.assertAlmostEqual(np.abs(ln_p_single-ln_p)[np.isfinite(ln_p)].max(), 0, 4)
+        self.assertRaises(NotImplementedError, combined_ln_pdf, False, a, error, False, False, False, False, False, False, False, generate_samples=100)
+        self.assertRaises(ValueError, combined_ln_pdf, mt, False, False, False, False, False, False, False, False, False)
+
+    def test_combined_ln_pdf_location_tolerance(self):
+        np.random.seed(0)
+        a = np.random.randn(5, 80, 6)
+        a1 = np.random.randn(5, 80, 6)
+        a2 = np.random.randn(5, 80, 6)
+        mt = np.random.randn(6, 101)
+        mt /= np.sqrt((mt*mt).sum(0))
+        error = 0.3*np.ones(5)
+        z = np.abs(np.random.randn(5))
+        pe = 0.2*np.ones(5)
+        polarity_prob = [np.random.rand(5), np.random.rand(5)]
+        multipliers = -0.2*np.arange(80.)
+        for args in [(a, error, False, False, False, False, False, False, False), (a, error, a1, a2, z, pe, pe, a, polarity_prob)]:
+            ln_p = combined_ln_pdf(mt, *args, marginalised=True, location_samples_multipliers=multipliers)
+            for tolerance in [1e-2, 1e-12]:
+                ln_p_bounded = combined_ln_pdf(mt, *args, marginalised=True, location_samples_multipliers=multipliers, location_tolerance=tolerance)
+                self.assertTrue(np.array_equal(np.isfinite(ln_p), np.isfinite(ln_p_bounded)))
+                difference = (ln_p-ln_p_bounded)[np.isfinite(ln_p)]
+                self.assertTrue((difference > -1e-12).all())
+                self.assertTrue((difference < -np.log(1-tolerance)+1e-12).all())
+        # Not marginalised so all the location samples are evaluated
+        self.assertTrue(np.array_equal(combined_ln_pdf(mt, a, error, False, False, False, False, False, False, False, location_samples_multipliers=multipliers,
+                                                       location_tolerance=1e-2),
+                                       combined_ln_pdf(mt, a, error, False, False, False, False, False, False, False, location_samples_multipliers=multipliers)))
+
+    def test_ratio_pdf_bound(self):
+        bound = ratio_pdf_bound([0.1, 0.5, 0.001, 0], [0.2, 0.5, 0.001, 0.1])
+        self.assertEqual(bound[3], np.inf)
+        for i, (psx, psy) in enumerate([(0.1, 0.2), (0.5, 0.5), (0.001, 0.001)]):
+            t = np.exp(np.linspace(-5, 5, 200001))
+            scaled_pdf = t*(ratio_pdf(t, 1., 1., psx, psy)+ratio_pdf(-t, 1., 1., psx, psy))
+            self.assertTrue(np.nanmax(scaled_pdf) <= bound[i] < 1.01*np.nanmax(scaled_pdf))
+
+    def test_ln_likelihood_upper_bound(self):
+        self.assertEqual(ln_likelihood_upper_bound(), 0)
+        self.assertAlmostEqual(ln_likelihood_upper_bound(polarity_prob=[np.array([0.8, 0.1, 0.3]), np.array([0.2, 0.6, 0.3])]), np.log(0.8*0.6*0.5))
+        z = np.array([0.5, 2.])
+        pe = np.array([0.1, 0.2])
+        self.assertAlmostEqual(ln_likelihood_upper_bound(amplitude_ratio=z, percentage_error1_amplitude_ratio=pe, percentage_error2_amplitude_ratio=pe),
+                               np.log(ratio_pdf_bound(pe, pe)/z).sum())
+        self.assertAlmostEqual(ln_likelihood_upper_bound(amplitude_ratio=z, percentage_error1_amplitude_ratio=pe, percentage_error2_amplitude_ratio=pe,
+                                                         ratio_pdf_max_error=1e-4),
+                               np.log(ratio_pdf_bound(pe, pe)/z).sum()+2e-4)
+
+    def test_ln_location_bounds(self):
+        bounds = ln_location_bounds(np.log([3., 2., 1.]), 0.1, np.log(0.5))
+        self.assertEqual(bounds.shape, (4,))
+        self.assertTrue(np.allclose(np.exp(bounds[:3]), np.array([6., 3., 1.])*0.5/0.1))
+        self.assertEqual(bounds[3], -np.inf)
+        self.assertRaises(ValueError, ln_location_bounds, np.zeros(3), 0, 0.)
+
     @mock.patch('MTfit.probability.probability.logger')
     def test_relative_amplitude_ratio_ln_pdf(self, logger):
         with PythonOnly():
@@ -988,6 +1086,90 @@ class ProbabilityTestCase(TestCase):
         self.assertAlmostEqual(dkl_estimate(np.ascontiguousarray(ln_p), 10, n), dkl(
             ln_p, np.log(np.ones(x.shape)/10.), 10./n))
 
+    def test_polarity_station_rejections(self):
+        a = np.array([[[1, 0, 0, 0, 0, 0]], [[0, 1, 0, 0, 0, 0]]], dtype=np.float64)
+        mt = np.array([[1, -1, 1], [1, 1, -1], [0, 0, 0], [0, 0, 0], [0, 0, 0], [0, 0, 0]], dtype=np.float64)
+        rejections = polarity_station_rejections(a, mt, np.array([0., 0.]))
+        self.assertEqual(rejections.shape, (2, 3))
+        self.assertEqual(rejections.tolist(), [[False, True, False], [False, False, True]])
+        self.assertFalse(polarity_station_rejections(a, mt, np.array([1., 1.])).any())
+        self.assertFalse(polarity_station_rejections(a, mt, np.array([0., 0.]), np.array([0.1, 0.1])).any())
+
+    def test_greedy_station_order(self):
+        rejections = np.array([[1, 0, 0, 0, 0, 0],
+                               [1, 1, 1, 0, 0, 0],
+                               [0, 0, 0, 0, 0, 0],
+                               [1, 1, 1, 1, 0, 0]], dtype=bool)
+        self.assertEqual(greedy_station_order(rejections).tolist(), [3, 0, 1, 2])
+        # Redundant stations are left at the end in the original order
+        rejections = np.array([[0, 0, 0, 1],
+                               [1, 1, 0, 0],
+                               [1, 1, 0, 0],
+                               [0, 0, 1, 0]], dtype=bool)
+        self.assertEqual(greedy_station_order(rejections).tolist(), [1, 0, 3, 2])
+        self.assertEqual(greedy_station_order(np.zeros((3, 4), dtype=bool)).tolist(), [0, 1, 2])
+
+    def test_station_evaluations(self):
+        rejections = np.array([[0, 0, 0, 0],
+                               [0, 0, 0, 0],
+                               [1, 1, 0, 0],
+                               [0, 0, 1, 0]], dtype=bool)
+        self.assertAlmostEqual(station_evaluations(rejections), 10/3.)
+        self.assertAlmostEqual(station_evaluations(rejections, np.array([2, 3, 0, 1])), 4/3.)
+        self.assertEqual(station_evaluations(np.zeros((3, 4), dtype=bool)), 0)
+
+
+class PolarityStationOrderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # The last station rejects half the samples, the first station rejects none
+        self.a = np.array([[[0, 0, 0, 0, 0, 0]], [[0, 0, 1, 0, 0, 0]], [[1, 0, 0, 0, 0, 0]]], dtype=np.float64)
+        self.mt = np.random.randn(6, 1000)
+        self.mt /= np.sqrt(np.sum(self.mt*self.mt, 0))
+        self.mt[2, :] = np.abs(self.mt[2, :])
+        self.sigma = np.array([0., 0., 0.])
+        self.station_order = PolarityStationOrder(interval=2)
+
+    def tearDown(self):
+        del self.station_order
+
+    def test_update(self):
+        self.assertEqual(self.station_order.update(self.a, self.mt, self.sigma).tolist(), [2, 0, 1])
+        self.assertEqual(self.station_order.rejections.shape, (3, 1000))
+        self.station_order.max_rejections = 1500
+        self.station_order.update(self.a, self.mt, self.sigma)
+        self.assertEqual(self.station_order.rejections.shape, (3, 1500))
+
+    def test___call__(self):
+        a, sigma, incorrect = self.station_order(self.a, self.mt, self.sigma, np.array([0., 0., 0.]))
+        self.assertEqual(self.station_order.number_calls, 1)
+        self.assertTrue((a == self.a[[2, 0, 1]]).all())
+        self.assertTrue(a.flags['C_CONTIGUOUS'])
+        self.assertEqual(sigma.shape, (3,))
+        # The order is only updated every interval calls
+        incorrect_polarity_probability = np.array([0.1, 0.2, 0.3])
+        a, sigma, incorrect = self.station_order(self.a, self.mt, self.sigma, incorrect_polarity_probability)
+        self.assertEqual(self.station_order.number_calls, 2)
+        self.assertTrue((a == self.a[[2, 0, 1]]).all())
+        self.assertEqual(incorrect.tolist(), [0.3, 0.1, 0.2])
+        self.assertTrue(self.station_order(self.a, self.mt, self.sigma, incorrect_polarity_probability)[0] is a)
+        # Unknown samples (generating samples) use random samples for the update
+        station_order = PolarityStationOrder()
+        a, sigma, incorrect = station_order(self.a, False, self.sigma, 0.0)
+        # Both constrained stations reject half of the random samples, so either can be first
+        self.assertEqual(sorted(station_order.order[:2].tolist()), [1, 2])
+        self.assertEqual(station_order.order[2], 0)
+        self.assertEqual(incorrect, 0.0)
+        # Identity order returns the inputs
+        station_order = PolarityStationOrder()
+        a = self.a[[2, 0, 1]]
+        self.assertTrue(station_order(a, self.mt, self.sigma)[0] is a)
+
+    def test_probability(self):
+        a, sigma, incorrect = self.station_order(self.a, self.mt, self.sigma)
+        self.assertAlmostEqual(float(np.sum(np.exp(polarity_ln_pdf(a, self.mt, sigma)))),
+                               float(np.sum(np.exp(polarity_ln_pdf(self.a, self.mt, self.sigma)))))
+
 
 class LnPDFTestCase(unittest.TestCase):
 
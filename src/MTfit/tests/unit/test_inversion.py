@@ -26,10 +26,16 @@ from MTfit.inversion import amplitude_ratio_matrix
 from MTfit.inversion import relative_amplitude_ratio_matrix
 from MTfit.inversion import _intersect_stations
 from MTfit.inversion import station_angles
+from MTfit.inversion import station_angle_coefficients
+from MTfit.inversion import LocationSampleCoefficients
+from MTfit.inversion import LocationSampleRecords
+from MTfit.inversion import location_sample_coefficients
 from MTfit.extensions.scatangle import parse_scatangle
 from MTfit.algorithms import markov_chain_monte_carlo as mcmc
+from MTfit.probability.backends import ForwardModelBackend
 from MTfit.utilities import C_EXTENSION_FALLBACK_LOG_MSG
 from MTfit.utilities.unittest_utils import get_extension_skip_if_args
+from MTfit.utilities.location_cache import file_hash
 
 logger = logging.getLogger('MTfit.tests')
 
@@ -40,6 +46,7 @@ else:
 
 
 C_EXTENSIONS = get_extension_skip_if_args('MTfit.algorithms.cmarkov_chain_monte_carlo')
+C_PROBABILITY = get_extension_skip_if_args('MTfit.probability.cprobability')
 
 
 class PythonAlgorithms(object):
@@ -150,6 +157,13 @@ class McMCForwardTaskTestCase(TestCase):
             result = self.mcmc_forward_task()
             self.assertIn(mock.call(C_EXTENSION_FALLBACK_LOG_MSG), logger.info.call_args_list)
 
+    @mock.patch('MTfit.algorithms.markov_chain_monte_carlo.logger')
+    def test_number_threads(self, logger):
+        self.mcmc_forward_task.algorithm_kwargs['number_threads'] = 2
+        with mock.patch('MTfit.inversion.ForwardTask', wraps=ForwardTask) as forward_task:
+            self.mcmc_forward_task()
+        self.assertEqual(forward_task.call_args[1]['number_threads'], 2)
+
 
 class MultipleEventsMcMCForwardTaskTestCase(TestCase):
 
@@ -656,6 +670,13 @@ class MultipleEventsForwardTaskTestCase(TestCase):
         # Add valid calculation (non-zero prob)
         #
 
+    def test_number_threads(self):
+        self.assertEqual(self.multiple_events_forward_task.number_threads, 1)
+        self.multiple_events_forward_task.number_threads = 2
+        with mock.patch('MTfit.inversion.ForwardTask', wraps=ForwardTask) as forward_task:
+            self.multiple_events_forward_task()
+        self.assertEqual(forward_task.call_args[1]['number_threads'], 2)
+
 
 class ForwardTaskTestCase(TestCase):
 
@@ -990,6 +1011,63 @@ class ForwardTaskTestCase(TestCase):
         self.assertAlmostEquals(resultcc['ln_pdf']._ln_pdf[resultcc['ln_pdf']._ln_pdf >= resulto['ln_pdf']._ln_pdf.min()], resulto['ln_pdf']._ln_pdf, 2)
         self.assertAlmostEquals(resulto['ln_pdf']._ln_pdf, resultc['ln_pdf']._ln_pdf, 2)
 
+    def test___call___seeded_random_sample(self):
+        from MTfit.algorithms.base import SeededRandomSample
+        self.forward_task.mt = SeededRandomSample(3, 200)
+        self.forward_task._return_zero = True
+        result = self.forward_task()
+        self.assertEqual(result['n'], 200)
+        self.assertEqual(result['moment_tensors'].shape, (6, 200))
+        self.assertEqual(result['moment_tensors'].tolist(), SeededRandomSample(3, 200)().tolist())
+
+    def test_backend(self):
+        # The backend is resolved when the task is created
+        self.assertTrue(isinstance(self.forward_task.backend, ForwardModelBackend))
+        forward_task = ForwardTask(self.MTs, self.forward_task.a_polarity, self.forward_task.error_polarity, False, False, False, False, False, False, False,
+                                   backend='numpy-chunked')
+        self.assertEqual(forward_task.backend.name, 'numpy-chunked')
+        self.assertRaises(ValueError, ForwardTask, self.MTs, self.forward_task.a_polarity, self.forward_task.error_polarity, False, False, False, False,
+                          False, False, False, backend='not-a-backend')
+
+    @unittest.skipIf(*C_PROBABILITY)
+    def test_backend_generate_samples(self):
+        # The NumPy backend cannot generate samples
+        self.assertRaises(ValueError, ForwardTask, False, self.forward_task.a_polarity, self.forward_task.error_polarity, False, False, False, False,
+                          False, False, False, generate_samples=100, backend='numpy-chunked')
+        forward_task = ForwardTask(False, self.forward_task.a_polarity, self.forward_task.error_polarity, False, False, False, False, False, False, False,
+                                   generate_samples=100)
+        self.assertTrue(forward_task.backend.generates_samples)
+
+    def test__subsample_locations(self):
+        np.random.seed(0)
+        a_polarity = np.random.randn(2, 10, 6)
+        # Location sample index in the first coefficient
+        a_polarity[:, :, 0] = np.arange(10)
+        multipliers = np.arange(1., 11.)
+        ln_multipliers = np.log(multipliers)
+        forward_task = ForwardTask(self.MTs, a_polarity, self.forward_task.error_polarity, False, False, False, False, False, False, False,
+                                   list(multipliers), location_subsample=4)
+        likelihood = np.random.rand(10)
+        estimates = []
+        for i in range(2000):
+            a, a1, a2, a_prob, ln_subsample_multipliers = forward_task._subsample_locations(ln_multipliers)
+            samples = a[0, :, 0].astype(int)
+            self.assertTrue(len(samples) <= 4)
+            self.assertEqual(a.shape, (2, len(samples), 6))
+            self.assertEqual(a_prob, False)
+            self.assertTrue(np.array_equal(a, a_polarity[:, samples, :]))
+            # The multipliers sum to the total multiplier
+            self.assertAlmostEqual(np.exp(ln_subsample_multipliers).sum(), multipliers.sum())
+            estimates.append((np.exp(ln_subsample_multipliers)*likelihood[samples]).sum())
+        # Unbiased estimate of the marginalised likelihood
+        self.assertAlmostEqual(np.mean(estimates)/(multipliers*likelihood).sum(), 1, 1)
+        # Not marginalised or fewer location samples than the subsample size
+        forward_task.marginalise = False
+        self.assertTrue(forward_task._subsample_locations(ln_multipliers)[4] is ln_multipliers)
+        forward_task.marginalise = True
+        forward_task.location_subsample = 10
+        self.assertTrue(forward_task._subsample_locations(ln_multipliers)[0] is a_polarity)
+
     def test_run_times(self):
         raise unittest.SkipTest('Test run times not setup correctly for c vs python')
         combined_times = []
@@ -1274,6 +1352,44 @@ S003,110,10,1,0.05"""
         self.inversion._set_algorithm()
         self.assertTrue('IterativeMultipleTryMetropolisHastingsGaussianTape' in str(self.inversion.algorithm.__class__), str(self.inversion.algorithm.__class__))
 
+    def test___init___gc_policy(self):
+        from MTfit.utilities.memory import get_gc_policy
+        from MTfit.utilities.memory import set_gc_policy
+        policy = get_gc_policy()
+        interval, threshold = policy.interval, policy.threshold
+        try:
+            self.inversion._close_pool()
+            self.inversion = Inversion({'PPolarity': {}}, parallel=self.parallel, phy_mem=1, max_time=10, convert=False, gc_interval=5, gc_threshold=1000)
+            self.assertEqual(policy.interval, 5)
+            self.assertEqual(policy.threshold, 1000)
+            # Unchanged if not set
+            self.inversion._close_pool()
+            self.inversion = Inversion({'PPolarity': {}}, parallel=self.parallel, phy_mem=1, max_time=10, convert=False)
+            self.assertEqual(policy.interval, 5)
+            self.assertEqual(policy.threshold, 1000)
+        finally:
+            set_gc_policy(interval, threshold)
+
+    def test_backend(self):
+        self.assertTrue(isinstance(self.inversion.backend, ForwardModelBackend))
+        self.inversion._close_pool()
+        self.inversion = Inversion({'PPolarity': {}}, parallel=self.parallel, phy_mem=1, max_time=10, convert=False, backend='numpy-chunked')
+        self.assertEqual(self.inversion.backend.name, 'numpy-chunked')
+        self.assertTrue(self.inversion.kwargs['backend'] is self.inversion.backend)
+        self.inversion._close_pool()
+        self.assertRaises(ValueError, Inversion, {'PPolarity': {}}, parallel=self.parallel, phy_mem=1, max_time=10, convert=False, backend='not-a-backend')
+
+    @unittest.skipIf(*C_PROBABILITY)
+    def test_backend_c_generate(self):
+        self.inversion._close_pool()
+        # The NumPy backend cannot generate samples
+        self.assertRaises(ValueError, Inversion, {'PPolarity': {}}, parallel=self.parallel, phy_mem=1, max_time=10, convert=False,
+                          backend='numpy-chunked', c_generate=True)
+        # Samples are not generated in the forward model for McMC
+        self.inversion = Inversion({'PPolarity': {}}, algorithm='mcmc', parallel=self.parallel, phy_mem=1, max_time=10, convert=False,
+                                   backend='numpy-chunked', c_generate=True)
+        self.assertEqual(self.inversion.backend.name, 'numpy-chunked')
+
     def test__worker_params(self):
         self.assertTrue(self.inversion.number_samples > 0)
         if len([u for u in os.environ.keys() if 'PBS_' in u]):
@@ -1306,6 +1422,18 @@ S003,110,10,1,0.05"""
         self.inversion.fid = False
         self.assertEqual(self.inversion._fid({}, 1), self.inversion._path+os.path.sep+'MTfitOutputMT.mat')
 
+    def test__coefficient_precision(self):
+        a = np.random.rand(3, 1, 6)
+        self.assertTrue(self.inversion._coefficient_precision(a, False)[0] is a)
+        self.inversion.single_precision = True
+        self.inversion.generate_samples = 0
+        coefficients = self.inversion._coefficient_precision(a, False)
+        self.assertEqual(coefficients[0].dtype, np.float32)
+        self.assertFalse(coefficients[1])
+        # Generating kernels are double precision
+        self.inversion.generate_samples = 100
+        self.assertTrue(self.inversion._coefficient_precision(a, False)[0] is a)
+
     def test__recover_test(self):
         self.assertFalse(self.inversion._recover_test('RecoverTestMT'))
         self.inversion = Inversion({'UID': 'RecoverTest', 'PPolarity': {'Stations': {'Name': ['S0649', "S0162", "S0083"], 'Azimuth': np.matrix([[90.0], [270.0], [180.]]), 'TakeOffAngle': np.matrix([[30.0], [60.0], [35.]])},
@@ -1405,6 +1533,100 @@ S003,110,10,1,0.05"""
         except Exception:
             pass
 
+    def test__station_angles_location_tolerance(self):
+        station_angles = self.station_angles().split('\n\n')
+        with open('test.scatangle', 'w') as f:
+            f.write(station_angles[0]+'\n\n'+station_angles[1].replace('504.7', '900.0', 1)+'\n\n')
+        self.inversion.location_pdf_files = ['test.scatangle']
+        data = {'PPolarity': {'Stations': {'Name': ['S0649', "S0162", "S0083"], 'Azimuth': np.matrix([[90.0], [270.0], [180.]]), 'TakeOffAngle': np.matrix([[30.0], [60.0], [35.]])},
+                              'Measured': np.matrix([[1], [-1], [-1]]), 'Error': np.matrix([[0.001], [0.5], [0.02]])}}
+        angles = self.inversion._station_angles(data, 0)
+        self.assertEqual(self.inversion.location_sample_multipliers, [504.7, 900.0])
+        # Sorted by decreasing multiplier for the bounded location marginalisation
+        self.inversion.location_tolerance = 1e-3
+        sorted_angles = self.inversion._station_angles(data, 0)
+        self.assertEqual(self.inversion.location_sample_multipliers, [900.0, 504.7])
+        self.assertEqual(self.inversion.location_sample_multipliers_original, [900.0, 504.7])
+        self.assertTrue(np.array_equal(sorted_angles[0], angles[0][:, ::-1, :]))
+        try:
+            os.remove('test.scatangle')
+        except Exception:
+            pass
+
+    def test__read_location_samples(self):
+        with open('test.scatangle', 'w') as f:
+            f.write(self.station_angles())
+        location_samples, multipliers = parse_scatangle('test.scatangle')
+        # Scatangle files are read into the station angle arrays without the location PDF parsers
+        with mock.patch.object(Inversion, '_read_location') as _read_location:
+            records, location_sample_multipliers, coefficients = self.inversion._read_location_samples('test.scatangle')
+            self.assertFalse(_read_location.called)
+        self.assertTrue(isinstance(records, LocationSampleRecords))
+        self.assertTrue(isinstance(coefficients, LocationSampleCoefficients))
+        self.assertEqual(location_sample_multipliers, multipliers)
+        self.assertEqual(len(records), len(location_samples))
+        self.assertEqual(records[1]['Name'], location_samples[1]['Name'])
+        self.assertEqual(records[-1]['Azimuth'].tolist(), location_samples[-1]['Azimuth'].tolist())
+        self.assertEqual([record['TakeOffAngle'].tolist() for record in records], [sample['TakeOffAngle'].tolist() for sample in location_samples])
+        self.assertEqual(len(records[1:]), len(location_samples)-1)
+        # Installed location PDF parser extensions are used rather than reading the file directly
+        parser = mock.MagicMock(return_value=(location_samples, multipliers))
+        with mock.patch('MTfit.inversion.get_extensions', return_value=(['.scatangle'], {'.scatangle': parser})):
+            with mock.patch('MTfit.inversion.read_scatangle') as read_scatangle:
+                records, location_sample_multipliers, coefficients = self.inversion._read_location_samples('test.scatangle')
+                self.assertFalse(read_scatangle.called)
+        parser.assert_called_once_with('test.scatangle')
+        self.assertEqual(location_sample_multipliers, multipliers)
+        self.assertEqual(len(records), len(location_samples))
+        # Location cache keyed on the file contents
+        self.inversion.location_cache = True
+        self.inversion.location_cache_content_hash = True
+        records, location_sample_multipliers, coefficients = self.inversion._read_location_samples('test.scatangle')
+        self.assertEqual(coefficients.cache.key, file_hash('test.scatangle'))
+        self.assertEqual(location_sample_multipliers, multipliers)
+        try:
+            os.remove('test.scatangle')
+        except Exception:
+            pass
+
+    def test__station_angles_location_cache(self):
+        with open('test.scatangle', 'w') as f:
+            f.write(self.station_angles())
+        self.inversion.location_pdf_files = ['test.scatangle']
+        data = {'PPolarity': {'Stations': {'Name': ['S0649', "S0162", "S0083"], 'Azimuth': np.matrix([[90.0], [270.0], [180.]]), 'TakeOffAngle': np.matrix([[30.0], [60.0], [35.]])},
+                              'Measured': np.matrix([[1], [-1], [-1]]), 'Error': np.matrix([[0.001], [0.5], [0.02]])}}
+        angles = self.inversion._station_angles(data, 0)
+        multipliers = self.inversion.location_sample_multipliers
+        self.inversion.location_cache = True
+        cached_angles = self.inversion._station_angles(data, 0)
+        self.assertTrue(len(glob.glob('.test.scatangle.mtfit_cache/*/names.npy')))
+        self.assertTrue(np.array_equal(cached_angles[0], angles[0]))
+        # Rerun uses the cache rather than reading the file
+        with mock.patch.object(Inversion, '_read_location') as _read_location:
+            cached_angles = self.inversion._station_angles(data, 0)
+            self.assertFalse(_read_location.called)
+        self.assertTrue(np.array_equal(cached_angles[0], angles[0]))
+        self.assertTrue(np.array_equal(cached_angles[1], angles[1]))
+        self.assertEqual(self.inversion.location_sample_multipliers, multipliers)
+        self.assertEqual(len(self.inversion.location_samples), 2)
+        # The sorted location samples are cached for the bounded location marginalisation
+        self.inversion.location_tolerance = 1e-3
+        sorted_angles = self.inversion._station_angles(data, 0)
+        self.assertTrue(len(glob.glob('.test.scatangle.mtfit_cache/*/sorted/multipliers.npy')))
+        self.assertEqual(self.inversion.location_sample_multipliers, sorted(multipliers, reverse=True))
+        self.assertTrue(np.array_equal(self.inversion._station_angles(data, 0)[0], sorted_angles[0]))
+        self.inversion.location_tolerance = 0
+        # Changing the file (size or modification time) invalidates the cache
+        with open('test.scatangle', 'w') as f:
+            f.write(self.station_angles().replace('504.7', '900.0', 1))
+        os.utime('test.scatangle', (0, 0))
+        self.inversion._station_angles(data, 0)
+        self.assertEqual(self.inversion.location_sample_multipliers[0], 900.0)
+        try:
+            os.remove('test.scatangle')
+        except Exception:
+            pass
+
     def test_forward(self):
         self.tearDown()
         self.inversion = Inversion({'PPolarity': {'Stations': {'Name': ['S0649', "S0162", "S0083"], 'Azimuth': np.matrix([[90.0], [270.0], [180.]]), 'TakeOffAngle': np.matrix([[30.0], [60.0], [35.]])},
@@ -1909,6 +2131,41 @@ class MiscTestCase(TestCase):
         self.assertAlmostEquals(station_angles({'Azimuth': np.array([90.0, 270.0]), 'TakeOffAngle': np.array([30.0, 60.0])}, 'P'), np.array(
             [[0.000, 0.2500, 0.7500, 0.000, 0.0000, 0.6124], [0.000, 0.7500, 0.2500, 0.000, -0.0000, -0.6124]]), 3)
 
+    def test_station_angle_coefficients(self):
+        np.random.seed(0)
+        azimuth = 360*np.random.rand(4, 5)
+        takeoff_angle = 180*np.random.rand(4, 5)
+        for phase in ['P', 'SH', 'SV', 'Pq']:
+            coefficients = station_angle_coefficients(azimuth, takeoff_angle, phase)
+            self.assertEqual(coefficients.shape, (4, 5, 6))
+            for i in range(4):
+                self.assertAlmostEquals(coefficients[i], station_angles({'Azimuth': azimuth[i], 'TakeOffAngle': takeoff_angle[i]}, phase))
+        self.assertAlmostEquals(station_angle_coefficients(np.pi*azimuth/180, np.pi*takeoff_angle/180, 'P', radians=True),
+                                station_angle_coefficients(azimuth, takeoff_angle, 'P'))
+        with self.assertRaises(ValueError):
+            station_angle_coefficients(azimuth, takeoff_angle, 'S')
+
+    def test_location_sample_coefficients(self):
+        location_samples = [{'Name': ['S01', 'S02', 'S03'], 'Azimuth':np.matrix([[91.0], [271.0], [120.1]]), 'TakeOffAngle':np.matrix(
+            [[31.0], [61.0], [12.1]])}, {'Name': ['S01', 'S02', 'S03'], 'Azimuth':np.matrix([[92.0], [272.0], [122.1]]), 'TakeOffAngle':np.matrix([[32.0], [62.0], [13.1]])}]
+        coefficients = location_sample_coefficients(location_samples)
+        self.assertTrue(isinstance(coefficients, LocationSampleCoefficients))
+        self.assertTrue(location_sample_coefficients(coefficients) is coefficients)
+        self.assertEqual(len(coefficients), 2)
+        self.assertEqual(coefficients.azimuth.shape, (2, 3))
+        selected_stations, indices = coefficients.select_stations(['S04', 'S03', 'S01'])
+        self.assertEqual(selected_stations, ['S01', 'S03'])
+        self.assertEqual(indices.tolist(), [0, 2])
+        for phase in ['P', 'SH', 'SV']:
+            a = coefficients.coefficients(phase, indices)
+            self.assertEqual(a.shape, (2, 2, 6))
+            for i, sample in enumerate(location_samples):
+                self.assertAlmostEquals(a[:, i, :], station_angles(sample, phase)[[0, 2], :])
+        # Calculated once for each phase
+        self.assertTrue(coefficients.coefficients('P') is coefficients.coefficients('Pq'))
+        with self.assertRaises(ValueError):
+            LocationSampleCoefficients(['S01'], np.zeros((2, 2)), np.zeros((2, 2)))
+
     def test_polarity_matrix(self):
         data = {'PPolarity': {'Stations': {'Name': ['S0271', 'S0595'], 'Azimuth': np.array([90.0, 270.0]), 'TakeOffAngle': np.array([30.0, 60.0])},
                               'Measured': np.matrix([[1], [-1]]), 'Error': np.matrix([[0.001], [0.001]])},
@@ -8,10 +8,55 @@ import shutil
 import numpy as np
 
 from MTfit.sampling import Sample
+from MTfit.sampling import SampleStore
 from MTfit.sampling import FileSample
+from MTfit.sampling import ChainSample
 from MTfit.probability.probability import LnPDF
 
 
+class SampleStoreTestCase(unittest.TestCase):
+
+    def test___init__(self):
+        store = SampleStore(10, moment_tensors=(6,), multiplicity=((), np.int64))
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.capacity, 10)
+        self.assertEqual(list(store.columns['moment_tensors'].shape), [6, 10])
+        self.assertEqual(store.columns['multiplicity'].dtype, np.int64)
+
+    def test_append(self):
+        store = SampleStore(2, moment_tensors=(6,))
+        store.append({'moment_tensors': np.matrix(np.ones((6, 1))), 'ln_pdf': np.matrix([[1.]])})
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.columns['ln_pdf'].dtype, np.float64)
+        self.assertFalse(isinstance(store.columns['ln_pdf'], np.matrix))
+        store.append({'moment_tensors': 2*np.ones((6, 3)), 'ln_pdf': np.array([[2, 3, 4]])})
+        self.assertEqual(len(store), 4)
+        self.assertEqual(store.capacity, 4)
+        store.append({'moment_tensors': 3*np.ones((6, 1)), 'ln_pdf': np.array([[5.]])})
+        self.assertEqual(store.capacity, 8)
+        self.assertEqual(list(store.columns['moment_tensors'][0, :5]), [1., 2., 2., 2., 3.])
+        self.assertEqual(list(store.columns['ln_pdf'][0, :5]), [1., 2., 3., 4., 5.])
+        store.append({'moment_tensors': np.ones((6, 0)), 'ln_pdf': np.ones((1, 0))})
+        self.assertEqual(len(store), 5)
+        with self.assertRaises(ValueError):
+            store.append({'moment_tensors': np.ones((6, 2)), 'ln_pdf': np.ones((1, 1))})
+        with self.assertRaises(ValueError):
+            store.append({'moment_tensors': np.ones((3, 1)), 'ln_pdf': np.ones((1, 1))})
+
+    def test_append_object(self):
+        store = SampleStore(1)
+        store.append({'scale_factor': np.array([{'mu': 1}, {'mu': 2}])})
+        self.assertEqual(store.columns['scale_factor'].dtype, object)
+        self.assertEqual(store.finalize()['scale_factor'][1]['mu'], 2)
+
+    def test_finalize(self):
+        store = SampleStore(10, moment_tensors=(6,))
+        store.append({'moment_tensors': np.ones((6, 3))})
+        columns = store.finalize()
+        self.assertEqual(list(columns['moment_tensors'].shape), [6, 3])
+        self.assertTrue(columns['moment_tensors'].base is store.columns['moment_tensors'])
+
+
 class SampleTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -75,6 +120,56 @@ class SampleTestCase(unittest.TestCase):
         self.Sample.append(moment_tensors, ln_pdf, 1)
         self.assertTrue((self.Sample.moment_tensors[:, 0:4] == np.matrix([[2, 2, 3, 2], [1, 1, 5, 1], [2, 2, 1, 2], [1, 1, 1, 1], [2, 2, 2, 2], [1, 1, 1, 1]])).all())
 
+    def test_append_growth(self):
+        self.Sample = Sample(initial_sample_size=2)
+        for i in range(5):
+            self.Sample.append(np.matrix(i*np.ones((6, 3))), LnPDF(np.matrix(np.ones((1, 3)))), 3)
+        self.assertEqual(self.Sample._i, 15)
+        self.assertEqual(self.Sample._store.capacity, 16)
+        self.assertEqual(list(self.Sample.moment_tensors.shape), [6, 15])
+        self.assertEqual(list(self.Sample.ln_pdf.shape), [1, 15])
+        self.assertEqual(self.Sample.moment_tensors[0, 14], 4)
+        self.assertTrue(self.Sample.moment_tensors.base is not None)
+
+    def test_append_dtype(self):
+        self.Sample = Sample(initial_sample_size=2, dtype=np.float32)
+        self.Sample.append(np.matrix(np.ones((6, 3))), LnPDF(np.matrix(np.ones((1, 3)))), 3)
+        self.assertEqual(self.Sample.moment_tensors.dtype, np.float32)
+
+    def test_append_discard(self):
+        self.Sample = Sample(initial_sample_size=2, discard=10, n_samples=10)
+        self.Sample.append(np.matrix(np.ones((6, 3))), LnPDF(np.matrix([[0., -10., -2.]])), 3)
+        # Cut-off is log(1/100) below the maximum
+        self.assertEqual(self.Sample._i, 2)
+        self.assertEqual(self.Sample.number_dropped, 1)
+        # Stored samples below the new cut-off are dropped
+        self.Sample.append(np.matrix(2*np.ones((6, 2))), LnPDF(np.matrix([[3., -1.]])), 2)
+        self.assertEqual(self.Sample.number_dropped, 2)
+        out, out_str = self.Sample.output(discard=0)
+        self.assertEqual(list(np.asarray(out['ln_pdf']).flatten()), [0., 3., -1.])
+        self.assertTrue('2 samples dropped while sampling' in out_str)
+
+    def test_append_max_retained(self):
+        self.Sample = Sample(initial_sample_size=2, max_retained=2)
+        for i in range(5):
+            self.Sample.append(np.matrix(i*np.ones((6, 2))), LnPDF(np.matrix([[i, -i]])), 2)
+            self.assertTrue(self.Sample._i <= 4)
+        out, out_str = self.Sample.output(normalise=False, discard=0)
+        self.assertEqual(self.Sample.number_dropped, 8)
+        self.assertEqual(sorted(np.asarray(out['ln_pdf']).flatten().tolist()), [3., 4.])
+        self.assertEqual(sorted(np.asarray(out['moment_tensor_space'])[0].tolist()), [3., 4.])
+
+    def test_output_evidence_dropped(self):
+        moment_tensors = np.matrix(np.random.randn(6, 20))
+        ln_pdf = LnPDF(np.matrix(np.random.randn(1, 20)))
+        sample = Sample()
+        sample.append(moment_tensors, ln_pdf, 40)
+        self.Sample = Sample(max_retained=3)
+        self.Sample.append(moment_tensors, ln_pdf, 40)
+        self.assertEqual(self.Sample.number_dropped, 17)
+        self.assertAlmostEqual(self.Sample.output(n_samples=40, discard=0)[0]['ln_bayesian_evidence'],
+                               sample.output(n_samples=40, discard=0)[0]['ln_bayesian_evidence'])
+
     def test_output(self):
         self.test_append()
         self.assertTrue((self.Sample.output()[0]['moment_tensor_space'] == np.matrix([[2, 2, 3, 2], [1, 1, 5, 1], [2, 2, 1, 2], [1, 1, 1, 1], [2, 2, 2, 2], [1, 1, 1, 1]])).all())
@@ -123,9 +218,98 @@ class SampleTestCase(unittest.TestCase):
         self.assertTrue('g' in out.keys())
 
 
+class ChainSampleTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.Sample = ChainSample(chain_length=3)
+
+    def tearDown(self):
+        del self.Sample
+
+    def test___init__(self):
+        self.assertEqual(self.Sample._store.capacity, 3)
+        self.assertEqual(self.Sample._i, 0)
+        self.assertEqual(self.Sample.n, 0)
+        self.assertEqual(len(self.Sample), 0)
+
+    def test_append(self):
+        self.Sample.append(np.matrix([[2], [1], [2], [1], [2], [1]]), LnPDF(np.matrix([[1.]])), 1)
+        self.assertEqual(self.Sample._i, 1)
+        self.assertEqual(self.Sample.n, 1)
+        self.assertTrue((self.Sample.expand()[0][:, 0] == np.matrix([[2], [1], [2], [1], [2], [1]])).all())
+        self.Sample.append(np.matrix([[2, 3], [1, 5], [2, 1], [1, 1], [2, 2], [1, 1]]), np.array([-np.inf, 2.]), 2)
+        self.assertEqual(self.Sample._i, 2)
+        self.assertEqual(self.Sample.n, 3)
+        self.assertEqual(self.Sample.expand()[0][1, 1], 5)
+        # Extend past the preallocated size
+        self.Sample.append(np.matrix(np.ones((6, 3))), np.array([1., 2., 3.]), 3)
+        self.assertEqual(self.Sample._i, 5)
+        self.assertEqual(self.Sample._store.capacity, 6)
+        self.assertEqual(self.Sample.expand()[0][1, 1], 5)
+        self.assertEqual(list(self.Sample._store.finalize()['ln_pdf'][0]), [1., 2., 1., 2., 3.])
+        with self.assertRaises(ValueError):
+            self.Sample.append(np.matrix(np.ones((6, 2))), np.array([1.]), 1)
+
+    def test_append_multiple_events(self):
+        self.Sample = ChainSample(chain_length=2, number_events=2)
+        moment_tensors = [np.matrix([[2], [1], [2], [1], [2], [1]]), np.matrix([[3], [1], [2], [1], [2], [1]])]
+        scale_factor = np.array([{'mu': np.array([[[2, 3], [3, 2]]]), 'sigma': np.array([[1, 1], [1, 1]])}])
+        self.Sample.append(moment_tensors, LnPDF(np.matrix([[1.]])), 1, scale_factor)
+        self.Sample.repeat()
+        self.assertTrue((self.Sample.expand()[0][:, 0] == np.matrix([[2], [1], [2], [1], [2], [1], [3], [1], [2], [1], [2], [1]])).all())
+        output = self.Sample.output()[0]
+        self.assertEqual(output['moment_tensor_space_1'].shape[1], 2)
+        self.assertEqual(len(output['scale_factors']), 2)
+
+    def test_repeat(self):
+        self.assertFalse(self.Sample.repeat())
+        self.Sample.append(np.matrix([[2], [1], [2], [1], [2], [1]]), np.array([1.]), 1)
+        self.assertTrue(self.Sample.repeat())
+        self.assertTrue(self.Sample.repeat(2))
+        self.assertEqual(self.Sample._i, 1)
+        self.assertEqual(self.Sample._store.finalize()['multiplicity'][0], 4)
+        self.assertEqual(self.Sample.n, 4)
+        self.assertEqual(len(self.Sample), 4)
+
+    def test_extend(self):
+        self.Sample.append(np.matrix([[2], [1], [2], [1], [2], [1]]), np.array([1.]), 1)
+        other = ChainSample(chain_length=2)
+        other.append(np.matrix([[3], [1], [2], [1], [2], [1]]), np.array([2.]), 1)
+        other.repeat()
+        self.Sample.extend(other)
+        self.Sample.extend(ChainSample(chain_length=2))
+        self.assertEqual(self.Sample._i, 2)
+        self.assertEqual(self.Sample.n, 3)
+        self.assertEqual(list(self.Sample._store.finalize()['multiplicity']), [1, 2])
+
+    def test_expand(self):
+        self.Sample.append(np.matrix([[2, 3], [1, 5], [2, 1], [1, 1], [2, 2], [1, 1]]), np.array([1., 2.]), 2, multiplicity=np.array([2, 1]))
+        moment_tensors, ln_pdf = self.Sample.expand()
+        self.assertEqual(list(moment_tensors.shape), [6, 3])
+        self.assertTrue((moment_tensors[1, :] == np.matrix([[1, 1, 5]])).all())
+        self.assertEqual(list(ln_pdf.shape), [1, 3])
+        self.assertEqual(list(np.asarray(ln_pdf._ln_pdf).flatten()), [1., 1., 2.])
+
+    def test_output(self):
+        moment_tensors = np.matrix([[2, 3], [1, 5], [2, 1], [1, 1], [2, 2], [1, 1]])
+        self.Sample.append(moment_tensors[:, 0], np.array([1.]), 1)
+        self.Sample.repeat()
+        self.Sample.append(moment_tensors[:, 1], np.array([2.]), 1)
+        sample = Sample()
+        sample.append(moment_tensors[:, [0, 0, 1]], LnPDF(np.matrix([[1., 1., 2.]])), 3)
+        out, out_str = self.Sample.output(convert=True)
+        expected, expected_str = sample.output(convert=True)
+        self.assertEqual(sorted(out.keys()), sorted(expected.keys()))
+        self.assertTrue((out['moment_tensor_space'] == expected['moment_tensor_space']).all())
+        self.assertTrue((out['probability'] == expected['probability']).all())
+        self.assertEqual(out['ln_pdf'].shape[1], 3)
+
+
 class FileSampleTestCase(unittest.TestCase):
     def setUp(self):
         self.cwd = os.getcwd()
+        # Restore the working directory if setUp fails (e.g. hdf5storage missing)
+        self.addCleanup(os.chdir, self.cwd)
         if sys.version_info >= (3, 0):
             self.tempdir = tempfile.TemporaryDirectory()
             os.chdir(self.tempdir.name)
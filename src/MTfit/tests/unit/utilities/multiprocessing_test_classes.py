@@ -22,3 +22,13 @@ class TaskTest2(object):
         print('Test 2 {}'.format(self.a+self.b))
         time.sleep(self.b*0.5)
         return self.a+self.b
+
+
+class TaskSharedArrayTest(object):
+
+    def __init__(self, array):
+        self.array = array
+
+    def __call__(self):
+        from MTfit.utilities.multiprocessing_helper import unshare_array
+        return float(unshare_array(self.array).sum())
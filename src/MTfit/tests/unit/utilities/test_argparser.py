@@ -16,6 +16,7 @@ from MTfit.extensions import default_cmd_defaults
 from MTfit.utilities.extensions import get_extensions
 from MTfit.utilities.argparser import _ARGPARSE
 from MTfit.utilities.argparser_defaults import DEFAULT_AMP_COLORMAP
+from MTfit.utilities.argparser_defaults import get_hist_colormap
 from MTfit.utilities.unittest_utils import TestCase
 from MTfit.utilities.argparser import MTfit_parser
 from MTfit.utilities.argparser import get_MTfit_defaults
@@ -1424,3 +1425,30 @@ class ParserTestCase(TestCase):
                 MTplot_parser(['test', '--hide'], test=True)['show'], False)
             _ARGPARSE = _argparse
 
+    def test_MTfit_parser_number_chains(self):
+        open('Test.i', 'w').write('test')
+        options, options_map = MTfit_parser(['-a=mcmc', 'Test.i'], test=True)
+        self.assertEqual(options['number_chains'], 1)
+        self.assertEqual(options['max_temperature'], 1.)
+        self.assertEqual(options['exchange_interval'], 10)
+        options, options_map = MTfit_parser(['-a=mcmc', '--chains=4', '--max_temperature=10', '--exchange_interval=5', 'Test.i'], test=True)
+        self.assertEqual(options['number_chains'], 4)
+        self.assertEqual(options['max_temperature'], 10.)
+        self.assertEqual(options['exchange_interval'], 5)
+        options, options_map = MTfit_parser(['-a=transdmcmc', '--number_chains=2', 'Test.i'], test=True)
+        self.assertEqual(options['number_chains'], 2)
+        with self.assertRaises(SystemExit):
+            MTfit_parser(['-a=mcmc', '--chains=0', 'Test.i'], test=True)
+
+    def test_get_hist_colormap(self):
+        import matplotlib
+        version = matplotlib.__version__
+        try:
+            matplotlib.__version__ = '1.4.3'
+            self.assertEqual(get_hist_colormap(), 'CMRmap')
+            matplotlib.__version__ = '1.5.0rc1'
+            self.assertEqual(get_hist_colormap(), 'viridis')
+            matplotlib.__version__ = '3.8.2'
+            self.assertEqual(get_hist_colormap(), 'viridis')
+        finally:
+            matplotlib.__version__ = version
@@ -6,9 +6,15 @@ Tests for src/utils/extensions.py
 """
 
 import unittest
+import sys
 
 from MTfit.utilities.unittest_utils import TestCase
 
+if sys.version_info >= (3, 3):
+    from unittest import mock
+else:
+    import mock
+
 
 class ExtensionsTestCase(TestCase):
 
@@ -23,3 +29,42 @@ class ExtensionsTestCase(TestCase):
         (name, extensions) = get_extensions('MTfit.parsers')
         self.assertTrue(any(['.hyp' in u for u in name]))
         self.assertTrue(any(['.csv' in u for u in name]))
+
+    def test_get_extensions_cache(self):
+        from MTfit.utilities import extensions
+        entrypoint = mock.MagicMock()
+        entrypoint.name = 'Test'
+        entrypoint.load.return_value = 5
+        extensions.clear_extensions_cache('MTfit.test_cache')
+        with mock.patch('MTfit.utilities.extensions._iter_entry_points', return_value=[entrypoint]) as iter_entry_points:
+            (names, funcs) = extensions.get_extensions('MTfit.test_cache', {'default': 2})
+            self.assertEqual(sorted(names), ['default', 'test'])
+            self.assertEqual(funcs, {'default': 2, 'test': 5})
+            (names, funcs) = extensions.get_extensions('MTfit.test_cache')
+            self.assertEqual(names, ['test'])
+            self.assertEqual(funcs, {'test': 5})
+            iter_entry_points.assert_called_once_with('MTfit.test_cache')
+            entrypoint.load.assert_called_once_with()
+            extensions.clear_extensions_cache('MTfit.test_cache')
+            extensions.get_extensions('MTfit.test_cache')
+            self.assertEqual(iter_entry_points.call_count, 2)
+            extensions.clear_extensions_cache()
+            self.assertFalse(len(extensions._EXTENSIONS_CACHE))
+            self.assertTrue(extensions._ENTRY_POINT_INDEX is None)
+
+    def test__iter_entry_points(self):
+        from MTfit.utilities import extensions
+        extensions.clear_extensions_cache()
+        entrypoint = mock.MagicMock()
+        entrypoint.name = 'test'
+        with mock.patch('MTfit.utilities.extensions._build_entry_point_index', return_value={'MTfit.test_index': [entrypoint]}) as build_entry_point_index:
+            self.assertEqual(extensions._iter_entry_points('MTfit.test_index'), [entrypoint])
+            self.assertEqual(extensions._iter_entry_points('MTfit.test_missing'), [])
+            build_entry_point_index.assert_called_once_with()
+        extensions.clear_extensions_cache()
+
+    def test__build_entry_point_index(self):
+        from MTfit.utilities import extensions
+        index = extensions._build_entry_point_index()
+        self.assertTrue(isinstance(index, dict))
+        self.assertTrue('console_scripts' in index)
@@ -10,6 +10,7 @@ import glob
 import sys
 import tempfile
 import shutil
+import struct
 
 try:
     import cPickle as pickle
@@ -365,6 +366,14 @@ END_NLLOC
         self.assertTrue('MOMENTTENSOR' in a)
         self.assertEqual(float(a.split()[a.split().index('MTNN')+1]), 2.0)
         self.assertEqual(len(b), 169)
+        # File version 3 adds an 8 byte ln_dropped double if samples were dropped
+        self.assertEqual(struct.unpack('Q', b[:8])[0], 2)
+        a, b, c = hyp_output_dicts(event, False, {'moment_tensor_space': np.matrix([[1., 2.], [2., 1.], [1., 2.], [2., 1.], [
+                                   1., 2.], [2., 1.]]), 'ln_pdf': np.matrix([0, 0.7]), 'probability': np.matrix([[1., 2.]]), 'total_number_samples': 400,
+                                   'ln_dropped': -3.5})
+        self.assertEqual(len(b), 177)
+        self.assertEqual(struct.unpack('Q', b[:8])[0], 3)
+        self.assertEqual(struct.unpack('1d', b[41:49])[0], -3.5)
         events = parse_hyp('hyptest.hyp')
         event = events[0]
         a, b, c = hyp_output_dicts(event, False, {'moment_tensor_space': np.matrix([[1., 2., 3.], [2., 1., 3.], [1., 2., 3.], [2., 1., 3.], [
@@ -530,6 +539,22 @@ END_NLLOC
             os.remove('MTfitOUTPUTTEST.mt')
         except Exception:
             pass
+        # Samples dropped while sampling
+        x['ln_dropped'] = -3.5
+        a, b, c = hyp_output_dicts(event, False, x)
+        fid, out_str = hyp_output([a, b], fid='MTfitOUTPUTTEST.hyp')
+        y = read_binary_output('MTfitOUTPUTTEST.mt')
+        self.assertEqual(sorted(y[0].keys()), sorted(x.keys()))
+        self.assertEqual(y[0]['ln_dropped'], x['ln_dropped'])
+        self.assertEqual(y[0]['dkl'], x['dkl'])
+        try:
+            os.remove('MTfitOUTPUTTEST.hyp')
+        except Exception:
+            pass
+        try:
+            os.remove('MTfitOUTPUTTEST.mt')
+        except Exception:
+            pass
 
     def test_read_pickle_output(self):
         self.hyp_file()
@@ -0,0 +1,133 @@
+"""
+test_location_cache.py
+**********************
+
+Tests for src/utilities/location_cache.py
+"""
+
+import os
+import sys
+import tempfile
+import shutil
+
+import numpy as np
+
+if sys.version_info >= (3, 3):
+    from unittest import mock
+else:
+    import mock
+
+from MTfit.utilities.unittest_utils import TestCase
+from MTfit.utilities import location_cache
+
+
+class LocationCacheTestCase(TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.mkdtemp()
+        self.filename = os.path.join(self.tempdir, 'test.scatangle')
+        with open(self.filename, 'w') as f:
+            f.write('1.0\nS01 10.0 20.0\n\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+    def test_file_hash(self):
+        key = location_cache.file_hash(self.filename)
+        self.assertEqual(key, location_cache.file_hash(self.filename, block_size=3))
+        with open(self.filename, 'w') as f:
+            f.write('2.0\nS01 10.0 20.0\n\n')
+        self.assertNotEqual(key, location_cache.file_hash(self.filename))
+
+    def test_file_key(self):
+        key = location_cache.file_key(self.filename)
+        self.assertEqual(key, location_cache.file_key(self.filename))
+        # Changes with the modification time or size
+        os.utime(self.filename, (0, 0))
+        self.assertNotEqual(key, location_cache.file_key(self.filename))
+        key = location_cache.file_key(self.filename)
+        with open(self.filename, 'a') as f:
+            f.write('1.0\nS01 10.0 20.0\n\n')
+        self.assertNotEqual(key, location_cache.file_key(self.filename))
+
+    def test_content_hash(self):
+        cache = location_cache.LocationCache(self.filename, content_hash=True)
+        self.assertEqual(cache.key, location_cache.file_hash(self.filename))
+        self.assertNotEqual(cache.key, location_cache.LocationCache(self.filename).key)
+        # Only hashed once for each version of the file
+        with mock.patch('MTfit.utilities.location_cache.file_hash') as file_hash:
+            self.assertEqual(location_cache.LocationCache(self.filename, content_hash=True).key, cache.key)
+            self.assertFalse(file_hash.called)
+
+    def test_data_hash(self):
+        data = {'PPolarity': {'Stations': {'Name': ['S01', 'S02'], 'Azimuth': np.array([90.0, 270.0])}, 'Measured': np.matrix([[1], [-1]])}}
+        key = location_cache.data_hash(data, 0)
+        self.assertEqual(key, location_cache.data_hash({'PPolarity': {'Measured': np.matrix([[1], [-1]]),
+                                                                      'Stations': {'Azimuth': np.array([90.0, 270.0]), 'Name': ['S01', 'S02']}}}, 0))
+        self.assertNotEqual(key, location_cache.data_hash(data, 1))
+        data['PPolarity']['Measured'][1, 0] = 1
+        self.assertNotEqual(key, location_cache.data_hash(data, 0))
+
+    def test_save_array(self):
+        cache = location_cache.LocationCache(self.filename)
+        self.assertEqual(os.path.dirname(os.path.dirname(cache.path)), self.tempdir)
+        self.assertTrue(cache.load_array('test') is None)
+        array = np.random.rand(10, 3)
+        cached_array = cache.save_array('test', array)
+        self.assertTrue(isinstance(cached_array, np.memmap))
+        self.assertTrue(np.array_equal(cached_array, array))
+        # Copy-on-write
+        cached_array[0, 0] = -1
+        self.assertTrue(np.array_equal(cache.load_array('test'), array))
+        self.assertTrue(cache.load_array('test', 'key') is None)
+
+    def test_location_samples(self):
+        cache = location_cache.LocationCache(self.filename)
+        self.assertTrue(cache.load_location_samples() is None)
+        azimuth = np.random.rand(4, 2)
+        takeoff_angle = np.random.rand(4, 2)
+        cache.save_location_samples(['S01', 'S02'], azimuth, takeoff_angle, [1., 2., 3., 4.])
+        names, cached_azimuth, cached_takeoff_angle, multipliers = location_cache.LocationCache(self.filename).load_location_samples()
+        self.assertEqual(names, ['S01', 'S02'])
+        self.assertTrue(np.array_equal(cached_azimuth, azimuth))
+        self.assertTrue(np.array_equal(cached_takeoff_angle, takeoff_angle))
+        self.assertEqual(multipliers.tolist(), [1., 2., 3., 4.])
+        self.assertTrue(cache.load_location_samples('sorted') is None)
+        cache.save_location_samples(['S01', 'S02'], azimuth[::-1], takeoff_angle[::-1], [4., 3., 2., 1.], key='sorted')
+        self.assertEqual(cache.load_location_samples('sorted')[3].tolist(), [4., 3., 2., 1.])
+        self.assertTrue(np.array_equal(cache.load_location_samples('sorted')[1], azimuth[::-1]))
+        # New cache if the file changes
+        with open(self.filename, 'w') as f:
+            f.write('20.0\nS01 10.0 20.0\n\n')
+        self.assertTrue(location_cache.LocationCache(self.filename).load_location_samples() is None)
+
+    def test_save(self):
+        cache = location_cache.LocationCache(self.filename)
+        self.assertTrue(cache.load('key') is None)
+        a = np.random.rand(40, 30, 6)
+        values = (a, False, np.array([0.1, 0.2]), (np.array([0.5]), np.array([0.5])), [1., 2.], 0)
+        cache.save('key', values)
+        cached_values = cache.load('key')
+        self.assertEqual(len(cached_values), len(values))
+        self.assertTrue(isinstance(cached_values[0], np.memmap))
+        self.assertTrue(np.array_equal(cached_values[0], a))
+        self.assertFalse(cached_values[1])
+        self.assertTrue(np.array_equal(cached_values[2], values[2]))
+        self.assertTrue(np.array_equal(cached_values[3][0], values[3][0]))
+        self.assertEqual(cached_values[4], [1., 2.])
+        self.assertEqual(cached_values[5], 0)
+        self.assertTrue(cache.load('other_key') is None)
+
+    def test_save_error(self):
+        cache = location_cache.LocationCache(self.filename, cache_dir=os.path.join(self.tempdir, 'missing'))
+        if sys.platform != 'win32':
+            os.mkdir(os.path.join(self.tempdir, 'missing'))
+            os.chmod(os.path.join(self.tempdir, 'missing'), 0o500)
+            try:
+                if not os.access(os.path.join(self.tempdir, 'missing'), os.W_OK):
+                    array = np.random.rand(3)
+                    self.assertTrue(cache.save_array('test', array) is array)
+                    cache.save('key', (array,))
+                    self.assertTrue(cache.load('key') is None)
+            finally:
+                os.chmod(os.path.join(self.tempdir, 'missing'), 0o700)
@@ -0,0 +1,68 @@
+"""
+test_memory.py
+**************
+
+Tests for src/utilities/memory.py
+"""
+
+import sys
+
+import numpy as np
+
+from MTfit.utilities.unittest_utils import TestCase
+from MTfit.utilities import memory
+
+if sys.version_info >= (3, 3):
+    from unittest import mock
+else:
+    import mock
+
+
+class GarbageCollectionPolicyTestCase(TestCase):
+
+    def test_collect_interval(self):
+        policy = memory.GarbageCollectionPolicy(interval=3, threshold=0)
+        with mock.patch('MTfit.utilities.memory.gc.collect') as gc_collect:
+            self.assertEqual([policy.collect() for i in range(6)], [False, False, True, False, False, True])
+            self.assertEqual(gc_collect.call_count, 2)
+            gc_collect.assert_called_with(2)
+        self.assertEqual(policy.number_collections, 2)
+
+    def test_collect_threshold(self):
+        policy = memory.GarbageCollectionPolicy(interval=0, threshold=100)
+        with mock.patch('MTfit.utilities.memory.gc.collect') as gc_collect:
+            self.assertFalse(policy.collect(60))
+            self.assertEqual(policy.pressure, 60)
+            self.assertTrue(policy(60))
+            self.assertEqual(policy.pressure, 0)
+            self.assertFalse(policy.collect())
+            self.assertTrue(policy.collect(force=True))
+            self.assertEqual(gc_collect.call_count, 2)
+
+    def test_collect_disabled(self):
+        policy = memory.GarbageCollectionPolicy(interval=0, threshold=0)
+        with mock.patch('MTfit.utilities.memory.gc.collect') as gc_collect:
+            for i in range(100):
+                self.assertFalse(policy.collect(10**9))
+            self.assertFalse(gc_collect.called)
+
+    def test_set_gc_policy(self):
+        policy = memory.get_gc_policy()
+        interval = policy.interval
+        threshold = policy.threshold
+        try:
+            self.assertTrue(memory.set_gc_policy(interval=2) is policy)
+            self.assertEqual(policy.interval, 2)
+            self.assertEqual(policy.threshold, threshold)
+            memory.set_gc_policy(threshold=False)
+            self.assertEqual(policy.threshold, 0)
+            with mock.patch('MTfit.utilities.memory.gc.collect') as gc_collect:
+                self.assertFalse(memory.collect())
+                self.assertTrue(memory.collect())
+                self.assertEqual(gc_collect.call_count, 1)
+        finally:
+            memory.set_gc_policy(interval, threshold)
+
+    def test_array_nbytes(self):
+        self.assertEqual(memory.array_nbytes(np.zeros(10), False, None, [np.zeros((2, 2)), np.zeros(3, dtype=np.float32)]), 124)
+        self.assertEqual(memory.array_nbytes(), 0)
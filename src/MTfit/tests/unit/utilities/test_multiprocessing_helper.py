@@ -8,14 +8,23 @@ import sys
 import unittest
 import multiprocessing
 import multiprocessing.queues
+import pickle
 
+import numpy as np
 
 from MTfit.utilities.unittest_utils import TestCase
 from MTfit.utilities.multiprocessing_helper import Worker
 from MTfit.utilities.multiprocessing_helper import JobPool
 from MTfit.utilities.multiprocessing_helper import PoisonPill
+from MTfit.utilities.multiprocessing_helper import TaskContext
+from MTfit.utilities.multiprocessing_helper import ContextTask
+from MTfit.utilities.multiprocessing_helper import SharedArray
+from MTfit.utilities.multiprocessing_helper import share_array
+from MTfit.utilities.multiprocessing_helper import unshare_array
+from MTfit.utilities.multiprocessing_helper import shared_memory
 from MTfit.tests.unit.utilities.multiprocessing_test_classes import TaskTest
 from MTfit.tests.unit.utilities.multiprocessing_test_classes import TaskTest2
+from MTfit.tests.unit.utilities.multiprocessing_test_classes import TaskSharedArrayTest
 
 
 class WorkerTestCase(TestCase):
@@ -56,6 +65,36 @@ class WorkerTestCase(TestCase):
         self.assertTrue(self.result_queue.empty())
         self.assertEqual(r, 5)
 
+    def test_context(self):
+        task_queue = multiprocessing.Queue()
+        context_queue = multiprocessing.Queue()
+        worker = Worker(task_queue, self.result_queue, context_queue=context_queue)
+        worker.start()
+        try:
+            task_queue.put(ContextTask(1, 3))
+            context_queue.put(TaskContext(1, TaskTest, (4,)))
+            self.assertEqual(self.result_queue.get(timeout=10), 12)
+            context_queue.put(TaskContext(1))
+            context_queue.put(TaskContext(2, TaskTest2, (), {'b': 0}))
+            task_queue.put(ContextTask(2, 5))
+            self.assertEqual(self.result_queue.get(timeout=10), 5)
+        finally:
+            task_queue.put(PoisonPill())
+            worker.join()
+
+    def test_get_context(self):
+        context_queue = multiprocessing.Queue()
+        worker = Worker(self.task_queue, self.result_queue, context_queue=context_queue)
+        context_queue.put(TaskContext(1, TaskTest, (4,)))
+        self.assertEqual(worker.get_context(1).args, (4,))
+        context_queue.put(TaskContext(1))
+        context_queue.put(TaskContext(2, TaskTest, (4,)))
+        worker.get_context(2)
+        self.assertFalse(1 in worker.contexts)
+        worker = Worker(self.task_queue, self.result_queue)
+        with self.assertRaises(KeyError):
+            worker.get_context(1)
+
 
 class JobPoolTestCase(TestCase):
 
@@ -77,6 +116,29 @@ class JobPoolTestCase(TestCase):
         self.job_pool.task(1, 2)
         self.assertEqual(self.job_pool.number_jobs, 1)
 
+    def test_load_context(self):
+        context_id = self.job_pool.load_context(4)
+        self.assertTrue(context_id in self.job_pool.contexts)
+        self.assertEqual(self.job_pool.contexts[context_id].args, (4,))
+        self.assertEqual(self.job_pool.contexts[context_id].task_class, TaskTest)
+        self.assertNotEqual(self.job_pool.load_context(2, task=TaskTest2), context_id)
+
+    def test_context_task(self):
+        context_id = self.job_pool.load_context(4)
+        self.job_pool.context_task(context_id, 2)
+        self.job_pool.context_task(context_id, 3)
+        self.assertEqual(self.job_pool.number_jobs, 2)
+        self.assertEqual(sorted(self.job_pool.all_results()), [8, 12])
+        with self.assertRaises(KeyError):
+            self.job_pool.context_task(context_id+1, 2)
+
+    def test_clear_context(self):
+        context_id = self.job_pool.load_context(4)
+        self.job_pool.clear_context(context_id)
+        self.assertFalse(context_id in self.job_pool.contexts)
+        with self.assertRaises(KeyError):
+            self.job_pool.context_task(context_id, 2)
+
     def test_custom_task(self):
         self.job_pool.custom_task(TaskTest2, 4, 2)
         self.assertEqual(self.job_pool.number_jobs, 1)
@@ -117,3 +179,51 @@ class JobPoolTestCase(TestCase):
         self.assertTrue(6 in results)
         results.pop(results.index(6))
         self.assertTrue(isinstance(results[0], TypeError))
+
+
+@unittest.skipIf(shared_memory is None, 'multiprocessing.shared_memory not available')
+class SharedArrayTestCase(TestCase):
+
+    def setUp(self):
+        self.array = np.random.rand(4, 3, 6)
+        self.shared_array = SharedArray(self.array)
+
+    def tearDown(self):
+        self.shared_array.unlink()
+        del self.shared_array
+
+    def test___init__(self):
+        self.assertEqual(self.shared_array.shape, (4, 3, 6))
+        self.assertEqual(self.shared_array.array.tolist(), self.array.tolist())
+        self.assertFalse(np.shares_memory(self.shared_array.array, self.array))
+
+    def test_pickle(self):
+        data = pickle.dumps(self.shared_array)
+        # Only the handle is pickled
+        self.assertTrue(len(data) < self.array.nbytes)
+        attached = pickle.loads(data)
+        self.assertEqual(attached.array.tolist(), self.array.tolist())
+        self.shared_array.array[0, 0, 0] = 10
+        self.assertEqual(attached.array[0, 0, 0], 10)
+        attached.close()
+
+    def test_share_array(self):
+        self.assertFalse(share_array(False))
+        self.assertEqual(share_array(np.array([])).shape, (0,))
+        shared = share_array(self.array)
+        self.assertTrue(isinstance(shared, SharedArray))
+        self.assertEqual(unshare_array(shared).tolist(), self.array.tolist())
+        shared.unlink()
+
+    def test_unshare_array(self):
+        self.assertEqual(unshare_array(self.shared_array).tolist(), self.array.tolist())
+        self.assertFalse(unshare_array(False))
+
+    def test_job_pool(self):
+        job_pool = JobPool(2, task=TaskSharedArrayTest)
+        try:
+            job_pool.task(self.shared_array)
+            job_pool.task(self.shared_array)
+            self.assertEqual(job_pool.all_results(), [self.array.sum(), self.array.sum()])
+        finally:
+            job_pool.close()
@@ -0,0 +1,51 @@
+"""
+test_quasi_random.py
+********************
+
+Tests for src/utilities/quasi_random.py
+"""
+
+import numpy as np
+
+from MTfit.utilities.unittest_utils import TestCase
+from MTfit.utilities import quasi_random
+
+
+class SobolDirectionNumbersTestCase(TestCase):
+
+    def test_sobol_direction_numbers(self):
+        direction_numbers = quasi_random.sobol_direction_numbers(6)
+        self.assertEqual(direction_numbers.shape, (6, quasi_random.SOBOL_BITS))
+        self.assertEqual(direction_numbers[0, 0], 2**(quasi_random.SOBOL_BITS-1))
+        self.assertEqual(direction_numbers[0, 1], 2**(quasi_random.SOBOL_BITS-2))
+        # Second dimension m = 1, 3, 5, 15
+        self.assertEqual([int(u) >> (quasi_random.SOBOL_BITS-1-k) for k, u in enumerate(direction_numbers[1, :4])], [1, 3, 5, 15])
+        with self.assertRaises(ValueError):
+            quasi_random.sobol_direction_numbers(0)
+        with self.assertRaises(ValueError):
+            quasi_random.sobol_direction_numbers(len(quasi_random.SOBOL_DIRECTION_NUMBERS)+2)
+
+
+class SobolSequenceTestCase(TestCase):
+
+    def test_random_unscrambled(self):
+        sequence = quasi_random.SobolSequence(2, scramble=False)
+        points = sequence.random(4)
+        self.assertTrue(np.allclose(points, [[0, 0], [0.5, 0.5], [0.75, 0.25], [0.25, 0.75]], atol=1e-9))
+        self.assertEqual(len(sequence), 4)
+
+    def test_random_scrambled(self):
+        points = quasi_random.SobolSequence(6, seed=3).random(64)
+        self.assertEqual(points.shape, (64, 6))
+        self.assertTrue((points > 0).all() and (points < 1).all())
+        # Each dimension has one point in each of the 64 intervals
+        self.assertTrue((np.sort(np.floor(64*points), axis=0) == np.arange(64)[:, np.newaxis]).all())
+        self.assertTrue((points == quasi_random.SobolSequence(6, seed=3).random(64)).all())
+        self.assertFalse((points == quasi_random.SobolSequence(6, seed=4).random(64)).all())
+        self.assertFalse((points == quasi_random.SobolSequence(6, seed=np.random.SeedSequence(3)).random(64)).all())
+
+    def test_random_continues(self):
+        sequence = quasi_random.SobolSequence(3, seed=1)
+        points = np.vstack([sequence.random(16), sequence.random(16)])
+        self.assertTrue((points == quasi_random.SobolSequence(3, seed=1).random(32)).all())
+        self.assertEqual(quasi_random.SobolSequence(3).random(0).shape, (0, 3))
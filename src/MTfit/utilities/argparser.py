@@ -43,7 +43,7 @@ from ..extensions import default_cmd_opts
 from ..extensions import default_cmd_defaults
 from .argparser_defaults import MTFIT_PARSER_DEFAULTS
 from .argparser_defaults import MTFIT_PARSER_DEFAULT_TYPES
-from .argparser_defaults import DEFAULT_HIST_COLORMAP
+from .argparser_defaults import get_hist_colormap
 from .argparser_defaults import DEFAULT_AMP_COLORMAP
 from .argparser_defaults import MTPLOT_PARSER_DEFAULTS
 from .argparser_defaults import MTPLOT_PARSER_DEFAULT_TYPES
@@ -616,6 +616,31 @@ def _MTfit_argparser(input_args=None, test=False):
              default=defaults['single_threaded'], help="Flag to disable parallel computation", dest="singlethread"),
         dict(flags=["-n", "--numberworkers", "--number_workers"], default=defaults['number_workers'], type=int,
              help="Set the number of workers used in the parallel computation. [default=all available cpus]", dest="n"),
+        dict(flags=["--numberthreads", "--number_threads", "--number-threads"], default=defaults['number_threads'], type=int,
+             help="Set the number of OpenMP threads used by each worker to evaluate the forward model (requires the C extensions built with MTFIT_OPENMP=1) [default=" +
+             str(defaults['number_threads'])+"]", dest="number_threads"),
+        dict(flags=["--nostationordering", "--no_station_ordering", "--no-station-ordering"], action="store_true", default=defaults['no_station_ordering'],
+             help="Disable the adaptive reordering of the polarity stations (most discriminating stations first) used to reject samples early in the C forward model", dest="no_station_ordering"),
+        dict(flags=["--singleprecision", "--single_precision", "--single-precision", "--float32"], action="store_true", default=defaults['single_precision'],
+             help="Use single precision (float32) station angle coefficients and moment tensor samples in the C forward model and the stored samples, halving their memory", dest="single_precision"),
+        dict(flags=["--ratiopdfmaxerror", "--ratio_pdf_max_error", "--ratio-pdf-max-error"], default=defaults['ratio_pdf_max_error'], type=float,
+             help="Interpolate the amplitude ratio PDFs in the C forward model from tables with this maximum relative error, e.g. 1e-4 (0 uses the exact PDF) [default=" +
+             str(defaults['ratio_pdf_max_error'])+"]", dest="ratio_pdf_max_error"),
+        dict(flags=["--backend", "--forward_model_backend", "--forward-model-backend"], default=defaults['backend'], type=str,
+             help="Set the forward model backend used to evaluate the combined PDF (cython, cython-openmp, numpy-chunked or an installed MTfit.forward_model_backends " +
+             "extension), auto selects the fastest available backend using a short calibration benchmark [default="+str(defaults['backend'])+"]", dest="backend"),
+        dict(flags=["--locationtolerance", "--location_tolerance", "--location-tolerance"], default=defaults['location_tolerance'], type=float,
+             help="Stop the location marginalisation for each sample once the remaining location samples, sorted by probability, cannot change the marginalised PDF by " +
+             "more than this fraction, e.g. 1e-3 (0 evaluates all the location samples) [default="+str(defaults['location_tolerance'])+"]", dest="location_tolerance"),
+        dict(flags=["--locationsubsample", "--location_subsample", "--location-subsample"], default=defaults['location_subsample'], type=int,
+             help="Marginalise over this number of location samples drawn in proportion to their probabilities for each batch of samples, giving an unbiased " +
+             "estimate of the marginalised PDF (0 uses all the location samples) [default="+str(defaults['location_subsample'])+"]", dest="location_subsample"),
+        dict(flags=["--locationcache", "--location_cache", "--location-cache"], action="store_true", default=defaults['location_cache'],
+             help="Cache the parsed location PDF station angles and station angle coefficients in memory-mapped files next to the location PDF file, so that " +
+             "reruns using the same file do not parse it again. Caches for old versions of the file are not removed, so must be deleted by hand", dest="location_cache"),
+        dict(flags=["--locationcachecontenthash", "--location_cache_content_hash", "--location-cache-content-hash"], action="store_true",
+             default=defaults['location_cache_content_hash'], help="Key the location cache by the hash of the location PDF file contents rather than the file size, " +
+             "modification time and inode (the file is read once in each run to calculate the hash)", dest="location_cache_content_hash"),
         dict(flags=["-m", "--mem", "--memory", "--physical_memory", "--physicalmemory"], default=defaults['memory'], type=float,
              help="Set the maximum memory used in Gb if psutil not available [default="+str(defaults['memory'])+"Gb]", dest='mem'),
         dict(flags=["-c", "--doublecouple", "--double-couple", "--double_couple", "--dc", "--DC"], action="store_true",
@@ -697,7 +722,7 @@ def _MTfit_argparser(input_args=None, test=False):
         dict(flags=["--dc-prior", "--dc_prior", "--dcprior"], default=defaults['dc_prior'], type=float,
              help='Prior probability for the double-couple model when using the Trans-Dimensional McMC algorithm', dest='dc_prior'),
         dict(flags=["--sampling", "--sampling", "--sampling"], default=defaults['sampling'],
-             type=float, help='Random moment tensor sampling distribution', dest='sampling'),
+             type=str, help='Random moment tensor sampling distribution (6sphere or sobol for scrambled Sobol quasi-random samples)', dest='sampling'),
         dict(flags=["--sample-models", "--sample_distribution", "--samplemodels"], default=defaults['sample_distribution'],
              type=str, help='Alternate models for random sampling (Monte Carlo algorithms only)', dest='sample_distribution'),
         dict(flags=["--sampling-prior", "--sampling_prior", "--samplingprior"], default=defaults['sampling_prior'], type=str,
@@ -708,12 +733,35 @@ def _MTfit_argparser(input_args=None, test=False):
              help='Convert the output MTs to Tape parameters, hudson parameters and strike dip rakes.', dest='convert'),
         dict(flags=["--discard"], default=defaults['discard'], type=float,
              help='Fraction of maxProbability * total samples to discard as negligeable.', dest='discard'),
+        dict(flags=["--streaming_discard", "--streaming-discard"], default=defaults['streaming_discard'], action='store_true',
+             help='Apply the discard cut-off as the samples are added rather than at the output, bounding the memory by the retained samples (Monte Carlo algorithms only)', dest='streaming_discard'),
+        dict(flags=["--max_retained_samples", "--max-retained-samples"], default=defaults['max_retained_samples'], type=int,
+             help='Maximum number of samples to retain, keeping the highest probability samples, 0 keeps all the samples (Monte Carlo algorithms only) [default=' +
+             str(defaults['max_retained_samples'])+']', dest='max_retained_samples'),
         dict(flags=["--mpioutput", "--mpi_output", "--mpi-output"], default=defaults['mpi_output'], action='store_true',
              help='When the mpi flag -M is used outputs each processor individually rather than combining', dest='mpi_output'),
         dict(flags=["--combine_mpi_output", "--combine-mpi-output", "--combinempioutput"], default=defaults['combine_mpi_output'], action='store_true',
              help='Combine the mpi output from the mpioutput flag. The data path corresponds to the root path for the mpi output', dest='combine_mpi_output'),
         dict(flags=["--c_generate", "--c-generate", "--generate"], default=defaults['c_generate'],
              action='store_true', help='Generate moment tensor samples in the probability evaluation', dest='c_generate'),
+        dict(flags=["--worker_generate", "--worker-generate"], default=defaults['worker_generate'], action='store_true',
+             help='Generate moment tensor samples in the workers using independent seeded random number streams', dest='worker_generate'),
+        dict(flags=["--seed"], default=defaults['seed'], type=int,
+             help='Random number seed for the worker generated moment tensor samples', dest='seed'),
+        dict(flags=["--chains", "--number_chains", "--number-chains"], default=defaults['number_chains'], type=int,
+             help='Number of McMC chains to run together for each event, evaluating the proposals from all the chains in a single forward model step [default=' +
+             str(defaults['number_chains'])+']', dest='number_chains'),
+        dict(flags=["--max_temperature", "--max-temperature"], default=defaults['max_temperature'], type=float,
+             help='Temperature of the hottest chain for parallel tempering when running multiple McMC chains, 1 means no tempering [default=' +
+             str(defaults['max_temperature'])+']', dest='max_temperature'),
+        dict(flags=["--exchange_interval", "--exchange-interval"], default=defaults['exchange_interval'], type=int,
+             help='Number of steps between replica exchange proposals for tempered McMC chains [default='+str(defaults['exchange_interval'])+']', dest='exchange_interval'),
+        dict(flags=["--gc_interval", "--gc-interval"], default=defaults['gc_interval'], type=int,
+             help='Number of forward model or McMC iterations between garbage collections, 0 means only collect on allocation pressure [default=' +
+             str(defaults['gc_interval'])+']', dest='gc_interval'),
+        dict(flags=["--gc_threshold", "--gc-threshold"], default=defaults['gc_threshold'], type=int,
+             help='Size in bytes of the temporary arrays released between garbage collections, 0 means only collect on gc_interval [default=' +
+             str(defaults['gc_threshold'])+']', dest='gc_threshold'),
         dict(flags=["--relative_loop", "--relative-loop", "--relativeloop", "--loop"], default=defaults['relative_loop'], action='store_true',
              help='Loop over independent non-zero samples randomly to construct joint rather than joint samples', dest='relative_loop')
     ]
@@ -992,6 +1040,11 @@ def MTfit_parser(input_args=False, test=False):
         options.pop('min_number_initialisation_samples')
         options['min_number_check_samples'] = defaults[
             'min_number_check_samples']
+    if options['number_chains'] < 1:
+        parser.error('Number of chains must be at least 1')
+    if options['number_chains'] > 1 and 'mcmc' not in options['algorithm']:
+        if not options['_mpi_call']:
+            log('number_chains argument ignored as {} algorithm selected.'.format(options['algorithm']))
     if 'mcmc' in options['algorithm']:
         if options['mpi']:
             log('Cannot run McMC with MPI - disabling mpi')
@@ -1255,7 +1308,7 @@ def MTplot_parser(input_args=False, test=False):
                 options['projection']+' not recognised for Hudson type plot')
     if not options['colormap']:
         if options['plot_type'].lower() in ['hudson', 'lune']:
-            options['colormap'] = DEFAULT_HIST_COLORMAP
+            options['colormap'] = get_hist_colormap()
         else:
             options['colormap'] = DEFAULT_AMP_COLORMAP
 
@@ -14,9 +14,9 @@ default types
 #
 # Applications for commercial use should be made to Schlumberger or the University of Cambridge.
 
-from distutils.version import StrictVersion
+from .memory import DEFAULT_GC_INTERVAL
+from .memory import DEFAULT_GC_THRESHOLD
 
-from matplotlib import __version__ as matplotlib_version
 #
 # MTfit defaults
 #
@@ -29,6 +29,15 @@ MTFIT_PARSER_DEFAULTS = {
     'algorithm': 'time',
     'single_threaded': False,
     'number_workers': 0,
+    'number_threads': 1,
+    'no_station_ordering': False,
+    'single_precision': False,
+    'ratio_pdf_max_error': 0,
+    'backend': 'auto',
+    'location_tolerance': 0,
+    'location_subsample': 0,
+    'location_cache': False,
+    'location_cache_content_hash': False,
     'number_stations': 0,
     'memory': 8,
     'double-couple': False,
@@ -83,12 +92,21 @@ MTFIT_PARSER_DEFAULTS = {
     'no_normalise': False,
     'convert': False,
     'discard': 10000,
+    'streaming_discard': False,
+    'max_retained_samples': 0,
     'dc_prior': 0.5,
     'sampling': False,
     'sample_distribution': False,
     'sampling_prior': False,
     'mpi_output': False,
     'c_generate': False,
+    'worker_generate': False,
+    'seed': False,
+    'number_chains': 1,
+    'max_temperature': 1.,
+    'exchange_interval': 10,
+    'gc_interval': DEFAULT_GC_INTERVAL,
+    'gc_threshold': DEFAULT_GC_THRESHOLD,
     'combine_mpi_output': False,
     'relative_loop': False
 }
@@ -101,6 +119,15 @@ MTFIT_PARSER_DEFAULT_TYPES = {
     'algorithm': [str],
     'single_threaded': [bool],
     'number_workers': [int],
+    'number_threads': [int],
+    'no_station_ordering': [bool],
+    'single_precision': [bool],
+    'ratio_pdf_max_error': [float],
+    'backend': [str],
+    'location_tolerance': [float],
+    'location_subsample': [int],
+    'location_cache': [bool],
+    'location_cache_content_hash': [bool],
     'number_stations': [int],
     'memory': [float],
     'double-couple': [bool],
@@ -154,6 +181,8 @@ MTFIT_PARSER_DEFAULT_TYPES = {
     'results_format': [str],
     'no_normalise': [bool],
     'discard': [float],
+    'streaming_discard': [bool],
+    'max_retained_samples': [int],
     'convert': [bool],
     'dc_prior': [float],
     'sampling': [bool, str],
@@ -161,6 +190,13 @@ MTFIT_PARSER_DEFAULT_TYPES = {
     'sample_distribution': [bool, str],
     'mpi_output': [bool],
     'c_generate': [bool],
+    'worker_generate': [bool],
+    'seed': [bool, int],
+    'number_chains': [int],
+    'max_temperature': [float],
+    'exchange_interval': [int],
+    'gc_interval': [int],
+    'gc_threshold': [int],
     'combine_mpi_output': [bool],
     'relative_loop': [bool]
 }
@@ -168,8 +204,8 @@ MTFIT_PARSER_DEFAULT_TYPES = {
 # MTplot defaults are set in this dictionary and updated by site and user
 # defaults
 DEFAULT_HIST_COLORMAP = 'viridis'
-if StrictVersion(matplotlib_version) < StrictVersion('1.5.0'):
-    DEFAULT_HIST_COLORMAP = 'CMRmap'
+# Used if matplotlib < 1.5.0 (no viridis colormap)
+LEGACY_HIST_COLORMAP = 'CMRmap'
 DEFAULT_AMP_COLORMAP = 'bwr'
 
 MTPLOT_PARSER_DEFAULTS = {
@@ -223,3 +259,24 @@ MTPLOT_PARSER_DEFAULT_TYPES = {
     'save_dpi': [int],
     'hide': [bool],
 }
+
+
+def get_hist_colormap():
+    """
+    Get the default histogram colormap for the installed matplotlib version
+
+    matplotlib is only imported when this is called (rather than when the defaults
+    are imported) to keep the MTfit import and command line startup times low.
+
+    Returns
+        str: colormap name.
+    """
+    try:
+        from matplotlib import __version__ as matplotlib_version
+    except ImportError:
+        return DEFAULT_HIST_COLORMAP
+    version = tuple(int(''.join(c for c in part if c.isdigit()) or 0)
+                    for part in matplotlib_version.split('.')[:2])
+    if version < (1, 5):
+        return LEGACY_HIST_COLORMAP
+    return DEFAULT_HIST_COLORMAP
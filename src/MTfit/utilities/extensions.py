@@ -15,7 +15,107 @@ Simple functions that are used throughout the module
 # Applications for commercial use should be made to Schlumberger or the University of Cambridge.
 
 
-import pkg_resources
+# Process level cache of the loaded entry points for each group
+_EXTENSIONS_CACHE = {}
+# Index of the installed entry points by group (built on first use)
+_ENTRY_POINT_INDEX = None
+
+
+def _build_entry_point_index():
+    """
+    Build the index of installed entry points by group.
+
+    Uses importlib.metadata (or the importlib_metadata backport) to scan the
+    installed distributions once, falling back to pkg_resources if neither are
+    available. The metadata modules are imported here rather than at module
+    level to reduce the MTfit import time.
+
+    Returns
+        dict: dictionary of group : list of entry points.
+    """
+    try:
+        from importlib import metadata as importlib_metadata
+    except ImportError:
+        try:
+            import importlib_metadata
+        except ImportError:
+            importlib_metadata = None
+    index = {}
+    if importlib_metadata is not None:
+        seen = set()
+        for distribution in importlib_metadata.distributions():
+            # Skip shadowed distributions (as importlib_metadata.entry_points does)
+            name = distribution.metadata['Name']
+            if name in seen:
+                continue
+            seen.add(name)
+            for entrypoint in distribution.entry_points:
+                index.setdefault(entrypoint.group, []).append(entrypoint)
+    else:
+        import pkg_resources
+        for distribution in pkg_resources.working_set:
+            for (group, entry_map) in distribution.get_entry_map().items():
+                index.setdefault(group, []).extend(entry_map.values())
+    return index
+
+
+def _iter_entry_points(group):
+    """
+    Get the installed entry points for a group from the (cached) entry point index.
+
+    Args
+        group: str setuptools entrypoint name.
+
+    Returns
+        list: list of entry points with name attributes and load methods.
+    """
+    global _ENTRY_POINT_INDEX
+    if _ENTRY_POINT_INDEX is None:
+        _ENTRY_POINT_INDEX = _build_entry_point_index()
+    return _ENTRY_POINT_INDEX.get(group, [])
+
+
+def _load_extensions(group):
+    """
+    Load the setuptools entrypoint installed extensions for a given entrypoint
+    (group), caching the result so the entrypoints are only iterated and loaded once
+    per process.
+
+    Args
+        group: str setuptools entrypoint name.
+
+    Returns
+        (list,dict): tuple of extension name list and dictionary of extension name : function pairs.
+    """
+    try:
+        return _EXTENSIONS_CACHE[group]
+    except KeyError:
+        pass
+    names = []
+    funcs = {}
+    for entrypoint in _iter_entry_points(group):
+        plugin = entrypoint.load()
+        names.append(entrypoint.name.lower())
+        funcs[entrypoint.name.lower()] = plugin
+    _EXTENSIONS_CACHE[group] = (names, funcs)
+    return (names, funcs)
+
+
+def clear_extensions_cache(group=None):
+    """
+    Clear the cached extensions so that the entrypoints are reloaded (e.g. after
+    installing a new extension).
+
+    Keyword Args
+        group: str setuptools entrypoint name to clear, if None all groups are cleared
+            and the installed entry points are re-indexed.
+    """
+    global _ENTRY_POINT_INDEX
+    if group is None:
+        _EXTENSIONS_CACHE.clear()
+        _ENTRY_POINT_INDEX = None
+    else:
+        _EXTENSIONS_CACHE.pop(group, None)
 
 
 def get_extensions(group, defaults=False):
@@ -23,6 +123,9 @@ def get_extensions(group, defaults=False):
     Get the setuptools entrypoint installed extensions for a given entrypoint
     (group). Default values can be set using a dictionary of name:function values.
 
+    The entrypoints are only loaded on the first call for each group, and cached
+    for subsequent calls (see clear_extensions_cache).
+
     Args
         group: str setuptools entrypoint name.
 
@@ -41,10 +144,9 @@ def get_extensions(group, defaults=False):
                 funcs[plugin_name] = plugin
                 names.append(plugin_name)
     # Entrypoints
-    for entrypoint in pkg_resources.iter_entry_points(group=group):
-        plugin = entrypoint.load()
-        names.append(entrypoint.name.lower())
-        funcs[entrypoint.name.lower()] = plugin
+    extension_names, extension_funcs = _load_extensions(group)
+    names.extend(extension_names)
+    funcs.update(extension_funcs)
     names = list(set(names))
     return (names, funcs)
 
@@ -70,9 +172,17 @@ def evaluate_extensions(group, defaults=False, **kwargs):
             for plugin in defaults.values():
                 results.append(plugin(**kwargs))
         # Entrypoints
-        for entrypoint in pkg_resources.iter_entry_points(group=group):
+        if group in _EXTENSIONS_CACHE:
+            plugins = _EXTENSIONS_CACHE[group][1].values()
+        else:
+            plugins = []
+            for entrypoint in _iter_entry_points(group):
+                try:
+                    plugins.append(entrypoint.load())
+                except Exception:
+                    pass
+        for plugin in plugins:
             try:
-                plugin = entrypoint.load()
                 results.append(plugin(**kwargs))
             except Exception:
                 pass
@@ -505,6 +505,7 @@ def _convert_mt_space_to_struct(output_data, i=False):
         Converted(bool)
         Ln_BayesianEvidence
         DKL
+        Ln_Dropped (ln sum of the samples dropped while sampling, only in file version 3, which is used if samples were dropped)
         NSamples as:
             P(double)
             Ln_P(double)
@@ -537,7 +538,11 @@ def _convert_mt_space_to_struct(output_data, i=False):
     Returns
         binary MT and scale factor outputs
     """
+    # File version 3 adds the ln sum of the dropped samples, so version 2 is written if no samples were dropped
+    ln_dropped = output_data.get('ln_dropped', -np.inf)
     file_version = 2
+    if np.isfinite(ln_dropped):
+        file_version = 3
     sqrt2 = np.sqrt(2)
     # Check MT is single event
     if 'moment_tensor_space' in output_data:
@@ -576,6 +581,9 @@ def _convert_mt_space_to_struct(output_data, i=False):
         binary_output += struct.pack('1d', output_data['dkl'])
     except Exception:
         binary_output += struct.pack('1d', np.nan)  # No Dkl
+    # Add the ln sum of the samples dropped while sampling
+    if file_version >= 3:
+        binary_output += struct.pack('1d', ln_dropped)
     # Loop over MTs
     for i in range(output_data['moment_tensor_space'+end].shape[1]):
         # This seems slow in python 3
@@ -1193,6 +1201,11 @@ def read_binary_output(filename, version=2):
                 dkl = struct.unpack('1d', f.read(8))[0]
             else:
                 dkl = np.nan
+            # Get the ln sum of the samples dropped while sampling
+            if version >= 3:
+                ln_dropped = struct.unpack('1d', f.read(8))[0]
+            else:
+                ln_dropped = -np.inf
             # Generate blank arrays
             MTSpace = np.matrix(np.zeros((6, number_mt_samples)))
             Probability = np.matrix(np.zeros((1, number_mt_samples)))
@@ -1229,6 +1242,8 @@ def read_binary_output(filename, version=2):
             if converted:
                 out.update({'g': g, 'd': d, 'k': k, 'h': h, 's': s, 'u': u, 'v': v, 'S1': s1, 'D1': d1,
                             'R1': r1, 'S2': s2, 'D2': d2, 'R2': r2, 'ln_bayesian_evidence': ln_bayesian_evidence})
+            if np.isfinite(ln_dropped):
+                out['ln_dropped'] = ln_dropped
             # Append to output data list
             output_data.append(out)
     return output_data
@@ -0,0 +1,336 @@
+"""
+location_cache.py
+*****************
+
+Persistent on-disk cache of the location PDF station angles and station angle coefficients.
+
+Parsing a large location PDF (e.g. scatangle) file and calculating the station angle coefficients for every location
+sample can take longer than the inversion itself, and is repeated for every run (and recovery) using the same file.
+The LocationCache stores the parsed station angles, the station angle coefficients for each phase, and the station
+angle coefficients and location sample multipliers for each event in a directory next to the location PDF file,
+named from the file size, modification time and inode (or optionally the hash of the file contents), so that the
+cache is not used if the file changes. The arrays are stored
+as .npy files and memory-mapped when they are loaded, so that they are opened without reading the whole file, and
+the pages are shared between processes using the same cache.
+"""
+
+# **Restricted:  For Non-Commercial Use Only**
+# This code is protected intellectual property and is available solely for teaching
+# and non-commercially funded academic research purposes.
+#
+# Applications for commercial use should be made to Schlumberger or the University of Cambridge.
+
+import os
+import hashlib
+import logging
+import tempfile
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import numpy as np
+
+
+logger = logging.getLogger('MTfit.utilities')
+
+
+# Cache format version (included in the hashes, so old caches are not used if the format changes)
+LOCATION_CACHE_VERSION = 1
+# Block size for hashing the location PDF files (bytes)
+HASH_BLOCK_SIZE = 2**20
+# Minimum size of the arrays stored as memory-mapped .npy files (smaller arrays are pickled in the manifest)
+MIN_CACHED_ARRAY_SIZE = 1024
+
+_replace = getattr(os, 'replace', os.rename)
+
+# File content hashes calculated in this run, keyed by the file name and file_key
+_FILE_HASHES = {}
+
+
+def file_hash(filename, block_size=HASH_BLOCK_SIZE):
+    """
+    Returns the SHA-1 hash of the file contents
+
+    Args
+        filename: str - file name.
+
+    Keyword Args
+        block_size:[HASH_BLOCK_SIZE] int - number of bytes to read at a time.
+
+    Returns
+        str - hexadecimal hash.
+    """
+    sha1 = hashlib.sha1(str(LOCATION_CACHE_VERSION).encode())
+    with open(filename, 'rb') as f:
+        block = f.read(block_size)
+        while block:
+            sha1.update(block)
+            block = f.read(block_size)
+    return sha1.hexdigest()
+
+
+def file_key(filename):
+    """
+    Returns a key for the file from its size, modification time and inode
+
+    The key changes if the file is modified or replaced, without reading the file. Modifications that keep the size
+    and modification time (e.g. within the file system timestamp resolution) are not detected, for which the file
+    content hash (file_hash) can be used.
+
+    Args
+        filename: str - file name.
+
+    Returns
+        str - hexadecimal hash.
+    """
+    stat = os.stat(filename)
+    return data_hash(stat.st_size, getattr(stat, 'st_mtime_ns', stat.st_mtime), stat.st_ino)
+
+
+def _content_hash(filename):
+    """Returns the file content hash, calculated once in a run for each version of the file (see file_key)"""
+    key = (os.path.abspath(filename), file_key(filename))
+    if key not in _FILE_HASHES:
+        _FILE_HASHES[key] = file_hash(filename)
+    return _FILE_HASHES[key]
+
+
+def data_hash(*args):
+    """
+    Returns the SHA-1 hash of the arguments
+
+    Hashes nested dictionaries (using the sorted keys), lists, tuples, numpy arrays (using the shape, data type and
+    data) and other values (using repr), e.g. for an event data dictionary.
+
+    Args
+        args: values to hash.
+
+    Returns
+        str - hexadecimal hash.
+    """
+    sha1 = hashlib.sha1(str(LOCATION_CACHE_VERSION).encode())
+    _update_hash(sha1, args)
+    return sha1.hexdigest()
+
+
+def _update_hash(sha1, value):
+    """Updates the hash with the value (see data_hash)"""
+    if isinstance(value, dict):
+        sha1.update(b'dict')
+        for key in sorted(value.keys(), key=repr):
+            _update_hash(sha1, key)
+            _update_hash(sha1, value[key])
+    elif isinstance(value, (list, tuple)):
+        sha1.update(type(value).__name__.encode())
+        for item in value:
+            _update_hash(sha1, item)
+    elif isinstance(value, np.ndarray):
+        sha1.update(repr((value.shape, value.dtype.str)).encode())
+        if value.dtype.hasobject:
+            _update_hash(sha1, value.tolist())
+        else:
+            sha1.update(np.ascontiguousarray(value).tobytes())
+    else:
+        sha1.update(repr(value).encode())
+
+
+class _CachedArray(object):
+    """Placeholder for an array stored as a .npy file in the cache manifest"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+class LocationCache(object):
+
+    """
+    On-disk cache for a location PDF file
+
+    The cache is stored in the directory .<file name>.mtfit_cache/<file key> next to the location PDF file (or in
+    cache_dir if set), where the file key is from the file size, modification time and inode (see file_key), or
+    the hash of the file contents if content_hash is set (calculated once in a run for each file). Arrays are written to temporary files and renamed, so an interrupted write does
+    not leave a partial cache entry. Errors writing to the cache (e.g. a read-only directory) are logged and ignored. The
+    cache directories for old versions of the file are not removed, so they must be deleted by hand.
+
+    Loaded arrays are memory-mapped copy-on-write, so they can be modified (e.g. by the C extensions) without changing
+    the cache.
+
+    Initialisation
+        Args
+            filename: str - location PDF file name.
+
+        Keyword Args
+            cache_dir:[None] str - directory to store the cache in (None uses the location PDF file directory).
+            content_hash:[False] bool - use the hash of the file contents for the cache directory.
+
+    """
+
+    def __init__(self, filename, cache_dir=None, content_hash=False):
+        """
+        LocationCache initialisation
+
+        Args
+            filename: str - location PDF file name.
+
+        Keyword Args
+            cache_dir:[None] str - directory to store the cache in (None uses the location PDF file directory).
+            content_hash:[False] bool - use the hash of the file contents for the cache directory.
+        """
+        self.filename = filename
+        if content_hash:
+            self.key = _content_hash(filename)
+        else:
+            self.key = file_key(filename)
+        if cache_dir is None:
+            cache_dir = os.path.dirname(os.path.abspath(filename))
+        self.path = os.path.join(cache_dir, '.'+os.path.basename(filename)+'.mtfit_cache', self.key)
+
+    def _file(self, name, key=None):
+        if key:
+            return os.path.join(self.path, key, name)
+        return os.path.join(self.path, name)
+
+    def _write(self, filename, write):
+        """Writes to a temporary file using write(file) and renames it to filename"""
+        directory = os.path.dirname(filename)
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+        fd, tmp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                write(f)
+            _replace(tmp_filename, filename)
+        except Exception:
+            os.remove(tmp_filename)
+            raise
+
+    def load_array(self, name, key=None):
+        """
+        Loads a memory-mapped array from the cache
+
+        Args
+            name: str - array name.
+
+        Keyword Args
+            key:[None] str - cache entry key (None for the file level arrays).
+
+        Returns
+            numpy memmap array or None if the array is not in the cache.
+        """
+        filename = self._file(name+'.npy', key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            return np.load(filename, mmap_mode='c')
+        except Exception:
+            logger.warning('Error reading location cache array {}'.format(filename))
+            return None
+
+    def save_array(self, name, array, key=None):
+        """
+        Saves an array to the cache
+
+        Args
+            name: str - array name.
+            array: numpy array.
+
+        Keyword Args
+            key:[None] str - cache entry key (None for the file level arrays).
+
+        Returns
+            numpy memmap array of the cached array (or the array if it could not be saved).
+        """
+        array = np.ascontiguousarray(array)
+        try:
+            self._write(self._file(name+'.npy', key), lambda f: np.save(f, array))
+        except Exception:
+            logger.warning('Error writing location cache array {}'.format(self._file(name+'.npy', key)))
+            return array
+        return self.load_array(name, key)
+
+    def load_location_samples(self, key=None):
+        """
+        Loads the location sample station angles from the cache
+
+        Keyword Args
+            key:[None] str - cache entry key (None for the location samples in the file order).
+
+        Returns
+            (names, azimuth, takeoff_angle, multipliers) tuple of the list of station names, and the azimuth and take-off
+            angle (location samples x stations) and multiplier arrays, or None if they are not in the cache.
+        """
+        arrays = [self.load_array(name, key) for name in ['names', 'azimuth', 'takeoff_angle', 'multipliers']]
+        if any(array is None for array in arrays):
+            return None
+        return (arrays[0].tolist(),)+tuple(arrays[1:])
+
+    def save_location_samples(self, names, azimuth, takeoff_angle, multipliers, key=None):
+        """
+        Saves the location sample station angles to the cache
+
+        Args
+            names: list of station names.
+            azimuth: numpy array of azimuths (location samples x stations).
+            takeoff_angle: numpy array of take-off angles (location samples x stations).
+            multipliers: list or numpy array of location sample multipliers.
+
+        Keyword Args
+            key:[None] str - cache entry key (None for the location samples in the file order).
+        """
+        # The multipliers are saved last, so the entry is only complete once they exist
+        self.save_array('names', np.array(names, dtype=np.str_), key)
+        self.save_array('azimuth', azimuth, key)
+        self.save_array('takeoff_angle', takeoff_angle, key)
+        self.save_array('multipliers', np.array(multipliers, dtype=np.float64), key)
+
+    def load(self, key):
+        """
+        Loads a cache entry
+
+        Args
+            key: str - cache entry key (e.g. from data_hash).
+
+        Returns
+            tuple of the cached values (with the arrays memory-mapped) or None if the entry is not in the cache.
+        """
+        filename = self._file('manifest.pkl', key)
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                values = pickle.load(f)
+            values = [self.load_array(value.name, key) if isinstance(value, _CachedArray) else value for value in values]
+        except Exception:
+            logger.warning('Error reading location cache entry {}'.format(filename))
+            return None
+        if any(value is None for value in values):
+            return None
+        return tuple(values)
+
+    def save(self, key, values):
+        """
+        Saves a cache entry
+
+        Large numpy arrays are saved as .npy files, and the other values are pickled in the entry manifest, which is
+        written last.
+
+        Args
+            key: str - cache entry key (e.g. from data_hash).
+            values: tuple of values (must be picklable).
+        """
+        manifest = []
+        try:
+            for i, value in enumerate(values):
+                if isinstance(value, np.ndarray) and not value.dtype.hasobject and value.size >= MIN_CACHED_ARRAY_SIZE:
+                    self._write(self._file('{}.npy'.format(i), key), lambda f: np.save(f, np.ascontiguousarray(value)))
+                    manifest.append(_CachedArray(str(i)))
+                else:
+                    manifest.append(value)
+            self._write(self._file('manifest.pkl', key), lambda f: pickle.dump(manifest, f, protocol=2))
+        except Exception:
+            logger.warning('Error writing location cache entry {}'.format(self._file('', key)))
@@ -0,0 +1,144 @@
+"""
+memory.py
+*********
+
+Garbage collection policy for the iterative loops (McMC steps, forward model calls and worker tasks).
+
+A full garbage collection (gc.collect) traverses every tracked object, so running one on every iteration dominates
+the run time for small problems, while the numpy arrays that make up most of the memory use are freed by reference
+counting anyway. Instead, the loops report the size of the temporary arrays they have finished with to the
+GarbageCollectionPolicy, which only runs a collection once the accumulated allocation pressure passes a threshold,
+or on a fixed cadence if set.
+"""
+
+# **Restricted:  For Non-Commercial Use Only**
+# This code is protected intellectual property and is available solely for teaching
+# and non-commercially funded academic research purposes.
+#
+# Applications for commercial use should be made to Schlumberger or the University of Cambridge.
+
+import gc
+
+
+DEFAULT_GC_INTERVAL = 0
+DEFAULT_GC_THRESHOLD = 256*1024*1024  # bytes
+
+
+class GarbageCollectionPolicy(object):
+
+    """
+    Garbage collection policy
+
+    Counts the calls and the allocation pressure (bytes of temporary arrays released) reported by the caller,
+    and runs gc.collect when either the call interval or the pressure threshold is reached.
+    """
+
+    def __init__(self, interval=DEFAULT_GC_INTERVAL, threshold=DEFAULT_GC_THRESHOLD, generation=2):
+        """
+        Initialisation of GarbageCollectionPolicy
+
+        Keyword Args
+            interval:[0] Number of calls between collections (0 disables collecting on a cadence).
+            threshold:[268435456] Allocation pressure in bytes at which to collect (0 disables collecting on pressure).
+            generation:[2] Generation to collect (2 is a full collection).
+        """
+        self.interval = max(int(interval), 0) if interval else 0
+        self.threshold = max(int(threshold), 0) if threshold else 0
+        self.generation = generation
+        self.number_collections = 0
+        self.reset()
+
+    def reset(self):
+        """Resets the call count and allocation pressure."""
+        self._calls = 0
+        self._pressure = 0
+
+    @property
+    def pressure(self):
+        return self._pressure
+
+    def collect(self, nbytes=0, force=False):
+        """
+        Reports an iteration and collects if required by the policy
+
+        Keyword Args
+            nbytes:[0] Number of bytes of temporary arrays released since the last call (see array_nbytes).
+            force:[False] Collect regardless of the policy.
+
+        Returns
+            bool: True if a collection was carried out.
+        """
+        self._calls += 1
+        self._pressure += nbytes
+        if not (force or (self.interval and self._calls >= self.interval) or (self.threshold and self._pressure >= self.threshold)):
+            return False
+        gc.collect(self.generation)
+        self.number_collections += 1
+        self.reset()
+        return True
+
+    __call__ = collect
+
+
+_POLICY = GarbageCollectionPolicy()
+
+
+def get_gc_policy():
+    """Returns the garbage collection policy for this process."""
+    return _POLICY
+
+
+def set_gc_policy(interval=None, threshold=None):
+    """
+    Sets the garbage collection policy for this process
+
+    Worker processes started after this is called inherit the policy.
+
+    Keyword Args
+        interval:[None] Number of calls between collections (0 disables collecting on a cadence), None leaves unchanged.
+        threshold:[None] Allocation pressure in bytes at which to collect (0 disables collecting on pressure), None leaves unchanged.
+
+    Returns
+        GarbageCollectionPolicy: the process policy.
+    """
+    if interval is not None:
+        _POLICY.interval = max(int(interval), 0) if interval else 0
+    if threshold is not None:
+        _POLICY.threshold = max(int(threshold), 0) if threshold else 0
+    _POLICY.reset()
+    return _POLICY
+
+
+def collect(nbytes=0, force=False):
+    """
+    Reports an iteration to the process garbage collection policy, collecting if required
+
+    Keyword Args
+        nbytes:[0] Number of bytes of temporary arrays released since the last call (see array_nbytes).
+        force:[False] Collect regardless of the policy.
+
+    Returns
+        bool: True if a collection was carried out.
+    """
+    return _POLICY.collect(nbytes, force)
+
+
+def array_nbytes(*arrays):
+    """
+    Total size of the arrays in bytes
+
+    Non-array arguments (e.g. False or None for unused data) are ignored, and lists and tuples are summed.
+
+    Args
+        arrays: arrays to sum.
+
+    Returns
+        int: number of bytes.
+    """
+    nbytes = 0
+    for array in arrays:
+        if isinstance(array, (list, tuple)):
+            nbytes += array_nbytes(*array)
+        else:
+            nbytes += getattr(array, 'nbytes', 0)
+    return nbytes
@@ -14,10 +14,24 @@ Handles multiprocessing queue and worker behaviour, including return codes
 import multiprocessing
 import gc
 import os
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 
+import numpy as np
+
 from ..probability import LnPDF
 
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
+    resource_tracker = None
+
 #
 # Job return codes
 #
@@ -28,6 +42,226 @@ class PoisonPill(object):
     pass
 
 
+#
+# Worker resident task contexts
+#
+
+
+class TaskContext(object):
+
+    """
+    Task context message
+
+    Holds the arguments shared between all the tasks for an event (e.g. the
+    station angle coefficients and observations), which are sent once to
+    each Worker and stored there, so that each task only needs to carry the
+    arguments that change (e.g. the moment tensor samples).
+
+    A TaskContext with task_class None removes the context from the workers.
+
+    Initialisation
+        Args
+            context_id: Context identifier.
+            task_class:[None] Task class to initialise using the context.
+            args:[()] Tuple of positional arguments appended to the task arguments.
+            kwargs:[{}] Dictionary of keyword arguments for the task.
+
+    """
+
+    def __init__(self, context_id, task_class=None, args=(), kwargs={}):
+        """
+        TaskContext initialisation
+
+        Args
+            context_id: Context identifier.
+            task_class:[None] Task class to initialise using the context.
+            args:[()] Tuple of positional arguments appended to the task arguments.
+            kwargs:[{}] Dictionary of keyword arguments for the task.
+        """
+        self.context_id = context_id
+        self.task_class = task_class
+        self.args = tuple(args)
+        self.kwargs = dict(kwargs)
+
+
+class ContextTask(object):
+
+    """
+    Lightweight task referencing a TaskContext
+
+    The Worker builds the task as
+    context.task_class(*(args+context.args), **context.kwargs) using the
+    context stored in the worker.
+
+    Initialisation
+        Args
+            context_id: Context identifier.
+            args*: Task specific positional arguments, preceding the context arguments.
+
+    """
+
+    def __init__(self, context_id, *args):
+        """
+        ContextTask initialisation
+
+        Args
+            context_id: Context identifier.
+            args*: Task specific positional arguments, preceding the context arguments.
+        """
+        self.context_id = context_id
+        self.args = args
+
+    def build(self, context):
+        """
+        Builds the task from the context
+
+        Args
+            context: TaskContext object.
+
+        Returns
+            Task object.
+        """
+        return context.task_class(*(self.args+context.args), **context.kwargs)
+
+
+#
+# Shared memory arrays
+#
+
+
+class SharedArray(object):
+
+    """
+    Numpy array stored in a shared memory block
+
+    The array data is copied once into a multiprocessing.shared_memory
+    block, and pickling the object only transfers the block name, shape
+    and dtype, so tasks passed through the JobPool queues attach to the
+    data zero-copy rather than re-pickling it for every task.
+
+    The process that creates the SharedArray owns the block and should
+    call unlink() when it is no longer needed (this is also done when
+    the owner is garbage collected).
+
+    Initialisation
+        Args
+            array: numpy array to copy into shared memory.
+
+    """
+
+    def __init__(self, array):
+        """
+        SharedArray initialisation
+
+        Args
+            array: numpy array to copy into shared memory.
+        """
+        array = np.ascontiguousarray(array)
+        self.shape = array.shape
+        self.dtype = array.dtype
+        self._owner = True
+        self._shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+        self._array[...] = array
+
+    def __getstate__(self):
+        return {'name': self._shm.name, 'shape': self.shape, 'dtype': self.dtype.str}
+
+    def __setstate__(self, state):
+        self.shape = state['shape']
+        self.dtype = np.dtype(state['dtype'])
+        self._owner = False
+        self._shm = shared_memory.SharedMemory(name=state['name'])
+        self._array = np.ndarray(self.shape, dtype=self.dtype, buffer=self._shm.buf)
+
+    @property
+    def array(self):
+        """Numpy array view of the shared memory block"""
+        return self._array
+
+    def close(self):
+        """Closes access to the shared memory block from this process"""
+        self._array = None
+        if self._shm is not None:
+            try:
+                self._shm.close()
+            except BufferError:
+                # Views of the array are still in use, the mapping is
+                # released when they are garbage collected.
+                pass
+
+    def unlink(self):
+        """Closes and frees the shared memory block (owner process only)"""
+        self.close()
+        if self._owner and self._shm is not None:
+            try:
+                self._shm.unlink()
+            except (OSError, IOError):
+                pass
+            self._owner = False
+        self._shm = None
+
+    def __del__(self):
+        try:
+            if self._owner:
+                self.unlink()
+            else:
+                self.close()
+        except Exception:
+            pass
+
+
+def share_array(array):
+    """
+    Places array in shared memory if possible
+
+    Only non-empty numeric numpy arrays are placed in shared memory, other
+    objects (e.g. False for missing data) are returned unchanged, as is the array
+    if shared memory is not available.
+
+    Args
+        array: numpy array to share.
+
+    Returns
+        SharedArray object or the original array.
+    """
+    if shared_memory is None or not isinstance(array, np.ndarray) or isinstance(array, np.matrix):
+        return array
+    if not array.size or array.dtype.hasobject:
+        return array
+    try:
+        return SharedArray(array)
+    except Exception:
+        return array
+
+
+def unshare_array(array):
+    """
+    Returns the numpy array from a SharedArray object
+
+    Args
+        array: SharedArray object or other object.
+
+    Returns
+        numpy array view of the shared memory, or the original object if not a SharedArray.
+    """
+    if isinstance(array, SharedArray):
+        return array.array
+    return array
+
+
+def unlink_arrays(*arrays):
+    """
+    Frees the shared memory for any SharedArray objects in the arguments
+
+    Args
+        arrays*: SharedArray objects or other objects (ignored)
+    """
+    for array in arrays:
+        if isinstance(array, SharedArray):
+            array.unlink()
+
+
 #
 # Worker
 #
@@ -48,10 +282,12 @@ class Worker(multiprocessing.Process):
             task_queue: multiprocessing.Queue object for storing tasks
             result_queue: multiprocessing.Queue object for storing results
             single_life:[False] Boolean flag for killing worker after single job.
+            context_queue:[None] multiprocessing.Queue object for the TaskContext
+                            messages for this worker.
 
     """
 
-    def __init__(self, task_queue, result_queue, single_life=False):
+    def __init__(self, task_queue, result_queue, single_life=False, context_queue=None):
         """
         Worker initialisation
 
@@ -59,11 +295,15 @@ class Worker(multiprocessing.Process):
             task_queue: multiprocessing.Queue object for storing tasks
             result_queue: multiprocessing.Queue object for storing results
             single_life:[False] Boolean flag for killing worker after single job.
+            context_queue:[None] multiprocessing.Queue object for the TaskContext
+                            messages for this worker.
         """
         super(Worker, self).__init__()
         self.task_queue = task_queue
         self.result_queue = result_queue
         self.single_life = single_life
+        self.context_queue = context_queue
+        self.contexts = {}
         self.__closed__ = False
         print('{} Initialised'.format(self.name))
         print(self._Popen)
@@ -82,6 +322,8 @@ class Worker(multiprocessing.Process):
                 next_task = self.task_queue.get()
                 if isinstance(next_task, PoisonPill):
                     break
+                if isinstance(next_task, ContextTask):
+                    next_task = next_task.build(self.get_context(next_task.context_id))
                 answer = next_task()
                 if isinstance(answer, dict):
                     for key, value in answer.items():
@@ -90,13 +332,53 @@ class Worker(multiprocessing.Process):
                 self.result_queue.put(answer)
                 if self.single_life:
                     break
-                gc.collect()
+                # The tasks report to the garbage collection policy (see MTfit.utilities.memory)
+                # rather than forcing a collection after every task
             except Exception as e:
                 self.result_queue.put(e)
                 gc.collect()
                 break
         return
 
+    def update_contexts(self, block=False):
+        """
+        Updates the stored contexts from the context queue
+
+        Keyword Args
+            block:[False] Block until a context message is received.
+        """
+        if self.context_queue is None:
+            return
+        try:
+            context = self.context_queue.get(block)
+            while True:
+                if context.task_class is None:
+                    self.contexts.pop(context.context_id, None)
+                else:
+                    self.contexts[context.context_id] = context
+                context = self.context_queue.get(False)
+        except queue.Empty:
+            pass
+
+    def get_context(self, context_id):
+        """
+        Gets a stored context
+
+        Blocks until the context has been received if it is not already stored.
+
+        Args
+            context_id: Context identifier.
+
+        Returns
+            TaskContext object.
+        """
+        self.update_contexts()
+        while context_id not in self.contexts:
+            if self.context_queue is None:
+                raise KeyError('Context {} not found'.format(context_id))
+            self.update_contexts(block=True)
+        return self.contexts[context_id]
+
     def start(self):
         print(self.name, 'Starting')
         super(Worker, self).start()
@@ -152,6 +434,12 @@ class JobPool(object):
         self.number_workers = number_workers
         self.single_life = single_life
         self.number_jobs = 0
+        self.contexts = {}
+        self._context_id = 0
+        if resource_tracker is not None:
+            # Start the resource tracker before the workers so that they share it,
+            # otherwise SharedArray objects attached in the workers are reported as leaked
+            resource_tracker.ensure_running()
         # Add new workers until the number of workers is correct
         self.clean_workers()
         print('Job Pool Initialised')
@@ -181,6 +469,60 @@ class JobPool(object):
         self.tasks.put(task)
         self.number_jobs += 1
 
+    def load_context(self, *args, **kwargs):
+        """
+        Loads a task context into all the workers
+
+        The context arguments are sent once to each worker and stored there, so
+        that tasks added using context_task only need to carry the remaining arguments.
+        The task class used is the default task (set during initialisation), unless the
+        task keyword argument is set.
+
+        Args
+            args*: Task arguments following the context_task arguments.
+
+        Keyword Args
+            task:[None] Task class to use instead of the default task.
+            kwargs**: Task keyword arguments.
+
+        Returns
+            Context identifier.
+        """
+        task_class = kwargs.pop('task', None) or self.task_class
+        self._context_id += 1
+        context = TaskContext(self._context_id, task_class, args, kwargs)
+        self.contexts[context.context_id] = context
+        self.clean_workers()
+        for worker in self.workers:
+            worker.context_queue.put(context)
+        return context.context_id
+
+    def context_task(self, context_id, *args):
+        """
+        Adds a task using a loaded context
+
+        Args
+            context_id: Context identifier returned by load_context.
+            args*: Task arguments preceding the context arguments.
+        """
+        if context_id not in self.contexts:
+            raise KeyError('Context {} not loaded'.format(context_id))
+        self.clean_workers()
+        self.tasks.put(ContextTask(context_id, *args))
+        self.number_jobs += 1
+
+    def clear_context(self, context_id):
+        """
+        Removes a task context from all the workers
+
+        Args
+            context_id: Context identifier returned by load_context.
+        """
+        if self.contexts.pop(context_id, None) is None:
+            return
+        for worker in self.workers:
+            worker.context_queue.put(TaskContext(context_id))
+
     def clean_workers(self):
         """
         Cleans workers
@@ -195,7 +537,10 @@ class JobPool(object):
                 self.workers.pop(i)
                 del worker
         while len(self.workers) < self.number_workers:
-            w = Worker(self.tasks, self.results, self.single_life)
+            w = Worker(self.tasks, self.results, self.single_life, multiprocessing.Queue())
+            # New workers need the current contexts
+            for context in self.contexts.values():
+                w.context_queue.put(context)
             self.workers.append(w)
             w.start()
         gc.collect()
@@ -0,0 +1,147 @@
+"""
+quasi_random.py
+***************
+
+Scrambled Sobol low-discrepancy sequences for quasi-Monte Carlo sampling.
+
+The Sobol sequence fills the unit hypercube more evenly than pseudo-random points, so Monte Carlo estimates of
+integrals of smooth functions (such as the Bayesian evidence) converge faster than the N^-1/2 Monte Carlo rate.
+The sequence is randomised using a random linear matrix scramble and a random digital shift, which keeps the
+low-discrepancy structure, but makes each point uniformly distributed, so that the estimates are unbiased and
+independently scrambled sequences can be combined.
+"""
+
+# **Restricted:  For Non-Commercial Use Only**
+# This code is protected intellectual property and is available solely for teaching
+# and non-commercially funded academic research purposes.
+#
+# Applications for commercial use should be made to Schlumberger or the University of Cambridge.
+
+import numpy as np
+
+
+# Number of bits in each coordinate (and the maximum number of points is 2**SOBOL_BITS)
+SOBOL_BITS = 32
+
+# Primitive polynomial degree (s), coefficients (a) and initial direction numbers (m) for dimensions 2 onwards from
+# S. Joe and F. Y. Kuo, Constructing Sobol sequences with better two-dimensional projections, 2008, SIAM J. Sci.
+# Comput. 30, 2635-2654 (new-joe-kuo-6.21201). The first dimension is the van der Corput sequence.
+SOBOL_DIRECTION_NUMBERS = [(1, 0, [1]),
+                           (2, 1, [1, 3]),
+                           (3, 1, [1, 3, 1]),
+                           (3, 2, [1, 1, 1]),
+                           (4, 1, [1, 1, 3, 3]),
+                           (4, 4, [1, 3, 5, 13])]
+
+
+def sobol_direction_numbers(dimension):
+    """
+    Returns the Sobol direction numbers
+
+    Args
+        dimension: int - number of dimensions (up to len(SOBOL_DIRECTION_NUMBERS)+1).
+
+    Returns
+        np.array - direction numbers (dimension x SOBOL_BITS), with the most significant bit as the first digit.
+    """
+    if not 0 < dimension <= len(SOBOL_DIRECTION_NUMBERS)+1:
+        raise ValueError('Sobol sequence dimension must be between 1 and {}: {}'.format(len(SOBOL_DIRECTION_NUMBERS)+1, dimension))
+    direction_numbers = np.empty((dimension, SOBOL_BITS), dtype=np.uint64)
+    direction_numbers[0, :] = [1 << (SOBOL_BITS-1-k) for k in range(SOBOL_BITS)]
+    for j in range(1, dimension):
+        s, a, m = SOBOL_DIRECTION_NUMBERS[j-1]
+        m = list(m)
+        for k in range(s, SOBOL_BITS):
+            m_k = m[k-s] ^ (m[k-s] << s)
+            for i in range(1, s):
+                if (a >> (s-1-i)) & 1:
+                    m_k ^= m[k-i] << i
+            m.append(m_k)
+        direction_numbers[j, :] = [m[k] << (SOBOL_BITS-1-k) for k in range(SOBOL_BITS)]
+    return direction_numbers
+
+
+class SobolSequence(object):
+
+    """
+    Scrambled Sobol sequence
+
+    Generates successive points of the Sobol sequence in the unit hypercube. If scrambled, the direction numbers are
+    scrambled using a random lower triangular binary matrix for each dimension, and the points shifted using a random
+    digital shift, seeded from the seed. If the 2**SOBOL_BITS points are used up, the sequence is rescrambled and
+    restarted.
+
+    The balance properties of the sequence are best when the points are used in blocks of powers of 2.
+
+    Initialisation
+        Args
+            dimension: int - number of dimensions.
+
+        Keyword Args
+            seed:[None] Seed for the scrambling (integer, numpy.random.SeedSequence or None to seed from the system).
+            scramble:[True] Boolean flag to scramble the sequence.
+
+    """
+
+    def __init__(self, dimension, seed=None, scramble=True):
+        """
+        SobolSequence initialisation
+
+        Args
+            dimension: int - number of dimensions.
+
+        Keyword Args
+            seed:[None] Seed for the scrambling (integer, numpy.random.SeedSequence or None to seed from the system).
+            scramble:[True] Boolean flag to scramble the sequence.
+        """
+        self.dimension = dimension
+        self.scramble = scramble
+        if hasattr(seed, 'generate_state'):
+            seed = seed.generate_state(4)
+        self._random_state = np.random.RandomState(seed)
+        self._direction_numbers = sobol_direction_numbers(dimension)
+        self._scramble()
+
+    def __len__(self):
+        """Number of points generated"""
+        return self.index
+
+    def _scramble(self):
+        """Scrambles the direction numbers and sets the digital shift, and restarts the sequence"""
+        self.index = 0
+        self.direction_numbers = self._direction_numbers.copy()
+        self.shift = np.zeros(self.dimension, dtype=np.uint64)
+        if not self.scramble:
+            return
+        digits = (self._direction_numbers[:, :, np.newaxis] >> np.arange(SOBOL_BITS-1, -1, -1, dtype=np.uint64)) & np.uint64(1)
+        powers = np.uint64(1) << np.arange(SOBOL_BITS-1, -1, -1, dtype=np.uint64)
+        for j in range(self.dimension):
+            lower = np.tril(self._random_state.randint(0, 2, (SOBOL_BITS, SOBOL_BITS)), -1)+np.eye(SOBOL_BITS, dtype=int)
+            scrambled_digits = (lower.dot(digits[j].T.astype(np.int64)) % 2).T.astype(np.uint64)
+            self.direction_numbers[j, :] = (scrambled_digits*powers).sum(1)
+        self.shift = self._random_state.randint(0, 2**16, (self.dimension, 2)).astype(np.uint64)
+        self.shift = (self.shift[:, 0] << np.uint64(16)) | self.shift[:, 1]
+
+    def random(self, number_points):
+        """
+        Returns the next points in the sequence
+
+        Args
+            number_points: int - number of points.
+
+        Returns
+            np.array - points in the open unit hypercube (number_points x dimension).
+        """
+        number_points = int(number_points)
+        if self.index+number_points > 2**SOBOL_BITS:
+            self._scramble()
+        index = np.arange(self.index, self.index+number_points, dtype=np.uint64)
+        gray_code = index ^ (index >> np.uint64(1))
+        points = np.empty((number_points, self.dimension), dtype=np.uint64)
+        points[:] = self.shift
+        for k in range(int(gray_code.max()).bit_length() if number_points else 0):
+            bit = ((gray_code >> np.uint64(k)) & np.uint64(1)).astype(bool)
+            points[bit] ^= self.direction_numbers[:, k]
+        self.index += number_points
+        # Centre of the finest interval, so the points are never 0 or 1
+        return (points.astype(np.float64)+0.5)/2.**SOBOL_BITS